@@ -2,6 +2,11 @@
 
 # LaTeX Compilation Script with Timing
 # Compiles main.tex with detailed timing measurements
+#
+# Options:
+#   --build-dir DIR   Write all LaTeX output to DIR instead of the repo root
+#   --isolated        Build in build/main/ (only main.pdf is copied back)
+#   --tmpfs           Build on /dev/shm; build/main links to it (implies --isolated)
 
 set -e  # Exit on any error
 
@@ -42,6 +47,28 @@ format_time() {
     fi
 }
 
+# Parse options
+OUTDIR=""
+ISOLATED=0
+TMPFS_FLAG=""
+while [ $# -gt 0 ]; do
+    case "$1" in
+        --build-dir) OUTDIR="$2"; shift 2 ;;
+        --isolated) ISOLATED=1; shift ;;
+        --tmpfs) ISOLATED=1; TMPFS_FLAG="--tmpfs"; shift ;;
+        *) print_error "Unknown option: $1"; exit 1 ;;
+    esac
+done
+if [ -z "$OUTDIR" ] && [ $ISOLATED -eq 1 ]; then
+    OUTDIR=$(python3 utils/build_dirs.py main $TMPFS_FLAG)
+fi
+OUT="${OUTDIR:-.}"
+OUTPUT_OPT=()
+if [ -n "$OUTDIR" ]; then
+    mkdir -p "$OUTDIR"
+    OUTPUT_OPT=("-output-directory=$OUTDIR")
+fi
+
 # Start timing
 SCRIPT_START=$(date +%s.%N)
 
@@ -56,7 +83,13 @@ fi
 # Clean previous build artifacts
 print_step "Cleaning previous build artifacts..."
 CLEAN_START=$(date +%s.%N)
-rm -f *.aux *.log *.out *.toc *.lot *.lof *.synctex.gz *.fls *.fdb_latexmk *.idx *.ilg *.ind main.pdf
+if [ -n "$OUTDIR" ]; then
+    # Isolated build: only this build directory is cleaned
+    echo "  Build directory: $OUTDIR"
+    rm -f "$OUT"/main.{aux,log,out,toc,lot,lof,synctex.gz,fls,fdb_latexmk,idx,ilg,ind,pdf} "$OUT"/compile_pass{1,2}.log
+else
+    rm -f *.aux *.log *.out *.toc *.lot *.lof *.synctex.gz *.fls *.fdb_latexmk *.idx *.ilg *.ind main.pdf
+fi
 CLEAN_END=$(date +%s.%N)
 CLEAN_TIME=$(echo "$CLEAN_END - $CLEAN_START" | bc -l)
 print_success "Cleanup completed in $(format_time $CLEAN_TIME)"
@@ -65,7 +98,7 @@ echo ""
 # First compilation pass
 print_step "First LuaLaTeX compilation pass..."
 FIRST_START=$(date +%s.%N)
-if lualatex --interaction=nonstopmode main.tex > compile_pass1.log 2>&1; then
+if lualatex --interaction=nonstopmode "${OUTPUT_OPT[@]}" main.tex > "$OUT/compile_pass1.log" 2>&1; then
     FIRST_END=$(date +%s.%N)
     FIRST_TIME=$(echo "$FIRST_END - $FIRST_START" | bc -l)
     print_success "First pass completed in $(format_time $FIRST_TIME)"
@@ -73,19 +106,19 @@ else
     FIRST_END=$(date +%s.%N)
     FIRST_TIME=$(echo "$FIRST_END - $FIRST_START" | bc -l)
     print_error "First pass failed after $(format_time $FIRST_TIME)"
-    echo "Check compile_pass1.log for details"
+    echo "Check $OUT/compile_pass1.log for details"
     exit 1
 fi
 
 # Check if PDF was generated
-if [ ! -f "main.pdf" ]; then
+if [ ! -f "$OUT/main.pdf" ]; then
     print_error "PDF was not generated after first pass"
     exit 1
 fi
 
 # Get first pass statistics
-FIRST_PAGES=$(grep "Output written" main.log | tail -1 | grep -o '[0-9]\+ pages' | grep -o '[0-9]\+' || echo "0")
-FIRST_SIZE=$(ls -lh main.pdf | awk '{print $5}' 2>/dev/null || echo "0")
+FIRST_PAGES=$(grep "Output written" "$OUT/main.log" | tail -1 | grep -o '[0-9]\+ pages' | grep -o '[0-9]\+' || echo "0")
+FIRST_SIZE=$(ls -lh "$OUT/main.pdf" | awk '{print $5}' 2>/dev/null || echo "0")
 
 echo "  - Pages generated: $FIRST_PAGES"
 echo "  - PDF size: $FIRST_SIZE"
@@ -94,7 +127,7 @@ echo ""
 # Second compilation pass (for cross-references)
 print_step "Second LuaLaTeX compilation pass (for cross-references)..."
 SECOND_START=$(date +%s.%N)
-if lualatex --interaction=nonstopmode main.tex > compile_pass2.log 2>&1; then
+if lualatex --interaction=nonstopmode "${OUTPUT_OPT[@]}" main.tex > "$OUT/compile_pass2.log" 2>&1; then
     SECOND_END=$(date +%s.%N)
     SECOND_TIME=$(echo "$SECOND_END - $SECOND_START" | bc -l)
     print_success "Second pass completed in $(format_time $SECOND_TIME)"
@@ -102,18 +135,23 @@ else
     SECOND_END=$(date +%s.%N)
     SECOND_TIME=$(echo "$SECOND_END - $SECOND_START" | bc -l)
     print_error "Second pass failed after $(format_time $SECOND_TIME)"
-    echo "Check compile_pass2.log for details"
+    echo "Check $OUT/compile_pass2.log for details"
     # Don't exit - first pass PDF might still be usable
 fi
 
 # Get final statistics
-if [ -f "main.pdf" ]; then
-    FINAL_PAGES=$(grep "Output written" main.log | tail -1 | grep -o '[0-9]\+ pages' | grep -o '[0-9]\+' || echo "0")
-    FINAL_SIZE=$(ls -lh main.pdf | awk '{print $5}' 2>/dev/null || echo "0")
-    FINAL_BYTES=$(stat -f%z main.pdf 2>/dev/null || stat -c%s main.pdf 2>/dev/null || echo "0")
+if [ -f "$OUT/main.pdf" ]; then
+    FINAL_PAGES=$(grep "Output written" "$OUT/main.log" | tail -1 | grep -o '[0-9]\+ pages' | grep -o '[0-9]\+' || echo "0")
+    FINAL_SIZE=$(ls -lh "$OUT/main.pdf" | awk '{print $5}' 2>/dev/null || echo "0")
+    FINAL_BYTES=$(stat -f%z "$OUT/main.pdf" 2>/dev/null || stat -c%s "$OUT/main.pdf" 2>/dev/null || echo "0")
     
     # Calculate MB
     FINAL_MB=$(echo "scale=2; $FINAL_BYTES / 1048576" | bc -l)
+
+    # Isolated build: only the PDF comes back to the repo root
+    if [ -n "$OUTDIR" ]; then
+        cp "$OUT/main.pdf" main.pdf
+    fi
 fi
 
 # Calculate total compilation time
@@ -135,7 +173,7 @@ printf "%-25s %s\n" "Total compile time:" "$(format_time $COMPILE_TIME)"
 printf "%-25s %s\n" "Total script time:" "$(format_time $TOTAL_TIME)"
 echo ""
 
-if [ -f "main.pdf" ]; then
+if [ -f "$OUT/main.pdf" ]; then
     printf "%-25s %s\n" "Final page count:" "$FINAL_PAGES pages"
     printf "%-25s %s\n" "Final PDF size:" "$FINAL_SIZE (${FINAL_MB} MB)"
     printf "%-25s %.2f\n" "Pages per second:" "$(echo "scale=2; $FINAL_PAGES / $COMPILE_TIME" | bc -l)"
@@ -147,17 +185,21 @@ else
     print_error "PDF compilation failed!"
 fi
 
-# Show any warnings
-WARNINGS=$(grep -i "warning\|error" main.log | wc -l | tr -d ' ')
-if [ "$WARNINGS" -gt 0 ]; then
+# Show any warnings, indexed by chapter (a plain count if the indexer is unavailable)
+if [ -f "$OUT/main.log" ]; then
     echo ""
-    echo -e "${YELLOW}Found $WARNINGS warnings/errors in main.log${NC}"
-    echo "Use 'grep -i \"warning\\|error\" main.log' to see details"
+    if ! python3 utils/log_index.py "$OUT/main.log" --summary; then
+        WARNINGS=$(grep -i "warning\|error" "$OUT/main.log" | wc -l | tr -d ' ')
+        if [ "$WARNINGS" -gt 0 ]; then
+            echo -e "${YELLOW}Found $WARNINGS warnings/errors in $OUT/main.log${NC}"
+            echo "Use 'grep -i \"warning\\|error\" $OUT/main.log' to see details"
+        fi
+    fi
 fi
 
 echo ""
 echo -e "${BLUE}Compilation logs saved:${NC}"
-echo "  - compile_pass1.log (first pass)"
-echo "  - compile_pass2.log (second pass)"  
-echo "  - main.log (latest compilation)"
+echo "  - $OUT/compile_pass1.log (first pass)"
+echo "  - $OUT/compile_pass2.log (second pass)"  
+echo "  - $OUT/main.log (latest compilation)"
 echo "" 
\ No newline at end of file
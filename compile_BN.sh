@@ -4,9 +4,11 @@
 echo "Compiling Barnes & Noble print files..."
 
 # Compile interior (without cover)
+# The interior is generated from main.tex's chapter list and built in build/bn/
+# (LuaLaTeX - the shared preamble uses fontspec); the PDF is copied back to the repo root.
+# Extra arguments go to the build, e.g. ./compile_BN.sh --tmpfs
 echo "Compiling interior PDF..."
-pdflatex -interaction=nonstopmode main_interior_BN.tex
-pdflatex -interaction=nonstopmode main_interior_BN.tex  # Run twice for TOC
+python3 utils/editions.py build bn "$@"
 
 # Compile cover
 echo "Compiling wraparound cover PDF..."
@@ -3,10 +3,13 @@
 Generate a table of contents by extracting titles and summaries from all chapters.
 """
 
-import os
 import re
+import sys
 from pathlib import Path
 
+sys.path.insert(0, str(Path(__file__).resolve().parent / 'utils'))
+from book_model import load_book
+
 def clean_latex_text(text):
     """Remove LaTeX commands and clean up text for plain text output."""
     # Remove common LaTeX commands
@@ -19,38 +22,9 @@ def clean_latex_text(text):
     text = re.sub(r'\s+', ' ', text)  # Normalize whitespace
     return text.strip()
 
-def read_chapter_file(chapter_dir, filename):
-    """Read and clean content from a chapter file."""
-    file_path = chapter_dir / filename
-    if not file_path.exists():
-        return ""
-    
-    try:
-        with open(file_path, 'r', encoding='utf-8') as f:
-            content = f.read()
-        
-        # Clean the content
-        content = clean_latex_text(content)
-        return content
-    except Exception as e:
-        print(f"Warning: Could not read {file_path}: {e}")
-        return ""
-
 def main():
-    workspace_dir = Path(".")
-    
-    # Get all chapter directories and sort them numerically
-    chapter_dirs = []
-    for item in workspace_dir.iterdir():
-        if item.is_dir() and re.match(r'^\d+_', item.name):
-            # Extract chapter number for sorting
-            match = re.match(r'^(\d+)_', item.name)
-            if match:
-                chapter_num = int(match.group(1))
-                chapter_dirs.append((chapter_num, item))
-    
-    # Sort by chapter number
-    chapter_dirs.sort(key=lambda x: x[0])
+    # All chapter directories, sorted numerically (cached in build/cache/ by utils/book_model.py)
+    chapter_dirs = [(c.number, c) for c in load_book().chapter_dirs()]
     
     toc_content = []
     toc_content.append("TABLE OF CONTENTS")
@@ -60,13 +34,11 @@ def main():
     toc_content.append("")
     
     for chapter_num, chapter_dir in chapter_dirs:
-        print(f"Processing Chapter {chapter_num}: {chapter_dir.name}")
-        
-        # Read title
-        title = read_chapter_file(chapter_dir, "title.tex")
+        print(f"Processing Chapter {chapter_num}: {chapter_dir.directory}")
         
-        # Read summary
-        summary = read_chapter_file(chapter_dir, "summary.tex")
+        # Title and summary
+        title = clean_latex_text(chapter_dir.title)
+        summary = clean_latex_text(chapter_dir.summary)
         
         # Format chapter entry
         toc_content.append(f"Chapter {chapter_num:02d}: {title}")
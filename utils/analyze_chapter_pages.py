@@ -17,6 +17,9 @@ Usage:
     
     basename: Base filename without extension (default: "main")
               Examples: "main", "main_sidenotes"
+    --build-dir: read the .toc/.log/.pdf of an out-of-tree build (e.g. build/main)
+    --no-history: do not record the chapter lengths in build/page_history.sqlite
+                  (see page_history.py for queries across builds)
 """
 
 import os
@@ -28,6 +31,10 @@ import subprocess
 import sys
 import argparse
 
+from book_model import load_book
+from build_dirs import artifact_path, resolve_build_dir
+from page_history import HISTORY_DB, record_chapter_lengths
+
 # Optional PDF analysis
 try:
     import PyPDF2
@@ -35,9 +42,9 @@ try:
 except ImportError:
     HAS_PYPDF2 = False
 
-def parse_toc_file(basename="main"):
+def parse_toc_file(basename="main", build_dir=None):
     """Parse LaTeX .toc file to extract chapter information."""
-    toc_path = f"{basename}.toc"
+    toc_path = artifact_path(basename, 'toc', build_dir)
     if not os.path.exists(toc_path):
         print(f"❌ TOC file not found: {toc_path}")
         return []
@@ -79,9 +86,9 @@ def parse_toc_file(basename="main"):
     
     return sorted(chapters, key=lambda x: x['chapter_num'])
 
-def get_total_pages_from_log(basename="main"):
+def get_total_pages_from_log(basename="main", build_dir=None):
     """Extract total page count from LaTeX log file."""
-    log_path = f"{basename}.log"
+    log_path = artifact_path(basename, 'log', build_dir)
     if not os.path.exists(log_path):
         return None
     
@@ -99,9 +106,9 @@ def get_total_pages_from_log(basename="main"):
     
     return None
 
-def get_pdf_page_count(basename="main"):
+def get_pdf_page_count(basename="main", build_dir=None):
     """Get page count directly from PDF file."""
-    pdf_path = f"{basename}.pdf"
+    pdf_path = artifact_path(basename, 'pdf', build_dir)
     if not os.path.exists(pdf_path):
         return None
     
@@ -157,58 +164,41 @@ def calculate_chapter_lengths(chapters, total_pages):
     return results
 
 def get_chapter_folder_info(basename="main"):
-    """Get chapter folder information by parsing the actual inclusion order."""
+    """Get chapter folder information from the inclusion order in the cached BookModel."""
     folders = {}
     
-    # Try to read the main tex file to get actual chapter order
+    # Chapter order of the main tex file
     tex_file = f"{basename}.tex"
-    if os.path.exists(tex_file):
-        try:
-            with open(tex_file, 'r', encoding='utf-8') as f:
-                content = f.read()
-            
-            # Remove comment blocks first
-            # Remove \begin{comment}...\end{comment} blocks
-            content_no_comments = re.sub(r'\\begin\{comment\}.*?\\end\{comment\}', '', content, flags=re.DOTALL)
-            
-            # Find all \inputstory{folder_name} entries in order
-            input_pattern = r'\\inputstory\{([^}]+)\}'
-            matches = re.findall(input_pattern, content_no_comments)
-            
-            for chapter_position, folder_name in enumerate(matches, 1):
-                if os.path.exists(folder_name):
-                    # Extract the descriptive name (after the number prefix)
-                    folder_match = re.match(r'(\d+)_(.+)', folder_name)
-                    if folder_match:
-                        descriptive_name = folder_match.group(2)
-                    else:
-                        descriptive_name = folder_name
-                    
-                    folders[chapter_position] = {
-                        'folder_name': descriptive_name,
-                        'full_folder': folder_name
-                    }
-        
-        except Exception as e:
-            print(f"⚠️  Could not parse chapter order from {tex_file}: {e}")
+    try:
+        model = load_book(tex_file)
+    except FileNotFoundError:
+        model = None
+    except Exception as e:
+        print(f"⚠️  Could not parse chapter order from {tex_file}: {e}")
+        model = None
+    
+    if model:
+        stories = [e for e in model.entries if e.inputstory_line]
+        for chapter_position, entry in enumerate(stories, 1):
+            chapter = model.chapter_of(entry)
+            if chapter:
+                folders[chapter_position] = {
+                    'folder_name': chapter.name,
+                    'full_folder': chapter.directory
+                }
     
     # Fallback to old method if parsing failed
     if not folders:
         print("⚠️  Using folder number fallback (may be inaccurate)")
-        for item in Path('.').iterdir():
-            if item.is_dir() and re.match(r'\d+_', item.name):
-                match = re.match(r'(\d+)_(.+)', item.name)
-                if match:
-                    chapter_num = int(match.group(1))
-                    folder_name = match.group(2)
-                    folders[chapter_num] = {
-                        'folder_name': folder_name,
-                        'full_folder': item.name
-                    }
+        for chapter in (model or load_book()).chapter_dirs():
+            folders[chapter.number] = {
+                'folder_name': chapter.name,
+                'full_folder': chapter.directory
+            }
     
     return folders
 
-def analyze_chapter_pages(basename="main"):
+def analyze_chapter_pages(basename="main", build_dir=None):
     """Main analysis function."""
     print("📊 CHAPTER PAGE ANALYSIS")
     print("=" * 60)
@@ -217,7 +207,7 @@ def analyze_chapter_pages(basename="main"):
     
     # Parse TOC file
     print("📖 Parsing table of contents...")
-    chapters = parse_toc_file(basename)
+    chapters = parse_toc_file(basename, build_dir)
     
     if not chapters:
         print("❌ No chapters found in TOC file!")
@@ -227,11 +217,11 @@ def analyze_chapter_pages(basename="main"):
     
     # Get total page count
     print("📄 Determining total page count...")
-    total_pages = get_total_pages_from_log(basename)
+    total_pages = get_total_pages_from_log(basename, build_dir)
     if total_pages:
         print(f"   ✅ From log file: {total_pages} pages")
     else:
-        total_pages = get_pdf_page_count(basename)
+        total_pages = get_pdf_page_count(basename, build_dir)
         if total_pages:
             print(f"   ✅ From PDF file: {total_pages} pages")
         else:
@@ -375,6 +365,7 @@ def main():
 Examples:
   python analyze_chapter_pages.py                    # Analyze main.pdf
   python analyze_chapter_pages.py main_sidenotes    # Analyze main_sidenotes.pdf
+  python analyze_chapter_pages.py --build-dir build/main  # Analyze an out-of-tree build
         """
     )
     parser.add_argument(
@@ -384,8 +375,20 @@ Examples:
         help='Base filename without extension (default: main)'
     )
     
+    parser.add_argument(
+        '--build-dir',
+        help='Read .toc/.log/.pdf files from this build directory'
+    )
+    
+    parser.add_argument(
+        '--no-history',
+        action='store_true',
+        help='Do not append the chapter lengths to build/page_history.sqlite'
+    )
+    
     args = parser.parse_args()
     basename = args.basename
+    build_dir = resolve_build_dir(args.build_dir)
     
     # Clean up old CSV files first
     cleanup_old_csvs()
@@ -403,7 +406,7 @@ Examples:
     print()
     
     # Check if we're in the right directory
-    base_files = list(Path('.').glob(f'{basename}.*'))
+    base_files = list((build_dir or Path('.')).glob(f'{basename}.*'))
     if not base_files:
         print(f"⚠️  Warning: No {basename}.* files found")
         response = input("Continue anyway? (y/N): ")
@@ -415,7 +418,7 @@ Examples:
     
     # Run analysis
     try:
-        results, total_pages = analyze_chapter_pages(basename)
+        results, total_pages = analyze_chapter_pages(basename, build_dir)
         
         if not results:
             print("❌ Analysis failed - no results generated")
@@ -423,6 +426,12 @@ Examples:
         
         stats = generate_statistics(results)
         csv_filename = save_csv_report(results, stats, basename)
+        if not args.no_history:
+            try:
+                build_id = record_chapter_lengths(basename, build_dir, results, total_pages)
+                print(f"🗃️  Recorded as build {build_id} in {HISTORY_DB.name}")
+            except Exception as e:
+                print(f"⚠️  Could not record chapter lengths: {e}")
         display_results(results, stats, total_pages)
         
         print()
@@ -28,6 +28,8 @@ import csv
 from pathlib import Path
 from datetime import datetime
 
+from book_model import load_book
+
 def count_words_and_chars(text):
     """Count words and characters in text, excluding LaTeX commands."""
     # Remove LaTeX comments
@@ -55,21 +57,17 @@ def get_file_stats(file_path):
     except Exception:
         return 0, 0
 
-def analyze_chapter(chapter_dir):
-    """Analyze a single chapter directory."""
-    chapter_path = Path(chapter_dir)
-    
-    if not chapter_path.is_dir():
-        return None
+def analyze_chapter(chapter):
+    """Analyze a single chapter directory (a BookModel Chapter)."""
+    chapter_path = chapter.path
     
     # Extract chapter number and name
-    dir_name = chapter_path.name
-    match = re.match(r'(\d+)_(.+)', dir_name)
-    if not match:
+    dir_name = chapter.directory
+    if chapter.number is None:
         return None
     
-    chapter_num = int(match.group(1))
-    chapter_name = match.group(2)
+    chapter_num = chapter.number
+    chapter_name = chapter.name
     
     # Define all possible files based on \inputstory
     files_to_check = {
@@ -99,7 +97,7 @@ def analyze_chapter(chapter_dir):
     # Check file presence
     for filename, file_type in files_to_check.items():
         file_path = chapter_path / filename
-        exists = file_path.exists()
+        exists = chapter.has(filename)
         result[f'has_{filename.replace(".tex", "")}'] = 'V' if exists else 'X'
         
         # For main.tex, also get word and character counts
@@ -112,12 +110,12 @@ def analyze_chapter(chapter_dir):
             result['main_characters'] = 0
     
     # Get total file count
-    all_tex_files = list(chapter_path.glob('*.tex'))
+    all_tex_files = chapter.tex_files
     result['total_tex_files'] = len(all_tex_files)
     
     # Check for additional files not in standard set
     standard_files = set(files_to_check.keys())
-    actual_files = set(f.name for f in all_tex_files)
+    actual_files = set(all_tex_files)
     extra_files = actual_files - standard_files
     result['extra_files'] = ', '.join(sorted(extra_files)) if extra_files else ''
     
@@ -125,13 +123,7 @@ def analyze_chapter(chapter_dir):
 
 def find_all_chapters():
     """Find all chapter directories."""
-    chapter_dirs = []
-    
-    for item in Path('.').iterdir():
-        if item.is_dir() and re.match(r'\d+_', item.name):
-            chapter_dirs.append(item)
-    
-    return sorted(chapter_dirs, key=lambda x: int(re.match(r'(\d+)_', x.name).group(1)))
+    return load_book().chapter_dirs()
 
 def generate_csv_report():
     """Generate comprehensive CSV report of all chapters."""
@@ -152,9 +144,9 @@ def generate_csv_report():
     total_words = 0
     total_chars = 0
     
-    for chapter_dir in chapters:
-        print(f"   📖 Analyzing {chapter_dir.name}...")
-        result = analyze_chapter(chapter_dir)
+    for chapter in chapters:
+        print(f"   📖 Analyzing {chapter.directory}...")
+        result = analyze_chapter(chapter)
         if result:
             results.append(result)
             total_words += result.get('main_words', 0)
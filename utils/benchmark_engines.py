@@ -0,0 +1,308 @@
+#!/usr/bin/env python3
+"""
+Engine A/B benchmarking harness (LuaLaTeX vs pdfLaTeX vs XeLaTeX).
+
+Builds a target (the main book, the B&N interior, the cover, or a chapter
+subset) under every compatible engine, several times each, and records:
+- wall time and CPU time (user + system, including child processes)
+- peak resident set size
+- PDF size and page count
+- pagination differences between engines (chapter start pages from the .toc)
+
+Every engine builds in its own directory under build/bench/, so runs never
+touch the .aux/.log files in the repository root.
+
+Usage:
+  python3 utils/benchmark_engines.py main --runs 3
+  python3 utils/benchmark_engines.py --chapters 1-3 --engines lualatex,xelatex
+  python3 utils/benchmark_engines.py cover
+"""
+
+import argparse
+import csv
+import os
+import re
+import shutil
+import subprocess
+import sys
+import time
+from dataclasses import dataclass, field
+from datetime import datetime
+from pathlib import Path
+from statistics import mean, median
+from typing import Dict, List, Optional, Tuple
+
+from generate_chapter_subset import ChapterExtractor
+
+ROOT = Path(__file__).resolve().parents[1]
+BENCH_ROOT = ROOT / 'build' / 'bench'
+
+ENGINES = ['lualatex', 'pdflatex', 'xelatex']
+
+# (tex file, working directory) relative to the repository root
+TARGETS = {
+    'main': ('main.tex', '.'),
+    'bn': ('main_interior_BN.tex', '.'),
+    'cover': ('cover_refined.tex', 'cover'),
+}
+
+# Packages that only run on Unicode engines
+UNICODE_ONLY_PACKAGES = {'fontspec', 'unicode-math', 'polyglossia'}
+# Constructs that only run on LuaTeX
+LUA_ONLY_PATTERN = re.compile(r'\\directlua|\\usepackage(?:\[[^\]]*\])?\{(?:luacode|luaotfload|luatexbase)\}')
+
+
+@dataclass
+class RunResult:
+    engine: str
+    run: int
+    success: bool
+    wall: float
+    cpu: float
+    peak_rss_mb: float
+    pdf_bytes: int
+    pages: Optional[int]
+    chapter_pages: Dict[int, int] = field(default_factory=dict)
+
+
+def read_with_inputs(tex_path: Path, cwd: Path) -> str:
+    """Return the source of a target plus the files it \\input's from its working directory (one level)."""
+    text = tex_path.read_text(encoding='utf-8', errors='ignore')
+    parts = [text]
+    for name in re.findall(r'^[^%\n]*\\input\{([^}]+)\}', text, flags=re.MULTILINE):
+        path = cwd / (name if name.endswith('.tex') else f'{name}.tex')
+        if path.exists():
+            parts.append(path.read_text(encoding='utf-8', errors='ignore'))
+    return "\n".join(parts)
+
+
+def compatible_engines(tex_path: Path, cwd: Path) -> Tuple[List[str], Dict[str, str]]:
+    """Return (engines that can build the target, {engine: reason it was excluded})."""
+    source = read_with_inputs(tex_path, cwd)
+    packages = set()
+    for group in re.findall(r'^[^%\n]*\\usepackage(?:\[[^\]]*\])?\{([^}]+)\}', source, flags=re.MULTILINE):
+        packages.update(p.strip() for p in group.split(','))
+
+    excluded = {}
+    unicode_only = sorted(packages & UNICODE_ONLY_PACKAGES)
+    if unicode_only:
+        excluded['pdflatex'] = f"needs a Unicode engine ({', '.join(unicode_only)})"
+    if LUA_ONLY_PATTERN.search(source):
+        excluded.setdefault('pdflatex', 'uses LuaTeX-only code')
+        excluded['xelatex'] = 'uses LuaTeX-only code'
+
+    return [e for e in ENGINES if e not in excluded], excluded
+
+
+def run_measured(cmd: List[str], cwd: Path, log_path: Path) -> Tuple[int, float, float, float]:
+    """Run a command and return (exit code, wall seconds, cpu seconds, peak RSS in MB)."""
+    start = time.perf_counter()
+    with open(log_path, 'w') as log:
+        proc = subprocess.Popen(cmd, cwd=cwd, stdout=log, stderr=subprocess.STDOUT)
+        _, status, usage = os.wait4(proc.pid, 0)
+    wall = time.perf_counter() - start
+    proc.returncode = os.waitstatus_to_exitcode(status)
+
+    cpu = usage.ru_utime + usage.ru_stime
+    # ru_maxrss is in kilobytes on Linux and in bytes on macOS
+    divisor = 1024 * 1024 if sys.platform == 'darwin' else 1024
+    return proc.returncode, wall, cpu, usage.ru_maxrss / divisor
+
+
+def pages_from_log(log_file: Path) -> Optional[int]:
+    if not log_file.exists():
+        return None
+    content = log_file.read_text(encoding='utf-8', errors='ignore')
+    match = re.search(r'Output written on [^(]*\((\d+) pages?', content)
+    return int(match.group(1)) if match else None
+
+
+def chapter_pages_from_toc(toc_file: Path) -> Dict[int, int]:
+    """Map chapter number -> start page from a .toc file."""
+    if not toc_file.exists():
+        return {}
+    content = toc_file.read_text(encoding='utf-8', errors='ignore')
+    pattern = r'\\contentsline\s*\{chapter\}\s*\{\\numberline\s*\{(\d+)\}.*?\}\s*\{(\d+)\}'
+    return {int(num): int(page) for num, page in re.findall(pattern, content)}
+
+
+def benchmark_engine(engine: str, tex_file: str, cwd: Path, runs: int, passes: int) -> List[RunResult]:
+    """Build the target `runs` times under one engine, each time from a clean directory."""
+    jobname = Path(tex_file).stem
+    out_dir = BENCH_ROOT / jobname / engine
+    results = []
+
+    for run in range(1, runs + 1):
+        if out_dir.exists():
+            shutil.rmtree(out_dir)
+        out_dir.mkdir(parents=True)
+
+        wall = cpu = peak = 0.0
+        code = 0
+        for pass_num in range(1, passes + 1):
+            cmd = [engine, '-interaction=nonstopmode', f'-output-directory={out_dir}', tex_file]
+            code, w, c, rss = run_measured(cmd, cwd, out_dir / f'bench_pass{pass_num}.log')
+            wall += w
+            cpu += c
+            peak = max(peak, rss)
+
+        pdf = out_dir / f'{jobname}.pdf'
+        success = pdf.exists()
+        result = RunResult(
+            engine=engine,
+            run=run,
+            success=success,
+            wall=wall,
+            cpu=cpu,
+            peak_rss_mb=peak,
+            pdf_bytes=pdf.stat().st_size if success else 0,
+            pages=pages_from_log(out_dir / f'{jobname}.log'),
+            chapter_pages=chapter_pages_from_toc(out_dir / f'{jobname}.toc'),
+        )
+        icon = '✅' if success else '❌'
+        print(f"  {icon} {engine:<9} run {run}/{runs}: {wall:6.1f}s wall, {cpu:6.1f}s cpu, "
+              f"{peak:6.0f} MB, {result.pages or '?'} pages (exit {code})")
+        results.append(result)
+
+    return results
+
+
+def pagination_differences(results: Dict[str, List[RunResult]], reference: str) -> List[str]:
+    """Compare chapter start pages and page counts of each engine against the reference engine."""
+    ok = {engine: [r for r in runs if r.success] for engine, runs in results.items()}
+    if not ok.get(reference):
+        return []
+
+    ref = ok[reference][-1]
+    report = []
+    for engine, runs in ok.items():
+        if engine == reference or not runs:
+            continue
+        other = runs[-1]
+        if ref.pages != other.pages:
+            report.append(f"{engine}: {other.pages} pages vs {ref.pages} with {reference}")
+        for chapter in sorted(set(ref.chapter_pages) | set(other.chapter_pages)):
+            a = ref.chapter_pages.get(chapter)
+            b = other.chapter_pages.get(chapter)
+            if a != b:
+                report.append(f"{engine}: chapter {chapter} starts on page {b} (page {a} with {reference})")
+    return report
+
+
+def save_csv(results: Dict[str, List[RunResult]], label: str) -> str:
+    timestamp = datetime.now().strftime("%Y%m%d_%H%M%S")
+    csv_filename = f"engine_benchmark_{label}_{timestamp}.csv"
+    fieldnames = ['engine', 'run', 'success', 'wall_seconds', 'cpu_seconds', 'peak_rss_mb', 'pdf_bytes', 'pages']
+    with open(csv_filename, 'w', newline='', encoding='utf-8') as f:
+        writer = csv.DictWriter(f, fieldnames=fieldnames)
+        writer.writeheader()
+        for runs in results.values():
+            for r in runs:
+                writer.writerow({
+                    'engine': r.engine,
+                    'run': r.run,
+                    'success': r.success,
+                    'wall_seconds': f"{r.wall:.2f}",
+                    'cpu_seconds': f"{r.cpu:.2f}",
+                    'peak_rss_mb': f"{r.peak_rss_mb:.1f}",
+                    'pdf_bytes': r.pdf_bytes,
+                    'pages': r.pages if r.pages is not None else '',
+                })
+    return csv_filename
+
+
+def display_summary(results: Dict[str, List[RunResult]], reference: str) -> None:
+    print()
+    print("=" * 78)
+    print("📊 ENGINE BENCHMARK SUMMARY (medians over successful runs)")
+    print("=" * 78)
+    print(f"{'Engine':<10} {'OK':>5} {'Wall':>9} {'CPU':>9} {'Peak RSS':>10} {'PDF':>9} {'Pages':>6}")
+    print("-" * 78)
+    for engine, runs in results.items():
+        ok = [r for r in runs if r.success]
+        if not ok:
+            print(f"{engine:<10} {0:>2}/{len(runs):<2} {'failed':>9}")
+            continue
+        print(f"{engine:<10} {len(ok):>2}/{len(runs):<2} "
+              f"{median(r.wall for r in ok):8.1f}s {median(r.cpu for r in ok):8.1f}s "
+              f"{median(r.peak_rss_mb for r in ok):8.0f}MB "
+              f"{mean(r.pdf_bytes for r in ok) / (1024 * 1024):7.1f}MB "
+              f"{ok[-1].pages if ok[-1].pages is not None else '?':>6}")
+
+    differences = pagination_differences(results, reference)
+    print()
+    if differences:
+        print(f"⚠️  PAGINATION DIFFERENCES (reference: {reference}):")
+        for line in differences:
+            print(f"   - {line}")
+    else:
+        print(f"✅ No pagination differences against {reference}")
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(
+        description='Benchmark a build target under each compatible TeX engine',
+        formatter_class=argparse.RawDescriptionHelpFormatter,
+        epilog="""
+Examples:
+  python3 utils/benchmark_engines.py main --runs 3
+  python3 utils/benchmark_engines.py --chapters 1-3,14 --passes 1
+  python3 utils/benchmark_engines.py cover --engines xelatex,lualatex
+        """
+    )
+    parser.add_argument('target', nargs='?', default='main', choices=sorted(TARGETS),
+                        help='Build target (default: main); ignored with --chapters')
+    parser.add_argument('--chapters', help='Benchmark a chapter subset instead (same syntax as generate_chapter_subset.py)')
+    parser.add_argument('--engines', default=','.join(ENGINES),
+                        help=f"Comma-separated engines to try (default: {','.join(ENGINES)})")
+    parser.add_argument('--runs', type=int, default=3, help='Builds per engine (default: 3)')
+    parser.add_argument('--passes', type=int, default=2, help='Engine passes per build (default: 2)')
+    parser.add_argument('--reference', default='lualatex', help='Engine the pagination is compared against')
+    args = parser.parse_args()
+
+    if args.chapters:
+        BENCH_ROOT.mkdir(parents=True, exist_ok=True)
+        extractor = ChapterExtractor(ROOT / 'main.tex')
+        extractor.parse_main_tex()
+        numbers = extractor.parse_chapter_spec(args.chapters)
+        subset = BENCH_ROOT / 'bench_subset.tex'
+        if not numbers or not extractor.generate_subset_tex(numbers, str(subset)):
+            sys.exit(1)
+        # Compiled from the repository root so \input{preamble} and chapter paths resolve
+        tex_file, cwd = str(subset.relative_to(ROOT)), ROOT
+        label = 'subset'
+    else:
+        tex_file, workdir = TARGETS[args.target]
+        cwd = ROOT / workdir
+        label = args.target
+
+    compatible, excluded = compatible_engines(cwd / tex_file, cwd)
+    requested = [e.strip() for e in args.engines.split(',') if e.strip()]
+    engines = []
+    for engine in requested:
+        if engine in excluded:
+            print(f"⏭️  Skipping {engine}: {excluded[engine]}")
+        elif shutil.which(engine) is None:
+            print(f"⏭️  Skipping {engine}: not found on PATH")
+        elif engine in compatible:
+            engines.append(engine)
+
+    if not engines:
+        print("❌ No compatible engine available for this target")
+        sys.exit(1)
+
+    print(f"🚀 Benchmarking {tex_file} with {', '.join(engines)} "
+          f"({args.runs} run(s) x {args.passes} pass(es))")
+
+    results: Dict[str, List[RunResult]] = {}
+    for engine in engines:
+        results[engine] = benchmark_engine(engine, tex_file, cwd, args.runs, args.passes)
+
+    reference = args.reference if args.reference in results else engines[0]
+    display_summary(results, reference)
+    csv_filename = save_csv(results, label)
+    print(f"\n📄 CSV report saved: {csv_filename}")
+
+
+if __name__ == '__main__':
+    main()
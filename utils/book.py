@@ -0,0 +1,187 @@
+#!/usr/bin/env python3
+"""
+Single entry point for the book tooling.
+
+Each subcommand runs an existing script as if it had been started directly
+(same arguments, same output). Nothing a subcommand needs is imported until
+it runs, so `book.py --help` and quick commands like `book.py subset --list`
+do not pay for cv2, matplotlib, scipy, numpy, PIL or PyPDF2, which only the
+image and PDF scripts import.
+
+Usage:
+  python3 utils/book.py --help
+  python3 utils/book.py build main.tex --isolated
+  python3 utils/book.py subset --list
+  python3 utils/book.py analyze pages --build-dir build/main
+  python3 utils/book.py trees fruits
+  python3 utils/book.py startup subset --list    # import time of a subcommand (python -X importtime)
+  python3 utils/book.py release --yes             # publish without the confirmation prompt
+
+`book.py <command> --help` never runs anything: it is forwarded only to scripts
+that parse their arguments with argparse; for the others (shell scripts and
+plain Python scripts) the command's help text below is printed instead.
+"""
+
+import argparse
+import os
+import re
+import sys
+import time
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+# name -> (help, {variant: script}); the first variant is the default
+COMMANDS = {
+    'build': ('Compile a book file with live progress', {'': 'utils/compile_realtime.py'}),
+    'subset': ('Generate a .tex with selected chapters', {'': 'utils/generate_chapter_subset.py'}),
+    'flatten': ('Flatten the book into one .tex file', {'': 'utils/flatten_book.py'}),
+    'analyze': ('Chapter statistics, page ranges and page tables', {
+        'chapters': 'utils/analyze_chapters.py',
+        'pages': 'utils/analyze_chapter_pages.py',
+        'table': 'utils/generate_page_table.py',
+        'pagemap': 'utils/pdf_pagemap.py',
+        'fill': 'utils/page_fill.py',
+        'history': 'utils/page_history.py',
+        'warnings': 'utils/log_index.py',
+        'pdfdiff': 'utils/pdf_diff.py',
+        'forecast': 'utils/page_forecast.py',
+        'index': 'utils/generate_chapter_index.py',
+        'deps': 'utils/dep_index.py',
+    }),
+    'split': ('Cut the compiled book into per-chapter PDFs', {'': 'utils/split_chapters.py'}),
+    'previews': ('Cached thumbnails of chapter pages from the compiled book', {'': 'utils/chapter_previews.py'}),
+    'toc': ('Write TABLE_OF_CONTENTS.txt', {'': 'generate_toc.py'}),
+    'bios': ('Collect the biographical notes of all chapters', {'': 'utils/collect_bios.py'}),
+    'trees': ('Fractal tree images', {
+        'fruits': 'fractal_trees/add_dna_fruits.py',
+        'branches': 'fractal_trees/detect_branches.py',
+        'pad': 'fractal_trees/pad_images.py',
+        'rows': 'fractal_trees/fasta_to_growing_rows.py',
+    }),
+    'poster': ('Sticker posters and the wrap cover', {
+        'mega': 'design_scripts/generate_mega_poster.py',
+        'random': 'design_scripts/generate_random_poster.py',
+        'stickers': 'design_scripts/analyze_stickers_for_poster.py',
+        'cover': 'design_scripts/create_wrap_cover.py',
+    }),
+    'release': ('Publish main.pdf as the "latest" GitHub release', {'': 'release_pdf.sh'}),
+}
+
+HELP_FLAGS = ('-h', '--help')
+
+# Commands with side effects outside the working tree; they ask before running
+# unless --yes/-y is given
+CONFIRM = {
+    'release': 'This deletes the "latest" GitHub release and tag and republishes main.pdf.',
+}
+
+IMPORTTIME_RE = re.compile(r'^import time:\s+(\d+) \|\s+(\d+) \|( *)(\S+)')
+
+
+def describe() -> str:
+    lines = ['commands:']
+    for name, (help_text, variants) in COMMANDS.items():
+        lines.append(f'  {name:<9} {help_text}')
+        if '' not in variants:
+            lines.append(f"            {' | '.join(variants)} (default: {next(iter(variants))})")
+    lines.append(f"  {'startup':<9} Measure the import time of a command: startup <command> [args]")
+    return '\n'.join(lines)
+
+
+def resolve(command: str, args: list) -> tuple:
+    """(script, remaining args) for a command line."""
+    variants = COMMANDS[command][1]
+    if args and args[0] in variants:
+        return variants[args[0]], args[1:]
+    if '' not in variants and args and args[0] in HELP_FLAGS:
+        print(f"usage: book.py {command} [{'|'.join(variants)}] [args ...]\n\n"
+              f"{COMMANDS[command][0]}; the variant's own --help lists its arguments.")
+        sys.exit(0)
+    return next(iter(variants.values())), args
+
+
+def parses_args(path: str) -> bool:
+    """Whether a script handles --help itself (it uses argparse) instead of ignoring it."""
+    if not path.endswith('.py'):
+        return False
+    with open(path, encoding='utf-8') as f:
+        return 'import argparse' in f.read()
+
+
+def confirm(command: str) -> bool:
+    print(f"⚠️  {CONFIRM[command]}")
+    try:
+        answer = input('Continue? [y/N] ')
+    except EOFError:
+        answer = ''
+    return answer.strip().lower() in ('y', 'yes')
+
+
+def run(command: str, args: list) -> int:
+    script, args = resolve(command, args)
+    path = os.path.join(ROOT, script)
+    if any(arg in HELP_FLAGS for arg in args) and not parses_args(path):
+        print(f"usage: book.py {command} [args ...]\n\n{COMMANDS[command][0]} ({script}).")
+        if command in CONFIRM:
+            print(f"{CONFIRM[command]}\nAsks for confirmation unless --yes is given.")
+        return 0
+    if command in CONFIRM:
+        if '--yes' in args or '-y' in args:
+            args = [arg for arg in args if arg not in ('--yes', '-y')]
+        elif not confirm(command):
+            print("❌ Cancelled")
+            return 1
+    if path.endswith('.sh'):
+        import subprocess
+        return subprocess.call(['bash', path] + args)
+
+    import runpy
+    sys.argv = [path] + args
+    # The script sees its own directory first on sys.path, as when run directly
+    sys.path.insert(0, os.path.dirname(path))
+    runpy.run_path(path, run_name='__main__')
+    return 0
+
+
+def startup(args: list) -> int:
+    """Run a command under python -X importtime and summarize where its startup time goes."""
+    if not args or args[0] not in COMMANDS:
+        print("❌ startup needs a command, e.g. startup subset --list")
+        return 2
+    import subprocess
+    cmd = [sys.executable, '-X', 'importtime', os.path.abspath(__file__)] + args
+    start = time.perf_counter()
+    proc = subprocess.run(cmd, cwd=os.getcwd(), stdout=subprocess.DEVNULL, stderr=subprocess.PIPE, text=True)
+    wall = (time.perf_counter() - start) * 1000
+
+    imports = []
+    for line in proc.stderr.splitlines():
+        match = IMPORTTIME_RE.match(line)
+        if match and len(match.group(3)) == 1:
+            imports.append((int(match.group(2)), match.group(4)))
+    total = sum(us for us, _ in imports) / 1000
+    print(f"⏱️  book.py {' '.join(args)}: {wall:.0f} ms wall, {total:.1f} ms importing "
+          f"{len(imports)} top-level modules (exit {proc.returncode})")
+    for us, name in sorted(imports, reverse=True)[:10]:
+        print(f"   {us / 1000:7.1f} ms  {name}")
+    return proc.returncode
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(
+        description='Unified entry point for the book tooling',
+        formatter_class=argparse.RawDescriptionHelpFormatter,
+        epilog=describe(),
+    )
+    parser.add_argument('command', choices=list(COMMANDS) + ['startup'], metavar='command',
+                        help='One of the commands below')
+    parser.add_argument('args', nargs=argparse.REMAINDER, help='Arguments of the command (see book.py <command> --help)')
+    args = parser.parse_args()
+
+    if args.command == 'startup':
+        sys.exit(startup(args.args))
+    sys.exit(run(args.command, args.args))
+
+
+if __name__ == '__main__':
+    main()
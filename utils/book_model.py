@@ -0,0 +1,335 @@
+#!/usr/bin/env python3
+"""
+Cached model of the book: chapter order, labels, directories, section files,
+titles and summaries.
+
+The utils scripts used to rescan the chapter directories and re-parse
+main.tex each with their own regexes. They now call load_book(), which
+parses once and serializes the result to build/cache/book_<stem>.json. Every
+source the model was built from (the book file, the repository root listing,
+each chapter directory listing, title.tex and summary.tex) is recorded with
+its mtime, size and SHA-1, together with the repository root it was built in.
+A later load only stats those paths; a path whose mtime or size changed is
+re-hashed, and the model is rebuilt only if a hash differs or the checkout
+has moved (a copied build/cache would otherwise validate against the old
+tree's files).
+
+Usage:
+  python3 utils/book_model.py                  # chapter order of main.tex
+  python3 utils/book_model.py main_interior_BN.tex --json
+  python3 utils/book_model.py --rebuild
+"""
+
+import argparse
+import json
+import os
+import re
+import sys
+import time
+from pathlib import Path
+from typing import Dict, List, Optional, Tuple, Union
+
+# Every book tool imports this module, so it keeps its imports cheap: plain
+# classes instead of dataclasses (which pull in inspect), hashlib only when a
+# file has to be hashed, and build_dirs (tempfile, shutil) not at all
+ROOT = Path(__file__).resolve().parents[1]
+CACHE_DIR = ROOT / 'build' / 'cache'  # build_dirs.BUILD_ROOT / 'cache'
+CACHE_VERSION = 2
+
+CHAPTER_DIR_RE = re.compile(r'^(\d+)_(.+)$')
+CHAPTER_LINE_RE = re.compile(r'\\chapterwithsummaryfromfile(?:\[([^\]]+)\])?\{([^\}]+)\}')
+
+# Files \inputstory reads, in the order it reads them
+SECTION_FILES = [
+    'title.tex', 'summary.tex', 'sidenote.tex', 'topicmap.tex', 'quote.tex', 'historical.tex', 'main.tex',
+    'phenomenon_extra.tex', 'joke.tex', 'exercises.tex', 'cartoon.tex', 'imagefigure.tex', 'technical.tex',
+]
+
+
+class Chapter:
+    """A chapter directory on disk."""
+    __slots__ = ('directory', 'number', 'name', 'files', 'title', 'summary')
+
+    def __init__(self, directory: str, number: Optional[int], name: str, files: List[str],
+                 title: str = '', summary: str = ''):
+        self.directory = directory
+        self.number = number
+        self.name = name
+        self.files = files
+        self.title = title
+        self.summary = summary
+
+    def to_dict(self) -> dict:
+        return {name: getattr(self, name) for name in self.__slots__}
+
+    @property
+    def path(self) -> Path:
+        return ROOT / self.directory
+
+    @property
+    def tex_files(self) -> List[str]:
+        return [f for f in self.files if f.endswith('.tex')]
+
+    @property
+    def section_files(self) -> List[str]:
+        """The \\inputstory files present, in the order they are read."""
+        return [f for f in SECTION_FILES if f in self.files]
+
+    def has(self, filename: str) -> bool:
+        return filename in self.files
+
+
+class BookEntry:
+    """One \\chapterwithsummaryfromfile line of the book file."""
+    __slots__ = ('position', 'directory', 'label', 'line_index', 'chapterwithsummary_line', 'inputstory_line',
+                 'comment')
+
+    def __init__(self, position: int, directory: str, label: Optional[str], line_index: int,
+                 chapterwithsummary_line: str, inputstory_line: Optional[str], comment: str = ''):
+        self.position = position
+        self.directory = directory
+        self.label = label
+        self.line_index = line_index
+        self.chapterwithsummary_line = chapterwithsummary_line
+        self.inputstory_line = inputstory_line
+        self.comment = comment
+
+    def to_dict(self) -> dict:
+        return {name: getattr(self, name) for name in self.__slots__}
+
+    @property
+    def number(self) -> Optional[int]:
+        match = CHAPTER_DIR_RE.match(self.directory)
+        return int(match.group(1)) if match else None
+
+
+class BookModel:
+    __slots__ = ('tex_file', 'entries', 'chapters', 'preamble', 'postamble')
+
+    def __init__(self, tex_file: str, entries: List[BookEntry], chapters: Dict[str, Chapter],
+                 preamble: Optional[List[str]] = None, postamble: Optional[List[str]] = None):
+        self.tex_file = tex_file
+        self.entries = entries
+        self.chapters = chapters
+        self.preamble = preamble if preamble is not None else []
+        self.postamble = postamble if postamble is not None else []
+
+    def to_dict(self) -> dict:
+        return {
+            'tex_file': self.tex_file,
+            'entries': [e.to_dict() for e in self.entries],
+            'chapters': {name: c.to_dict() for name, c in self.chapters.items()},
+            'preamble': self.preamble,
+            'postamble': self.postamble,
+        }
+
+    def chapter_dirs(self) -> List[Chapter]:
+        """Every chapter directory on disk, by number."""
+        return sorted(self.chapters.values(), key=lambda c: (c.number is None, c.number or 0, c.directory))
+
+    def chapter_of(self, entry: BookEntry) -> Optional[Chapter]:
+        return self.chapters.get(entry.directory)
+
+    def entry_by_number(self, number: int) -> Optional[BookEntry]:
+        return next((e for e in self.entries if e.number == number), None)
+
+    def entry_by_label(self, label: str) -> Optional[BookEntry]:
+        return next((e for e in self.entries if e.label == label), None)
+
+
+def digest(path: Path) -> str:
+    """SHA-1 of a file, or of the sorted listing of a directory."""
+    import hashlib
+    if path.is_dir():
+        return hashlib.sha1('\n'.join(sorted(os.listdir(path))).encode('utf-8')).hexdigest()
+    return hashlib.sha1(path.read_bytes()).hexdigest()
+
+
+def stamp(path: Path) -> Optional[dict]:
+    try:
+        st = path.stat()
+    except OSError:
+        return None
+    return {'mtime': st.st_mtime_ns, 'size': st.st_size, 'sha1': digest(path)}
+
+
+def read_text(path: Path) -> str:
+    try:
+        return path.read_text(encoding='utf-8').strip()
+    except (OSError, UnicodeDecodeError):
+        return ''
+
+
+def first_line(text: str) -> str:
+    """First line that is neither empty nor a comment."""
+    for raw in text.splitlines():
+        line = raw.strip()
+        if line and not line.startswith('%'):
+            return line
+    return ''
+
+
+def scan_chapters() -> Dict[str, Chapter]:
+    chapters = {}
+    for item in ROOT.iterdir():
+        match = CHAPTER_DIR_RE.match(item.name)
+        if not match or not item.is_dir():
+            continue
+        chapters[item.name] = Chapter(
+            directory=item.name,
+            number=int(match.group(1)),
+            name=match.group(2),
+            files=sorted(f.name for f in item.iterdir() if f.is_file()),
+            title=read_text(item / 'title.tex'),
+            summary=read_text(item / 'summary.tex'),
+        )
+    return chapters
+
+
+def parse_book(tex_path: Path) -> BookModel:
+    """Chapter entries, preamble and postamble of a book file (the rules ChapterExtractor used)."""
+    lines = tex_path.read_text(encoding='utf-8').splitlines(keepends=True)
+
+    start = next((i for i, line in enumerate(lines)
+                  if '\\chapterwithsummaryfromfile' in line and not line.strip().startswith('%')), len(lines))
+    end = next((i for i, line in enumerate(lines) if '\\end{document}' in line), len(lines))
+
+    entries = []
+    for i in range(start, end):
+        line = lines[i]
+        if '\\chapterwithsummaryfromfile' not in line or line.strip().startswith('%'):
+            continue
+        match = CHAPTER_LINE_RE.search(line)
+        if not match:
+            continue
+        inputstory_line, comment = None, ''
+        if i + 1 < end and '\\inputstory' in lines[i + 1]:
+            inputstory_line = lines[i + 1]
+            comment_match = re.search(r'%(.+)$', inputstory_line)
+            if comment_match:
+                comment = comment_match.group(1).strip()
+        entries.append(BookEntry(
+            position=len(entries) + 1,
+            directory=match.group(2),
+            label=match.group(1),
+            line_index=i,
+            chapterwithsummary_line=line,
+            inputstory_line=inputstory_line,
+            comment=comment,
+        ))
+
+    return BookModel(tex_file=str(tex_path), entries=entries, chapters=scan_chapters(),
+                     preamble=lines[:start], postamble=lines[end:])
+
+
+def model_sources(tex_path: Path, model: BookModel) -> List[Path]:
+    sources = [tex_path, ROOT]
+    for chapter in model.chapters.values():
+        sources.append(chapter.path)
+        sources.extend(chapter.path / f for f in ('title.tex', 'summary.tex') if chapter.has(f))
+    return sources
+
+
+def cache_path(tex_path: Path) -> Path:
+    try:
+        key = tex_path.relative_to(ROOT).as_posix()
+    except ValueError:
+        key = tex_path.as_posix()
+    return CACHE_DIR / f"book_{re.sub(r'[^A-Za-z0-9_.-]', '_', key.removesuffix('.tex'))}.json"
+
+
+def cache_valid(sources: Dict[str, dict]) -> Tuple[bool, bool]:
+    """(valid, refreshed): valid if every recorded source still has its hash.
+
+    Sources that were touched without changing get their new stats recorded,
+    and refreshed tells the caller to write them back.
+    """
+    refreshed = False
+    for name, recorded in sources.items():
+        path = Path(name)
+        try:
+            st = path.stat()
+        except OSError:
+            return False, False
+        if st.st_mtime_ns == recorded['mtime'] and st.st_size == recorded['size']:
+            continue
+        if digest(path) != recorded['sha1']:
+            return False, False
+        recorded['mtime'], recorded['size'] = st.st_mtime_ns, st.st_size
+        refreshed = True
+    return True, refreshed
+
+
+def model_from_json(data: dict) -> BookModel:
+    return BookModel(
+        tex_file=data['tex_file'],
+        entries=[BookEntry(**e) for e in data['entries']],
+        chapters={name: Chapter(**c) for name, c in data['chapters'].items()},
+        preamble=data['preamble'],
+        postamble=data['postamble'],
+    )
+
+
+def load_book(tex_file: Union[str, Path] = 'main.tex', use_cache: bool = True) -> BookModel:
+    """The BookModel of tex_file (relative to the current directory or the repository root)."""
+    tex_path = Path(tex_file)
+    if not tex_path.exists() and (ROOT / tex_path).exists():
+        tex_path = ROOT / tex_path
+    tex_path = tex_path.resolve()
+    if not tex_path.exists():
+        raise FileNotFoundError(f"Cannot find {tex_file}")
+
+    cache = cache_path(tex_path)
+    if use_cache and cache.exists():
+        try:
+            data = json.loads(cache.read_text(encoding='utf-8'))
+            if data.get('version') == CACHE_VERSION and data.get('root') == str(ROOT):
+                valid, refreshed = cache_valid(data['sources'])
+                if valid:
+                    if refreshed:
+                        cache.write_text(json.dumps(data), encoding='utf-8')
+                    return model_from_json(data['model'])
+        except (json.JSONDecodeError, KeyError, TypeError):
+            pass
+
+    model = parse_book(tex_path)
+    sources = {str(p): s for p in model_sources(tex_path, model) if (s := stamp(p))}
+    CACHE_DIR.mkdir(parents=True, exist_ok=True)
+    cache.write_text(json.dumps({'version': CACHE_VERSION, 'root': str(ROOT), 'sources': sources, 'model': model.to_dict()}),
+                     encoding='utf-8')
+    return model
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description='Show the cached chapter model of a book file')
+    parser.add_argument('tex_file', nargs='?', default='main.tex', help='Book file (default: main.tex)')
+    parser.add_argument('--rebuild', action='store_true', help='Ignore the cache and rescan')
+    parser.add_argument('--json', action='store_true', help='Print the model as JSON')
+    args = parser.parse_args()
+
+    start = time.perf_counter()
+    try:
+        model = load_book(args.tex_file, use_cache=not args.rebuild)
+    except FileNotFoundError as e:
+        print(f"❌ {e}")
+        sys.exit(1)
+    elapsed = (time.perf_counter() - start) * 1000
+
+    if args.json:
+        print(json.dumps(model.to_dict(), indent=2))
+        return
+
+    print(f"📖 {args.tex_file}: {len(model.entries)} chapters, {len(model.chapters)} chapter directories "
+          f"({elapsed:.1f} ms)")
+    print(f"\n{'Pos':>3} {'Directory':<35} {'Label':<25} {'Files':>5}")
+    for entry in model.entries:
+        chapter = model.chapter_of(entry)
+        files = len(chapter.section_files) if chapter else 0
+        print(f"{entry.position:3d} {entry.directory[:35]:<35} {(entry.label or '')[:25]:<25} {files:5d}")
+    missing = [e.directory for e in model.entries if e.directory not in model.chapters]
+    if missing:
+        print(f"\n⚠️  Missing chapter directories: {', '.join(missing)}")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,110 @@
+#!/usr/bin/env python3
+"""
+Isolated build directories for out-of-tree LaTeX builds.
+
+Every driver can write its .aux/.log/.toc/.pdf into a directory of its own
+instead of the repository root:
+
+  build/<target>/                  stable per-target directory (aux files survive between builds)
+  build/<target>/<build-id>/       one directory per build, for concurrent builds of one target
+  /dev/shm/unpopular-science/...   the same layout on tmpfs, with build/<target> symlinked to it
+
+Analysis tools take --build-dir and read their inputs through artifact_path().
+
+Usage (prints the directory, creating it):
+  python3 utils/build_dirs.py main
+  python3 utils/build_dirs.py main --per-build --tmpfs
+"""
+
+import argparse
+import os
+import sys
+import time
+from pathlib import Path
+from typing import Optional, Union
+
+ROOT = Path(__file__).resolve().parents[1]
+BUILD_ROOT = ROOT / 'build'
+TMPFS_ROOT = Path('/dev/shm')
+TMPFS_NAME = 'unpopular-science'
+
+
+def tmpfs_base() -> Path:
+    """Return the tmpfs build root, falling back to the system temp dir where /dev/shm is missing (macOS)."""
+    if TMPFS_ROOT.is_dir() and os.access(TMPFS_ROOT, os.W_OK):
+        return TMPFS_ROOT / TMPFS_NAME
+    import tempfile  # Only on this fallback: every tool imports build_dirs, and tempfile pulls in shutil
+    print(f"⚠️  {TMPFS_ROOT} not available, using {tempfile.gettempdir()} instead", file=sys.stderr)
+    return Path(tempfile.gettempdir()) / TMPFS_NAME
+
+
+def new_build_id() -> str:
+    return f"{time.strftime('%Y%m%d_%H%M%S')}_{os.getpid()}"
+
+
+def build_dir_for(target: str, per_build: bool = False, tmpfs: bool = False) -> Path:
+    """Create and return the build directory for a target.
+
+    With tmpfs=True the directory lives in RAM and build/<target> becomes a
+    symlink to it, so tools that look in build/<target> still find the files.
+    With per_build=True a fresh subdirectory is made for this build and
+    <target>/latest points at it.
+    """
+    target_dir = BUILD_ROOT / target
+    if tmpfs:
+        real_dir = tmpfs_base() / target
+        real_dir.mkdir(parents=True, exist_ok=True)
+        if target_dir.is_symlink() or not target_dir.exists():
+            target_dir.parent.mkdir(parents=True, exist_ok=True)
+            if target_dir.is_symlink():
+                target_dir.unlink()
+            target_dir.symlink_to(real_dir, target_is_directory=True)
+        else:
+            print(f"⚠️  {target_dir} is a real directory; tmpfs build goes to {real_dir}", file=sys.stderr)
+            target_dir = real_dir
+
+    if per_build:
+        build_dir = target_dir / new_build_id()
+        build_dir.mkdir(parents=True, exist_ok=True)
+        latest = target_dir / 'latest'
+        if latest.is_symlink():
+            latest.unlink()
+        if not latest.exists():
+            latest.symlink_to(build_dir.name, target_is_directory=True)
+        return build_dir
+
+    target_dir.mkdir(parents=True, exist_ok=True)
+    return target_dir
+
+
+def resolve_build_dir(build_dir: Optional[Union[str, Path]]) -> Optional[Path]:
+    """Turn a --build-dir argument into a directory, following <dir>/latest for per-build layouts."""
+    if not build_dir:
+        return None
+    path = Path(build_dir)
+    if not path.is_absolute() and not path.exists() and (BUILD_ROOT / path).exists():
+        path = BUILD_ROOT / path
+    latest = path / 'latest'
+    if latest.is_dir():
+        path = latest
+    return path.resolve()
+
+
+def artifact_path(base_name: str, ext: str, build_dir: Optional[Path] = None) -> Path:
+    """Path of <base_name>.<ext>, inside build_dir if given, else relative to the current directory."""
+    if build_dir is None:
+        return Path(f'{base_name}.{ext}')
+    return build_dir / f'{Path(base_name).name}.{ext}'
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description='Create (and print) an isolated build directory')
+    parser.add_argument('target', help='Target name, usually the jobname (e.g. main, main_ch)')
+    parser.add_argument('--per-build', action='store_true', help='Make a fresh directory for this build')
+    parser.add_argument('--tmpfs', action='store_true', help='Place the directory on /dev/shm')
+    args = parser.parse_args()
+    print(build_dir_for(args.target, per_build=args.per_build, tmpfs=args.tmpfs))
+
+
+if __name__ == '__main__':
+    main()
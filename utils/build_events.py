@@ -0,0 +1,186 @@
+#!/usr/bin/env python3
+"""
+Structured build events from LuaLaTeX runs.
+
+The drivers load utils/lua/build_events.lua ahead of the document. That hooks
+LuaTeX's open_read_file, pre_shipout_filter, finish_pdfpage and wrapup_run
+callbacks and writes newline-delimited JSON to <build-dir>/<jobname>.events.ndjson:
+
+  {"event": "open",  "t": 1.52, "file": "01_BanachTarskiParadox/title.tex", "depth": 3}
+  {"event": "close", "t": 1.60, "file": "01_BanachTarskiParadox/title.tex", "seconds": 0.08}
+  {"event": "page",  "t": 1.71, "page": 17, "label": 1, "chapter": "01_BanachTarskiParadox",
+                     "file": "01_BanachTarskiParadox/title.tex"}
+
+Page maps, progress and per-file timings read this stream instead of
+scraping stdout and the .log with regexes.
+
+Usage:
+  python3 utils/build_events.py build/main/main.events.ndjson            # chapter page ranges
+  python3 utils/build_events.py build/main/main.events.ndjson --files 20 # slowest files
+"""
+
+import argparse
+import json
+import os
+import re
+import sys
+import time
+from pathlib import Path
+from typing import Callable, Dict, Iterator, List, Optional, Sequence, Tuple, Union
+
+ROOT = Path(__file__).resolve().parents[1]
+LUA_MODULE = ROOT / 'utils' / 'lua' / 'build_events.lua'
+EVENTS_ENV = 'BOOK_EVENTS_FILE'
+EVENTS_EXT = 'events.ndjson'
+
+CHAPTER_DIR_RE = re.compile(r'^(\d+)_(.+)$')
+
+
+def lualatex_command(tex_file: str, options: List[str], jobname: Optional[str] = None,
+                     lua_modules: Sequence[Path] = (LUA_MODULE,), pre_inputs: Sequence[str] = ()) -> List[str]:
+    """lualatex command line that loads the event hooks before reading tex_file.
+
+    lua_modules are run with dofile() and pre_inputs are \\input before the
+    document class (the profilers use both). The document is read with \\input
+    from the command line, so the jobname is passed explicitly to keep the
+    output names unchanged.
+    """
+    jobname = jobname or Path(tex_file).stem
+    preload = ''.join(f'\\directlua{{dofile("{Path(m).as_posix()}")}}' for m in lua_modules)
+    preload += ''.join(f'\\input{{{p}}}' for p in pre_inputs)
+    return ['lualatex', *options, f'-jobname={jobname}', f'{preload}\\input{{{tex_file}}}']
+
+
+def events_env(events_file: Union[str, Path]) -> Dict[str, str]:
+    """Environment for a lualatex process that should write events to events_file."""
+    return {**os.environ, EVENTS_ENV: str(events_file)}
+
+
+def read_events(events_file: Union[str, Path]) -> Iterator[dict]:
+    """Yield the events of a finished run, skipping a truncated last line."""
+    with open(events_file, 'r', encoding='utf-8', errors='ignore') as f:
+        for line in f:
+            try:
+                yield json.loads(line)
+            except json.JSONDecodeError:
+                continue
+
+
+def follow_events(events_file: Union[str, Path], running: Callable[[], bool],
+                  interval: float = 0.1) -> Iterator[dict]:
+    """Yield events as a running build writes them, until running() is false and the file is drained."""
+    path = Path(events_file)
+    position = 0
+    partial = ''
+    while True:
+        still_running = running()
+        if path.exists():
+            with open(path, 'r', encoding='utf-8', errors='ignore') as f:
+                if os.fstat(f.fileno()).st_size < position:
+                    position, partial = 0, ''  # a new run truncated the file
+                f.seek(position)
+                chunk = f.read()
+                position = f.tell()
+            lines = (partial + chunk).split('\n')
+            partial = lines.pop()
+            for line in lines:
+                try:
+                    yield json.loads(line)
+                except json.JSONDecodeError:
+                    continue
+        if not still_running:
+            return
+        time.sleep(interval)
+
+
+def chapter_of(event: dict) -> Tuple[Optional[int], Optional[str]]:
+    """(number, name) of the chapter an event belongs to, if any."""
+    chapter = event.get('chapter')
+    if not chapter and event.get('file'):
+        chapter = event['file'].split('/')[0]
+    match = CHAPTER_DIR_RE.match(chapter or '')
+    if not match:
+        return None, None
+    return int(match.group(1)), match.group(2)
+
+
+def page_content(events: List[dict]) -> Dict[int, dict]:
+    """Physical page -> {chapter, chapter_name, section, file_path}, the shape analyze_log_file() returns."""
+    pages = {}
+    for event in events:
+        if event.get('event') != 'page':
+            continue
+        chapter_num, chapter_name = chapter_of(event)
+        if chapter_num is None:
+            continue
+        file_path = event.get('file', '')
+        pages[event['page']] = {
+            'chapter': chapter_num,
+            'chapter_name': chapter_name,
+            'section': Path(file_path).stem,
+            'file_path': file_path,
+        }
+    return pages
+
+
+def chapter_page_ranges(events: List[dict]) -> Dict[int, dict]:
+    """Chapter number -> {name, first, last, pages} from the shipped pages."""
+    ranges: Dict[int, dict] = {}
+    for page, content in sorted(page_content(events).items()):
+        entry = ranges.setdefault(content['chapter'], {
+            'name': content['chapter_name'], 'first': page, 'last': page, 'pages': 0})
+        entry['last'] = page
+        entry['pages'] += 1
+    return ranges
+
+
+def file_times(events: List[dict]) -> List[Tuple[str, float]]:
+    """(file, seconds spent inside it) for every closed file, slowest first."""
+    times = [(e['file'], e.get('seconds', 0.0)) for e in events if e.get('event') == 'close']
+    return sorted(times, key=lambda item: item[1], reverse=True)
+
+
+def load_page_content(events_file: Union[str, Path]) -> Dict[int, dict]:
+    """page_content() of an events file, or {} if the build was not instrumented."""
+    if not Path(events_file).exists():
+        return {}
+    return page_content(list(read_events(events_file)))
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(
+        description='Summarize the event stream of an instrumented LuaLaTeX build')
+    parser.add_argument('events_file', help='<jobname>.events.ndjson from the build directory')
+    parser.add_argument('--files', type=int, metavar='N', help='Also list the N slowest input files')
+    parser.add_argument('--json', action='store_true', help='Print the chapter page ranges as JSON')
+    args = parser.parse_args()
+
+    if not Path(args.events_file).exists():
+        print(f"❌ Events file not found: {args.events_file}")
+        sys.exit(1)
+
+    events = list(read_events(args.events_file))
+    ranges = chapter_page_ranges(events)
+
+    if args.json:
+        print(json.dumps(ranges, indent=2))
+        return
+
+    end = next((e for e in reversed(events) if e.get('event') == 'end'), None)
+    if end:
+        print(f"📖 {end['pages']} pages in {end['seconds']:.1f}s")
+    else:
+        print("⚠️  No end event - the run did not finish")
+
+    print(f"\n{'Ch':>3} {'Chapter':<35} {'Pages':>9} {'Count':>5}")
+    for num, entry in sorted(ranges.items()):
+        print(f"{num:3d} {entry['name'][:35]:<35} {entry['first']:4d}-{entry['last']:<4d} {entry['pages']:5d}")
+
+    if args.files:
+        print(f"\n⏱️  Slowest input files:")
+        for file_path, seconds in file_times(events)[:args.files]:
+            print(f"  {seconds:7.2f}s  {file_path}")
+
+
+if __name__ == '__main__':
+    main()
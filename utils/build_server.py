@@ -0,0 +1,464 @@
+#!/usr/bin/env python3
+"""
+Local build server with a request queue and deduplication.
+
+Several people and editor plugins compile the same tree; when each of them
+starts its own lualatex, the runs collide on main.aux/main.log. This daemon
+is the single place builds happen:
+
+- requests (a target plus an optional chapter subset) arrive over localhost
+  HTTP or a Unix socket
+- identical requests that are still queued or running are merged into one job
+- at most --workers jobs run at once, each in its own build directory
+- every client gets a stream of newline-delimited JSON progress events,
+  ending with the artifact paths
+
+Usage:
+  python3 utils/build_server.py serve [--port 8765] [--socket /tmp/book.sock] [--workers 2]
+  python3 utils/build_server.py submit main
+  python3 utils/build_server.py submit subset --chapters 1-5,14
+  python3 utils/build_server.py status
+
+HTTP protocol:
+  POST /build   {"target": "main" | "bn" | "subset", "chapters": "1-5"}  -> NDJSON event stream
+                (400 with a JSON error for an invalid request; "chapters" is for main/subset only)
+  GET  /jobs    -> JSON list of queued/running/finished jobs
+Unix socket protocol: send one JSON request line, read NDJSON events until EOF.
+"""
+
+import argparse
+import hashlib
+import itertools
+import json
+import queue
+import socket
+import socketserver
+import subprocess
+import sys
+import threading
+import time
+import urllib.error
+import urllib.request
+import uuid
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from pathlib import Path
+from typing import Dict, Iterator, List, Optional, Tuple
+
+from build_dirs import build_dir_for
+from build_events import EVENTS_EXT, chapter_of, events_env, follow_events, lualatex_command
+from compile_realtime import RealTimeCompiler
+from editions import EDITIONS, MAX_PASSES, aux_state, generate_editions
+from generate_chapter_subset import ChapterExtractor, full_build_context
+from latex_aux import single_pass_ok
+
+ROOT = Path(__file__).resolve().parents[1]
+
+DEFAULT_PORT = 8765
+DEFAULT_WORKERS = 2
+# Finished jobs kept for GET /jobs
+HISTORY_LIMIT = 50
+
+
+class BuildRequestError(ValueError):
+    pass
+
+
+class BuildJob:
+    """One build, shared by every client that asked for the same thing while it was pending."""
+
+    def __init__(self, key: Tuple[str, Tuple[int, ...]], target: str, chapters: Tuple[int, ...]) -> None:
+        self.id = uuid.uuid4().hex[:8]
+        self.key = key
+        self.target = target
+        self.chapters = chapters
+        self.state = 'queued'
+        self.clients = 1
+        self.created = time.time()
+        self.artifacts: Dict[str, str] = {}
+        self.events: List[dict] = []
+        self.finished = False
+        self._cond = threading.Condition()
+
+    @property
+    def jobname(self) -> str:
+        if self.target != 'subset':
+            return Path(EDITIONS[self.target].entry_file).stem
+        digest = hashlib.sha1(','.join(map(str, self.chapters)).encode()).hexdigest()[:10]
+        return f'main_subset_{digest}'
+
+    def emit(self, event: str, **data) -> None:
+        with self._cond:
+            self.events.append({'event': event, 'job': self.id, 'time': round(time.time(), 3), **data})
+            self._cond.notify_all()
+
+    def finish(self, state: str, **data) -> None:
+        self.state = state
+        with self._cond:
+            self.events.append({'event': 'done', 'job': self.id, 'time': round(time.time(), 3),
+                                'status': state, 'artifacts': self.artifacts, **data})
+            self.finished = True
+            self._cond.notify_all()
+
+    def stream(self) -> Iterator[dict]:
+        """Yield every event of the job (including past ones) until it finishes."""
+        index = 0
+        while True:
+            with self._cond:
+                while index >= len(self.events) and not self.finished:
+                    self._cond.wait()
+                batch = self.events[index:]
+                index = len(self.events)
+                done = self.finished
+            yield from batch
+            if done and index >= len(self.events):
+                return
+
+    def summary(self) -> dict:
+        return {
+            'job': self.id,
+            'target': self.target,
+            'chapters': list(self.chapters),
+            'state': self.state,
+            'clients': self.clients,
+            'created': round(self.created, 3),
+            'artifacts': self.artifacts,
+        }
+
+
+class BuildQueue:
+    """Queue of build jobs with request merging and a fixed number of workers."""
+
+    def __init__(self, workers: int = DEFAULT_WORKERS, tmpfs: bool = False, build_root: str = 'server') -> None:
+        self._tmpfs = tmpfs
+        # Jobs build in build/<build_root>/<jobname>; every queue needs its own root, since
+        # jobnames repeat across queues and two lualatex runs must not share an output directory
+        self._build_root = build_root
+        self._queue: 'queue.Queue[BuildJob]' = queue.Queue()
+        self._lock = threading.Lock()
+        self._in_flight: Dict[Tuple[str, Tuple[int, ...]], BuildJob] = {}
+        self._history: List[BuildJob] = []
+        self._extractor = ChapterExtractor(ROOT / 'main.tex')
+        self._workers = [threading.Thread(target=self._work, daemon=True) for _ in range(workers)]
+        for worker in self._workers:
+            worker.start()
+
+    def normalize(self, request: dict) -> Tuple[str, Tuple[int, ...]]:
+        target = request.get('target', 'main')
+        spec = request.get('chapters')
+        if spec and target == 'main':
+            target = 'subset'
+        if target not in EDITIONS and target != 'subset':
+            raise BuildRequestError(f"unknown target '{target}' (known: {', '.join(list(EDITIONS) + ['subset'])})")
+        if spec and target != 'subset':
+            raise BuildRequestError(f"target '{target}' always builds the whole edition; "
+                                    f"'chapters' is only for main/subset")
+        if target != 'subset':
+            return target, ()
+        if not spec:
+            raise BuildRequestError("target 'subset' needs a 'chapters' specification")
+
+        with self._lock:
+            # main.tex may have been reordered since the last request
+            self._extractor.chapters = []
+            self._extractor.parse_main_tex()
+            numbers = self._extractor.parse_chapter_spec(str(spec))
+        if not numbers:
+            raise BuildRequestError(f"no chapters match '{spec}'")
+        return target, tuple(numbers)
+
+    def submit(self, request: dict) -> Tuple[BuildJob, bool]:
+        """Return (job, merged); merged is True when an identical pending job was reused."""
+        target, chapters = self.normalize(request)
+        key = (target, chapters)
+        with self._lock:
+            job = self._in_flight.get(key)
+            if job is not None:
+                job.clients += 1
+                job.emit('merged', clients=job.clients)
+                return job, True
+            job = BuildJob(key, target, chapters)
+            self._in_flight[key] = job
+            self._history.append(job)
+            del self._history[:-HISTORY_LIMIT]
+        job.emit('queued', target=target, chapters=list(chapters), position=self._queue.qsize())
+        self._queue.put(job)
+        return job, False
+
+    def jobs(self) -> List[dict]:
+        with self._lock:
+            return [job.summary() for job in self._history]
+
+    def _work(self) -> None:
+        while True:
+            job = self._queue.get()
+            try:
+                self._run(job)
+            except Exception as e:
+                job.finish('failed', error=str(e))
+            finally:
+                with self._lock:
+                    if self._in_flight.get(job.key) is job:
+                        del self._in_flight[job.key]
+                self._queue.task_done()
+
+    def _prepare(self, job: BuildJob, build_dir: Path) -> str:
+        """Write the entry file for the job and return its path relative to the repo root."""
+        if job.target != 'subset':
+            edition = EDITIONS[job.target]
+            if not edition.generated:
+                return edition.entry_file
+            # Generated into the build directory: a server build must not rewrite files in the tree
+            generate_editions([job.target], directory=build_dir)
+            return str((build_dir / edition.entry_file).relative_to(ROOT))
+
+        with self._lock:
+            self._extractor.chapters = []
+            self._extractor.parse_main_tex()
+            subset_file = build_dir / f'{job.jobname}.tex'
+            # Chapter/page numbers and cross-references of the last full build of main.tex
+            seeds, snapshot = full_build_context(self._extractor, list(job.chapters), str(ROOT / 'main.tex'))
+            if not self._extractor.generate_subset_tex(list(job.chapters), str(subset_file), seeds, snapshot):
+                raise RuntimeError('could not generate subset file')
+        return str(subset_file.relative_to(ROOT))
+
+    def _run(self, job: BuildJob) -> None:
+        job.state = 'running'
+        build_dir = build_dir_for(f'{self._build_root}/{job.jobname}', tmpfs=self._tmpfs)
+        tex_file = self._prepare(job, build_dir)
+
+        total = RealTimeCompiler(str(ROOT / tex_file)).count_chapters()
+        job.emit('started', tex_file=tex_file, build_dir=str(build_dir), chapters_total=total)
+
+        start = time.time()
+        passes = 0
+        success = False
+        while passes < MAX_PASSES:
+            before = aux_state(build_dir, job.jobname)
+            passes += 1
+            success = self._run_pass(job, tex_file, build_dir, passes, total)
+            if not success or aux_state(build_dir, job.jobname) == before:
+                break
+            if passes == 1 and single_pass_ok(ROOT / tex_file, build_dir / f'{job.jobname}.toc',
+                                              build_dir / f'{job.jobname}.log'):
+                break
+
+        pdf = build_dir / f'{job.jobname}.pdf'
+        log = build_dir / f'{job.jobname}.log'
+        if pdf.exists():
+            job.artifacts['pdf'] = str(pdf)
+        if log.exists():
+            job.artifacts['log'] = str(log)
+        events = build_dir / f'{job.jobname}.{EVENTS_EXT}'
+        if events.exists():
+            job.artifacts['events'] = str(events)
+        job.finish('ok' if success else 'failed', passes=passes, seconds=round(time.time() - start, 2))
+
+    def _run_pass(self, job: BuildJob, tex_file: str, build_dir: Path,
+                  pass_num: int, total: int) -> bool:
+        job.emit('pass_started', number=pass_num)
+        pass_start = time.time()
+        events_file = build_dir / f'{job.jobname}.{EVENTS_EXT}'
+        events_file.unlink(missing_ok=True)
+        cmd = lualatex_command(tex_file, ['-interaction=nonstopmode', f'-output-directory={build_dir}'],
+                               jobname=job.jobname)
+        seen = set()
+        with open(build_dir / f'compile_pass{pass_num}.log', 'w') as log:
+            proc = subprocess.Popen(cmd, cwd=ROOT, stdin=subprocess.DEVNULL, stdout=log,
+                                    stderr=subprocess.STDOUT, env=events_env(events_file.resolve()))
+            # Chapter progress comes from the Lua event stream, not from scraping stdout
+            for event in follow_events(events_file, lambda: proc.poll() is None):
+                if event.get('event') != 'open':
+                    continue
+                chapter_num, chapter_name = chapter_of(event)
+                if chapter_num and chapter_num not in seen:
+                    seen.add(chapter_num)
+                    job.emit('chapter', number=chapter_num, name=chapter_name,
+                             done=len(seen), total=total, pass_number=pass_num)
+            proc.wait()
+
+        success = proc.returncode == 0 or (build_dir / f'{job.jobname}.pdf').exists()
+        job.emit('pass_finished', number=pass_num, ok=success, seconds=round(time.time() - pass_start, 2))
+        return success
+
+
+def handle_request(build_queue: BuildQueue, request: dict) -> Iterator[dict]:
+    """Submit a request and yield its event stream (or a single error event)."""
+    try:
+        job, merged = build_queue.submit(request)
+    except BuildRequestError as e:
+        yield {'event': 'error', 'message': str(e)}
+        return
+    yield {'event': 'accepted', 'job': job.id, 'merged': merged}
+    yield from job.stream()
+
+
+def make_http_handler(build_queue: BuildQueue):
+    class Handler(BaseHTTPRequestHandler):
+        def log_message(self, fmt, *args):
+            sys.stderr.write(f"🌐 {self.address_string()} {fmt % args}\n")
+
+        def _send_json(self, status: int, payload) -> None:
+            body = json.dumps(payload).encode()
+            self.send_response(status)
+            self.send_header('Content-Type', 'application/json')
+            self.send_header('Content-Length', str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def do_GET(self):
+            if self.path == '/jobs':
+                self._send_json(200, build_queue.jobs())
+            else:
+                self._send_json(404, {'error': 'not found'})
+
+        def do_POST(self):
+            if self.path != '/build':
+                self._send_json(404, {'error': 'not found'})
+                return
+            try:
+                length = int(self.headers.get('Content-Length', 0))
+                request = json.loads(self.rfile.read(length) or b'{}')
+            except (ValueError, json.JSONDecodeError):
+                self._send_json(400, {'error': 'body must be a JSON object'})
+                return
+            if not isinstance(request, dict):
+                self._send_json(400, {'error': 'body must be a JSON object'})
+                return
+            try:
+                job, merged = build_queue.submit(request)
+            except BuildRequestError as e:
+                self._send_json(400, {'error': str(e)})
+                return
+
+            # Events are streamed until the job finishes; the connection end marks the end of the stream
+            self.send_response(200)
+            self.send_header('Content-Type', 'application/x-ndjson')
+            self.send_header('Connection', 'close')
+            self.end_headers()
+            self.close_connection = True
+            try:
+                events = [{'event': 'accepted', 'job': job.id, 'merged': merged}]
+                for event in itertools.chain(events, job.stream()):
+                    self.wfile.write((json.dumps(event) + '\n').encode())
+                    self.wfile.flush()
+            except (BrokenPipeError, ConnectionResetError):
+                pass  # Client went away; the job keeps running for the others
+
+    return Handler
+
+
+def make_socket_handler(build_queue: BuildQueue):
+    class Handler(socketserver.StreamRequestHandler):
+        def handle(self):
+            try:
+                request = json.loads(self.rfile.readline() or b'{}')
+            except json.JSONDecodeError:
+                request = None
+            events = (handle_request(build_queue, request) if isinstance(request, dict)
+                      else iter([{'event': 'error', 'message': 'request must be one JSON object line'}]))
+            try:
+                for event in events:
+                    self.wfile.write((json.dumps(event) + '\n').encode())
+                    self.wfile.flush()
+            except (BrokenPipeError, ConnectionResetError):
+                pass
+
+    return Handler
+
+
+def serve(port: int, socket_path: Optional[str], workers: int, tmpfs: bool = False) -> None:
+    build_queue = BuildQueue(workers, tmpfs)
+
+    if socket_path:
+        path = Path(socket_path)
+        if path.exists():
+            path.unlink()
+        unix_server = socketserver.ThreadingUnixStreamServer(str(path), make_socket_handler(build_queue))
+        unix_server.daemon_threads = True
+        threading.Thread(target=unix_server.serve_forever, daemon=True).start()
+        print(f"🔌 Listening on unix socket {path}")
+
+    http_server = ThreadingHTTPServer(('127.0.0.1', port), make_http_handler(build_queue))
+    http_server.daemon_threads = True
+    print(f"🚀 Build server on http://127.0.0.1:{port} with {workers} worker(s)")
+    try:
+        http_server.serve_forever()
+    except KeyboardInterrupt:
+        print("\n👋 Shutting down")
+
+
+def submit(request: dict, port: int, socket_path: Optional[str]) -> bool:
+    """Send a request and print its events; returns True if the build succeeded."""
+    if socket_path:
+        sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        sock.connect(socket_path)
+        sock.sendall((json.dumps(request) + '\n').encode())
+        lines = sock.makefile('rb')
+    else:
+        http_request = urllib.request.Request(
+            f'http://127.0.0.1:{port}/build',
+            data=json.dumps(request).encode(),
+            headers={'Content-Type': 'application/json'},
+        )
+        try:
+            lines = urllib.request.urlopen(http_request)
+        except urllib.error.HTTPError as e:
+            print(f"❌ {json.loads(e.read() or b'{}').get('error', e.reason)}")
+            return False
+
+    ok = False
+    for raw in lines:
+        event = json.loads(raw)
+        kind = event['event']
+        if kind == 'accepted':
+            print(f"📨 Job {event['job']}" + (" (merged with an identical pending build)" if event['merged'] else ""))
+        elif kind == 'chapter':
+            print(f"\r🔄 Pass {event['pass_number']}: {event['done']}/{event['total']} "
+                  f"Ch.{event['number']:02d} {event['name'][:30]:<30}", end="", flush=True)
+        elif kind == 'pass_finished':
+            print(f"\n{'✅' if event['ok'] else '❌'} Pass {event['number']} finished in {event['seconds']}s")
+        elif kind == 'error':
+            print(f"❌ {event['message']}")
+        elif kind == 'done':
+            ok = event['status'] == 'ok'
+            print(f"🏁 {event['status']}")
+            for name, path in event.get('artifacts', {}).items():
+                print(f"   {name}: {path}")
+    return ok
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description='Local build server with request queue and deduplication')
+    parser.add_argument('--port', type=int, default=DEFAULT_PORT, help=f'Localhost HTTP port (default: {DEFAULT_PORT})')
+    parser.add_argument('--socket', help='Unix socket path (serve: also listen there; submit: connect there)')
+    sub = parser.add_subparsers(dest='command', required=True)
+
+    serve_parser = sub.add_parser('serve', help='Run the build daemon')
+    serve_parser.add_argument('--workers', type=int, default=DEFAULT_WORKERS,
+                              help=f'Builds run at the same time (default: {DEFAULT_WORKERS})')
+    serve_parser.add_argument('--tmpfs', action='store_true', help='Keep build directories on /dev/shm')
+
+    submit_parser = sub.add_parser('submit', help='Request a build and stream its progress')
+    submit_parser.add_argument('target', nargs='?', default='main', help='main, bn or subset (default: main)')
+    submit_parser.add_argument('--chapters', help='Chapter subset (same syntax as generate_chapter_subset.py)')
+
+    sub.add_parser('status', help='Show queued, running and recent jobs')
+
+    args = parser.parse_args()
+
+    if args.command == 'serve':
+        serve(args.port, args.socket, args.workers, args.tmpfs)
+    elif args.command == 'submit':
+        request = {'target': args.target}
+        if args.chapters:
+            request['chapters'] = args.chapters
+        sys.exit(0 if submit(request, args.port, args.socket) else 1)
+    elif args.command == 'status':
+        with urllib.request.urlopen(f'http://127.0.0.1:{args.port}/jobs') as response:
+            for job in json.load(response):
+                chapters = ','.join(map(str, job['chapters'])) or '-'
+                print(f"{job['job']}  {job['state']:<8} {job['target']:<7} chapters={chapters:<20} clients={job['clients']}")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,276 @@
+#!/usr/bin/env python3
+"""
+Preview images of chapter pages, rendered from the compiled book and cached.
+
+For every chapter the chosen pages are located through the PDF's page map
+(see pdf_pagemap.py):
+
+  title    first page of the chapter's title part
+  intro    first page of its historical part (the story's opening)
+  figure   the page of its historical/main/extras parts with the largest
+           graphics, measured from the content stream (see page_fill.py)
+  <part>   first page of any other part, e.g. summary or technical
+
+Each page is fingerprinted from what it draws (pdf_diff.Fingerprinter). The
+thumbnails are cached in build/cache/previews under that fingerprint, so a
+page that did not change is never rendered again. Missing pages are
+rasterized with pdftoppm in a process pool, at the largest requested width.
+The smaller widths are resampled from it, and PNG and WebP files are written
+with Pillow (without Pillow, each width is rendered and only PNG is
+written). The previews are then copied to the output directory as
+ch<NN>_<page>_<width>.<format>, with a manifest.json listing chapter, page
+and fingerprint.
+
+Usage:
+  python3 utils/chapter_previews.py                          # title, intro and figure pages of main.pdf
+  python3 utils/chapter_previews.py main.pdf 1 5 27 --pages title,figure --sizes 600,1600
+  python3 utils/chapter_previews.py --out README_SOURCE/previews --formats webp
+  python3 utils/chapter_previews.py --prune                  # also drop cached previews no longer used
+"""
+
+import argparse
+import filecmp
+import json
+import os
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+from concurrent.futures import ProcessPoolExecutor
+from pathlib import Path
+from typing import Dict, List, Optional, Sequence
+
+from book_model import CACHE_DIR, CHAPTER_DIR_RE
+from build_dirs import BUILD_ROOT
+from pdf_diff import HAS_PIL, HAS_PYPDF2, Fingerprinter
+from pdf_pagemap import load_page_map
+from split_chapters import chapter_ranges, select
+
+if HAS_PIL:
+    from PIL import Image, features
+
+if HAS_PYPDF2:
+    from page_fill import scan_page
+
+PREVIEW_CACHE = CACHE_DIR / 'previews'
+PREVIEW_ROOT = BUILD_ROOT / 'previews'
+DEFAULT_PAGES = ('title', 'intro', 'figure')
+DEFAULT_SIZES = (400, 1200)
+DEFAULT_FORMATS = ('png', 'webp')
+# Preview page -> parts whose first page it is, in order of preference
+FIRST_PAGE_OF = {'title': ('title', 'block'), 'intro': ('historical', 'main')}
+FIGURE_PARTS = ('historical', 'main', 'phenomenon_extra', 'joke', 'exercises', 'cartoon', 'imagefigure')
+WEBP_QUALITY = 82
+
+
+def chapter_parts(page_map) -> Dict[str, Dict[str, List[int]]]:
+    """Chapter directory -> part -> its pages, from the page map."""
+    chapters: Dict[str, Dict[str, List[int]]] = {}
+    for page, entry in sorted(page_map.content.items()):
+        directory = entry['directory']
+        chapters.setdefault(directory, {}).setdefault(entry['section'], []).append(page)
+    return chapters
+
+
+def figure_page(reader, pages: Sequence[int]) -> Optional[int]:
+    """The page with the largest graphics area (images, forms, paths), or None without graphics."""
+    best, best_area = None, 0.0
+    for page in pages:
+        try:
+            _, boxes = scan_page(reader.pages[page - 1])
+        except Exception:
+            continue
+        box = reader.pages[page - 1].mediabox
+        page_area = float(box.width) * float(box.height)
+        area = sum(a for a in ((x1 - x0) * (y1 - y0) for x0, y0, x1, y1 in boxes) if a < 0.9 * page_area)
+        if area > best_area:
+            best, best_area = page, area
+    return best
+
+
+def preview_pages(parts: Dict[str, List[int]], kinds: Sequence[str], reader) -> Dict[str, int]:
+    """Preview kind -> page of one chapter (kinds without a page are left out)."""
+    chosen = {}
+    for kind in kinds:
+        if kind == 'figure':
+            page = figure_page(reader, [p for part in FIGURE_PARTS for p in parts.get(part, [])])
+        else:
+            page = next((parts[part][0] for part in FIRST_PAGE_OF.get(kind, (kind,)) if parts.get(part)), None)
+        if page:
+            chosen[kind] = page
+    return chosen
+
+
+def cached(fingerprint: str, width: int, fmt: str) -> Path:
+    return PREVIEW_CACHE / fingerprint[:2] / f'{fingerprint}_{width}.{fmt}'
+
+
+def render_width(pdf_file: str, page: int, width: int, prefix: Path) -> Path:
+    """Rasterize one page with pdftoppm at the given pixel width."""
+    subprocess.run(['pdftoppm', '-f', str(page), '-l', str(page), '-scale-to-x', str(width), '-scale-to-y', '-1',
+                    '-png', '-singlefile', pdf_file, str(prefix)], check=True, capture_output=True)
+    return prefix.with_suffix('.png')
+
+
+def store(path: Path, write) -> None:
+    """Write a cache file atomically through write(tmp_path)."""
+    path.parent.mkdir(parents=True, exist_ok=True)
+    tmp = path.with_name(f'.{path.name}.{os.getpid()}.tmp')
+    write(tmp)
+    os.replace(tmp, path)
+
+
+def render_preview(task: tuple) -> dict:
+    """Worker: render one page and store its missing thumbnails in the cache."""
+    pdf_file, page, fingerprint, sizes, formats = task
+    start = time.perf_counter()
+    with tempfile.TemporaryDirectory(prefix='preview_') as tmp:
+        if HAS_PIL:
+            image = Image.open(render_width(pdf_file, page, max(sizes), Path(tmp) / 'page')).convert('RGB')
+            for width in sizes:
+                scaled = image if width == image.width else image.resize(
+                    (width, round(image.height * width / image.width)), Image.LANCZOS)
+                for fmt in formats:
+                    if not cached(fingerprint, width, fmt).exists():
+                        options = {'quality': WEBP_QUALITY, 'method': 4} if fmt == 'webp' else {'optimize': True}
+                        store(cached(fingerprint, width, fmt),
+                              lambda path: scaled.save(path, format=fmt.upper(), **options))
+        else:
+            for width in sizes:
+                if not cached(fingerprint, width, 'png').exists():
+                    png = render_width(pdf_file, page, width, Path(tmp) / f'page{width}')
+                    store(cached(fingerprint, width, 'png'), lambda path: shutil.move(str(png), path))
+    return {'page': page, 'seconds': time.perf_counter() - start}
+
+
+def publish(source: Path, target: Path) -> bool:
+    """Copy a cached preview to the output (hard link when possible); False if it was already there."""
+    if target.exists() and (os.path.samefile(source, target) or filecmp.cmp(source, target, shallow=False)):
+        return False
+    target.parent.mkdir(parents=True, exist_ok=True)
+    tmp = target.with_name(f'.{target.name}.tmp')
+    try:
+        os.link(source, tmp)
+    except OSError:
+        shutil.copyfile(source, tmp)
+    os.replace(tmp, target)
+    return True
+
+
+def prune(keep: set) -> int:
+    """Delete cached previews not in keep; returns how many."""
+    removed = 0
+    for path in PREVIEW_CACHE.glob('*/*_*.*'):
+        if path not in keep:
+            path.unlink()
+            removed += 1
+    return removed
+
+
+def csv_ints(text: str) -> List[int]:
+    return sorted({int(v) for v in text.split(',') if v.strip()})
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(
+        description='Render cached preview thumbnails of chapter pages from the compiled book',
+        formatter_class=argparse.RawDescriptionHelpFormatter,
+        epilog="""
+Pages: title, intro, figure, or the name of any part (summary, main, technical, ...)
+
+Examples:
+  python3 utils/chapter_previews.py
+  python3 utils/chapter_previews.py main.pdf 27 --pages figure --sizes 800
+  python3 utils/chapter_previews.py build/main/main.pdf --out build/marketing --formats png
+        """
+    )
+    parser.add_argument('pdf_file', nargs='?', default='main.pdf', help='Compiled book (default: main.pdf)')
+    parser.add_argument('chapters', nargs='*', help='Chapter directories or numbers (default: all)')
+    parser.add_argument('--pages', default=','.join(DEFAULT_PAGES), help=f"Pages per chapter (default: {','.join(DEFAULT_PAGES)})")
+    parser.add_argument('--sizes', default=','.join(map(str, DEFAULT_SIZES)), help='Thumbnail widths in pixels (default: %(default)s)')
+    parser.add_argument('--formats', default=','.join(DEFAULT_FORMATS), help='png and/or webp (default: %(default)s)')
+    parser.add_argument('--out', help=f'Output directory (default: {PREVIEW_ROOT.relative_to(BUILD_ROOT.parent)})')
+    parser.add_argument('--jobs', type=int, default=os.cpu_count(), help='Pages rendered at the same time (default: CPU count)')
+    parser.add_argument('--prune', action='store_true', help='Delete cached previews this run did not use')
+    args = parser.parse_args()
+
+    kinds = [k.strip() for k in args.pages.split(',') if k.strip()]
+    sizes = csv_ints(args.sizes)
+    formats = [f.strip().lower() for f in args.formats.split(',') if f.strip()]
+    if not sizes or not kinds or not formats or set(formats) - {'png', 'webp'}:
+        print("❌ Give at least one page kind, width, and format (png, webp)")
+        sys.exit(1)
+    if not Path(args.pdf_file).exists():
+        print(f"❌ PDF not found: {args.pdf_file}")
+        sys.exit(1)
+    if not HAS_PYPDF2:
+        print("❌ PyPDF2 is required: pip install PyPDF2")
+        sys.exit(1)
+    if not shutil.which('pdftoppm'):
+        print("❌ pdftoppm not found - install poppler (brew install poppler / apt install poppler-utils)")
+        sys.exit(1)
+    if not HAS_PIL:
+        print("⚠️  Pillow not available: PNG only, every width rendered by pdftoppm")
+        formats = ['png']
+    elif 'webp' in formats and not features.check('webp'):
+        print("⚠️  This Pillow has no WebP support: PNG only")
+        formats = ['png']
+
+    start = time.perf_counter()
+    page_map = load_page_map(args.pdf_file)
+    if not page_map or not page_map.content:
+        print(f"❌ {args.pdf_file} has no story anchors to find chapter pages by (build it with the current preamble.tex)")
+        sys.exit(1)
+    chapters = chapter_parts(page_map)
+    directories = select(chapter_ranges(page_map), args.chapters)
+    if not directories:
+        sys.exit(1)
+
+    fingerprinter = Fingerprinter(Path(args.pdf_file))
+    previews = []  # (directory, kind, page, fingerprint)
+    for directory in directories:
+        for kind, page in preview_pages(chapters[directory], kinds, fingerprinter.reader).items():
+            previews.append((directory, kind, page, fingerprinter.page(page - 1)))
+    located = time.perf_counter() - start
+
+    pdf = str(Path(args.pdf_file).resolve())
+    todo = {}
+    for _, _, page, fingerprint in previews:
+        if fingerprint not in todo and not all(cached(fingerprint, w, f).exists() for w in sizes for f in formats):
+            todo[fingerprint] = (pdf, page, fingerprint, sizes, formats)
+    if todo:
+        print(f"🖨️  Rendering {len(todo)} of {len(previews)} page(s)...")
+        with ProcessPoolExecutor(max_workers=max(1, min(args.jobs or 1, len(todo)))) as pool:
+            for result in pool.map(render_preview, todo.values()):
+                print(f"  📄 page {result['page']:4d}  {result['seconds']:.1f}s")
+
+    out_dir = Path(args.out) if args.out else PREVIEW_ROOT
+    manifest, used, written = [], set(), 0
+    for directory, kind, page, fingerprint in previews:
+        prefix = CHAPTER_DIR_RE.match(directory)
+        stem = f"ch{prefix.group(1) if prefix else directory}_{kind}"
+        files = {}
+        for width in sizes:
+            for fmt in formats:
+                source = cached(fingerprint, width, fmt)
+                used.add(source)
+                target = out_dir / f'{stem}_{width}.{fmt}'
+                written += publish(source, target)
+                files[f'{width}.{fmt}'] = target.name
+        manifest.append({'chapter': directory, 'page': kind, 'pdf_page': page,
+                         'label': page_map.labels[page - 1] if page_map.labels else str(page),
+                         'fingerprint': fingerprint, 'files': files})
+    out_dir.mkdir(parents=True, exist_ok=True)
+    (out_dir / 'manifest.json').write_text(json.dumps(manifest, indent=2), encoding='utf-8')
+
+    removed = prune(used) if args.prune else 0
+    elapsed = time.perf_counter() - start
+    print(f"✅ {len(previews)} preview page(s) of {len(directories)} chapter(s): {len(todo)} rendered, "
+          f"{len(previews) - sum(1 for p in previews if p[3] in todo)} from cache, {written} file(s) updated "
+          f"in {out_dir} ({elapsed:.1f}s, {located:.1f}s locating pages)"
+          + (f"; pruned {removed} cached file(s)" if removed else ''))
+
+
+if __name__ == '__main__':
+    main()
@@ -9,6 +9,8 @@ from datetime import datetime
 from pathlib import Path
 from typing import Dict, Iterable, List, Tuple
 
+from book_model import load_book
+
 
 @dataclass
 class Context:
@@ -21,10 +23,10 @@ CHAPTER_DIR_PATTERN = re.compile(r"^\d{2}_")
 
 
 def iter_chapter_tex_files(root_dir: Path) -> Iterable[Path]:
-    for child in sorted(root_dir.iterdir()):
-        if child.is_dir() and CHAPTER_DIR_PATTERN.match(child.name):
-            for tex_path in sorted(child.glob("*.tex")):
-                yield tex_path
+    for chapter in load_book(root_dir / "main.tex").chapter_dirs():
+        if CHAPTER_DIR_PATTERN.match(chapter.directory):
+            for name in chapter.tex_files:
+                yield root_dir / chapter.directory / name
 
 
 def remove_comments(text: str) -> str:
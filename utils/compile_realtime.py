@@ -10,12 +10,27 @@ import os
 import re
 import sys
 import argparse
+import shutil
 from datetime import datetime, timedelta
+from pathlib import Path
+
+from book_model import load_book
+from build_dirs import artifact_path, build_dir_for
+from build_events import EVENTS_EXT, chapter_of, events_env, follow_events, lualatex_command
+from latex_aux import single_pass_ok
+from reorder_fastpath import base_dir_for, reorder_fastpath, save_base
 
 class RealTimeCompiler:
-    def __init__(self, tex_file='main.tex'):
+    def __init__(self, tex_file='main.tex', build_dir=None, events=True, fastpath=False):
         self.tex_file = tex_file
         self.base_name = os.path.splitext(tex_file)[0]
+        # Out-of-tree build: all LaTeX output goes to build_dir instead of the current directory
+        self.build_dir = Path(build_dir) if build_dir else None
+        # Load the Lua event hooks; progress then comes from <jobname>.events.ndjson instead of the log
+        self.events = events
+        # Opt-in: reassemble from the last full build when only the chapter order changed.
+        # Lossy (no links inside chapter pages), so its PDF stays in the build directory
+        self.fastpath = fastpath
         self.start_time = None
         self.current_chapter = 0
         self.total_chapters = 0
@@ -25,18 +40,9 @@ class RealTimeCompiler:
         self.monitoring = True
         
     def count_chapters(self):
-        """Count total chapters by looking for chapterwithsummaryfromfile statements."""
+        """Count total chapters from the cached BookModel of the tex file."""
         try:
-            with open(self.tex_file, 'r') as f:
-                content = f.read()
-            # Count only non-commented chapterwithsummaryfromfile commands
-            chapter_count = 0
-            for line in content.split('\n'):
-                # Skip commented lines
-                stripped_line = line.strip()
-                if not stripped_line.startswith('%') and '\\chapterwithsummaryfromfile' in line:
-                    chapter_count += 1
-            return chapter_count
+            return len(load_book(self.tex_file).entries)
         except:
             return 50  # fallback estimate
     
@@ -52,6 +58,30 @@ class RealTimeCompiler:
                 return chapter_num, chapter_name
         return None, None
     
+    def artifact(self, ext):
+        """Path of a build artifact (<base_name>.<ext>), honouring the build directory."""
+        return str(artifact_path(self.base_name, ext, self.build_dir))
+    
+    def pass_log(self, pass_num):
+        """Path of the captured stdout of a compilation pass."""
+        name = f'compile_pass{pass_num}.log'
+        return str(self.build_dir / name) if self.build_dir else name
+    
+    def clean_build_dir(self, latex_extensions):
+        """Clean artifacts of this document inside its build directory only."""
+        cleaned_count = 0
+        for ext in latex_extensions:
+            file_path = Path(self.artifact(ext))
+            if file_path.exists():
+                file_path.unlink()
+                cleaned_count += 1
+        for pass_num in (1, 2):
+            log_path = Path(self.pass_log(pass_num))
+            if log_path.exists():
+                log_path.unlink()
+                cleaned_count += 1
+        return cleaned_count
+    
     def clean_build_artifacts(self):
         """Clean all build artifacts from previous compilations."""
         print("🧹 Cleaning build artifacts...")
@@ -59,9 +89,16 @@ class RealTimeCompiler:
         # LaTeX build files
         latex_extensions = [
             'aux', 'toc', 'log', 'out', 'fdb_latexmk', 'fls', 'synctex.gz',
-            'bbl', 'blg', 'idx', 'ind', 'ilg', 'lof', 'lot', 'nav', 'snm', 'vrb'
+            'bbl', 'blg', 'idx', 'ind', 'ilg', 'lof', 'lot', 'nav', 'snm', 'vrb',
+            EVENTS_EXT
         ]
         
+        if self.build_dir:
+            # Isolated build: nothing outside the build directory is touched
+            cleaned_count = self.clean_build_dir(latex_extensions)
+            print(f"  ✅ Cleaned {cleaned_count} build artifacts in {self.build_dir}")
+            return
+        
         cleaned_count = 0
         
         # Clean document artifacts
@@ -159,8 +196,8 @@ class RealTimeCompiler:
                                     mystery_strings.append(line)
                                     print(f"\n🔍 Mystery string detected: '{line}'")
                                 
-                                # Extract chapter info
-                                chapter_num, chapter_name = self.extract_chapter_info(line)
+                                # Extract chapter info (the event stream does this exactly when enabled)
+                                chapter_num, chapter_name = (None, None) if self.events else self.extract_chapter_info(line)
                                 if chapter_num and chapter_name:
                                     self.current_chapter = max(self.current_chapter, chapter_num)
                                     elapsed = time.time() - self.start_time
@@ -192,6 +229,19 @@ class RealTimeCompiler:
         
         return mystery_strings
     
+    def monitor_events(self, events_file):
+        """Follow the Lua event stream and report chapter progress."""
+        try:
+            for event in follow_events(events_file, lambda: self.monitoring):
+                if event.get('event') != 'open':
+                    continue
+                chapter_num, chapter_name = chapter_of(event)
+                if chapter_num and chapter_name:
+                    self.current_chapter = max(self.current_chapter, chapter_num)
+                    self.print_progress(chapter_num, chapter_name, time.time() - self.start_time)
+        except Exception:
+            pass  # Progress display only; the build itself is unaffected
+    
     def compile_pass(self, pass_num, log_file):
         """Compile a single pass with monitoring."""
         print(f"\n📚 Pass {pass_num}: {'Building document structure' if pass_num == 1 else 'Finalizing cross-references'}")
@@ -207,12 +257,27 @@ class RealTimeCompiler:
         log_thread.start()
         
         # Start compilation
-        cmd = ['lualatex', '-interaction=nonstopmode', self.tex_file]
+        options = ['-interaction=nonstopmode']
+        if self.build_dir:
+            options.append(f'-output-directory={self.build_dir}')
+        env = None
+        if self.events:
+            events_file = self.artifact(EVENTS_EXT)
+            if os.path.exists(events_file):
+                os.remove(events_file)
+            cmd = lualatex_command(self.tex_file, options, jobname=Path(self.tex_file).stem)
+            env = events_env(os.path.abspath(events_file))
+            events_thread = threading.Thread(target=self.monitor_events, args=(events_file,))
+            events_thread.daemon = True
+            events_thread.start()
+        else:
+            cmd = ['lualatex', *options, self.tex_file]
         self.process = subprocess.Popen(
             cmd, 
             stdout=open(log_file, 'w'), 
             stderr=subprocess.STDOUT,
-            cwd='.'
+            cwd='.',
+            env=env
         )
         
         # Wait for completion
@@ -222,7 +287,7 @@ class RealTimeCompiler:
         elapsed = time.time() - self.start_time
         
         # Success is determined by PDF generation, not exit code (LaTeX can have warnings)
-        success = self.pdf_generated or os.path.exists(f'{self.base_name}.pdf')
+        success = self.pdf_generated or os.path.exists(self.artifact('pdf'))
         
         if success:
             print(f"\n✅ Pass {pass_num} completed in {self.format_time(elapsed)}")
@@ -239,6 +304,13 @@ class RealTimeCompiler:
         # Count chapters
         self.total_chapters = self.count_chapters()
         print(f"📖 Detected {self.total_chapters} chapters")
+        if self.build_dir:
+            print(f"📁 Build directory: {self.build_dir}")
+        
+        reorder_base = base_dir_for(Path(self.tex_file).stem, self.build_dir)
+        if self.fastpath and reorder_fastpath(self.tex_file, reorder_base):
+            print(f"📄 {self.base_name}.pdf was not replaced")
+            return True
         
         # Clean old files
         self.clean_build_artifacts()
@@ -246,13 +318,17 @@ class RealTimeCompiler:
         overall_start = time.time()
         
         # First pass
-        success1 = self.compile_pass(1, 'compile_pass1.log')
+        success1 = self.compile_pass(1, self.pass_log(1))
         if not success1:
             print("❌ First pass failed, aborting.")
             return False
         
-        # Second pass  
-        success2 = self.compile_pass(2, 'compile_pass2.log')
+        # Second pass, unless a subset's cross-reference snapshot already made the first one final
+        if single_pass_ok(self.tex_file, self.artifact('toc'), self.artifact('log')):
+            print("\n🔗 Cross-reference snapshot matched: labels and TOC are final, skipping pass 2")
+            success2 = True
+        else:
+            success2 = self.compile_pass(2, self.pass_log(2))
         
         total_time = time.time() - overall_start
         
@@ -260,12 +336,16 @@ class RealTimeCompiler:
         print(f"⏱️  Total time: {self.format_time(total_time)}")
         
         # Check final results
-        pdf_file = f'{self.base_name}.pdf'
+        pdf_file = self.artifact('pdf')
         if os.path.exists(pdf_file):
             pdf_size = os.path.getsize(pdf_file) / (1024*1024)
             print(f"📄 PDF: {pdf_size:.1f}MB")
+            if self.build_dir:
+                # Only the finished PDF comes back next to the source file
+                shutil.copy2(pdf_file, f'{self.base_name}.pdf')
+                print(f"📄 Copied to {self.base_name}.pdf")
         
-        toc_file = f'{self.base_name}.toc'
+        toc_file = self.artifact('toc')
         if os.path.exists(toc_file):
             toc_size = os.path.getsize(toc_file)
             if toc_size > 0:
@@ -276,11 +356,13 @@ class RealTimeCompiler:
         # Generate page structure table if compilation succeeded
         if success1 and success2:
             self.generate_page_structure_table()
+            if save_base(self.tex_file, self.artifact, reorder_base):
+                print(f"💾 Saved reorder base in {reorder_base}")
         
         return success1 and success2
     def generate_page_structure_table(self):
         """Generate detailed page structure CSV table."""
-        pdf_file = f'{self.base_name}.pdf'
+        pdf_file = self.artifact('pdf')
         
         if not os.path.exists(pdf_file):
             print(f"⚠️  PDF file not found: {pdf_file} - skipping page structure table")
@@ -288,9 +370,10 @@ class RealTimeCompiler:
         
         try:
             # Use the dedicated page table generation script
-            result = subprocess.run([
-                sys.executable, 'utils/generate_page_table.py', pdf_file, self.base_name
-            ], capture_output=True, text=True, cwd='.')
+            cmd = [sys.executable, 'utils/generate_page_table.py', pdf_file, self.base_name]
+            if self.build_dir:
+                cmd += ['--build-dir', str(self.build_dir)]
+            result = subprocess.run(cmd, capture_output=True, text=True, cwd='.')
             
             if result.returncode == 0:
                 # Print the output from the script
@@ -305,8 +388,8 @@ class RealTimeCompiler:
     
     def scale_pdf_to_7x10(self):
         """Scale the generated PDF from A4 to 7"×10" format."""
-        pdf_file = f'{self.base_name}.pdf'
-        scaled_file = f'{self.base_name}_7x10.pdf'
+        pdf_file = self.artifact('pdf')
+        scaled_file = str(artifact_path(f'{self.base_name}_7x10', 'pdf', self.build_dir))
         scale_script = os.path.join(os.path.dirname(__file__), 'scale_pdf.py')
         
         if not os.path.exists(pdf_file):
@@ -347,6 +430,9 @@ Examples:
   python3 compile_realtime.py main.tex                    # Compile to A4
   python3 compile_realtime.py main_sidenotes.tex --scale  # Compile to A4, then scale to 7"×10"
   python3 compile_realtime.py --scale main.tex            # Compile and scale (file can be anywhere)
+  python3 compile_realtime.py main.tex --isolated         # Build in build/main/ instead of the repo root
+  python3 compile_realtime.py main_ch.tex --isolated --tmpfs --per-build
+  python3 compile_realtime.py main.tex --fast-reorder     # Reassemble a reordered book (links dropped)
         """
     )
     
@@ -354,6 +440,19 @@ Examples:
                       help='LaTeX file to compile (default: main.tex)')
     parser.add_argument('--scale', '--scale-to-7x10', action='store_true',
                       help='Scale the final PDF from A4 to 7"×10" format')
+    parser.add_argument('--build-dir',
+                      help='Write all LaTeX output to this directory (only the PDF is copied back)')
+    parser.add_argument('--isolated', action='store_true',
+                      help='Build in build/<jobname>/ (implied by --per-build and --tmpfs)')
+    parser.add_argument('--per-build', action='store_true',
+                      help='Use a fresh build/<jobname>/<build-id>/ directory, for concurrent builds of one file')
+    parser.add_argument('--tmpfs', action='store_true',
+                      help='Place the build directory on /dev/shm (build/<jobname> links to it)')
+    parser.add_argument('--fast-reorder', action='store_true',
+                      help='If only the chapter order changed, reassemble from the last full build into '
+                           'build/<jobname>/reorder/ instead of retypesetting (drops links inside chapter pages)')
+    parser.add_argument('--no-events', action='store_true',
+                      help='Do not load the Lua event hooks (progress falls back to scraping the log)')
     
     args = parser.parse_args()
     
@@ -365,7 +464,14 @@ Examples:
     if args.scale:
         print(f"🎯 Will scale to 7\"×10\" after compilation")
     
-    compiler = RealTimeCompiler(args.tex_file)
+    build_dir = args.build_dir
+    if not build_dir and (args.isolated or args.per_build or args.tmpfs):
+        jobname = os.path.splitext(os.path.basename(args.tex_file))[0]
+        build_dir = build_dir_for(jobname, per_build=args.per_build, tmpfs=args.tmpfs)
+    if build_dir:
+        os.makedirs(build_dir, exist_ok=True)
+    
+    compiler = RealTimeCompiler(args.tex_file, build_dir, events=not args.no_events, fastpath=args.fast_reorder)
     success = compiler.compile_document()
     
     if success and args.scale:
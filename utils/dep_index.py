@@ -0,0 +1,410 @@
+#!/usr/bin/env python3
+"""
+Source dependency graph of the book: inputs, graphics, labels, references and
+custom macros, per file.
+
+Scans the book file, the front-matter files it \\input's and every .tex file
+in the chapter directories (in parallel processes), and stores for each file
+what it inputs, which images it includes, the labels it defines, the labels
+it references, and the commands and environments it uses. The index lives in
+build/cache/dep_index.json and is updated incrementally: a file is rescanned
+only when its mtime or size changed and its SHA-1 differs.
+
+Together with the chapter order from the BookModel this answers, in
+milliseconds:
+- what must rebuild when a file changes (the chapters whose section files
+  include it, directly or through \\input, plus the chapters that reference
+  labels defined in the changed chapters)
+- which files and chapters reference a label, and where it is defined
+- what a chapter depends on
+- which files and chapters use a macro or environment
+
+Usage:
+  python3 utils/dep_index.py                                   # update the index
+  python3 utils/dep_index.py --affected BANACH1.png
+  python3 utils/dep_index.py --refs ch:goldrelativity
+  python3 utils/dep_index.py --deps 3
+  python3 utils/dep_index.py --macro inlineimage
+"""
+
+import argparse
+import json
+import os
+import re
+import sys
+import time
+from concurrent.futures import ProcessPoolExecutor
+from dataclasses import dataclass, field
+from pathlib import Path
+from typing import Dict, Iterable, List, Optional, Set
+
+from book_model import BookModel, SECTION_FILES, digest, load_book
+from build_dirs import BUILD_ROOT
+
+ROOT = Path(__file__).resolve().parents[1]
+INDEX_FILE = BUILD_ROOT / 'cache' / 'dep_index.json'
+INDEX_VERSION = 1
+
+# Files that every chapter is typeset with
+PREAMBLE_FILES = {'preamble.tex'}
+# The fruit tree drawn by \chapterseparator is picked by chapter number, i.e. position in the book
+TREE_IMAGE = 'fractal_trees/with_fruits/{position}.png'
+
+IMAGE_EXTENSIONS = ('.pdf', '.png', '.jpg', '.jpeg', '.eps')
+INPUT_RE = re.compile(r'\\(?:input|include|subfile)\s*\{([^}#\\]+)\}')
+INCLUDEGRAPHICS_RE = re.compile(r'\\includegraphics\*?\s*(?:\[[^\]]*\])*\s*\{([^}#\\]+)\}')
+# Image paths passed to the book's own macros (\inlineimage, SideNotePage, ...)
+IMAGE_ARG_RE = re.compile(r'\{([^{}#\\]+\.(?:png|jpe?g|pdf|eps|svg))\}', re.IGNORECASE)
+LABEL_RE = re.compile(r'\\label\s*\{([^}]+)\}')
+BOOK_LABEL_RE = re.compile(r'\\chapterwithsummaryfromfile\[([^\]]+)\]')
+REF_RE = re.compile(r'\\(?:ref|cref|Cref|pageref|autoref|eqref|nameref|vref|cpageref|Cpageref)\*?\s*\{([^}]+)\}'
+                    r'|\\hyperref\s*\[([^\]]+)\]')
+COMMAND_RE = re.compile(r'\\([A-Za-z@]+)')
+ENVIRONMENT_RE = re.compile(r'\\begin\s*\{([^}]+)\}')
+DEFINITION_RE = re.compile(r'\\(?:re)?newcommand\*?\s*\{?\\([A-Za-z@]+)\}?'
+                           r'|\\(?:New|Renew|Provide|Declare)DocumentCommand\s*\{?\\([A-Za-z@]+)\}?'
+                           r'|\\def\\([A-Za-z@]+)'
+                           r'|\\(?:re)?newenvironment\*?\s*\{([^}]+)\}'
+                           r'|\\(?:New|Renew)DocumentEnvironment\s*\{([^}]+)\}'
+                           r'|\\newtcolorbox\s*(?:\[[^\]]*\])?\s*\{([^}]+)\}'
+                           r'|\\newmdenv\s*(?:\[[^\]]*\])?\s*\{([^}]+)\}')
+
+
+def strip_comments(text: str) -> str:
+    return re.sub(r'(?<!\\)%.*', '', text)
+
+
+def resolve(name: str, extensions: Iterable[str]) -> str:
+    """Repository-relative path of an \\input or graphics argument (TeX resolves from the root)."""
+    name = name.strip()
+    candidates = [name] if Path(name).suffix else []
+    candidates += [name + ext for ext in extensions]
+    for candidate in candidates:
+        if (ROOT / candidate).is_file():
+            return Path(candidate).as_posix()
+    return Path(candidates[0] if candidates else name).as_posix()
+
+
+def scan_file(rel_path: str) -> dict:
+    """Dependencies, labels, references and macro usage of one file."""
+    text = strip_comments((ROOT / rel_path).read_text(encoding='utf-8', errors='ignore'))
+    graphics = {resolve(m, IMAGE_EXTENSIONS) for m in INCLUDEGRAPHICS_RE.findall(text)}
+    graphics |= {resolve(m, ()) for m in IMAGE_ARG_RE.findall(text)}
+    refs = set()
+    for braces, brackets in REF_RE.findall(text):
+        refs.update(r.strip() for r in (braces or brackets).split(',') if r.strip())
+    definitions = set()
+    for groups in DEFINITION_RE.findall(text):
+        definitions.update(g for g in groups if g)
+    return {
+        'inputs': sorted({resolve(m, ('.tex',)) for m in INPUT_RE.findall(text)}),
+        'graphics': sorted(graphics),
+        'labels': sorted(set(LABEL_RE.findall(text)) | set(BOOK_LABEL_RE.findall(text))),
+        'refs': sorted(refs),
+        'commands': sorted(set(COMMAND_RE.findall(text))),
+        'environments': sorted(set(ENVIRONMENT_RE.findall(text))),
+        'defines': sorted(definitions),
+    }
+
+
+@dataclass
+class Affected:
+    chapters: List[str]       # chapters whose sources include a changed file, in book order
+    referencing: List[str]    # other chapters referencing labels defined in those chapters
+    frontmatter: List[str]    # front-matter files that include a changed file
+    everything: bool          # the preamble or the book file changed
+
+
+@dataclass
+class DepIndex:
+    files: Dict[str, dict]
+    model: BookModel
+    scanned: int = 0
+    dependents: Dict[str, Set[str]] = field(default_factory=dict)
+
+    def __post_init__(self) -> None:
+        for path, entry in self.files.items():
+            for dep in entry['inputs'] + entry['graphics']:
+                self.dependents.setdefault(dep, set()).add(path)
+        for unit, deps in self.chapter_sources().items():
+            for dep in deps:
+                self.dependents.setdefault(dep, set()).add(unit)
+
+    def chapter_sources(self) -> Dict[str, List[str]]:
+        """Chapter directory -> the files \\inputstory reads for it, and its fruit tree image."""
+        sources = {}
+        for entry in self.model.entries:
+            chapter = self.model.chapter_of(entry)
+            files = [f'{entry.directory}/{name}' for name in (chapter.section_files if chapter else SECTION_FILES)]
+            sources[entry.directory] = files + [TREE_IMAGE.format(position=entry.position)]
+        return sources
+
+    def match_path(self, name: str) -> List[str]:
+        """Known paths for a query: exact repository path, else every path with that file name."""
+        name = Path(name).as_posix().removeprefix('./')
+        known = set(self.files) | set(self.dependents)
+        if name in known:
+            return [name]
+        return sorted(p for p in known if Path(p).name == name)
+
+    def dependents_of(self, paths: Iterable[str]) -> Set[str]:
+        """Every file and chapter that includes one of paths, transitively."""
+        seen: Set[str] = set()
+        queue = list(paths)
+        while queue:
+            for parent in self.dependents.get(queue.pop(), ()):
+                if parent not in seen:
+                    seen.add(parent)
+                    queue.append(parent)
+        return seen
+
+    def chapters(self) -> List[str]:
+        return [e.directory for e in self.model.entries]
+
+    def chapters_of(self, nodes: Iterable[str]) -> List[str]:
+        nodes = set(nodes)
+        return [c for c in self.chapters() if c in nodes]
+
+    def affected(self, paths: Iterable[str]) -> 'Affected':
+        """What must rebuild when paths change."""
+        paths = list(paths)
+        nodes = self.dependents_of(paths) | set(paths)
+        everything = self.book_file() in paths or bool(nodes & PREAMBLE_FILES)
+        direct = self.chapters() if everything else self.chapters_of(nodes)
+        labels = {label for c in direct for f in self.chapter_files(c) for label in self.files[f]['labels']}
+        referencing = [c for c in self.chapters_of(self.referencing_units(labels)) if c not in direct]
+        front = [self.book_file()] + [p for p in self.files if '/' not in p and p != self.book_file()]
+        frontmatter = [p for p in front if p in nodes and p not in PREAMBLE_FILES and p != self.book_file()]
+        return Affected(chapters=direct, referencing=referencing, frontmatter=frontmatter, everything=everything)
+
+    def chapter_files(self, chapter: str) -> List[str]:
+        """The indexed .tex files a chapter reads, transitively."""
+        found, queue = [], list(self.chapter_sources().get(chapter, []))
+        while queue:
+            path = queue.pop(0)
+            if path in self.files and path not in found:
+                found.append(path)
+                queue.extend(self.files[path]['inputs'])
+        return found
+
+    def referencing_units(self, labels: Set[str]) -> Set[str]:
+        files = {p for p, e in self.files.items() if labels.intersection(e['refs'])}
+        return files | self.dependents_of(files)
+
+    def definitions(self, label: str) -> List[str]:
+        return sorted(p for p, e in self.files.items() if label in e['labels'])
+
+    def users(self, name: str) -> List[str]:
+        """Files that use a command (\\name) or environment (name)."""
+        return sorted(p for p, e in self.files.items()
+                      if (name in e['commands'] or name in e['environments']) and name not in e['defines'])
+
+    def book_file(self) -> str:
+        return relative(Path(self.model.tex_file))
+
+
+def relative(path: Path) -> str:
+    try:
+        return path.resolve().relative_to(ROOT).as_posix()
+    except ValueError:
+        return path.as_posix()
+
+
+def source_files(model: BookModel, files: Dict[str, dict]) -> List[str]:
+    """The book file, the root files it inputs (transitively, from the index) and all chapter .tex files."""
+    chapter_files = [f'{c.directory}/{name}' for c in model.chapter_dirs() for name in c.tex_files]
+    book = relative(Path(model.tex_file))
+    front, queue = [], [book]
+    while queue:
+        path = queue.pop(0)
+        if path in front or not (ROOT / path).is_file():
+            continue
+        front.append(path)
+        entry = files.get(path)
+        if entry:
+            queue.extend(p for p in entry['inputs'] if '/' not in p)
+    return front + chapter_files
+
+
+def update_index(model: BookModel, jobs: Optional[int] = None, rebuild: bool = False) -> DepIndex:
+    """Load the on-disk index and rescan the files that changed."""
+    files: Dict[str, dict] = {}
+    if INDEX_FILE.exists() and not rebuild:
+        try:
+            data = json.loads(INDEX_FILE.read_text(encoding='utf-8'))
+            if data.get('version') == INDEX_VERSION:
+                files = data['files']
+        except (json.JSONDecodeError, KeyError):
+            files = {}
+
+    scanned_total = 0
+    changed = False
+    # Front-matter inputs are only known after scanning the book file, so repeat until stable
+    while True:
+        wanted = source_files(model, files)
+        stale = []
+        for path in wanted:
+            try:
+                st = (ROOT / path).stat()
+            except OSError:
+                continue
+            entry = files.get(path)
+            if entry and entry['mtime'] == st.st_mtime_ns and entry['size'] == st.st_size:
+                continue
+            sha1 = digest(ROOT / path)
+            if entry and entry['sha1'] == sha1:
+                entry['mtime'], entry['size'] = st.st_mtime_ns, st.st_size
+                changed = True
+                continue
+            stale.append((path, st, sha1))
+
+        if stale:
+            if len(stale) > 8:
+                with ProcessPoolExecutor(max_workers=jobs or os.cpu_count()) as pool:
+                    results = list(pool.map(scan_file, [p for p, _, _ in stale], chunksize=16))
+            else:
+                results = [scan_file(p) for p, _, _ in stale]
+            for (path, st, sha1), result in zip(stale, results):
+                files[path] = {'mtime': st.st_mtime_ns, 'size': st.st_size, 'sha1': sha1, **result}
+            scanned_total += len(stale)
+            changed = True
+
+        removed = set(files) - set(wanted)
+        for path in removed:
+            del files[path]
+        changed = changed or bool(removed)
+        if not stale:
+            break
+
+    if changed:
+        INDEX_FILE.parent.mkdir(parents=True, exist_ok=True)
+        INDEX_FILE.write_text(json.dumps({'version': INDEX_VERSION, 'files': files}), encoding='utf-8')
+    return DepIndex(files=files, model=model, scanned=scanned_total)
+
+
+def load_index(tex_file: str = 'main.tex', jobs: Optional[int] = None) -> DepIndex:
+    """Up-to-date dependency index for a book file."""
+    return update_index(load_book(tex_file), jobs)
+
+
+def chapter_arg(index: DepIndex, value: str) -> Optional[str]:
+    """Chapter directory from a number (as in the directory name), a directory or a label."""
+    if value.isdigit():
+        entry = index.model.entry_by_number(int(value))
+    else:
+        entry = index.model.entry_by_label(value) or next(
+            (e for e in index.model.entries if value.lower() in e.directory.lower()), None)
+    return entry.directory if entry else None
+
+
+def print_list(title: str, items: List[str]) -> None:
+    print(f"\n{title} ({len(items)}):")
+    for item in items:
+        print(f"  {item}")
+    if not items:
+        print("  (none)")
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(
+        description='Index and query the source dependencies of the book',
+        formatter_class=argparse.RawDescriptionHelpFormatter,
+        epilog="""
+Examples:
+  python3 utils/dep_index.py --affected BANACH1.png
+  python3 utils/dep_index.py --affected 03_GoldRelativity/main.tex --affected preamble.tex
+  python3 utils/dep_index.py --refs ch:goldrelativity
+  python3 utils/dep_index.py --deps 29
+  python3 utils/dep_index.py --macro inlineimage --macro SideNotePage
+        """)
+    parser.add_argument('tex_file', nargs='?', default='main.tex', help='Book file (default: main.tex)')
+    parser.add_argument('--affected', action='append', default=[], metavar='PATH',
+                        help='What must rebuild if PATH changes (repository path or file name; repeatable)')
+    parser.add_argument('--refs', metavar='LABEL', help='Where LABEL is defined and who references it')
+    parser.add_argument('--deps', metavar='CHAPTER', help='Files a chapter depends on (number, directory or label)')
+    parser.add_argument('--macro', action='append', default=[], metavar='NAME',
+                        help='Files and chapters using a command or environment (repeatable)')
+    parser.add_argument('--rebuild', action='store_true', help='Rescan every file')
+    parser.add_argument('-j', '--jobs', type=int, help='Scanner processes (default: CPU count)')
+    parser.add_argument('--json', action='store_true', help='Print query results as JSON')
+    args = parser.parse_args()
+
+    start = time.perf_counter()
+    try:
+        model = load_book(args.tex_file)
+    except FileNotFoundError as e:
+        print(f"❌ {e}")
+        sys.exit(1)
+    index = update_index(model, args.jobs, args.rebuild)
+    elapsed = (time.perf_counter() - start) * 1000
+    results: Dict[str, object] = {}
+
+    if args.affected:
+        paths = [m for name in args.affected for m in index.match_path(name)]
+        unknown = [name for name in args.affected if not index.match_path(name)]
+        affected = index.affected(paths)
+        results['affected'] = {'paths': paths, 'unknown': unknown, 'rebuild': affected.chapters,
+                               'references': affected.referencing, 'frontmatter': affected.frontmatter,
+                               'everything': affected.everything}
+
+    if args.refs:
+        users = index.referencing_units({args.refs})
+        results['refs'] = {'label': args.refs, 'defined_in': index.definitions(args.refs),
+                           'files': sorted(u for u in users if u in index.files),
+                           'chapters': index.chapters_of(users)}
+
+    if args.deps:
+        chapter = chapter_arg(index, args.deps)
+        if not chapter:
+            print(f"❌ No chapter matches '{args.deps}'")
+            sys.exit(1)
+        tex = index.chapter_files(chapter)
+        graphics = sorted({g for f in tex for g in index.files[f]['graphics']})
+        results['deps'] = {'chapter': chapter, 'files': tex, 'graphics': graphics,
+                           'tree': index.chapter_sources()[chapter][-1],
+                           'refs': sorted({r for f in tex for r in index.files[f]['refs']})}
+
+    for name in args.macro:
+        name = name.lstrip('\\')
+        users = index.users(name)
+        results.setdefault('macros', []).append({
+            'name': name, 'files': users, 'chapters': index.chapters_of(index.dependents_of(users) | set(users))})
+
+    if args.json:
+        print(json.dumps(results, indent=2))
+        return
+
+    print(f"🗂️  {len(index.files)} files indexed, {index.scanned} rescanned ({elapsed:.0f} ms)")
+
+    if 'affected' in results:
+        affected = results['affected']
+        for name in affected['unknown']:
+            print(f"⚠️  Not referenced by any indexed file: {name}")
+        if affected['everything']:
+            print("\n🔁 The preamble or the book file changed: every chapter rebuilds")
+        elif affected['paths']:
+            print_list(f"🔁 Chapters to rebuild for {', '.join(affected['paths'])}", affected['rebuild'])
+        if affected['frontmatter']:
+            print_list("📑 Front matter", affected['frontmatter'])
+        if affected['references']:
+            print_list("🔗 Chapters referencing their labels", affected['references'])
+
+    if 'refs' in results:
+        refs = results['refs']
+        print(f"\n🏷️  {refs['label']} defined in: {', '.join(refs['defined_in']) or '(nowhere)'}")
+        print_list("Referenced from files", refs['files'])
+        print_list("Referenced from chapters", refs['chapters'])
+
+    if 'deps' in results:
+        deps = results['deps']
+        print_list(f"📄 {deps['chapter']}: input files", deps['files'])
+        print_list("🖼️  Graphics", deps['graphics'] + [deps['tree']])
+        print_list("🔗 Labels referenced", deps['refs'])
+
+    for macro in results.get('macros', []):
+        print_list(f"🔧 \\{macro['name']} used in files", macro['files'])
+        print(f"   chapters: {', '.join(macro['chapters']) or '(none)'}")
+
+
+if __name__ == '__main__':
+    main()
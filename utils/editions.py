@@ -0,0 +1,363 @@
+#!/usr/bin/env python3
+"""
+Edition definitions and multi-edition builds.
+
+main.tex is the single source of the chapter list. Every other edition
+(currently the Barnes & Noble print interior) is generated from that list
+plus a small set of per-edition overrides: document class options, TeX
+engine and front matter.
+
+Editions are built concurrently, each in its own output directory under
+build/<edition>/, so they never fight over main.aux/main.log in the repo
+root, and an edition is skipped entirely when its inputs have not changed
+since its last build. Apart from the luaotfload font cache (both editions
+run on LuaLaTeX) nothing is shared between them: the book has no
+externalized figures or image proxies, so building two editions costs two
+full typesets, run side by side rather than one after the other.
+
+Usage:
+  python3 utils/editions.py list
+  python3 utils/editions.py generate            # regenerate main_interior_BN.tex
+  python3 utils/editions.py generate --check    # fail if generated files are stale
+  python3 utils/editions.py build               # build every edition
+  python3 utils/editions.py build bn --force
+"""
+
+import argparse
+import hashlib
+import json
+import shutil
+import subprocess
+import sys
+import time
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import dataclass
+from pathlib import Path
+from typing import Dict, List, Optional
+
+from build_dirs import build_dir_for
+from generate_chapter_subset import ChapterExtractor
+
+ROOT = Path(__file__).resolve().parents[1]
+
+# Files that every edition depends on besides its own entry file
+SHARED_INPUTS = ['preamble.tex', 'titlepage.tex', 'intro.tex', 'prologue.tex']
+# Shared image directories (the per-chapter fruit trees drawn by \chapterseparator)
+SHARED_IMAGE_DIRS = ['fractal_trees/with_fruits']
+
+# Auxiliary files whose change means another pass is needed
+RERUN_EXTENSIONS = ['aux', 'toc', 'out']
+
+MAX_PASSES = 3
+
+MAIN_FRONTMATTER = r"""
+% Academic title page
+\input{titlepage}
+
+% Introduction
+\chapter*{Introduction}
+\addcontentsline{toc}{chapter}{Introduction}
+\vfill
+\input{intro}
+\vfill
+\newpage
+% Table of contents
+\tableofcontents
+\newpage
+% Prologue
+\chapter*{Prologue}
+\addcontentsline{toc}{chapter}{Prologue}
+\input{prologue}
+
+\mainmatter
+"""
+
+BN_FRONTMATTER = r"""
+% Force book to start on recto (odd) page
+\frontmatter
+
+% Academic title page
+\input{titlepage}
+
+% Table of contents
+\tableofcontents
+
+% Introduction
+\chapter*{Introduction}
+\addcontentsline{toc}{chapter}{Introduction}
+\vfill
+\input{intro}
+\vfill
+\clearpage
+
+% Prologue
+\chapter*{Prologue}
+\addcontentsline{toc}{chapter}{Prologue}
+\input{prologue}
+
+% Main matter - chapters start on recto
+\mainmatter
+"""
+
+
+@dataclass
+class Edition:
+    name: str
+    entry_file: str
+    description: str
+    class_options: str = '11pt,openright'
+    # The shared preamble loads fontspec, unicode-math and polyglossia, so it needs LuaLaTeX or XeLaTeX
+    engine: str = 'lualatex'
+    frontmatter: str = MAIN_FRONTMATTER
+    # main.tex is hand-edited and is the source of the chapter list; it is never regenerated
+    generated: bool = True
+
+    @property
+    def jobname(self) -> str:
+        return Path(self.entry_file).stem
+
+
+EDITIONS: Dict[str, Edition] = {
+    'main': Edition(
+        name='main',
+        entry_file='main.tex',
+        description='Main book (Introduction, Prologue, 50 chapters)',
+        generated=False,
+    ),
+    'bn': Edition(
+        name='bn',
+        entry_file='main_interior_BN.tex',
+        description='Barnes & Noble print - no cover',
+        class_options='11pt,openany',
+        frontmatter=BN_FRONTMATTER,
+    ),
+}
+
+
+def chapter_block(main_tex: Path) -> List[str]:
+    """Return the chapter lines of main.tex (\\chapterwithsummaryfromfile + \\inputstory pairs) in order."""
+    extractor = ChapterExtractor(main_tex)
+    extractor.parse_main_tex()
+
+    lines: List[str] = []
+    for ch in sorted(extractor.chapters, key=lambda c: c['line_index']):
+        lines.append(ch['chapterwithsummary_line'])
+        if ch['inputstory_line']:
+            lines.append(ch['inputstory_line'])
+        lines.append("\n")
+    return lines
+
+
+def render_edition(edition: Edition, chapters: List[str]) -> str:
+    """Render the entry file for an edition from the shared chapter list."""
+    out: List[str] = []
+    out.append(f"% Interior file for {edition.description}\n")
+    out.append("% Generated by utils/editions.py from the chapter list in main.tex - do not edit by hand\n")
+    out.append(f"\\documentclass[{edition.class_options}]{{book}}\n")
+    out.append("\n")
+    out.append("\\input{preamble}\n")
+    out.append("\n")
+    out.append("% Title and author\n")
+    out.append("\\title{Unpopular Science}\n")
+    out.append("\\author{David H. Silver}\n")
+    out.append("\\date{\\today}\n")
+    out.append("\n")
+    out.append("\\begin{document}\n")
+    out.append(edition.frontmatter.rstrip('\n') + "\n\n")
+    out.extend(chapters)
+    out.append("\\end{document}\n")
+    return "".join(out)
+
+
+def generate_editions(names: List[str], check: bool = False, directory: Optional[Path] = None) -> bool:
+    """Write (or with check=True, verify) the entry files of the generated editions.
+
+    They go to the repository root unless another directory is given (the
+    build server writes them into its build directories).
+    """
+    chapters = chapter_block(ROOT / EDITIONS['main'].entry_file)
+    up_to_date = True
+
+    for name in names:
+        edition = EDITIONS[name]
+        if not edition.generated:
+            continue
+        path = (directory or ROOT) / edition.entry_file
+        shown = edition.entry_file if directory is None else path
+        content = render_edition(edition, chapters)
+        current = path.read_text(encoding='utf-8') if path.exists() else None
+
+        if current == content:
+            print(f"✅ {shown} is up to date")
+            continue
+
+        up_to_date = False
+        if check:
+            print(f"❌ {edition.entry_file} is stale - run: python3 utils/editions.py generate")
+        else:
+            path.write_text(content, encoding='utf-8')
+            print(f"📝 Regenerated {shown}")
+
+    return up_to_date or not check
+
+
+def input_fingerprint(edition: Edition) -> str:
+    """Hash everything the edition reads: entry file, shared front matter and chapter directories."""
+    return sources_fingerprint([edition.entry_file], edition.engine)
+
+
+def sources_fingerprint(entry_files: List[str], engine: str = 'lualatex') -> str:
+    """Hash the given entry files plus the shared front matter, chapter directories and images."""
+    digest = hashlib.sha1()
+    digest.update(engine.encode())
+    for rel in entry_files + SHARED_INPUTS:
+        path = ROOT / rel
+        if path.exists():
+            digest.update(rel.encode())
+            digest.update(path.read_bytes())
+
+    # Chapter sources are hashed by content; images and PDFs by size and mtime to stay cheap
+    chapter_dirs = sorted(p for p in ROOT.iterdir() if p.is_dir() and p.name[:2].isdigit())
+    for directory in chapter_dirs + [ROOT / d for d in SHARED_IMAGE_DIRS]:
+        for path in sorted(directory.iterdir()):
+            if not path.is_file():
+                continue
+            digest.update(str(path.relative_to(ROOT)).encode())
+            if path.suffix == '.tex':
+                digest.update(path.read_bytes())
+            else:
+                stat = path.stat()
+                digest.update(f"{stat.st_size}:{stat.st_mtime_ns}".encode())
+    return digest.hexdigest()
+
+
+def aux_state(build_dir: Path, jobname: str) -> Dict[str, str]:
+    """Hash the rerun-relevant auxiliary files of a job."""
+    state = {}
+    for ext in RERUN_EXTENSIONS:
+        path = build_dir / f'{jobname}.{ext}'
+        if path.exists():
+            state[ext] = hashlib.sha1(path.read_bytes()).hexdigest()
+    return state
+
+
+def run_pass(edition: Edition, build_dir: Path, pass_num: int) -> bool:
+    """Run one engine pass for an edition inside its build directory."""
+    log_path = build_dir / f'compile_pass{pass_num}.log'
+    cmd = [
+        edition.engine,
+        '-interaction=nonstopmode',
+        f'-output-directory={build_dir}',
+        f'-jobname={edition.jobname}',
+        edition.entry_file,
+    ]
+    with open(log_path, 'w') as log:
+        result = subprocess.run(cmd, stdout=log, stderr=subprocess.STDOUT, cwd=ROOT)
+    # As in compile_realtime.py, a written PDF counts as success even with a nonzero exit code
+    return result.returncode == 0 or (build_dir / f'{edition.jobname}.pdf').exists()
+
+
+def build_edition(edition: Edition, force: bool = False, tmpfs: bool = False) -> dict:
+    """Build one edition, rerunning only until its aux/toc files stop changing."""
+    build_dir = build_dir_for(edition.name, tmpfs=tmpfs)
+    state_file = build_dir / 'edition.json'
+    pdf_path = build_dir / f'{edition.jobname}.pdf'
+
+    fingerprint = input_fingerprint(edition)
+    if not force and state_file.exists() and pdf_path.exists():
+        previous = json.loads(state_file.read_text(encoding='utf-8'))
+        if previous.get('fingerprint') == fingerprint:
+            return {'edition': edition.name, 'status': 'up-to-date', 'passes': 0, 'seconds': 0.0, 'pdf': pdf_path}
+
+    start = time.time()
+    passes = 0
+    success = False
+    while passes < MAX_PASSES:
+        before = aux_state(build_dir, edition.jobname)
+        passes += 1
+        success = run_pass(edition, build_dir, passes)
+        if not success:
+            break
+        if aux_state(build_dir, edition.jobname) == before:
+            break
+
+    elapsed = time.time() - start
+    if success:
+        state_file.write_text(json.dumps({'fingerprint': fingerprint, 'passes': passes}, indent=2), encoding='utf-8')
+        # Keep the historical location of the PDF in the repo root for release/upload scripts
+        shutil.copy2(pdf_path, ROOT / pdf_path.name)
+
+    return {
+        'edition': edition.name,
+        'status': 'built' if success else 'failed',
+        'passes': passes,
+        'seconds': elapsed,
+        'pdf': pdf_path,
+    }
+
+
+def build_editions(names: List[str], force: bool = False, jobs: Optional[int] = None,
+                   tmpfs: bool = False) -> bool:
+    """Build the selected editions concurrently."""
+    editions = [EDITIONS[name] for name in names]
+
+    for edition in editions:
+        if shutil.which(edition.engine) is None:
+            print(f"❌ {edition.engine} not found on PATH (needed for edition '{edition.name}')")
+            return False
+
+    print(f"🚀 Building {len(editions)} edition(s): {', '.join(e.name for e in editions)}")
+    overall_start = time.time()
+    with ThreadPoolExecutor(max_workers=jobs or len(editions)) as pool:
+        results = list(pool.map(lambda e: build_edition(e, force, tmpfs), editions))
+
+    for r in results:
+        icon = {'built': '✅', 'up-to-date': '⏭️ ', 'failed': '❌'}[r['status']]
+        print(f"{icon} {r['edition']:<6} {r['status']:<11} passes={r['passes']} "
+              f"time={r['seconds']:.1f}s  {r['pdf']}")
+    print(f"⏱️  Total wall time: {time.time() - overall_start:.1f}s")
+
+    return all(r['status'] != 'failed' for r in results)
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description='Generate and build book editions from one chapter list')
+    sub = parser.add_subparsers(dest='command', required=True)
+
+    sub.add_parser('list', help='List the defined editions')
+
+    gen = sub.add_parser('generate', help='Regenerate edition entry files from main.tex')
+    gen.add_argument('editions', nargs='*', help='Editions to generate (default: all)')
+    gen.add_argument('--check', action='store_true', help='Only check that generated files are up to date')
+
+    build = sub.add_parser('build', help='Build editions in isolated build directories')
+    build.add_argument('editions', nargs='*', help='Editions to build (default: all)')
+    build.add_argument('--force', action='store_true', help='Rebuild even if inputs are unchanged')
+    build.add_argument('-j', '--jobs', type=int, help='Maximum editions built at once (default: all)')
+    build.add_argument('--tmpfs', action='store_true', help='Build on /dev/shm (build/<edition> links to it)')
+
+    args = parser.parse_args()
+
+    names = getattr(args, 'editions', None) or list(EDITIONS)
+    unknown = [n for n in names if n not in EDITIONS]
+    if unknown:
+        raise SystemExit(f"ERROR: unknown edition(s): {', '.join(unknown)} (known: {', '.join(EDITIONS)})")
+
+    if args.command == 'list':
+        for edition in EDITIONS.values():
+            source = 'generated' if edition.generated else 'source'
+            print(f"{edition.name:<6} {edition.entry_file:<24} {edition.engine:<9} "
+                  f"[{edition.class_options}] ({source}) - {edition.description}")
+        return
+
+    if args.command == 'generate':
+        sys.exit(0 if generate_editions(names, check=args.check) else 1)
+
+    if args.command == 'build':
+        # Generated entry files always follow the current chapter list
+        generate_editions(names)
+        sys.exit(0 if build_editions(names, force=args.force, jobs=args.jobs, tmpfs=args.tmpfs) else 1)
+
+
+if __name__ == '__main__':
+    main()
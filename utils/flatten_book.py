@@ -6,274 +6,392 @@ Flatten the LaTeX book into a single TeX file with inlined chapter content.
 - Reproduces the layout used by \inputstory{...} for each chapter
 - Inlines chapter files (title, summary, sidenote, historical, main, technical, and optional extras)
 - Preserves front matter and inlines intro/prologue/titlepage
+- Resolves \input/\include recursively (name.tex, then name, relative to the
+  book file's directory, as TeX does), reading each file once per run and
+  refusing cycles; inputs that are not in the repository (TeX distribution
+  files) are left as they are
+- Streams the output to disk and optionally writes a source map from
+  flattened line to original file:line
 
 Usage:
   python3 utils/flatten_book.py main.tex -o main_flat.tex
+  python3 utils/flatten_book.py main.tex -o main_flat.tex --source-map main_flat.map
+  python3 utils/flatten_book.py --where 5120 --source-map main_flat.map
 """
 
 import argparse
+import bisect
+import contextlib
 import re
+import sys
 from pathlib import Path
-from typing import List, Optional, Tuple, Dict
+from typing import Dict, List, Optional, TextIO, Tuple
+
+from book_model import first_line, load_book
 
 ROOT = Path(__file__).resolve().parents[1]
 
+INPUT_RE = re.compile(r'\\(input|include)(?![A-Za-z@])\s*(?:\{([^{}]*)\}|([^\s{}%\\]+))')
+VERBATIM_RE = re.compile(r'\\(begin|end)\{(verbatim\*?|Verbatim|lstlisting|minted|comment)\}')
 
-class ChapterRef:
-    def __init__(self, label: Optional[str], directory: str, line_index: int) -> None:
-        self.label = label
-        self.directory = directory
-        self.line_index = line_index
+# Optional chapter files after main.tex, in the order \inputstory reads them
+EXTRA_FILES = ['phenomenon_extra.tex', 'joke.tex', 'exercises.tex', 'cartoon.tex', 'imagefigure.tex']
 
 
-def read_text_file(path: Path) -> str:
-    try:
-        return path.read_text(encoding='utf-8')
-    except Exception:
-        return ""
+def split_comment(line: str) -> Tuple[str, str]:
+    """(code, comment) of a source line; the comment starts at the first unescaped %."""
+    pos = 0
+    while pos < len(line):
+        if line[pos] == '\\':
+            pos += 2
+            continue
+        if line[pos] == '%':
+            return line[:pos], line[pos:]
+        pos += 1
+    return line, ''
 
 
-def read_first_nonempty_line(path: Path) -> str:
+def display_path(path: Path) -> str:
     try:
-        with path.open('r', encoding='utf-8') as f:
-            for raw in f:
-                line = raw.strip()
-                # Skip pure comments and empty lines
-                if not line or line.startswith('%'):
-                    continue
-                return line
-    except Exception:
-        pass
-    return ""
-
-
-def parse_main_for_chapters(main_tex_path: Path) -> Tuple[List[str], List[ChapterRef]]:
-    """Return (header_lines_before_first_chapter, chapters[]) in file order.
-    header_lines include everything up to but not including the first
-    un-commented \chapterwithsummaryfromfile line.
-    """
-    lines = main_tex_path.read_text(encoding='utf-8').splitlines()
+        return path.relative_to(ROOT).as_posix()
+    except ValueError:
+        return path.as_posix()
 
-    chapters: List[ChapterRef] = []
-    first_chapter_idx: Optional[int] = None
 
-    for i, line in enumerate(lines):
-        stripped = line.strip()
-        if stripped.startswith('%'):
-            continue
-        if "\\chapterwithsummaryfromfile" in line:
-            if first_chapter_idx is None:
-                first_chapter_idx = i
-            # Example: \chapterwithsummaryfromfile[ch:banach]{01_BanachTarskiParadox}
-            m = re.search(r"\\chapterwithsummaryfromfile(?:\[([^\]]+)\])?\{([^\}]+)\}", line)
-            if m:
-                label = m.group(1)
-                directory = m.group(2)
-                chapters.append(ChapterRef(label=label, directory=directory, line_index=i))
-
-    header_lines = lines[: (first_chapter_idx if first_chapter_idx is not None else len(lines))]
-    return header_lines, chapters
-
-
-def inline_if_root_input(line: str) -> Optional[str]:
-    """If the line is an \input{<name>} in the repository root for known front-matter
-    files, return the inlined content; otherwise None.
-    We inline: intro, prologue, titlepage. We do NOT inline preamble.
+class SourceMap:
+    """Flattened line -> original file:line, stored as runs of consecutive lines.
+
+    Each row of the file is `flat_line<TAB>count<TAB>file<TAB>line` (1-based);
+    lines no row covers were generated by the flattener.
     """
-    m = re.match(r"^\\input\{([^\}]+)\}\s*$", line.strip())
-    if not m:
-        return None
-    name = m.group(1)
-    if name in {"preamble"}:
+
+    def __init__(self, stream: TextIO) -> None:
+        self.stream = stream
+        self.run: Optional[List] = None
+        stream.write("# flat_line\tcount\tsource\tsource_line\n")
+
+    def record(self, flat_line: int, source: str, source_line: int) -> None:
+        run = self.run
+        if run and run[2] == source and run[0] + run[1] == flat_line and run[3] + run[1] == source_line:
+            run[1] += 1
+            return
+        self.flush()
+        self.run = [flat_line, 1, source, source_line]
+
+    def flush(self) -> None:
+        if self.run:
+            self.stream.write('\t'.join(map(str, self.run)) + '\n')
+            self.run = None
+
+
+def source_of(map_path: Path, flat_line: int) -> Optional[Tuple[str, int]]:
+    """(file, line) a flattened line came from, or None for generated lines."""
+    starts, rows = [], []
+    with map_path.open(encoding='utf-8') as f:
+        for raw in f:
+            if raw.startswith('#'):
+                continue
+            start, count, source, line = raw.rstrip('\n').split('\t')
+            starts.append(int(start))
+            rows.append((int(count), source, int(line)))
+    i = bisect.bisect_right(starts, flat_line) - 1
+    if i < 0 or flat_line >= starts[i] + rows[i][0]:
         return None
-    if name in {"intro", "prologue", "titlepage"}:
-        path = ROOT / f"{name}.tex"
-        content = read_text_file(path)
-        if content:
-            return f"% BEGIN INLINE {name}.tex\n" + content.rstrip() + f"\n% END INLINE {name}.tex"
-    return None
-
-
-def build_title_page_block(title_tex: str) -> str:
-    return """
-% --- PAGE 1: Dedicated Title Page (big, centered) ---
-\thispagestyle{empty}
-\begin{center}
-    \vspace*{\fill}
-    {\fontsize{48pt}{62pt}\selectfont\bfseries\raggedright
-    \parbox{0.8\textwidth}{\centering
-""".rstrip('\n') + "\n" + title_tex.rstrip('\n') + "\n" + """
-    }}
-    \vspace*{\fill}
-\end{center}
-\clearpage
-""".lstrip('\n')
-
-
-def build_page3_intro_block(title_tex: str, summary_tex: str, topicmap_tex: str, quote_tex: str) -> str:
-    body = []
-    body.append("% --- PAGE 3: Title + Summary + Topicmap + Quote ---")
-    body.append("\\thispagestyle{empty}")
-    body.append("\\begin{center}")
-    body.append("    \\vspace*{\\fill}")
-    body.append("    {\\Huge \\bfseries ")
-    body.append(title_tex.rstrip())
-    body.append("    }")
-    body.append("")
-    body.append("    \\vspace{2em}")
-    body.append("    \\begin{minipage}{0.8\\textwidth}")
-    body.append("        {\\fontsize{13pt}{18pt}\\selectfont\\color{black}")
-    body.append("        \\justifying")
-    body.append(summary_tex.rstrip())
-    body.append("        }")
-    body.append("    \\end{minipage}")
-    body.append("")
-    body.append("    \\vspace{2em}")
-    body.append("    \\chapterseparator")
-    body.append("    \\vspace{2em}")
-    if topicmap_tex:
-        body.append("    \\begin{minipage}{0.7\\textwidth}")
-        body.append("        \\centering")
-        body.append(topicmap_tex.rstrip())
-        body.append("    \\end{minipage}")
-    body.append("    \\vfill")
-    if quote_tex:
-        body.append("    \\vspace{2em}")
-        body.append("    \\begin{minipage}{0.8\\textwidth}")
-        body.append("        \\centering \\itshape")
-        body.append(quote_tex.rstrip())
-        body.append("    \\end{minipage}")
-    body.append("    \\vspace*{\\fill}")
-    body.append("\\end{center}")
-    body.append("\\clearpage")
-    return "\n".join(body) + "\n"
-
-
-def inline_tex_file(path: Path) -> str:
-    content = read_text_file(path)
-    return (f"% BEGIN INLINE {path.relative_to(ROOT)}\n" + content.rstrip() +
-            f"\n% END INLINE {path.relative_to(ROOT)}\n") if content else ""
-
-
-def generate_flattened(main_tex_path: Path, output_path: Path) -> None:
-    header_lines, chapters = parse_main_for_chapters(main_tex_path)
-
-    # Compose header, inlining intro/prologue/titlepage where encountered
-    output: List[str] = []
-    output.append("% === FLATTENED BOOK GENERATED BY utils/flatten_book.py ===")
-    for line in header_lines:
-        maybe_inline = inline_if_root_input(line)
-        output.append(maybe_inline if maybe_inline is not None else line)
-
-    # Ensure we are in main matter after front-matter, as in original main.tex
-    # The header_lines already include up to \mainmatter; no changes here.
-
-    # Process each chapter in the original order
-    for ch in sorted(chapters, key=lambda c: c.line_index):
-        chapter_dir = ROOT / ch.directory
-        title_path = chapter_dir / 'title.tex'
-        summary_path = chapter_dir / 'summary.tex'
-        sidenote_path = chapter_dir / 'sidenote.tex'
-        historical_path = chapter_dir / 'historical.tex'
-        main_path = chapter_dir / 'main.tex'
-        technical_path = chapter_dir / 'technical.tex'
-        topicmap_path = chapter_dir / 'topicmap.tex'
-        quote_path = chapter_dir / 'quote.tex'
-        phenomenon_extra_path = chapter_dir / 'phenomenon_extra.tex'
-        joke_path = chapter_dir / 'joke.tex'
-        exercises_path = chapter_dir / 'exercises.tex'
-        cartoon_path = chapter_dir / 'cartoon.tex'
-        imagefigure_path = chapter_dir / 'imagefigure.tex'
-
-        title_first = read_first_nonempty_line(title_path)
-        summary_first = read_first_nonempty_line(summary_path)
-
-        title_tex = inline_tex_file(title_path)
-        summary_tex = inline_tex_file(summary_path)
-        topicmap_tex = read_text_file(topicmap_path)
-        quote_tex = read_text_file(quote_path)
-
-        output.append("")
-        output.append(f"% ===== CHAPTER {ch.directory} =====")
-        output.append("\\refstepcounter{chapter}")
-        if ch.label:
-            output.append(f"\\label{{{ch.label}}}")
-        output.append("\\phantomsection")
-
-        # Verso empty page BEFORE each chapter (as in inputstory)
-        output.append("% --- Verso empty page before chapter ---")
-        output.append("\\clearpage")
-        output.append("\\thispagestyle{empty}")
-        output.append("\\mbox{}")
-        output.append("\\clearpage")
-
-        # Page 1: Big Title
-        output.append(build_title_page_block(title_tex))
-
-        # Page 2: Sidenote or empty
-        output.append("% --- PAGE 2: Sidenote (or empty) ---")
-        if sidenote_path.exists():
-            output.append(inline_tex_file(sidenote_path))
+    count, source, line = rows[i]
+    return source, line + flat_line - starts[i]
+
+
+class Flattener:
+    """Writes the flattened book line by line, inlining inputs as they are met."""
+
+    def __init__(self, out: TextIO, base_dir: Path, source_map: Optional[SourceMap] = None,
+                 keep: Tuple[str, ...] = ('preamble',)) -> None:
+        self.out = out
+        self.base_dir = base_dir
+        self.source_map = source_map
+        self.keep = set(keep)
+        self.lines_written = 0
+        self.cache: Dict[Path, List[str]] = {}
+        self.unresolved: Dict[str, int] = {}
+
+    # --- sources -----------------------------------------------------------------
+
+    def read_lines(self, path: Path) -> List[str]:
+        """Lines of a file, read once per run."""
+        if path not in self.cache:
+            try:
+                self.cache[path] = path.read_text(encoding='utf-8').splitlines()
+            except (OSError, UnicodeDecodeError):
+                self.cache[path] = []
+        return self.cache[path]
+
+    def first_line(self, path: Path) -> str:
+        return first_line('\n'.join(self.read_lines(path)))
+
+    def resolve(self, kind: str, name: str) -> Optional[Path]:
+        """The file TeX would read for \\input{name} / \\include{name}, if it is in the repository."""
+        name = name.strip()
+        if not name or '#' in name or '\\' in name:
+            return None
+        if kind == 'include':
+            candidates = [f'{name}.tex']
+        elif Path(name).suffix:
+            candidates = [name, f'{name}.tex']
         else:
-            output.append("\\thispagestyle{empty}")
-            output.append("\\mbox{}")
-        output.append("\\clearpage")
-
-        # Add TOC entry here (after sidenote page)
-        output.append("% --- Table of Contents entry (title + summary first lines) ---")
-        output.append("\\addcontentsline{toc}{chapter}{%")
-        output.append(f"  \\protect\\numberline{{\\thechapter}}{title_first}\\\\")
-        output.append(f"  {{\\normalfont\\small\\textit{{\\textcolor{{summarycolor}}{{{summary_first}}}}}}}%")
-        output.append("}")
-        output.append("\\clearpage")
-
-        # Page 3: Title + Summary + Topicmap + Quote
-        output.append(build_page3_intro_block(title_tex, summary_tex, topicmap_tex, quote_tex))
-
-        # Pages 4-8: Historical + Main + Optional materials
-        output.append("% --- PAGES 4-8: Historical + Main + Optional ---")
-        output.append(f"\\chaptermark{{{title_first}}}")
-        output.append("{\\LARGE \\bfseries ")
-        output.append(title_tex.rstrip())
-        output.append("}")
-        output.append(inline_tex_file(historical_path))
-        output.append(inline_tex_file(main_path))
-        if phenomenon_extra_path.exists():
-            output.append(inline_tex_file(phenomenon_extra_path))
-        if joke_path.exists():
-            output.append(inline_tex_file(joke_path))
-        if exercises_path.exists():
-            output.append(inline_tex_file(exercises_path))
-        if cartoon_path.exists():
-            output.append(inline_tex_file(cartoon_path))
-        if imagefigure_path.exists():
-            output.append(inline_tex_file(imagefigure_path))
-
-        # Page 9: Technical (exactly one page)
-        output.append("% --- PAGE 9: Technical ---")
-        output.append("\\newpage")
-        output.append(inline_tex_file(technical_path))
-
-    # End document
-    output.append("\\end{document}")
-
-    # Write to output
-    output_path.write_text("\n".join(output) + "\n", encoding='utf-8')
+            candidates = [f'{name}.tex', name]
+        for candidate in candidates:
+            path = (self.base_dir / candidate).resolve()
+            if path.is_file():
+                return path
+        return None
+
+    # --- output ------------------------------------------------------------------
+
+    def emit(self, text: str = '') -> None:
+        """Generated text (no source)."""
+        for line in text.split('\n'):
+            self.out.write(line + '\n')
+            self.lines_written += 1
+
+    def emit_source(self, line: str, source: str, source_line: int) -> None:
+        self.out.write(line + '\n')
+        self.lines_written += 1
+        if self.source_map:
+            self.source_map.record(self.lines_written, source, source_line)
+
+    def inline(self, path: Path, stack: Tuple[Path, ...] = ()) -> bool:
+        """Write a file with its inputs resolved, between BEGIN/END INLINE comments. False if it is empty."""
+        lines = self.read_lines(path)
+        if not any(line.strip() for line in lines):
+            return False
+        while lines and not lines[-1].strip():
+            lines = lines[:-1]
+        name = display_path(path)
+        self.emit(f"% BEGIN INLINE {name}")
+        self.write_lines(path, lines, stack + (path,))
+        self.emit(f"% END INLINE {name}")
+        return True
+
+    def write_lines(self, path: Path, lines: List[str], stack: Tuple[Path, ...]) -> None:
+        source = display_path(path)
+        verbatim = None
+        for lineno, line in enumerate(lines, 1):
+            if verbatim:
+                self.emit_source(line, source, lineno)
+                if any(kind == 'end' and env == verbatim for kind, env in VERBATIM_RE.findall(line)):
+                    verbatim = None
+                continue
+            code, comment = split_comment(line)
+            begins = [env for kind, env in VERBATIM_RE.findall(code) if kind == 'begin']
+            if begins:
+                verbatim = begins[-1]
+            inputs = [] if begins else [m for m in INPUT_RE.finditer(code)
+                                        if (m.group(2) or m.group(1) == 'input')
+                                        and (m.group(2) or m.group(3)) not in self.keep]
+            if not inputs:
+                self.emit_source(line, source, lineno)
+                continue
+            self.write_inputs(code, comment, inputs, source, lineno, stack)
+
+    def write_inputs(self, code: str, comment: str, inputs, source: str, lineno: int,
+                     stack: Tuple[Path, ...]) -> None:
+        """Split a line around its \\input/\\include commands and inline each resolvable one."""
+        pos = 0
+        for match in inputs:
+            kind, name = match.group(1), match.group(2) or match.group(3)
+            path = self.resolve(kind, name)
+            if path is None:
+                self.unresolved[name] = self.unresolved.get(name, 0) + 1
+                continue
+            before = code[pos:match.start()]
+            if before.strip():
+                self.emit_source(before.rstrip() + '%', source, lineno)
+            if path in stack:
+                chain = ' -> '.join(display_path(p) for p in stack + (path,))
+                print(f"⚠️  Cyclic input skipped: {chain}")
+                self.emit(f"% flatten_book: skipped cyclic {match.group(0)} ({chain})")
+            else:
+                if kind == 'include':
+                    self.emit("\\clearpage")
+                self.inline(path, stack)
+                if kind == 'include':
+                    self.emit("\\clearpage")
+            pos = match.end()
+        rest = code[pos:] + comment
+        if rest.strip():
+            self.emit_source(rest, source, lineno)
+
+    def close(self) -> None:
+        if self.source_map:
+            self.source_map.flush()
+
+
+def write_title_page(flat: Flattener, title_path: Path) -> None:
+    flat.emit("% --- PAGE 1: Dedicated Title Page (big, centered) ---\n"
+              "\\thispagestyle{empty}\n"
+              "\\begin{center}\n"
+              "    \\vspace*{\\fill}\n"
+              "    {\\fontsize{48pt}{62pt}\\selectfont\\bfseries\\raggedright\n"
+              "    \\parbox{0.8\\textwidth}{\\centering")
+    flat.inline(title_path)
+    flat.emit("    }}\n"
+              "    \\vspace*{\\fill}\n"
+              "\\end{center}\n"
+              "\\clearpage")
+
+
+def write_page3_intro(flat: Flattener, chapter_dir: Path) -> None:
+    flat.emit("% --- PAGE 3: Title + Summary + Topicmap + Quote ---\n"
+              "\\thispagestyle{empty}\n"
+              "\\begin{center}\n"
+              "    \\vspace*{\\fill}\n"
+              "    {\\Huge \\bfseries ")
+    flat.inline(chapter_dir / 'title.tex')
+    flat.emit("    }\n"
+              "\n"
+              "    \\vspace{2em}\n"
+              "    \\begin{minipage}{0.8\\textwidth}\n"
+              "        {\\fontsize{13pt}{18pt}\\selectfont\\color{black}\n"
+              "        \\justifying")
+    flat.inline(chapter_dir / 'summary.tex')
+    flat.emit("        }\n"
+              "    \\end{minipage}\n"
+              "\n"
+              "    \\vspace{2em}\n"
+              "    \\chapterseparator\n"
+              "    \\vspace{2em}")
+    if (chapter_dir / 'topicmap.tex').exists():
+        flat.emit("    \\begin{minipage}{0.7\\textwidth}\n"
+                  "        \\centering")
+        flat.inline(chapter_dir / 'topicmap.tex')
+        flat.emit("    \\end{minipage}")
+    flat.emit("    \\vfill")
+    if (chapter_dir / 'quote.tex').exists():
+        flat.emit("    \\vspace{2em}\n"
+                  "    \\begin{minipage}{0.8\\textwidth}\n"
+                  "        \\centering \\itshape")
+        flat.inline(chapter_dir / 'quote.tex')
+        flat.emit("    \\end{minipage}")
+    flat.emit("    \\vspace*{\\fill}\n"
+              "\\end{center}\n"
+              "\\clearpage")
+
+
+def write_chapter(flat: Flattener, directory: str, label: Optional[str]) -> None:
+    chapter_dir = ROOT / directory
+    title_path = chapter_dir / 'title.tex'
+    title_first = flat.first_line(title_path)
+    summary_first = flat.first_line(chapter_dir / 'summary.tex')
+
+    flat.emit()
+    flat.emit(f"% ===== CHAPTER {directory} =====")
+    flat.emit("\\refstepcounter{chapter}")
+    if label:
+        flat.emit(f"\\label{{{label}}}")
+    flat.emit("\\phantomsection")
+
+    # Verso empty page BEFORE each chapter (as in inputstory)
+    flat.emit("% --- Verso empty page before chapter ---\n"
+              "\\clearpage\n"
+              "\\thispagestyle{empty}\n"
+              "\\mbox{}\n"
+              "\\clearpage")
+
+    # Page 1: Big Title
+    write_title_page(flat, title_path)
+
+    # Page 2: Sidenote or empty
+    flat.emit("% --- PAGE 2: Sidenote (or empty) ---")
+    if not ((chapter_dir / 'sidenote.tex').exists() and flat.inline(chapter_dir / 'sidenote.tex')):
+        flat.emit("\\thispagestyle{empty}\n\\mbox{}")
+    flat.emit("\\clearpage")
+
+    # Add TOC entry here (after sidenote page)
+    flat.emit("% --- Table of Contents entry (title + summary first lines) ---\n"
+              "\\addcontentsline{toc}{chapter}{%\n"
+              f"  \\protect\\numberline{{\\thechapter}}{title_first}\\\\\n"
+              f"  {{\\normalfont\\small\\textit{{\\textcolor{{summarycolor}}{{{summary_first}}}}}}}%\n"
+              "}\n"
+              "\\clearpage")
+
+    # Page 3: Title + Summary + Topicmap + Quote
+    write_page3_intro(flat, chapter_dir)
+
+    # Pages 4-8: Historical + Main + Optional materials
+    flat.emit("% --- PAGES 4-8: Historical + Main + Optional ---")
+    flat.emit(f"\\chaptermark{{{title_first}}}")
+    flat.emit("{\\LARGE \\bfseries ")
+    flat.inline(title_path)
+    flat.emit("}")
+    flat.inline(chapter_dir / 'historical.tex')
+    flat.inline(chapter_dir / 'main.tex')
+    for name in EXTRA_FILES:
+        if (chapter_dir / name).exists():
+            flat.inline(chapter_dir / name)
+
+    # Page 9: Technical (exactly one page)
+    flat.emit("% --- PAGE 9: Technical ---")
+    flat.emit("\\newpage")
+    flat.inline(chapter_dir / 'technical.tex')
+
+
+def generate_flattened(main_tex_path: Path, output_path: Path, map_path: Optional[Path] = None,
+                       keep: Tuple[str, ...] = ('preamble',)) -> Flattener:
+    """Stream the flattened book to output_path (and its source map to map_path)."""
+    model = load_book(main_tex_path)
+    book = Path(model.tex_file)
+    header = [line.rstrip('\n') for line in model.preamble]
+
+    with output_path.open('w', encoding='utf-8') as out, \
+            (map_path.open('w', encoding='utf-8') if map_path else contextlib.nullcontext()) as map_stream:
+        flat = Flattener(out, book.parent, SourceMap(map_stream) if map_path else None, keep)
+        flat.emit("% === FLATTENED BOOK GENERATED BY utils/flatten_book.py ===")
+
+        # Header up to the first chapter, with its inputs (intro, prologue, titlepage) resolved
+        flat.write_lines(book, header, (book,))
+
+        # Process each chapter in the original order
+        for entry in sorted(model.entries, key=lambda e: e.line_index):
+            write_chapter(flat, entry.directory, entry.label)
+
+        flat.emit("\\end{document}")
+        flat.close()
+    return flat
 
 
 def main() -> None:
     parser = argparse.ArgumentParser(description='Flatten LaTeX book into a single TeX file with inlined chapter content')
-    parser.add_argument('main_tex', help='Path to main.tex (entry point)')
+    parser.add_argument('main_tex', nargs='?', default='main.tex', help='Path to main.tex (entry point)')
     parser.add_argument('-o', '--output', default='main_flat.tex', help='Output TeX filename (default: main_flat.tex)')
+    parser.add_argument('--source-map', metavar='FILE',
+                        help='Write a map from flattened line to original file:line (tab-separated runs)')
+    parser.add_argument('--inline-preamble', action='store_true',
+                        help='Inline preamble.tex too (by default \\input{preamble} is kept)')
+    parser.add_argument('--where', type=int, metavar='LINE',
+                        help='Print the original file:line of a flattened line (needs --source-map)')
     args = parser.parse_args()
 
+    if args.where is not None:
+        if not args.source_map or not Path(args.source_map).exists():
+            raise SystemExit("ERROR: --where needs an existing --source-map file")
+        origin = source_of(Path(args.source_map), args.where)
+        print(f"{origin[0]}:{origin[1]}" if origin else f"line {args.where} was generated by the flattener")
+        return
+
     main_tex_path = Path(args.main_tex).resolve()
     if not main_tex_path.exists():
         raise SystemExit(f"ERROR: {main_tex_path} not found")
 
     output_path = (Path.cwd() / args.output).resolve()
-    generate_flattened(main_tex_path, output_path)
-    print(f"✅ Flattened TeX written: {output_path}")
+    map_path = (Path.cwd() / args.source_map).resolve() if args.source_map else None
+    keep = () if args.inline_preamble else ('preamble',)
+    flat = generate_flattened(main_tex_path, output_path, map_path, keep)
+    print(f"✅ Flattened TeX written: {output_path} ({flat.lines_written} lines, {len(flat.cache)} source files)")
+    if map_path:
+        print(f"🗺️  Source map written: {map_path}")
+    if flat.unresolved:
+        names = ', '.join(sorted(flat.unresolved))
+        print(f"ℹ️  Left as is (not in the repository): {names}", file=sys.stderr)
 
 
 if __name__ == '__main__':
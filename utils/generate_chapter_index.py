@@ -3,39 +3,31 @@
 Generate a comprehensive CSV index of all chapters in the book.
 """
 
-import os
 import csv
 import re
 from pathlib import Path
 
-def extract_title_content(file_path):
-    """Extract the content from title.tex file."""
-    try:
-        with open(file_path, 'r', encoding='utf-8') as f:
-            content = f.read().strip()
-            # Remove LaTeX commands and clean up
-            content = re.sub(r'\\[a-zA-Z]+\{([^}]*)\}', r'\1', content)
-            content = re.sub(r'\\[a-zA-Z]+', '', content)
-            content = re.sub(r'[{}]', '', content)
-            content = re.sub(r'\s+', ' ', content).strip()
-            return content
-    except:
+from book_model import load_book
+
+def extract_title_content(chapter):
+    """Extract the content of the chapter's title.tex."""
+    if not chapter.has('title.tex'):
         return "N/A"
+    content = chapter.title
+    # Remove LaTeX commands and clean up
+    content = re.sub(r'\\[a-zA-Z]+\{([^}]*)\}', r'\1', content)
+    content = re.sub(r'\\[a-zA-Z]+', '', content)
+    content = re.sub(r'[{}]', '', content)
+    content = re.sub(r'\s+', ' ', content).strip()
+    return content
 
-def find_pdf_files(chapter_dir):
+def find_pdf_files(chapter):
     """Find all PDF files in the chapter directory."""
-    pdf_files = []
-    try:
-        for file in os.listdir(chapter_dir):
-            if file.endswith('.pdf'):
-                pdf_files.append(file)
-    except:
-        pass
-    return pdf_files
+    return [file for file in chapter.files if file.endswith('.pdf')]
 
-def check_file_exists(chapter_dir, filename):
+def check_file_exists(chapter, filename):
     """Check if a specific file exists in the chapter directory."""
-    return os.path.exists(os.path.join(chapter_dir, filename))
+    return chapter.has(filename)
 
 def get_chapter_topic(folder_name):
     """Extract the topic name from folder name (after underscore)."""
@@ -46,11 +38,7 @@ def get_chapter_topic(folder_name):
 
 def main():
     # Get all chapter directories
-    chapters = []
-    
-    for item in sorted(os.listdir('.')):
-        if os.path.isdir(item) and re.match(r'^\d{2}_', item):
-            chapters.append(item)
+    chapters = [c for c in load_book().chapter_dirs() if re.match(r'^\d{2}_', c.directory)]
     
     # Prepare CSV data
     csv_data = []
@@ -74,19 +62,19 @@ def main():
         'Has Images'
     ]
     
-    for chapter_folder in chapters:
+    for chapter in chapters:
+        chapter_folder = chapter.directory
         # Extract chapter number
-        chapter_num = int(chapter_folder[:2])
+        chapter_num = chapter.number
         
         # Get topic from folder name
         topic = get_chapter_topic(chapter_folder)
         
         # Extract title
-        title_path = os.path.join(chapter_folder, 'title.tex')
-        title_content = extract_title_content(title_path)
+        title_content = extract_title_content(chapter)
         
         # Find PDF files
-        pdf_files = find_pdf_files(chapter_folder)
+        pdf_files = find_pdf_files(chapter)
         main_pdf = None
         other_pdfs = []
         
@@ -98,22 +86,22 @@ def main():
         
         # Check for various tex files
         tex_files = {
-            'title.tex': check_file_exists(chapter_folder, 'title.tex'),
-            'summary.tex': check_file_exists(chapter_folder, 'summary.tex'),
-            'main.tex': check_file_exists(chapter_folder, 'main.tex'),
-            'technical.tex': check_file_exists(chapter_folder, 'technical.tex'),
-            'historical.tex': check_file_exists(chapter_folder, 'historical.tex'),
-            'sidenote.tex': check_file_exists(chapter_folder, 'sidenote.tex'),
-            'topicmap.tex': check_file_exists(chapter_folder, 'topicmap.tex'),
-            'quote.tex': check_file_exists(chapter_folder, 'quote.tex'),
-            'exercises.tex': check_file_exists(chapter_folder, 'exercises.tex'),
-            'joke.tex': check_file_exists(chapter_folder, 'joke.tex')
+            'title.tex': check_file_exists(chapter, 'title.tex'),
+            'summary.tex': check_file_exists(chapter, 'summary.tex'),
+            'main.tex': check_file_exists(chapter, 'main.tex'),
+            'technical.tex': check_file_exists(chapter, 'technical.tex'),
+            'historical.tex': check_file_exists(chapter, 'historical.tex'),
+            'sidenote.tex': check_file_exists(chapter, 'sidenote.tex'),
+            'topicmap.tex': check_file_exists(chapter, 'topicmap.tex'),
+            'quote.tex': check_file_exists(chapter, 'quote.tex'),
+            'exercises.tex': check_file_exists(chapter, 'exercises.tex'),
+            'joke.tex': check_file_exists(chapter, 'joke.tex')
         }
         
         # Check for images
         image_extensions = ['.png', '.jpg', '.jpeg', '.pdf']
         has_images = False
-        for file in os.listdir(chapter_folder):
+        for file in chapter.files:
             if any(file.lower().endswith(ext) for ext in image_extensions):
                 has_images = True
                 break
@@ -2,13 +2,30 @@
 """
 Generate a custom main_ch.tex file with only selected chapters.
 This allows compiling a subset of the book for faster testing.
+
+When a full build exists, each selected chapter keeps the chapter number,
+page numbers and recto/verso parity it has there (read from that build's
+.aux and .toc), so subset pages look exactly like the full book's.
+The subset also embeds that build's resolved labels and TOC lines, so
+references to chapters left out resolve and a single pass is final.
+
+With --changed-since REV the chapters are picked from `git diff REV`: every
+chapter that includes a changed file (directly, through \\input or as an
+image), plus the chapters referencing its labels; a change to the preamble
+or the book file selects all chapters. That subset is then compiled.
 """
 
-import re
 import argparse
+import subprocess
 import sys
 from pathlib import Path
 
+from book_model import load_book
+from build_dirs import resolve_build_dir
+from latex_aux import SNAPSHOT_MARKER, find_aux, load_seeds, load_snapshot
+
+ROOT = Path(__file__).resolve().parents[1]
+
 class ChapterExtractor:
     def __init__(self, main_tex_path='main.tex'):
         self.main_tex_path = Path(main_tex_path)
@@ -17,68 +34,23 @@ class ChapterExtractor:
         self.postamble = []
         
     def parse_main_tex(self):
-        """Parse main.tex to extract chapters and document structure."""
+        """Load the chapters and document structure of main.tex from the cached BookModel."""
         if not self.main_tex_path.exists():
             raise FileNotFoundError(f"Cannot find {self.main_tex_path}")
-            
-        with open(self.main_tex_path, 'r', encoding='utf-8') as f:
-            lines = f.readlines()
-        
-        # Find where chapters start and end
-        chapter_start_idx = None
-        chapter_end_idx = None
-        
-        for i, line in enumerate(lines):
-            # First chapter starts after prologue
-            if chapter_start_idx is None and '\\chapterwithsummaryfromfile' in line and not line.strip().startswith('%'):
-                chapter_start_idx = i
-            # Last chapter before \end{document}
-            if '\\end{document}' in line:
-                chapter_end_idx = i
-                break
-        
-        # Extract sections
-        self.preamble = lines[:chapter_start_idx]
-        self.postamble = lines[chapter_end_idx:]
-        
-        # Extract chapters
-        i = chapter_start_idx
-        while i < chapter_end_idx:
-            line = lines[i]
-            if '\\chapterwithsummaryfromfile' in line and not line.strip().startswith('%'):
-                # Extract chapter info
-                match = re.search(r'\\chapterwithsummaryfromfile\[([^\]]+)\]\{([^\}]+)\}', line)
-                if match:
-                    label = match.group(1)
-                    directory = match.group(2)
-                    
-                    # Get chapter number from directory name
-                    num_match = re.match(r'(\d+)_', directory)
-                    chapter_num = int(num_match.group(1)) if num_match else None
-                    
-                    # Look for the corresponding \inputstory line
-                    inputstory_line = None
-                    comment = ""
-                    if i + 1 < chapter_end_idx:
-                        next_line = lines[i + 1]
-                        if '\\inputstory' in next_line:
-                            inputstory_line = next_line
-                            # Extract comment if present
-                            comment_match = re.search(r'%(.+)$', next_line)
-                            if comment_match:
-                                comment = comment_match.group(1).strip()
-                    
-                    self.chapters.append({
-                        'number': chapter_num,
-                        'label': label,
-                        'directory': directory,
-                        'chapterwithsummary_line': line,
-                        'inputstory_line': inputstory_line,
-                        'comment': comment,
-                        'line_index': i
-                    })
-            i += 1
-        
+
+        model = load_book(self.main_tex_path)
+        self.preamble = list(model.preamble)
+        self.postamble = list(model.postamble)
+        self.chapters = [{
+            'number': entry.number,
+            'label': entry.label,
+            'directory': entry.directory,
+            'chapterwithsummary_line': entry.chapterwithsummary_line,
+            'inputstory_line': entry.inputstory_line,
+            'comment': entry.comment,
+            'line_index': entry.line_index,
+        } for entry in model.entries]
+
         print(f"Found {len(self.chapters)} chapters in {self.main_tex_path}")
         
     def list_chapters(self):
@@ -130,8 +102,14 @@ class ChapterExtractor:
         # Remove duplicates and sort
         return sorted(set(selected))
     
-    def generate_subset_tex(self, chapter_numbers, output_file='main_ch.tex'):
-        """Generate a new tex file with only specified chapters."""
+    def generate_subset_tex(self, chapter_numbers, output_file='main_ch.tex', seeds=None, snapshot=None):
+        """Generate a new tex file with only specified chapters.
+
+        seeds (from latex_aux.load_seeds) gives each chapter the chapter number,
+        page number and recto/verso parity it has in the full build.
+        snapshot (from latex_aux.load_snapshot, plus 'source' and 'stale') holds
+        the labels and TOC lines of that build.
+        """
         
         # Filter chapters
         selected_chapters = [ch for ch in self.chapters 
@@ -144,23 +122,36 @@ class ChapterExtractor:
         # Sort by original order in file
         selected_chapters.sort(key=lambda x: x['line_index'])
         
+        seeds = seeds or {}
         print(f"\nGenerating {output_file} with {len(selected_chapters)} chapters:")
         for ch in selected_chapters:
-            print(f"  - Chapter {ch['number']}: {ch['directory']}")
+            seed = seeds.get(ch['directory'])
+            where = f" (chapter {seed['chapter']}, page {seed['page']})" if seed else ''
+            print(f"  - Chapter {ch['number']}: {ch['directory']}{where}")
         
         # Build output
         output_lines = []
         
-        # Add preamble
-        output_lines.extend(self.preamble)
+        # Add preamble (the snapshot goes right before \begin{document})
+        begin = next((i for i, line in enumerate(self.preamble) if '\\begin{document}' in line
+                      and not line.strip().startswith('%')), len(self.preamble))
+        output_lines.extend(self.preamble[:begin])
+        if snapshot:
+            output_lines.extend(snapshot_macros(snapshot))
+        output_lines.extend(self.preamble[begin:])
         
         # Add comment about this being a subset
         output_lines.append("\n% This is a generated subset of chapters\n")
         output_lines.append(f"% Selected chapters: {', '.join(map(str, sorted(chapter_numbers)))}\n")
         output_lines.append("% Generated by utils/generate_chapter_subset.py\n\n")
+        if seeds:
+            output_lines.extend(seed_macros(seeds, selected_chapters))
         
         # Add selected chapters
         for ch in selected_chapters:
+            seed = seeds.get(ch['directory'])
+            if seed:
+                output_lines.append(f"\\setcounter{{chapter}}{{{seed['chapter'] - 1}}}\n")
             output_lines.append(ch['chapterwithsummary_line'])
             if ch['inputstory_line']:
                 output_lines.append(ch['inputstory_line'])
@@ -175,10 +166,156 @@ class ChapterExtractor:
             f.writelines(output_lines)
         
         print(f"\n✅ Successfully generated {output_file}")
-        print(f"   You can now compile with: python3 utils/compile_realtime.py {output_file}")
+        print(f"   You can now compile with: python3 utils/compile_realtime.py {output_file} --isolated")
         
         return True
 
+def seed_macros(seeds, chapters):
+    """Redefine \\atstoryblock so each chapter block starts with its full-build page number and parity."""
+    lines = [
+        "% Page counters and recto/verso parity of the last full build\n",
+        "\\newcommand{\\subsetseed}[2]{% #1 = page number, #2 = physical page in the full build\n",
+        "  \\ifodd\\numexpr\\ReadonlyShipoutCounter+1-#2\\relax\n",
+        "    \\null\\thispagestyle{empty}\\clearpage\n",
+        "  \\fi\n",
+        "  \\setcounter{page}{#1}}\n",
+        "\\renewcommand{\\atstoryblock}[1]{\\ifcsname subsetseed@#1\\endcsname\\csname subsetseed@#1\\endcsname\\fi}\n",
+    ]
+    for ch in chapters:
+        seed = seeds.get(ch['directory'])
+        if seed:
+            lines.append(f"\\expandafter\\def\\csname subsetseed@{ch['directory']}\\endcsname"
+                         f"{{\\subsetseed{{{seed['page']}}}{{{seed['physical']}}}}}\n")
+    lines.append("\n")
+    return lines
+
+def snapshot_macros(snapshot):
+    """Define every label of the full build and pre-write its TOC lines, once LaTeX has read the subset's .aux.
+
+    Labels the subset's .aux already defines win, and the TOC lines are only
+    written on a first pass (no .aux marker yet), so a second pass, if one
+    is needed, sees the subset's own values.
+    """
+    lines = [
+        f"{SNAPSHOT_MARKER}{snapshot['source']}\n",
+        "\\makeatletter\n",
+        "\\newcommand{\\snapshotlabel}[2]{\\@ifundefined{r@#1}{\\global\\@namedef{r@#1}{#2}}{}}\n",
+        "\\AddToHook{begindocument}{%\n",
+    ]
+    lines.extend(f"  \\snapshotlabel{{{label}}}{{{value}}}%\n" for label, value in snapshot['labels'].items())
+    lines.append("}\n")
+    if snapshot['toc'] is not None:
+        lines.extend([
+            "\\newwrite\\snapshot@toc\n",
+            "\\AddToHook{begindocument}{%\n",
+            "  \\ifdefined\\snapshot@seen\\else\n",
+            "    \\immediate\\write\\@auxout{\\string\\global\\string\\let\\string\\snapshot@seen\\string\\relax}%\n",
+            "    \\immediate\\openout\\snapshot@toc=\\jobname.toc\n",
+        ])
+        lines.extend(f"    \\immediate\\write\\snapshot@toc{{\\detokenize{{{line}}}}}%\n" for line in snapshot['toc'])
+        lines.extend([
+            "    \\immediate\\closeout\\snapshot@toc\n",
+            "  \\fi}\n",
+        ])
+    if snapshot['stale']:
+        stale = ', '.join(snapshot['stale'])
+        lines.append(f"\\AddToHook{{begindocument/end}}{{\\PackageWarningNoLine{{subset}}"
+                     f"{{Snapshot may be stale for: {stale}}}}}\n")
+    lines.extend(["\\makeatother\n", "\n"])
+    return lines
+
+def stale_labels(labels, aux_file, tex_file):
+    """Snapshot labels defined in a source that changed after the build that wrote aux_file."""
+    from dep_index import load_index  # only needed with a snapshot; keeps --list fast
+    built = aux_file.stat().st_mtime_ns
+    index = load_index(tex_file)
+    return sorted({label for entry in index.files.values() if entry['mtime'] > built
+                   for label in entry['labels'] if label in labels})
+
+def changed_files(rev):
+    """Paths (relative to the repository root) that differ between rev and the working tree, untracked files included."""
+    commands = [['git', 'diff', '--name-only', '--relative', '--no-renames', rev, '--'],
+                ['git', 'ls-files', '--others', '--exclude-standard']]
+    paths = set()
+    for cmd in commands:
+        result = subprocess.run(cmd, cwd=ROOT, capture_output=True, text=True)
+        if result.returncode != 0:
+            raise ValueError(result.stderr.strip() or f"{' '.join(cmd)} failed")
+        paths.update(line for line in result.stdout.splitlines() if line)
+    return sorted(paths)
+
+def chapters_changed_since(extractor, rev, input_file='main.tex'):
+    """Chapter numbers a rebuild must cover for the changes since rev (see the module docstring)."""
+    from dep_index import load_index
+    paths = changed_files(rev)
+    print(f"🔍 {len(paths)} files changed since {rev}")
+    if not paths:
+        return []
+    affected = load_index(input_file).affected(paths)
+    numbers = {ch['directory']: ch['number'] for ch in extractor.chapters}
+
+    if affected.everything:
+        print("🌐 The preamble or the book file changed: all chapters are affected")
+    else:
+        if affected.chapters:
+            print(f"📝 Chapters including a changed file: {', '.join(affected.chapters)}")
+        if affected.referencing:
+            print(f"🔗 Chapters referencing their labels: {', '.join(affected.referencing)}")
+        if affected.frontmatter:
+            print(f"📄 Front matter changed (part of every subset): {', '.join(affected.frontmatter)}")
+    selected = [numbers[d] for d in affected.chapters + affected.referencing if numbers.get(d)]
+    if not selected and affected.frontmatter and extractor.chapters:
+        first = min(extractor.chapters, key=lambda ch: ch['line_index'])
+        print(f"   No chapter changed; building {first['directory']} to typeset the front matter")
+        selected = [first['number']]
+    return sorted(set(selected))
+
+def compile_subset(output_file):
+    """Compile the generated subset in build/<stem>/ the way compile_realtime.py --isolated does."""
+    from build_dirs import build_dir_for
+    from compile_realtime import RealTimeCompiler
+    build_dir = build_dir_for(Path(output_file).stem)
+    return RealTimeCompiler(output_file, build_dir).compile_document()
+
+def full_build_context(extractor, chapter_numbers, input_file='main.tex', seed_from=None, seed=True, xref=True):
+    """(seeds, snapshot) of the last full build of input_file (or of seed_from) for generate_subset_tex."""
+    seeds, snapshot = {}, None
+    aux_file = None
+    if seed or xref:
+        jobname = Path(input_file).stem
+        seed_path = Path(seed_from) if seed_from else None
+        if seed_path and seed_path.is_dir():
+            aux_file = find_aux(jobname, resolve_build_dir(seed_path))
+        else:
+            aux_file = seed_path or find_aux(jobname)
+        if not (aux_file and aux_file.exists()):
+            aux_file = None
+    if seed:
+        if aux_file:
+            seeds = load_seeds(aux_file)
+            missing = [ch['directory'] for ch in extractor.chapters
+                       if ch['number'] in chapter_numbers and ch['directory'] not in seeds]
+            print(f"📐 Seeding chapter/page counters from {aux_file}")
+            if missing:
+                print(f"⚠️  Not in that build (numbered from the previous chapter): {', '.join(missing)}")
+        else:
+            print("⚠️  No full build found to seed counters from; chapters and pages restart at 1")
+    if xref and aux_file:
+        directories = [ch['directory'] for ch in extractor.chapters if ch['number'] in chapter_numbers]
+        snapshot = load_snapshot(aux_file, directories)
+        snapshot['source'] = aux_file.as_posix()
+        snapshot['stale'] = stale_labels(snapshot['labels'], aux_file, input_file)
+        print(f"🔗 Embedding {len(snapshot['labels'])} labels from {aux_file}")
+        if snapshot['toc'] is None:
+            print("⚠️  TOC of that build does not match its chapter blocks; the subset needs a second pass")
+        elif not seeds:
+            print("⚠️  Without seeded page numbers the snapshot will not match; the subset needs a second pass")
+        if snapshot['stale']:
+            stale = snapshot['stale']
+            more = f" and {len(stale) - 10} more" if len(stale) > 10 else ''
+            print(f"⚠️  Defined in files changed since that build (may be stale): {', '.join(stale[:10])}{more}")
+    return seeds, snapshot
+
 def main():
     parser = argparse.ArgumentParser(
         description='Generate a LaTeX file with a subset of chapters for faster compilation',
@@ -200,6 +337,15 @@ Examples:
   
   # Custom output file
   python3 utils/generate_chapter_subset.py 1,2,3 -o main_first3.tex
+  
+  # Chapter/page numbers and parity from a specific full build (default: the latest one)
+  python3 utils/generate_chapter_subset.py 29 --seed-from build/main
+  
+  # Without the cross-reference snapshot of that build (two passes, like a standalone file)
+  python3 utils/generate_chapter_subset.py 29 --no-xref
+  
+  # The chapters touched since main (uncommitted work included), generated and compiled
+  python3 utils/generate_chapter_subset.py --changed-since main -o main_changed.tex
         """
     )
     
@@ -211,6 +357,19 @@ Examples:
                       help='Output filename (default: main_ch.tex)')
     parser.add_argument('-i', '--input', default='main.tex',
                       help='Input main.tex file (default: main.tex)')
+    parser.add_argument('--seed-from', metavar='AUX_OR_BUILD_DIR',
+                      help='Full build whose chapter numbers, page numbers and parity the subset reproduces '
+                           '(default: the most recent <input>.aux in build/<input>/ or the current directory)')
+    parser.add_argument('--no-seed', action='store_true',
+                      help='Number chapters and pages from 1 as a standalone document')
+    parser.add_argument('--no-xref', action='store_true',
+                      help='Do not embed the labels and TOC lines of the full build')
+    parser.add_argument('--changed-since', metavar='REV',
+                      help='Add the chapters affected by the changes since this git revision, then compile')
+    parser.add_argument('--compile', action='store_true',
+                      help='Compile the generated file in build/<output stem>/ (default with --changed-since)')
+    parser.add_argument('--no-compile', action='store_true',
+                      help='Only generate the file, also with --changed-since')
     
     args = parser.parse_args()
     
@@ -229,21 +388,39 @@ Examples:
         sys.exit(0)
     
     # Check if chapters specified
-    if not args.chapters:
+    if not args.chapters and not args.changed_since:
         print("❌ Error: No chapters specified!")
         print("   Use --list to see available chapters")
         print("   Use --help for usage examples")
         sys.exit(1)
     
     # Parse chapter specification
-    chapter_numbers = extractor.parse_chapter_spec(args.chapters)
+    chapter_numbers = extractor.parse_chapter_spec(args.chapters) if args.chapters else []
+    
+    if args.changed_since:
+        try:
+            changed = chapters_changed_since(extractor, args.changed_since, args.input)
+        except ValueError as e:
+            print(f"❌ Error: {e}")
+            sys.exit(1)
+        if not changed and not chapter_numbers:
+            print(f"✅ No chapter is affected by the changes since {args.changed_since}")
+            sys.exit(0)
+        chapter_numbers = sorted(set(chapter_numbers) | set(changed))
     
     if not chapter_numbers:
         print("❌ Error: No valid chapters found in specification")
         sys.exit(1)
     
+    # Layout and cross-references of the last full build
+    seeds, snapshot = full_build_context(extractor, chapter_numbers, args.input, args.seed_from,
+                                         seed=not args.no_seed, xref=not args.no_xref)
+    
     # Generate subset file
-    success = extractor.generate_subset_tex(chapter_numbers, args.output)
+    success = extractor.generate_subset_tex(chapter_numbers, args.output, seeds, snapshot)
+    
+    if success and (args.compile or args.changed_since) and not args.no_compile:
+        success = compile_subset(args.output)
     
     sys.exit(0 if success else 1)
 
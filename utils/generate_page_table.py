@@ -4,6 +4,7 @@ Generate detailed CSV table of page structure from compiled PDF.
 Maps each page to chapter, section type, and position within section.
 """
 
+import argparse
 import csv
 import re
 import sys
@@ -12,38 +13,43 @@ from pathlib import Path
 from datetime import datetime
 import subprocess
 
+from build_dirs import artifact_path, resolve_build_dir
+from build_events import EVENTS_EXT, load_page_content
+from latex_aux import load_labels
+from page_history import HISTORY_DB, record_page_table
+from page_forecast import record_features
+from page_fill import page_warnings
+from pdf_pagemap import load_page_map
+
 def parse_aux_file(aux_file):
-    """Parse .aux file to extract page references and structure."""
+    """Parse .aux file to extract page references and structure.
+
+    Returns page -> {'type': 'chapter_start', 'chapter', 'label'} for pages
+    where a ch: label sits, plus 'references' with every other label on the
+    page. Built in one pass from the label index of latex_aux.
+    """
     if not Path(aux_file).exists():
         return {}
     
     page_refs = {}
     
     try:
-        with open(aux_file, 'r', encoding='utf-8', errors='ignore') as f:
-            content = f.read()
-        
-        # Extract chapter labels and page numbers
-        # Format: \newlabel{ch:chaptername}{{number}{page}...}
-        chapter_matches = re.findall(r'\\newlabel\{ch:([^}]+)\}\{\{(\d+)\}\{(\d+)\}', content)
-        for label, chapter_num, page_num in chapter_matches:
-            page_refs[int(page_num)] = {
-                'type': 'chapter_start',
-                'chapter': int(chapter_num),
-                'label': label
-            }
-        
-        # Extract other structural references
-        # Format: \newlabel{...}{{...}{page}...}
-        all_refs = re.findall(r'\\newlabel\{([^}]+)\}\{[^{]*\{(\d+)\}', content)
-        for label, page_num in all_refs:
-            if label not in [f'ch:{ref["label"]}' for ref in page_refs.values() if 'label' in ref]:
-                page_refs[int(page_num)] = page_refs.get(int(page_num), {})
-                page_refs[int(page_num)]['references'] = page_refs[int(page_num)].get('references', [])
-                page_refs[int(page_num)]['references'].append(label)
-    
-    except Exception as e:
+        index = load_labels(Path(aux_file))
+    except OSError as e:
         print(f"⚠️  Could not parse aux file: {e}")
+        return {}
+    
+    for page, labels in index.by_page.items():
+        if not page.isdigit():
+            continue  # Roman-numbered front matter
+        entry = page_refs.setdefault(int(page), {})
+        for label in labels:
+            # Format: \newlabel{ch:chaptername}{{number}{page}...}
+            number = index.labels[label]['number']
+            if label.startswith('ch:') and number.isdigit() and 'type' not in entry:
+                entry.update(type='chapter_start', chapter=int(number), label=label[3:])
+            else:
+                entry.setdefault('references', []).append(label)
     
     return page_refs
 
@@ -182,29 +188,45 @@ def get_pdf_page_count(pdf_file):
     
     return None
 
-def generate_page_table(pdf_file, base_name):
-    """Generate comprehensive page table CSV."""
+def generate_page_table(pdf_file, base_name, build_dir=None, history=True, layout=True):
+    """Generate comprehensive page table CSV (and append it to the page history database)."""
     
     print("📊 GENERATING PAGE STRUCTURE TABLE")
     print("=" * 50)
     
-    # Parse auxiliary files
-    aux_file = f'{base_name}.aux'
-    toc_file = f'{base_name}.toc'
-    log_file = f'{base_name}.log'
+    # Parse auxiliary files (from the build directory for out-of-tree builds)
+    aux_file = artifact_path(base_name, 'aux', build_dir)
+    toc_file = artifact_path(base_name, 'toc', build_dir)
+    log_file = artifact_path(base_name, 'log', build_dir)
+    events_file = artifact_path(base_name, EVENTS_EXT, build_dir)
     
-    print(f"📄 Parsing auxiliary files...")
-    aux_data = parse_aux_file(aux_file)
-    toc_data = parse_toc_file(toc_file)
-    log_data = analyze_log_file(log_file)
+    # Exact page map from the story anchors, outline and page labels of the PDF itself
+    page_map = load_page_map(pdf_file)
+    if page_map and page_map.content:
+        print(f"📄 Reading the page map of {pdf_file}...")
+        aux_data, toc_data = {}, {}
+        log_data = page_map.content
+        log_source = 'PDF'
+    else:
+        print(f"📄 Parsing auxiliary files...")
+        aux_data = parse_aux_file(aux_file)
+        toc_data = parse_toc_file(toc_file)
+        # Exact per-page data from the Lua event stream; the log heuristics are the fallback
+        log_data = load_page_content(events_file)
+        log_source = 'Event'
+        if not log_data:
+            log_data = analyze_log_file(log_file)
+            log_source = 'Log'
     
     print(f"  - Aux references: {len(aux_data)}")
     print(f"  - ToC entries: {len(toc_data)}")
-    print(f"  - Log page mappings: {len(log_data)}")
+    print(f"  - {log_source} page mappings: {len(log_data)}")
     
     # Get total page count
     total_pages = None
-    if pdf_file:
+    if page_map:
+        total_pages = page_map.pages
+    elif pdf_file:
         total_pages = get_pdf_page_count(pdf_file)
     
     if total_pages:
@@ -278,7 +300,7 @@ def generate_page_table(pdf_file, base_name):
         page_in_chapter = page_num - chapter_start_page + 1
         page_in_section = page_num - section_start_page + 1
         
-        # Check for layout warnings (from page flow analysis)
+        # Layout warnings are filled in from the PDF below
         has_warning = False
         warning_type = ""
         
@@ -293,8 +315,16 @@ def generate_page_table(pdf_file, base_name):
             'warning_type': warning_type
         })
     
-    # Save to CSV
-    csv_file = f'{base_name}_page_structure.csv'
+    # Underfull, overflowing, widowed and orphaned pages from the PDF's page geometry
+    if layout and pdf_file:
+        warnings = page_warnings(pdf_file, [row['section'] for row in page_table])
+        if warnings is not None and len(warnings) == len(page_table):
+            for row, warning in zip(page_table, warnings):
+                row['has_warning'] = bool(warning)
+                row['warning_type'] = warning
+
+    # Save to CSV (next to the aux files)
+    csv_file = str(artifact_path(f'{base_name}_page_structure', 'csv', build_dir))
     
     try:
         with open(csv_file, 'w', newline='', encoding='utf-8') as f:
@@ -306,6 +336,14 @@ def generate_page_table(pdf_file, base_name):
         
         print(f"✅ Page structure table saved: {csv_file}")
         
+        if history:
+            try:
+                build_id = record_page_table(base_name, build_dir, page_table)
+                record_features(build_id)  # Training data for page_forecast.py
+                print(f"🗃️  Recorded as build {build_id} in {HISTORY_DB.name}")
+            except Exception as e:
+                print(f"⚠️  Could not record page history: {e}")
+        
         # Show summary statistics
         sections = {}
         for row in page_table:
@@ -318,7 +356,11 @@ def generate_page_table(pdf_file, base_name):
         
         warnings = sum(1 for row in page_table if row['has_warning'])
         if warnings:
-            print(f"\n⚠️  Pages with warnings: {warnings}")
+            kinds = {}
+            for row in page_table:
+                for kind in filter(None, row['warning_type'].split('+')):
+                    kinds[kind] = kinds.get(kind, 0) + 1
+            print(f"\n⚠️  Pages with warnings: {warnings} ({', '.join(f'{n} {k}' for k, n in kinds.items())})")
         
         return csv_file
         
@@ -327,19 +369,30 @@ def generate_page_table(pdf_file, base_name):
         return None
 
 def main():
-    if len(sys.argv) < 2:
-        print("Usage: python generate_page_table.py <base_name_or_pdf_file> [base_name]")
-        print("Examples:")
-        print("  python generate_page_table.py main.pdf main")
-        print("  python generate_page_table.py main  # Uses aux/log files only")
-        sys.exit(1)
+    parser = argparse.ArgumentParser(
+        description='Generate a CSV table mapping every page to its chapter and section',
+        formatter_class=argparse.RawDescriptionHelpFormatter,
+        epilog="""
+Examples:
+  python generate_page_table.py main.pdf main
+  python generate_page_table.py main  # Uses aux/log files only
+  python generate_page_table.py main --build-dir build/main
+        """
+    )
+    parser.add_argument('input', help='PDF file or base name')
+    parser.add_argument('base_name', nargs='?', help='Base name of the aux/toc/log files (default: PDF stem)')
+    parser.add_argument('--build-dir', help='Read aux/toc/log/pdf files from this build directory')
+    parser.add_argument('--no-history', action='store_true', help='Do not append the table to build/page_history.sqlite')
+    parser.add_argument('--no-layout', action='store_true', help='Skip the page fill analysis (has_warning/warning_type stay empty)')
+    args = parser.parse_args()
     
-    input_arg = sys.argv[1]
+    input_arg = args.input
+    build_dir = resolve_build_dir(args.build_dir)
     
     # Determine if input is PDF file or base name
     if input_arg.endswith('.pdf'):
         pdf_file = input_arg
-        base_name = sys.argv[2] if len(sys.argv) > 2 else Path(pdf_file).stem
+        base_name = args.base_name or Path(pdf_file).stem
         
         if not Path(pdf_file).exists():
             print(f"⚠️  PDF file not found: {pdf_file}")
@@ -348,14 +401,15 @@ def main():
     else:
         # Input is base name
         base_name = input_arg
-        pdf_file = f'{base_name}.pdf'
+        pdf_file = str(artifact_path(base_name, 'pdf', build_dir))
         
         if not Path(pdf_file).exists():
             print(f"⚠️  PDF file not found: {pdf_file}")
             print(f"   Will analyze using auxiliary files only...")
             pdf_file = None
     
-    csv_file = generate_page_table(pdf_file, base_name)
+    csv_file = generate_page_table(pdf_file, base_name, build_dir, history=not args.no_history,
+                                   layout=not args.no_layout)
     
     if csv_file:
         print(f"\n🎯 SUCCESS: Detailed page structure saved to {csv_file}")
@@ -0,0 +1,323 @@
+#!/usr/bin/env python3
+"""
+Readers for the .aux and .toc files of a finished build.
+
+- page bookkeeping written by preamble.tex (\\storypage, \\storystyle, \\storytree)
+- chapter entries of the table of contents (\\contentsline {chapter}...)
+- the chapter counter and page number each chapter block starts with, used
+  to seed subset builds so they paginate like the full book
+- the resolved labels (\\newlabel) and TOC lines a subset build embeds as a
+  cross-reference snapshot, so it resolves in a single pass
+- an index of every \\newlabel (label -> number/page/title/anchor, page ->
+  labels), built in one regex scan per .aux, following \\@input'ed .aux files
+
+Usage:
+  python3 utils/latex_aux.py build/main/main.aux      # chapter seeds of a build
+  python3 utils/latex_aux.py build/main/main.aux --labels
+"""
+
+import argparse
+import json
+import re
+import sys
+from pathlib import Path
+from typing import Dict, Iterator, List, Optional, Tuple
+
+from build_dirs import BUILD_ROOT, resolve_build_dir
+
+ROOT = Path(__file__).resolve().parents[1]
+
+STORYPAGE_RE = re.compile(r'\\storypage\{([^}]+)\}\{(block|toc)\}\{(\d+)\}')
+STORYSTYLE_RE = re.compile(r'\\storystyle\{(\d+)\}\{(head|foot)\}')
+STORYTREE_RE = re.compile(r'\\storytree\{(\d+)\}\{(\d+)\}\{(-?\d+)\}\{(-?\d+)\}')
+CONTENTSLINE_RE = re.compile(r'\\contentsline\s*\{(\w+)\}')
+NUMBERLINE_RE = re.compile(r'\\numberline\s*\{([^}]*)\}')
+# Braces and escaped characters: all brace matching needs to look at
+BRACE_TOKEN_RE = re.compile(r'\\.|[{}]', re.DOTALL)
+# \newlabel{label}{{number}{page}} (LaTeX) or {{number}{page}{title}{anchor}{extra}} (hyperref)
+LABEL_FIELDS = ('number', 'page', 'title', 'anchor', 'extra')
+_FLAT = r'([^{}\\\n]*(?:\\.[^{}\\\n]*)*)'
+# Tokens of an .aux, in one scan: a one-line \newlabel with flat fields, any other \newlabel
+# (read with brace_groups from there), and \@input of the .aux of an \include'd file
+AUX_TOKEN_RE = re.compile(
+    r'^\\newlabel\{%s\}\{(\{%s\}\{%s\}(?:\{%s\}\{%s\}\{%s\})?)\}[ \t]*$' % ((_FLAT,) * 6)
+    + r'|^\\newlabel(?=\{)'
+    + r'|^\\@input\{([^}]+)\}',
+    re.MULTILINE)
+SNAPSHOT_TOC_RE = re.compile(r'\\immediate\\write\\snapshot@toc\{\\detokenize\{(.*)\}\}%?$', re.MULTILINE)
+# Warnings that ask for another pass (hyperref's outline notice is left out: bookmarks may lag one build)
+RERUN_RE = re.compile(r'Rerun to get (?!outlines)|Label\(s\) may have changed|There were undefined references')
+
+SNAPSHOT_MARKER = '% Cross-reference snapshot of '
+
+
+def parse_layout(aux_text: str) -> dict:
+    """Read the page bookkeeping that preamble.tex writes to the .aux (page numbers are physical, 1-based)."""
+    layout = {'blocks': {}, 'toc': {}, 'styles': {}, 'trees': {}}
+    for directory, kind, shipped in STORYPAGE_RE.findall(aux_text):
+        key = 'blocks' if kind == 'block' else 'toc'
+        layout[key][directory] = int(shipped) + 1
+    for page, style in STORYSTYLE_RE.findall(aux_text):
+        layout['styles'][page] = style
+    for page, chapter, x, y in STORYTREE_RE.findall(aux_text):
+        layout['trees'][page] = [int(chapter), int(x), int(y)]
+    return layout
+
+
+def brace_groups(text: str, pos: int, count: int) -> Tuple[List[str], int]:
+    """Read up to count balanced {...} groups starting at pos (whitespace between them is skipped)."""
+    groups = []
+    while len(groups) < count:
+        while pos < len(text) and text[pos] in ' \t\r\n':
+            pos += 1
+        if pos >= len(text) or text[pos] != '{':
+            break
+        depth, start, end = 0, pos, len(text)
+        for token in BRACE_TOKEN_RE.finditer(text, pos):
+            if token.group() == '{':
+                depth += 1
+            elif token.group() == '}':
+                depth -= 1
+                if depth == 0:
+                    end = token.start()
+                    break
+        groups.append(text[start + 1:end])
+        pos = end + 1
+    return groups, pos
+
+
+def toc_entries(toc_text: str, level: str = 'chapter') -> List[dict]:
+    """Entries of one level of a .toc: {number, text, page, anchor}, in order."""
+    entries = []
+    for match in CONTENTSLINE_RE.finditer(toc_text):
+        if match.group(1) != level:
+            continue
+        groups, _ = brace_groups(toc_text, match.end(), 3)
+        if len(groups) < 2:
+            continue
+        number = NUMBERLINE_RE.search(groups[0])
+        entries.append({
+            'number': number.group(1) if number else None,
+            'text': groups[0],
+            'page': groups[1],
+            'anchor': groups[2] if len(groups) > 2 else None,
+        })
+    return entries
+
+
+def chapter_seeds(aux_text: str, toc_text: str) -> Dict[str, dict]:
+    """Chapter directory -> {chapter, page, physical} at the start of its block in the full build.
+
+    The k-th numbered chapter entry of the TOC belongs to the k-th chapter
+    block (\\inputstory adds exactly one). The page number of the block's
+    first page follows from the TOC entry's page number and the physical
+    pages between the block start and the TOC mark.
+    """
+    layout = parse_layout(aux_text)
+    numbered = [e for e in toc_entries(toc_text) if e['number'] and e['number'].isdigit()]
+    marks = list(layout['toc'].items())
+    if len(numbered) != len(marks):
+        return {}
+
+    seeds = {}
+    for entry, (directory, toc_physical) in zip(numbered, marks):
+        block = layout['blocks'].get(directory)
+        if block is None or not entry['page'].strip().isdigit():
+            continue
+        seeds[directory] = {
+            'chapter': int(entry['number']),
+            'page': int(entry['page']) - (toc_physical - block),
+            'physical': block,
+        }
+    return seeds
+
+
+def iter_aux(text: str) -> Iterator[Tuple[str, str, object]]:
+    """One pass over .aux text, in order.
+
+    Yields ('label', label, (raw value, [number, page, title, anchor, extra]))
+    for each \\newlabel and ('input', file, None) for each \\@input.
+    """
+    for match in AUX_TOKEN_RE.finditer(text):
+        if match.group(1) is not None:
+            fields = [g or '' for g in match.group(3, 4, 5, 6, 7)]
+            yield 'label', match.group(1), (match.group(2), fields)
+        elif match.group(8) is not None:
+            yield 'input', match.group(8), None
+        else:
+            groups, end = brace_groups(text, match.end(), 2)
+            if len(groups) == 2 and end <= len(text):
+                fields, _ = brace_groups(groups[1], 0, len(LABEL_FIELDS))
+                yield 'label', groups[0], (groups[1], fields + [''] * (len(LABEL_FIELDS) - len(fields)))
+
+
+def newlabels(aux_text: str) -> Dict[str, str]:
+    """Label -> the raw value of its \\newlabel ({number}{page}{title}{anchor}{} with hyperref)."""
+    return {name: data[0] for kind, name, data in iter_aux(aux_text) if kind == 'label'}
+
+
+class LabelIndex:
+    """The \\newlabel entries of a build, indexed both ways.
+
+    labels: label -> {number, page, title, anchor, extra} (missing fields are '')
+    by_page: page as typeset (e.g. '12' or 'vii') -> labels on it, in .aux order
+    """
+
+    def __init__(self) -> None:
+        self.labels: Dict[str, Dict[str, str]] = {}
+        self.by_page: Dict[str, List[str]] = {}
+
+    def add(self, label: str, fields: List[str]) -> None:
+        entry = dict(zip(LABEL_FIELDS, fields))
+        previous = self.labels.get(label)
+        if previous is not None:
+            self.by_page[previous['page']].remove(label)  # Multiply defined: the last definition wins, as in LaTeX
+        self.labels[label] = entry
+        self.by_page.setdefault(entry['page'], []).append(label)
+
+    def read(self, aux_file: Path, seen: Optional[set] = None) -> 'LabelIndex':
+        """Add the labels of an .aux and of the .aux files it \\@input's (\\include'd files)."""
+        aux_file = Path(aux_file)
+        seen = seen if seen is not None else set()
+        if aux_file.resolve() in seen:
+            return self
+        seen.add(aux_file.resolve())
+        text = aux_file.read_text(encoding='utf-8', errors='ignore')
+        for kind, name, data in iter_aux(text):
+            if kind == 'label':
+                self.add(name, data[1])
+            elif (aux_file.parent / name).exists():
+                self.read(aux_file.parent / name, seen)
+        return self
+
+    def page(self, label: str) -> Optional[str]:
+        entry = self.labels.get(label)
+        return entry['page'] if entry else None
+
+    def on_page(self, page) -> List[str]:
+        return self.by_page.get(str(page), [])
+
+
+def load_labels(aux_file: Path) -> LabelIndex:
+    return LabelIndex().read(aux_file)
+
+
+def toc_line(line: str) -> str:
+    """A .toc line without its trailing % and with whitespace collapsed, for comparisons."""
+    return ' '.join(line.strip().removesuffix('%').split())
+
+
+def toc_snapshot(aux_text: str, toc_text: str, directories) -> Optional[List[str]]:
+    """The .toc lines a subset of the given chapter directories would write, or None if they cannot be matched.
+
+    Unnumbered chapter entries (Introduction, Prologue) are kept; a numbered
+    chapter entry and the entries below it are kept if its block (matched in
+    order, as in chapter_seeds) is one of the directories.
+    """
+    marks = list(parse_layout(aux_text)['toc'])
+    lines, keep, numbered = [], True, 0
+    for raw in toc_text.splitlines():
+        match = CONTENTSLINE_RE.match(raw.strip())
+        if not match:
+            continue
+        if match.group(1) == 'chapter':
+            number = NUMBERLINE_RE.search(raw)
+            if number and number.group(1).isdigit():
+                if numbered >= len(marks):
+                    return None
+                keep = marks[numbered] in directories
+                numbered += 1
+            else:
+                keep = True
+        if keep:
+            lines.append(toc_line(raw))
+    return lines if numbered == len(marks) else None
+
+
+def load_snapshot(aux_file: Path, directories) -> dict:
+    """{labels, toc} of a build for a subset of its chapter directories (toc is None without a usable .toc)."""
+    aux_text = aux_file.read_text(encoding='utf-8', errors='ignore')
+    toc_file = aux_file.with_suffix('.toc')
+    toc_text = toc_file.read_text(encoding='utf-8', errors='ignore') if toc_file.exists() else ''
+    return {
+        'labels': newlabels(aux_text),
+        'toc': toc_snapshot(aux_text, toc_text, set(directories)) if toc_text else None,
+    }
+
+
+def single_pass_ok(tex_file, toc_file, log_file) -> bool:
+    """True if one pass of a file with a cross-reference snapshot is final.
+
+    That is the case when LaTeX asked for no rerun (no label changed and
+    none is undefined) and the TOC the pass wrote is the snapshot it read.
+    """
+    try:
+        tex_text = Path(tex_file).read_text(encoding='utf-8', errors='ignore')
+        if SNAPSHOT_MARKER not in tex_text:
+            return False
+        log_text = Path(log_file).read_text(encoding='utf-8', errors='ignore')
+        toc_text = Path(toc_file).read_text(encoding='utf-8', errors='ignore')
+    except OSError:
+        return False
+    if RERUN_RE.search(log_text):
+        return False
+    written = [toc_line(line) for line in toc_text.splitlines() if CONTENTSLINE_RE.match(line.strip())]
+    return written == [toc_line(line) for line in SNAPSHOT_TOC_RE.findall(tex_text)]
+
+
+def find_aux(jobname: str = 'main', build_dir: Optional[Path] = None) -> Optional[Path]:
+    """The most recent <jobname>.aux: of build_dir if given, else of build/<jobname>/ or the repository root."""
+    if build_dir:
+        candidates = [Path(build_dir) / f'{jobname}.aux']
+    else:
+        isolated = resolve_build_dir(BUILD_ROOT / jobname) if (BUILD_ROOT / jobname).exists() else None
+        candidates = [p for p in (isolated / f'{jobname}.aux' if isolated else None, ROOT / f'{jobname}.aux') if p]
+    existing = [p for p in candidates if p.exists()]
+    return max(existing, key=lambda p: p.stat().st_mtime) if existing else None
+
+
+def load_seeds(aux_file: Path) -> Dict[str, dict]:
+    """chapter_seeds() of a build, reading the .toc next to the .aux (or the toc lines inside the .aux)."""
+    aux_text = aux_file.read_text(encoding='utf-8', errors='ignore')
+    toc_file = aux_file.with_suffix('.toc')
+    toc_text = toc_file.read_text(encoding='utf-8', errors='ignore') if toc_file.exists() else aux_text
+    return chapter_seeds(aux_text, toc_text)
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description='Show the chapter seeds (counter, page) of a finished build')
+    parser.add_argument('aux_file', nargs='?', help='.aux of a full build (default: the most recent main.aux)')
+    parser.add_argument('--json', action='store_true', help='Print the seeds as JSON')
+    parser.add_argument('--labels', action='store_true', help='Print the label index instead (label, number, page)')
+    args = parser.parse_args()
+
+    aux_file = Path(args.aux_file) if args.aux_file else find_aux()
+    if not aux_file or not aux_file.exists():
+        print("❌ No .aux found - build the book first")
+        sys.exit(1)
+
+    if args.labels:
+        index = load_labels(aux_file)
+        if args.json:
+            print(json.dumps(index.labels, indent=2))
+            return
+        print(f"🏷️  {aux_file}: {len(index.labels)} labels on {len(index.by_page)} pages")
+        for label, entry in index.labels.items():
+            print(f"  {label:<40} {entry['number']:>8} {entry['page']:>6}")
+        return
+
+    seeds = load_seeds(aux_file)
+    if args.json:
+        print(json.dumps(seeds, indent=2))
+        return
+    if not seeds:
+        print(f"⚠️  No chapter blocks in {aux_file} (built before the page bookkeeping existed?)")
+        return
+    print(f"📄 {aux_file}: {len(seeds)} chapter blocks")
+    print(f"\n{'Ch':>3} {'Directory':<35} {'Page':>5} {'Physical':>9}")
+    for directory, seed in seeds.items():
+        print(f"{seed['chapter']:3d} {directory[:35]:<35} {seed['page']:5d} {seed['physical']:9d}")
+
+
+if __name__ == '__main__':
+    main()
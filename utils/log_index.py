@@ -0,0 +1,361 @@
+#!/usr/bin/env python3
+"""
+Per-chapter index of the warnings in a LaTeX build log.
+
+The log is read as a stream, one line at a time. TeX's 79-column wrapping is
+undone, and the stack of open files is followed through the log's
+parentheses, so that every message can be attributed to the chapter directory
+and source file it was raised in. These messages are indexed:
+
+  overfull_hbox / overfull_vbox     with the overflow in pt
+  underfull_hbox / underfull_vbox   with the badness
+  font_substitution                 font shape or size substituted
+  missing_character                 glyph not in the font (dropped from the PDF)
+  undefined_reference               \\ref or \\cite to an undefined label
+  error                             '!' errors of a nonstopmode run
+
+Each gets a severity (error, high, medium, low), the source line and the page
+it was raised on. The index is stored in build/page_history.sqlite, next to
+the build's page table (see page_history.py), with a chapter_warnings view
+that holds one row per chapter:
+
+  sqlite3 build/page_history.sqlite "SELECT * FROM chapter_warnings
+      WHERE build = (SELECT MAX(id) FROM builds) ORDER BY worst, total DESC"
+
+compile.sh prints the --summary after every build.
+
+Usage:
+  python3 utils/log_index.py                          # main.log: warnings per chapter
+  python3 utils/log_index.py build/main/main.log --summary
+  python3 utils/log_index.py --chapter 27             # every warning of chapter 27, with file:line
+  python3 utils/log_index.py --kind overfull_hbox --min-severity medium
+"""
+
+import argparse
+import json
+import re
+import sys
+from pathlib import Path
+from typing import Dict, Iterable, Iterator, List, Optional
+
+from book_model import CHAPTER_DIR_RE
+from build_dirs import artifact_path, resolve_build_dir
+from page_history import HISTORY_DB, connect, record_build
+
+ROOT = Path(__file__).resolve().parents[1]
+MAX_PRINT_LINE = 79  # texmf.cnf max_print_line: longer lines are wrapped in the log
+
+KINDS = ('error', 'overfull_hbox', 'overfull_vbox', 'underfull_hbox', 'underfull_vbox',
+         'font_substitution', 'missing_character', 'undefined_reference')
+SEVERITIES = ('error', 'high', 'medium', 'low')
+OVERFULL_HIGH_PT = 10.0
+OVERFULL_MEDIUM_PT = 1.0
+
+TOKEN_RE = re.compile(
+    r'\((?P<file>[^\s()"]+\.(?:tex|sty|cls|cfg|def|fd|clo|ldf|lua|aux|toc|out|lof|lot|bbl|ind|dict))'
+    r'|(?P<open>\()|(?P<close>\))|\[(?P<page>\d+)(?=[\]\s{<]|$)')
+BOX_RE = re.compile(r'^(Overfull|Underfull) \\([hv])box \((?:([\d.]+)pt too \w+|badness (\d+))\)'
+                    r'(?:.*? at lines? (\d+))?')
+WARNING_START_RE = re.compile(r'^(?:LaTeX|Package|Class) (?:(\S+) )?(?:Font )?Warning: ')
+CONTINUATION_RE = re.compile(r'^\([\w.@-]+\)\s+')
+INPUT_LINE_RE = re.compile(r'on input line (\d+)')
+MISSING_RE = re.compile(r'^Missing character: There is no (.+?) in font (.+?)!')
+ERROR_LINE_RE = re.compile(r'^l\.(\d+)')
+
+
+def logical_lines(lines: Iterable[str], width: int = MAX_PRINT_LINE) -> Iterator[str]:
+    """Lines of a log with TeX's hard wrapping at `width` columns undone."""
+    pending = ''
+    for raw in lines:
+        line = raw.rstrip('\r\n')
+        if len(line) == width or len(line.encode('utf-8', 'ignore')) == width:
+            pending += line
+            continue
+        yield pending + line
+        pending = ''
+    if pending:
+        yield pending
+
+
+def source_of(stack: List[Optional[str]]) -> Dict[str, Optional[str]]:
+    """Innermost open source file, and the chapter directory enclosing it."""
+    files = [f for f in stack if f and f.endswith('.tex')]
+    directory = None
+    for name in reversed(files):
+        top = Path(name).parts[0] if Path(name).parts else ''
+        if CHAPTER_DIR_RE.match(top) and (ROOT / top).is_dir():
+            directory = top
+            break
+    return {'directory': directory, 'file': files[-1] if files else None}
+
+
+def normalize(name: str) -> str:
+    """Log file name relative to the repository when it is inside it."""
+    path = Path(name)
+    if path.is_absolute():
+        try:
+            return str(path.resolve().relative_to(ROOT))
+        except ValueError:
+            return name
+    return str(Path(*[p for p in path.parts if p != '.'])) if path.parts else name
+
+
+def box_severity(kind: str, amount: Optional[float], badness: Optional[int]) -> str:
+    if kind.startswith('overfull'):
+        return 'high' if amount >= OVERFULL_HIGH_PT else ('medium' if amount >= OVERFULL_MEDIUM_PT else 'low')
+    return 'medium' if badness is not None and badness >= 10000 else 'low'
+
+
+def classify_warning(text: str) -> Optional[Dict]:
+    """Kind and severity of a (joined) LaTeX/Package warning, or None if it is not indexed."""
+    if 'Font shape' in text and ('undefined' in text or 'not available' in text):
+        return {'kind': 'font_substitution', 'severity': 'low' if 'size' in text and 'substituted' in text else 'medium'}
+    if re.search(r"(?:Reference|Citation) `[^']*' on page \d+\s*undefined", text):
+        return {'kind': 'undefined_reference', 'severity': 'high'}
+    return None
+
+
+def finish_warning(pending: Dict) -> Optional[Dict]:
+    """A collected warning with its kind, severity and input line, or None if it is not indexed."""
+    found = classify_warning(pending['message'])
+    if not found:
+        return None
+    match = INPUT_LINE_RE.search(pending['message'])
+    return {**pending, **found, 'line': int(match.group(1)) if match else None}
+
+
+def index_log(lines: Iterable[str], width: int = MAX_PRINT_LINE) -> Iterator[Dict]:
+    """Stream the indexed messages of a log: kind, severity, directory, file, line, page, badness, amount, message."""
+    stack: List[Optional[str]] = []
+    page = 1  # Page being built: one past the last shipped out
+    pending: Optional[Dict] = None  # A multi-line warning still collecting continuation lines
+    box: Optional[Dict] = None      # A box warning; its box listing follows up to an empty line
+    error: Optional[Dict] = None    # An error waiting for its l.<N> context line
+
+    def entry(kind: str, severity: str, message: str, line: Optional[int] = None,
+              badness: Optional[int] = None, amount: Optional[float] = None) -> Dict:
+        return {'kind': kind, 'severity': severity, **source_of(stack), 'line': line, 'page': page,
+                'badness': badness, 'amount': amount, 'message': message.strip()}
+
+    for text in logical_lines(lines, width):
+        if box is not None:
+            if text.strip():
+                box.setdefault('context', text.strip()[:120])
+                continue
+            yield box
+            box = None
+            continue
+
+        if pending is not None:
+            if CONTINUATION_RE.match(text):
+                pending['message'] += ' ' + CONTINUATION_RE.sub('', text)
+                continue
+            warning = finish_warning(pending)
+            if warning:
+                yield warning
+            pending = None
+
+        if error is not None:
+            match = ERROR_LINE_RE.match(text)
+            if match:
+                error['line'] = int(match.group(1))
+                error['context'] = text[match.end():].strip()[:120]
+                yield error
+                error = None
+                continue
+
+        match = BOX_RE.match(text)
+        if match:
+            kind = f"{match.group(1).lower()}_{match.group(2)}box"
+            amount = float(match.group(3)) if match.group(3) else None
+            badness = int(match.group(4)) if match.group(4) else None
+            box = entry(kind, box_severity(kind, amount, badness), text,
+                        int(match.group(5)) if match.group(5) else None, badness, amount)
+        elif text.startswith('! '):
+            if error is not None:
+                yield error
+            error = entry('error', 'error', text[2:])
+        elif WARNING_START_RE.match(text):
+            pending = entry('', '', text)
+        else:
+            match = MISSING_RE.match(text)
+            if match:
+                yield entry('missing_character', 'high', text)
+
+        # Follow open files and shipped pages through the rest of the line
+        for token in TOKEN_RE.finditer(text):
+            if token.group('file'):
+                stack.append(normalize(token.group('file')))
+            elif token.group('open'):
+                stack.append(None)
+            elif token.group('close'):
+                if stack:
+                    stack.pop()
+            else:
+                page = int(token.group('page')) + 1
+
+    for leftover in (box, error, pending and finish_warning(pending)):
+        if leftover:
+            yield leftover
+
+
+# --- storage -----------------------------------------------------------------
+
+LOG_SCHEMA = """
+CREATE TABLE IF NOT EXISTS log_warnings (
+    build INTEGER NOT NULL REFERENCES builds (id) ON DELETE CASCADE,
+    seq INTEGER NOT NULL,
+    directory TEXT,
+    file TEXT,
+    line INTEGER,
+    page INTEGER,
+    kind TEXT NOT NULL,
+    severity TEXT NOT NULL,
+    badness INTEGER,
+    amount REAL,
+    message TEXT,
+    context TEXT,
+    PRIMARY KEY (build, seq)
+) WITHOUT ROWID;
+CREATE INDEX IF NOT EXISTS log_warnings_by_directory ON log_warnings (directory, build);
+CREATE VIEW IF NOT EXISTS chapter_warnings AS
+    SELECT build, directory, COUNT(*) AS total,
+           MIN(CASE severity WHEN 'error' THEN 0 WHEN 'high' THEN 1 WHEN 'medium' THEN 2 ELSE 3 END) AS worst,
+           SUM(kind = 'error') AS errors,
+           SUM(kind LIKE 'overfull%') AS overfull,
+           SUM(kind LIKE 'underfull%') AS underfull,
+           SUM(kind = 'font_substitution') AS fonts,
+           SUM(kind = 'missing_character') AS missing,
+           SUM(kind = 'undefined_reference') AS refs,
+           MAX(amount) AS max_overfull_pt,
+           MAX(badness) AS max_badness
+    FROM log_warnings GROUP BY build, directory;
+"""
+
+
+def record_warnings(base_name: str, build_dir: Optional[Path], entries: List[Dict],
+                    db_file: Path = HISTORY_DB) -> str:
+    """Store the indexed warnings of a build (replacing earlier ones); returns its build ID."""
+    with connect(db_file) as conn:
+        conn.executescript(LOG_SCHEMA)
+        build, build_id = record_build(conn, base_name, build_dir)
+        conn.execute('DELETE FROM log_warnings WHERE build = ?', (build,))
+        conn.executemany(
+            'INSERT INTO log_warnings (build, seq, directory, file, line, page, kind, severity, badness, amount, '
+            'message, context) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)',
+            [(build, seq, e['directory'], e['file'], e['line'], e['page'], e['kind'], e['severity'],
+              e['badness'], e['amount'], e['message'], e.get('context')) for seq, e in enumerate(entries)])
+    return build_id
+
+
+# --- reports -----------------------------------------------------------------
+
+def chapter_table(entries: List[Dict]) -> List[Dict]:
+    """One row per chapter directory (None for front matter and the preamble), worst first."""
+    rows: Dict[Optional[str], Dict] = {}
+    for e in entries:
+        row = rows.setdefault(e['directory'], {'directory': e['directory'], 'total': 0, 'worst': len(SEVERITIES),
+                                               **{kind: 0 for kind in KINDS},
+                                               'max_overfull_pt': 0.0, 'max_badness': 0})
+        row['total'] += 1
+        row[e['kind']] += 1
+        row['worst'] = min(row['worst'], SEVERITIES.index(e['severity']))
+        row['max_overfull_pt'] = max(row['max_overfull_pt'], e['amount'] or 0.0)
+        row['max_badness'] = max(row['max_badness'], e['badness'] or 0)
+    return sorted(rows.values(), key=lambda r: (r['worst'], -r['total'], r['directory'] or ''))
+
+
+def print_chapters(rows: List[Dict], limit: Optional[int] = None) -> None:
+    print(f"{'Chapter':<32} {'worst':<6} {'err':>4} {'over':>5} {'under':>5} {'font':>5} {'miss':>5} {'ref':>4}"
+          f" {'max pt':>7} {'badness':>7}")
+    for r in rows[:limit]:
+        print(f"{(r['directory'] or '(front matter)')[:32]:<32} {SEVERITIES[r['worst']]:<6} {r['error']:4d} "
+              f"{r['overfull_hbox'] + r['overfull_vbox']:5d} {r['underfull_hbox'] + r['underfull_vbox']:5d} "
+              f"{r['font_substitution']:5d} {r['missing_character']:5d} {r['undefined_reference']:4d} "
+              f"{r['max_overfull_pt']:7.1f} {r['max_badness']:7d}")
+
+
+def print_entries(entries: List[Dict]) -> None:
+    for e in entries:
+        where = f"{e['file'] or '?'}:{e['line'] or '?'}"
+        measure = (f"{e['amount']:.1f}pt" if e['amount'] is not None
+                   else f"badness {e['badness']}" if e['badness'] is not None else '')
+        print(f"  {where:<40} p.{e['page']:<4} {e['severity']:<6} {e['kind']:<19} {measure:<14} "
+              f"{e.get('context') or e['message'][:60]}")
+
+
+def matches_chapter(entry: Dict, chapter: str) -> bool:
+    directory = entry['directory'] or ''
+    if chapter.isdigit():
+        match = CHAPTER_DIR_RE.match(directory)
+        return bool(match) and int(match.group(1)) == int(chapter)
+    return directory == chapter.rstrip('/')
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(
+        description='Index the warnings of a LaTeX log by chapter, source line and severity',
+        formatter_class=argparse.RawDescriptionHelpFormatter,
+        epilog=f"""
+Kinds: {', '.join(KINDS)}
+Severities: {', '.join(SEVERITIES)} (overfull >= {OVERFULL_HIGH_PT:g}pt is high, >= {OVERFULL_MEDIUM_PT:g}pt medium)
+
+Examples:
+  python3 utils/log_index.py
+  python3 utils/log_index.py build/main/main.log --summary
+  python3 utils/log_index.py --chapter 05_CircleWheel
+  python3 utils/log_index.py --kind undefined_reference --json
+        """
+    )
+    parser.add_argument('log_file', nargs='?', help='LaTeX log (default: main.log, or in --build-dir)')
+    parser.add_argument('--build-dir', help='Read main.log from this build directory')
+    parser.add_argument('--chapter', help='List the warnings of one chapter (directory or number)')
+    parser.add_argument('--kind', choices=KINDS, help='Only warnings of this kind')
+    parser.add_argument('--min-severity', choices=SEVERITIES, default='low', help='Only warnings at least this severe')
+    parser.add_argument('--summary', action='store_true', help='Counts and the ten worst chapters only')
+    parser.add_argument('--json', action='store_true', help='Print the indexed warnings as JSON')
+    parser.add_argument('--width', type=int, default=MAX_PRINT_LINE, help=f'Log line width (default: {MAX_PRINT_LINE})')
+    parser.add_argument('--no-history', action='store_true', help='Do not store the index in build/page_history.sqlite')
+    args = parser.parse_args()
+
+    build_dir = resolve_build_dir(args.build_dir)
+    log_file = Path(args.log_file) if args.log_file else artifact_path('main', 'log', build_dir)
+    if not log_file.exists():
+        print(f"❌ Log file not found: {log_file}")
+        sys.exit(1)
+
+    with open(log_file, 'r', encoding='utf-8', errors='replace') as f:
+        entries = list(index_log(f, args.width))
+
+    if not args.no_history:
+        try:
+            build_id = record_warnings(log_file.stem, log_file.resolve().parent, entries)
+            if not args.json:
+                print(f"🗃️  Indexed {len(entries)} warnings of {log_file} as build {build_id}")
+        except Exception as e:
+            print(f"⚠️  Could not record the warning index: {e}")
+
+    threshold = SEVERITIES.index(args.min_severity)
+    selected = [e for e in entries if SEVERITIES.index(e['severity']) <= threshold
+                and (not args.kind or e['kind'] == args.kind)
+                and (not args.chapter or matches_chapter(e, args.chapter))]
+    if args.json:
+        print(json.dumps(selected, indent=2, ensure_ascii=False))
+        return
+    if not selected:
+        print("✅ No warnings matching the filters" if entries else "✅ No warnings")
+        return
+
+    counts = {kind: sum(1 for e in selected if e['kind'] == kind) for kind in KINDS}
+    print('⚠️  ' + ', '.join(f"{n} {kind}" for kind, n in counts.items() if n))
+    if args.chapter:
+        print_entries(selected)
+        return
+    print()
+    print_chapters(chapter_table(selected), 10 if args.summary else None)
+    if args.summary:
+        print(f"\nDetails: python3 utils/log_index.py {log_file} --chapter <N>")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,158 @@
+-- Build event instrumentation for LuaLaTeX runs.
+--
+-- Loaded by the Python drivers before the document (see utils/build_events.py):
+--   lualatex '\directlua{dofile("utils/lua/build_events.lua")}\input{main.tex}'
+--
+-- Writes one JSON object per line to the file named by $BOOK_EVENTS_FILE:
+--   {"event":"start", ...}                      run started
+--   {"event":"open","file":...,"depth":N}       input file opened
+--   {"event":"close","file":...,"seconds":S}    input file closed (time spent inside it)
+--   {"event":"page","page":N,"label":L,"chapter":...,"file":...}
+--                                               physical page N is being shipped out
+--   {"event":"shipped","page":N,"ship_ms":M}    page N written to the PDF
+--   {"event":"end","pages":N,"seconds":S}       run finished
+-- Every event carries "t", seconds since the start of the run.
+
+local events_path = os.getenv('BOOK_EVENTS_FILE')
+if not events_path or events_path == '' then
+  return
+end
+
+local out = io.open(events_path, 'w')
+if not out then
+  texio.write_nl('term and log', 'build_events: cannot write ' .. events_path)
+  return
+end
+out:setvbuf('line')  -- lets the driver tail the stream while the run is going
+
+local clock = os.gettimeofday
+local start_time = clock()
+local cwd = (lfs.currentdir() or '') .. '/'
+
+local escapes = { ['"'] = '\\"', ['\\'] = '\\\\', ['\n'] = '\\n', ['\r'] = '\\r', ['\t'] = '\\t' }
+
+local function quote(s)
+  return '"' .. (s:gsub('[%c"\\]', function(c)
+    return escapes[c] or string.format('\\u%04x', c:byte())
+  end)) .. '"'
+end
+
+local function encode(value)
+  local kind = type(value)
+  if kind == 'string' then
+    return quote(value)
+  elseif kind == 'number' then
+    if value == math.floor(value) then
+      return string.format('%d', value)
+    end
+    return string.format('%.4f', value)
+  elseif kind == 'boolean' then
+    return tostring(value)
+  end
+  return 'null'
+end
+
+local function emit(event, fields)
+  local parts = { '"event":' .. quote(event), '"t":' .. encode(clock() - start_time) }
+  local keys = {}
+  for key in pairs(fields or {}) do
+    keys[#keys + 1] = key
+  end
+  table.sort(keys)
+  for _, key in ipairs(keys) do
+    parts[#parts + 1] = quote(key) .. ':' .. encode(fields[key])
+  end
+  out:write('{', table.concat(parts, ','), '}\n')
+end
+
+local function relative(name)
+  if name:sub(1, #cwd) == cwd then
+    name = name:sub(#cwd + 1)
+  end
+  return (name:gsub('^%./', ''))
+end
+
+-- Chapter directories look like 01_BanachTarskiParadox/
+local function chapter_of(name)
+  return name:match('^(%d%d_[^/]+)/')
+end
+
+-- Stack of open input files; the innermost chapter file is the "current section"
+local stack = {}
+local last_chapter_file = nil
+
+local function current_chapter_file()
+  for i = #stack, 1, -1 do
+    if chapter_of(stack[i].name) then
+      return stack[i].name
+    end
+  end
+  return last_chapter_file
+end
+
+local function open_read_file(filename)
+  local handle = io.open(filename, 'rb')
+  if not handle then
+    return nil
+  end
+  local entry = { name = relative(filename), opened = clock() }
+  stack[#stack + 1] = entry
+  if chapter_of(entry.name) then
+    last_chapter_file = entry.name
+  end
+  emit('open', { file = entry.name, depth = #stack })
+  return {
+    reader = function()
+      return handle:read('*l')
+    end,
+    close = function()
+      handle:close()
+      for i = #stack, 1, -1 do
+        if stack[i] == entry then
+          table.remove(stack, i)
+          break
+        end
+      end
+      emit('close', { file = entry.name, seconds = clock() - entry.opened })
+    end,
+  }
+end
+
+local shipped = 0
+local ship_started = nil
+
+local function pre_shipout_filter(head)
+  shipped = shipped + 1
+  ship_started = clock()
+  local file = current_chapter_file()
+  emit('page', {
+    page = shipped,
+    label = tex.count[0],
+    chapter = file and chapter_of(file) or nil,
+    file = file,
+  })
+  return true
+end
+
+local function finish_pdfpage(shippingout)
+  if shippingout and ship_started then
+    emit('shipped', { page = shipped, ship_ms = (clock() - ship_started) * 1000 })
+    ship_started = nil
+  end
+end
+
+local function wrapup_run()
+  emit('end', { pages = shipped, seconds = clock() - start_time, cpu = os.clock() })
+  out:close()
+end
+
+emit('start', { cwd = cwd, luatex = status.luatex_version })
+
+if #luatexbase.callback_descriptions('open_read_file') == 0 then
+  luatexbase.add_to_callback('open_read_file', open_read_file, 'build_events.open_read_file')
+else
+  texio.write_nl('term and log', 'build_events: open_read_file is taken, no file events')
+end
+luatexbase.add_to_callback('pre_shipout_filter', pre_shipout_filter, 'build_events.pre_shipout_filter')
+luatexbase.add_to_callback('finish_pdfpage', finish_pdfpage, 'build_events.finish_pdfpage')
+luatexbase.add_to_callback('wrapup_run', wrapup_run, 'build_events.wrapup_run')
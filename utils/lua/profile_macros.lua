@@ -0,0 +1,114 @@
+-- Macro/environment profiler for LuaLaTeX runs.
+--
+-- Loaded by utils/profile_macros.py before the document. The generated hook
+-- file wraps the profiled environments and macros in
+--   \directlua{book_profile.push("name")} ... \directlua{book_profile.pop()}
+-- and this module keeps a stack of open frames, timing each with os.clock()
+-- (CPU time of the TeX process). Frames whose name is a chapter directory
+-- (01_BanachTarskiParadox) attribute everything below them to that chapter.
+--
+-- At the end of the run it writes $BOOK_PROFILE_FILE (JSON: per chapter and
+-- frame name the call count, inclusive and self seconds) and next to it the
+-- same name with .folded instead of .json (one "frame;frame;frame microseconds"
+-- line per stack, the input format of flamegraph.pl and speedscope).
+
+local profile_path = os.getenv('BOOK_PROFILE_FILE')
+if not profile_path or profile_path == '' then
+  return
+end
+
+local clock = os.clock
+local stack = {}
+local totals = {}  -- chapter -> name -> {calls, inclusive, self}
+local folded = {}  -- "a;b;c" -> self seconds
+
+local function chapter_of(name)
+  return name:match('^%d%d_[^/]+$')
+end
+
+local function current_chapter()
+  for i = #stack, 1, -1 do
+    if chapter_of(stack[i].name) then
+      return stack[i].name
+    end
+  end
+  return 'frontmatter'
+end
+
+local function push(name)
+  stack[#stack + 1] = { name = name, start = clock(), children = 0 }
+end
+
+local function pop()
+  local frame = table.remove(stack)
+  if not frame then
+    return
+  end
+  local inclusive = clock() - frame.start
+  local self_time = inclusive - frame.children
+  if #stack > 0 then
+    stack[#stack].children = stack[#stack].children + inclusive
+  end
+
+  local names = {}
+  for i = 1, #stack do
+    names[i] = stack[i].name
+  end
+  names[#names + 1] = frame.name
+  local path = table.concat(names, ';')
+  folded[path] = (folded[path] or 0) + self_time
+
+  -- A chapter frame is attributed to itself, everything else to the chapter around it
+  local chapter = chapter_of(frame.name) or current_chapter()
+  totals[chapter] = totals[chapter] or {}
+  local entry = totals[chapter][frame.name]
+  if not entry then
+    entry = { calls = 0, inclusive = 0, self = 0 }
+    totals[chapter][frame.name] = entry
+  end
+  entry.calls = entry.calls + 1
+  entry.inclusive = entry.inclusive + inclusive
+  entry.self = entry.self + self_time
+end
+
+local function quote(s)
+  return '"' .. (s:gsub('[%c"\\]', function(c)
+    return string.format('\\u%04x', c:byte())
+  end)) .. '"'
+end
+
+local function write_results()
+  while #stack > 0 do
+    pop()  -- frames left open by an aborted run
+  end
+
+  local out = io.open(profile_path, 'w')
+  if out then
+    local chapters = {}
+    for chapter, names in pairs(totals) do
+      local rows = {}
+      for name, e in pairs(names) do
+        rows[#rows + 1] = string.format('%s:{"calls":%d,"inclusive":%.6f,"self":%.6f}',
+          quote(name), e.calls, e.inclusive, e.self)
+      end
+      chapters[#chapters + 1] = quote(chapter) .. ':{' .. table.concat(rows, ',') .. '}'
+    end
+    out:write('{"cpu":', string.format('%.6f', clock()), ',"chapters":{', table.concat(chapters, ','), '}}\n')
+    out:close()
+  end
+
+  local stacks = io.open(profile_path:gsub('%.json$', '') .. '.folded', 'w')
+  if stacks then
+    for path, seconds in pairs(folded) do
+      local micros = math.floor(seconds * 1e6 + 0.5)
+      if micros > 0 then
+        stacks:write((path:gsub(' ', '_')), ' ', micros, '\n')
+      end
+    end
+    stacks:close()
+  end
+end
+
+book_profile = { push = push, pop = pop }
+
+luatexbase.add_to_callback('wrapup_run', write_results, 'profile_macros.wrapup_run')
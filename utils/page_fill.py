@@ -0,0 +1,473 @@
+#!/usr/bin/env python3
+"""
+Page fill ratio, bottom whitespace and widow/orphan analysis of a compiled PDF.
+
+Every page's content stream is interpreted just far enough to place its text
+lines (baseline, size, number of characters) and the boxes of its graphics
+(paths, images, included PDFs) - nothing is rasterized. Page ranges are read
+in parallel; the per-page metrics are then computed with NumPy over all pages
+at once:
+
+  fill        share of the text area (geometry in preamble.tex) above the lowest
+              body line or graphic
+  whitespace  points between the lowest content and the bottom margin
+  underfull   fill below --min-fill on a page whose part continues on the next page
+  overflow    a body line below the bottom margin, or a graphic past the margins,
+              on a page of a chapter's text parts (not the designed title and
+              block pages or the front matter, whose elements sit in the margins)
+  widow       a short last line of a paragraph alone at the top of a continued page
+  orphan      a paragraph's first line, or a heading, alone at the bottom of a page
+
+generate_page_table.py fills its has_warning/warning_type columns from these.
+Parts come from pdf_pagemap.py when the PDF has story anchors; without them
+no page is known to continue or to belong to a text part, so none is flagged
+as underfull, overflowing, widowed or orphaned.
+
+Usage:
+  python3 utils/page_fill.py main.pdf                  # flagged pages
+  python3 utils/page_fill.py main.pdf --all            # every page
+  python3 utils/page_fill.py main.pdf --min-fill 0.7 --jobs 8
+"""
+
+import argparse
+import json
+import os
+import re
+import sys
+import time
+from concurrent.futures import ProcessPoolExecutor
+from pathlib import Path
+from typing import Dict, List, Optional, Sequence, Tuple
+
+from pdf_pagemap import STORY_PARTS, load_page_map
+
+# Optional PDF analysis
+try:
+    import PyPDF2
+    HAS_PYPDF2 = True
+except ImportError:
+    HAS_PYPDF2 = False
+
+try:
+    import numpy as np
+    HAS_NUMPY = True
+except ImportError:
+    HAS_NUMPY = False
+
+# Geometry from preamble.tex, in PDF points: 7in x 10in, 0.75in top/bottom, inner 0.875in, outer 0.625in
+PT = 72.0
+MARGIN_TOP = MARGIN_BOTTOM = 0.75 * PT
+MARGIN_INNER = 0.875 * PT
+MARGIN_OUTER = 0.625 * PT
+BAND_SLACK = 12.0      # Lines further into the top/bottom margin are running heads and page numbers
+OVERFLOW_SLACK = 2.0   # Tolerance before content counts as past a margin
+BACKGROUND_SHARE = 0.9  # Graphics covering this much of the page are backgrounds, not content
+MIN_FILL = 0.8
+WIDOW_SHARE = 0.5      # Lines shorter than this share of a full line end a paragraph
+PARAGRAPH_GAP = 1.3    # Baseline gaps wider than this many line skips separate paragraphs
+HEADING_SIZE = 1.15    # Lines this much larger than body text are headings
+
+LINE_FIELDS = ('page', 'y', 'x0', 'x1', 'chars', 'size')
+BOX_FIELDS = ('page', 'x0', 'y0', 'x1', 'y1')
+
+TOKEN_RE = re.compile(rb'''
+    \((?:[^\\()]|\\.|\((?:[^\\()]|\\.)*\))*\)   # literal string (one level of nested parentheses)
+  | <[0-9A-Fa-f\s]*>                           # hex string
+  | <<|>>|\[|\]
+  | /[^\s/\[\]()<>{}%]*                        # name
+  | [-+]?(?:\d+\.?\d*|\.\d+)                    # number
+  | %[^\r\n]*                                  # comment
+  | [A-Za-z'"*][A-Za-z0-9*]*                   # operator
+''', re.X | re.S)
+ESCAPE_RE = re.compile(rb'\\(?:[0-7]{1,3}|\r\n|.)', re.S)
+PAINT_OPS = {b'S', b's', b'f', b'F', b'f*', b'B', b'B*', b'b', b'b*'}
+IDENTITY = (1.0, 0.0, 0.0, 1.0, 0.0, 0.0)
+# Parts set in the text block; the chapter's title and block pages are designed pages
+TEXT_PARTS = tuple(part for part in STORY_PARTS if part not in ('block', 'title'))
+
+
+def mult(m: Sequence[float], n: Sequence[float]) -> Tuple[float, ...]:
+    """m x n for PDF matrices [a b c d e f]."""
+    a, b, c, d, e, f = m
+    A, B, C, D, E, F = n
+    return (a * A + b * C, a * B + b * D, c * A + d * C, c * B + d * D, e * A + f * C + E, e * B + f * D + F)
+
+
+def apply(m: Sequence[float], x: float, y: float) -> Tuple[float, float]:
+    return m[0] * x + m[2] * y + m[4], m[1] * x + m[3] * y + m[5]
+
+
+def transformed_box(m: Sequence[float], x0: float, y0: float, x1: float, y1: float) -> Tuple[float, float, float, float]:
+    points = [apply(m, x, y) for x in (x0, x1) for y in (y0, y1)]
+    xs, ys = [p[0] for p in points], [p[1] for p in points]
+    return min(xs), min(ys), max(xs), max(ys)
+
+
+def string_length(token: bytes) -> int:
+    """Bytes encoded by a literal or hex string token."""
+    if token[:1] == b'<':
+        return len(re.sub(rb'\s', b'', token[1:-1])) // 2
+    return len(ESCAPE_RE.sub(b'x', token[1:-1]))
+
+
+def resolve(obj):
+    return obj.get_object() if obj is not None else None
+
+
+def page_resources(page) -> Tuple[Dict[str, int], Dict[str, Optional[tuple]]]:
+    """Bytes per character of each font, and the box (None for images) of each XObject, by resource name."""
+    resources = resolve(page.get('/Resources')) or {}
+    fonts = {}
+    for name, font in (resolve(resources.get('/Font')) or {}).items():
+        fonts[name] = 2 if resolve(font).get('/Subtype') == '/Type0' else 1
+    xobjects = {}
+    for name, xobject in (resolve(resources.get('/XObject')) or {}).items():
+        xobject = resolve(xobject)
+        if xobject.get('/Subtype') == '/Form':
+            bbox = [float(v) for v in resolve(xobject.get('/BBox', [0, 0, 1, 1]))]
+            matrix = tuple(float(v) for v in resolve(xobject.get('/Matrix', IDENTITY)))
+            xobjects[name] = (matrix, bbox)
+        else:
+            xobjects[name] = None
+    return fonts, xobjects
+
+
+def page_content(page) -> bytes:
+    contents = page.get_contents()
+    if contents is None:
+        return b''
+    if isinstance(contents, list):
+        return b'\n'.join(resolve(part).get_data() for part in contents)
+    return contents.get_data()
+
+
+def scan_page(page) -> Tuple[List[tuple], List[tuple]]:
+    """(lines, boxes) of one page: text lines as (y, x0, x1, chars, size), graphics as (x0, y0, x1, y1)."""
+    fonts, xobjects = page_resources(page)
+    data = page_content(page)
+    fragments, boxes = [], []
+    ctm, stack = IDENTITY, []
+    tm = tlm = IDENTITY
+    font_size, bpc, leading, scale, render = 0.0, 1, 0.0, 1.0, 0
+    path = None
+    operands: List = []
+    arrays: List[List] = []
+
+    def show(strings: List) -> None:
+        nonlocal tm
+        if render == 3:  # Invisible text
+            return
+        trm = mult(tm, ctm)
+        x, y = trm[4], trm[5]
+        size = font_size * (trm[2] ** 2 + trm[3] ** 2) ** 0.5
+        chars, advance = 0, 0.0
+        for item in strings:
+            if isinstance(item, bytes):
+                n = string_length(item) // bpc
+                chars += n
+                advance += n * 0.5 * font_size * scale  # No font metrics: half an em per character
+            else:
+                advance -= item / 1000 * font_size * scale
+        if chars:
+            fragments.append((round(y, 1), x, x + advance * (trm[0] ** 2 + trm[1] ** 2) ** 0.5, chars, size))
+        tm = mult((1, 0, 0, 1, advance, 0), tm)
+
+    pos, end = 0, len(data)
+    while pos < end:
+        match = TOKEN_RE.search(data, pos)
+        if not match:
+            break
+        token = match.group()
+        pos = match.end()
+        first = token[:1]
+        if first in b'(<' and token != b'<<':
+            (arrays[-1] if arrays else operands).append(token)
+        elif first == b'/':
+            operands.append(token[1:].decode('latin-1'))
+        elif first == b'[':
+            arrays.append([])
+        elif first == b']':
+            array = arrays.pop() if arrays else []
+            (arrays[-1] if arrays else operands).append(array)
+        elif first == b'%' or token in (b'<<', b'>>'):
+            continue
+        elif first in b'+-.0123456789':
+            (arrays[-1] if arrays else operands).append(float(token))
+        else:
+            op, args = token, operands
+            operands = []
+            try:
+                if op == b'cm':
+                    ctm = mult(tuple(args[-6:]), ctm)
+                elif op == b'q':
+                    stack.append(ctm)
+                elif op == b'Q':
+                    ctm = stack.pop() if stack else IDENTITY
+                elif op == b'BT':
+                    tm = tlm = IDENTITY
+                elif op == b'Tf':
+                    bpc, font_size = fonts.get('/' + args[0], 1), args[1]
+                elif op == b'Tz':
+                    scale = args[0] / 100
+                elif op == b'Tr':
+                    render = int(args[0])
+                elif op == b'TL':
+                    leading = args[0]
+                elif op in (b'Td', b'TD'):
+                    if op == b'TD':
+                        leading = -args[1]
+                    tm = tlm = mult((1, 0, 0, 1, args[0], args[1]), tlm)
+                elif op == b'Tm':
+                    tm = tlm = tuple(args[-6:])
+                elif op == b'T*':
+                    tm = tlm = mult((1, 0, 0, 1, 0, -leading), tlm)
+                elif op == b'Tj':
+                    show(args[-1:])
+                elif op == b'TJ':
+                    show(args[-1])
+                elif op in (b"'", b'"'):
+                    tm = tlm = mult((1, 0, 0, 1, 0, -leading), tlm)
+                    show(args[-1:])
+                elif op == b're':
+                    x, y, w, h = args[-4:]
+                    box = transformed_box(ctm, x, y, x + w, y + h)
+                    path = box if path is None else (min(path[0], box[0]), min(path[1], box[1]),
+                                                     max(path[2], box[2]), max(path[3], box[3]))
+                elif op in (b'm', b'l', b'c', b'v', b'y'):
+                    for x, y in zip(args[0::2], args[1::2]):
+                        px, py = apply(ctm, x, y)
+                        path = (px, py, px, py) if path is None else (min(path[0], px), min(path[1], py),
+                                                                      max(path[2], px), max(path[3], py))
+                elif op in PAINT_OPS:
+                    if path:
+                        boxes.append(path)
+                    path = None
+                elif op == b'n':
+                    path = None
+                elif op == b'Do':
+                    form = xobjects.get('/' + args[-1])
+                    if form:
+                        boxes.append(transformed_box(mult(form[0], ctm), *form[1]))
+                    else:
+                        boxes.append(transformed_box(ctm, 0, 0, 1, 1))
+                elif op == b'ID':  # Inline image data runs up to EI
+                    ei = data.find(b'EI', pos)
+                    boxes.append(transformed_box(ctm, 0, 0, 1, 1))
+                    pos = end if ei < 0 else ei + 2
+            except (IndexError, TypeError, ValueError, ZeroDivisionError):
+                continue  # Malformed operands: skip the operator
+
+    lines: Dict[float, list] = {}
+    for y, x0, x1, chars, size in fragments:
+        line = lines.get(y)
+        if line is None:
+            lines[y] = [y, x0, x1, chars, size]
+        else:
+            line[1], line[2] = min(line[1], x0), max(line[2], x1)
+            line[3] += chars
+            line[4] = max(line[4], size)
+    return [tuple(line) for line in lines.values()], boxes
+
+
+def scan_range(task: Tuple[str, int, int]) -> Tuple[List[tuple], List[tuple], List[tuple]]:
+    """Worker: lines, boxes and media boxes of pages [first, last) of a PDF."""
+    pdf_file, first, last = task
+    reader = PyPDF2.PdfReader(pdf_file)
+    lines, boxes, media = [], [], []
+    for index in range(first, last):
+        page = reader.pages[index]
+        box = page.mediabox
+        media.append((float(box.left), float(box.bottom), float(box.right), float(box.top)))
+        try:
+            page_lines, page_boxes = scan_page(page)
+        except Exception:
+            page_lines, page_boxes = [], []
+        lines.extend((index,) + line for line in page_lines)
+        boxes.extend((index,) + b for b in page_boxes)
+    return lines, boxes, media
+
+
+def scan_pdf(pdf_file: str, jobs: Optional[int] = None) -> Tuple['np.ndarray', 'np.ndarray', 'np.ndarray']:
+    """Line, box and media box arrays of every page, read in parallel page ranges."""
+    pages = len(PyPDF2.PdfReader(pdf_file).pages)
+    jobs = max(1, min(jobs or os.cpu_count() or 1, pages))
+    bounds = [pages * i // jobs for i in range(jobs + 1)]
+    tasks = [(pdf_file, a, b) for a, b in zip(bounds, bounds[1:]) if b > a]
+    lines, boxes, media = [], [], []
+    if len(tasks) == 1:
+        results = [scan_range(tasks[0])]
+    else:
+        with ProcessPoolExecutor(max_workers=len(tasks)) as pool:
+            results = list(pool.map(scan_range, tasks))
+    for page_lines, page_boxes, page_media in results:
+        lines.extend(page_lines)
+        boxes.extend(page_boxes)
+        media.extend(page_media)
+    return (np.array(lines, dtype=float).reshape(-1, len(LINE_FIELDS)),
+            np.array(boxes, dtype=float).reshape(-1, len(BOX_FIELDS)),
+            np.array(media, dtype=float).reshape(-1, 4))
+
+
+def continued(sections: Sequence[str]) -> 'np.ndarray':
+    """Per page: whether the next page belongs to the same part."""
+    sections = np.asarray(list(sections), dtype=object)
+    result = np.zeros(len(sections), dtype=bool)
+    result[:-1] = (sections[1:] == sections[:-1]) & (sections[:-1] != '')
+    return result
+
+
+def analyze(lines: 'np.ndarray', boxes: 'np.ndarray', media: 'np.ndarray',
+            sections: Optional[Sequence[str]] = None, min_fill: float = MIN_FILL) -> Dict[str, 'np.ndarray']:
+    """Per-page fill, whitespace and warning flags, as arrays indexed by page - 1."""
+    n = len(media)
+    page_numbers = np.arange(1, n + 1)
+    bottom = media[:, 1] + MARGIN_BOTTOM
+    top = media[:, 3] - MARGIN_TOP
+    odd = page_numbers % 2 == 1
+    left = media[:, 0] + np.where(odd, MARGIN_INNER, MARGIN_OUTER)
+    right = media[:, 2] - np.where(odd, MARGIN_OUTER, MARGIN_INNER)
+    next_same = continued(sections) if sections is not None else np.zeros(n, dtype=bool)
+    text_part = (np.isin(np.asarray(list(sections), dtype=object), TEXT_PARTS) if sections is not None
+                 else np.zeros(n, dtype=bool))
+    prev_same = np.zeros(n, dtype=bool)
+    prev_same[1:] = next_same[:-1]
+
+    # Body text: lines between the running head and the page number bands
+    page = lines[:, 0].astype(int)
+    y, chars, size = lines[:, 1], lines[:, 4], lines[:, 5]
+    body = (y >= bottom[page] - BAND_SLACK) & (y <= top[page] + BAND_SLACK / 2) & (chars > 0)
+
+    # Graphics: drop page backgrounds and the white bands of the reorder fast path
+    gpage = boxes[:, 0].astype(int)
+    gx0, gy0, gx1, gy1 = boxes[:, 1], boxes[:, 2], boxes[:, 3], boxes[:, 4]
+    area = (media[:, 2] - media[:, 0]) * (media[:, 3] - media[:, 1])
+    wide = (gx1 - gx0) >= 0.95 * (media[gpage, 2] - media[gpage, 0])
+    graphic = (((gx1 - gx0) * (gy1 - gy0) < BACKGROUND_SHARE * area[gpage])
+               & ~(wide & ((gy0 >= top[gpage]) | (gy1 <= bottom[gpage])))
+               & (gy1 > bottom[gpage] - BAND_SLACK) & (gy0 < top[gpage] + BAND_SLACK / 2))
+
+    lowest = np.full(n, np.inf)
+    np.minimum.at(lowest, page[body], y[body])
+    np.minimum.at(lowest, gpage[graphic], gy0[graphic])
+    empty = ~np.isfinite(lowest)
+    fill = np.where(empty, 0.0, np.clip((top - lowest) / (top - bottom), 0.0, 1.0))
+    whitespace = np.where(empty, top - bottom, np.clip(lowest - bottom, 0.0, None))
+
+    overflow = ~empty & (lowest < bottom - OVERFLOW_SLACK)
+    past_side = graphic & ((gx0 < left[gpage] - OVERFLOW_SLACK) & (gx0 > media[gpage, 0])
+                           | (gx1 > right[gpage] + OVERFLOW_SLACK) & (gx1 < media[gpage, 2]))
+    overflow[gpage[past_side]] = True
+    overflow &= text_part
+    underfull = ~empty & next_same & (fill < min_fill)
+
+    # Widows and orphans from the first and last body lines of each page
+    widow = np.zeros(n, dtype=bool)
+    orphan = np.zeros(n, dtype=bool)
+    bpage, by, bchars, bsize = page[body], y[body], chars[body], size[body]
+    if len(by) > 1:
+        order = np.lexsort((-by, bpage))
+        bpage, by, bchars, bsize = bpage[order], by[order], bchars[order], bsize[order]
+        body_size = np.median(bsize)
+        text = np.abs(bsize - body_size) < 0.15 * body_size
+        same = bpage[1:] == bpage[:-1]
+        gaps = by[:-1] - by[1:]
+        regular = same & text[1:] & text[:-1] & (gaps > 0.5 * body_size) & (gaps < 2 * body_size)
+        skip = np.median(gaps[regular]) if regular.any() else 1.2 * body_size
+        full = np.median(bchars[text]) if text.any() else 0
+        starts = np.flatnonzero(np.r_[True, ~same])
+        ends = np.flatnonzero(np.r_[~same, True])
+        gap_after = np.r_[np.where(same, gaps, np.inf), np.inf]
+        gap_before = np.r_[np.inf, np.where(same, gaps, np.inf)]
+
+        short = text[starts] & (bchars[starts] < WIDOW_SHARE * full) & (gap_after[starts] > PARAGRAPH_GAP * skip)
+        widow[bpage[starts]] = short & prev_same[bpage[starts]]
+        alone = gap_before[ends] > PARAGRAPH_GAP * skip
+        opening = text[ends] & (bchars[ends] >= WIDOW_SHARE * full)
+        heading = bsize[ends] > HEADING_SIZE * body_size
+        orphan[bpage[ends]] = alone & (opening | heading) & next_same[bpage[ends]] & (ends != starts)
+
+    return {'fill': fill, 'whitespace': whitespace, 'empty': empty, 'underfull': underfull,
+            'overflow': overflow, 'widow': widow, 'orphan': orphan}
+
+
+WARNINGS = ('overflow', 'underfull', 'widow', 'orphan')
+
+
+def warning_types(metrics: Dict[str, 'np.ndarray']) -> List[str]:
+    """'+'-joined warning names per page ('' for none)."""
+    return ['+'.join(name for name in WARNINGS if metrics[name][i]) for i in range(len(metrics['fill']))]
+
+
+def page_warnings(pdf_file, sections: Optional[Sequence[str]] = None, jobs: Optional[int] = None,
+                  min_fill: float = MIN_FILL) -> Optional[List[str]]:
+    """Warning types per page of a PDF, or None without PyPDF2/NumPy or the PDF."""
+    if not HAS_PYPDF2 or not HAS_NUMPY or not pdf_file or not Path(pdf_file).exists():
+        return None
+    lines, boxes, media = scan_pdf(str(pdf_file), jobs)
+    if sections is not None and len(sections) != len(media):
+        sections = None
+    return warning_types(analyze(lines, boxes, media, sections, min_fill))
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(
+        description='Measure page fill and find underfull, overflowing, widowed and orphaned pages in a PDF',
+        formatter_class=argparse.RawDescriptionHelpFormatter,
+        epilog="""
+Examples:
+  python3 utils/page_fill.py main.pdf
+  python3 utils/page_fill.py main.pdf --all --json
+  python3 utils/page_fill.py build/main/main.pdf --min-fill 0.7
+        """
+    )
+    parser.add_argument('pdf_file', nargs='?', default='main.pdf', help='Compiled PDF (default: main.pdf)')
+    parser.add_argument('--min-fill', type=float, default=MIN_FILL,
+                        help=f'Fill below which a continued page is underfull (default: {MIN_FILL})')
+    parser.add_argument('--jobs', type=int, default=os.cpu_count(), help='Parallel page ranges (default: CPU count)')
+    parser.add_argument('--all', action='store_true', help='List every page, not only flagged ones')
+    parser.add_argument('--json', action='store_true', help='Print the per-page metrics as JSON')
+    args = parser.parse_args()
+
+    if not HAS_PYPDF2 or not HAS_NUMPY:
+        print("❌ PyPDF2 and NumPy are required: pip install PyPDF2 numpy")
+        sys.exit(1)
+    if not Path(args.pdf_file).exists():
+        print(f"❌ PDF not found: {args.pdf_file}")
+        sys.exit(1)
+
+    start = time.perf_counter()
+    lines, boxes, media = scan_pdf(args.pdf_file, args.jobs)
+    scanned = time.perf_counter() - start
+    page_map = load_page_map(args.pdf_file)
+    content = page_map.content if page_map else {}
+    sections = [content.get(p, {}).get('section', '') for p in range(1, len(media) + 1)] if content else None
+    metrics = analyze(lines, boxes, media, sections, args.min_fill)
+    types = warning_types(metrics)
+    elapsed = time.perf_counter() - start
+
+    rows = []
+    for i, warning in enumerate(types):
+        entry = content.get(i + 1, {})
+        rows.append({'page': i + 1, 'chapter': entry.get('chapter'), 'section': entry.get('section', ''),
+                     'fill': round(float(metrics['fill'][i]), 3),
+                     'whitespace_pt': round(float(metrics['whitespace'][i]), 1), 'warning_type': warning})
+    if args.json:
+        print(json.dumps(rows, indent=2))
+        return
+
+    shown = rows if args.all else [r for r in rows if r['warning_type']]
+    if shown:
+        print(f"{'Page':>5} {'Ch':>3} {'Part':<16} {'Fill':>5} {'White':>7}  Warning")
+        for r in shown:
+            print(f"{r['page']:5d} {r['chapter'] or '':>3} {r['section'][:16]:<16} {r['fill']:5.0%} "
+                  f"{r['whitespace_pt']:5.0f}pt  {r['warning_type']}")
+    counts = {name: int(metrics[name].sum()) for name in WARNINGS}
+    filled = metrics['fill'][~metrics['empty']]
+    print(f"\n📄 {len(rows)} pages in {elapsed:.1f}s ({scanned:.1f}s reading content streams); "
+          f"median fill {float(np.median(filled)) if len(filled) else 0:.0%}")
+    print('⚠️  ' + ', '.join(f"{count} {name}" for name, count in counts.items()) if any(counts.values())
+          else '✅ No layout warnings')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,460 @@
+#!/usr/bin/env python3
+"""
+Page-count forecast for chapters, from their sources alone.
+
+\\inputstory gives every chapter a 5-page content block (historical, main and
+the optional extras) and a 1-page technical page. This predicts the pages of
+each part from cheap features of its .tex file: words (as counted by
+analyze_chapters.count_words_and_chars), paragraphs, display equations,
+figures and their height, lists and list items, and tables. One linear model
+per part (historical, main, technical, extras) is fitted by least squares
+against the page tables of real builds in build/page_history.sqlite (see
+page_history.py), and refitted automatically when that database changes.
+
+Features of a build are recorded with its page table (generate_page_table.py
+calls record_features); for older builds made from a clean checkout they are
+read from git at the build's commit. Until there is enough history, built-in
+coefficients give the predicted pages, but no overflow risk is reported:
+unfitted, they are too rough to tell a full chapter from an overflowing one.
+
+The forecast reads only the chapter's own files, so an editor hook can run it
+on every save:
+
+Usage:
+  python3 utils/page_forecast.py                           # every chapter of main.tex
+  python3 utils/page_forecast.py 05_CircleWheel/main.tex   # the chapter of a saved file
+  python3 utils/page_forecast.py 5 27 --risky              # chapters by number, only at-risk ones
+  python3 utils/page_forecast.py --watch                   # re-forecast chapters as files are saved
+  python3 utils/page_forecast.py --fit                     # refit now and show the model
+"""
+
+import argparse
+import json
+import math
+import re
+import subprocess
+import sys
+import time
+from pathlib import Path
+from typing import Dict, List, Optional, Sequence, Tuple
+
+from analyze_chapters import count_words_and_chars
+from book_model import CACHE_DIR, load_book
+from page_history import HISTORY_DB, connect
+
+ROOT = Path(__file__).resolve().parents[1]
+MODEL_FILE = CACHE_DIR / 'page_forecast.json'
+
+FEATURES = ('words', 'paragraphs', 'display_math', 'figures', 'figure_height', 'lists', 'items', 'tables')
+# Parts of a chapter block that are forecast; the optional extras share one model
+PARTS = ('historical', 'main', 'technical', 'extras')
+EXTRAS = ('phenomenon_extra', 'joke', 'exercises', 'cartoon', 'imagefigure')
+CONTENT_PAGES = 5    # historical + main + extras, pages 4-8 of \inputstory
+TECHNICAL_PAGES = 1
+
+# Text area of the geometry in preamble.tex, for figure sizes
+TEXT_WIDTH_IN = 5.5
+TEXT_HEIGHT_IN = 8.5
+FIGURE_ASPECT = 0.6  # height/width when only a width is given
+UNIT_IN = {'in': 1.0, 'cm': 1 / 2.54, 'mm': 1 / 25.4, 'pt': 1 / 72.27}
+
+COMMENT_RE = re.compile(r'(?<!\\)%.*')
+DISPLAY_MATH_RE = re.compile(r'\\\[|\\begin\{(?:equation|align|gather|multline|eqnarray|displaymath)\*?\}')
+GRAPHICS_RE = re.compile(r'\\includegraphics\s*(?:\[([^\]]*)\])?')
+SIZE_RE = re.compile(r'(width|height)\s*=\s*([\d.]*)\s*(\\(?:text|line|column)width|\\textheight|in|cm|mm|pt)')
+LIST_RE = re.compile(r'\\begin\{(?:itemize|enumerate|description)\}')
+ITEM_RE = re.compile(r'\\item\b')
+TABLE_RE = re.compile(r'\\begin\{(?:tabular[x*]?|longtable|array)\}')
+PARAGRAPH_RE = re.compile(r'\n[ \t]*\n\s*(?=\S)')
+
+# Until there is history to fit: pages = intercept + sum(coefficient * feature), a rough starting point
+# from the median chapter (a 280-word historical page, 1700 words of main text, a 400-word technical page).
+# They run about half a page high on the current book, so parts using them get no overflow risk
+# (samples == 0), only predicted pages
+DEFAULT_LAYOUT = {'figures': 0.02, 'figure_height': 1.0, 'lists': 0.03, 'items': 0.015, 'tables': 0.1}
+DEFAULT_MODELS = {
+    'historical': {'intercept': 0.5, 'coefficients': {'words': 1 / 550, 'paragraphs': 0.0, 'display_math': 0.06}},
+    'main': {'intercept': 0.0, 'coefficients': {'words': 1 / 500, 'paragraphs': 0.02, 'display_math': 0.06}},
+    'technical': {'intercept': 0.1, 'coefficients': {'words': 1 / 650, 'paragraphs': 0.0, 'display_math': 0.03}},
+    'extras': {'intercept': 0.5, 'coefficients': {'words': 1 / 600, 'paragraphs': 0.0, 'display_math': 0.03}},
+}
+for _model in DEFAULT_MODELS.values():
+    _model.update(coefficients={**_model['coefficients'], **DEFAULT_LAYOUT}, rmse=0.4, samples=0)
+RIDGE = 1e-6
+MODEL_VERSION = 1  # Bump when features or defaults change, to drop cached models
+
+
+def part_of(section: str) -> Optional[str]:
+    if section in EXTRAS:
+        return 'extras'
+    return section if section in PARTS else None
+
+
+def figure_height(options: Optional[str]) -> float:
+    """Height of an \\includegraphics as a fraction of the text height."""
+    sizes = {}
+    for key, factor, unit in SIZE_RE.findall(options or ''):
+        factor = float(factor) if factor else 1.0
+        if unit in UNIT_IN:
+            inches = factor * UNIT_IN[unit]
+        elif unit == '\\textheight':
+            inches = factor * TEXT_HEIGHT_IN
+        else:
+            inches = factor * TEXT_WIDTH_IN
+        sizes[key] = inches
+    if 'height' in sizes:
+        return min(1.0, sizes['height'] / TEXT_HEIGHT_IN)
+    if 'width' in sizes:
+        return min(1.0, sizes['width'] * FIGURE_ASPECT / TEXT_HEIGHT_IN)
+    return 0.25
+
+
+def source_features(text: str) -> Dict[str, float]:
+    """Layout-relevant counts of one .tex file."""
+    text = COMMENT_RE.sub('', text)
+    words, _ = count_words_and_chars(text)
+    graphics = GRAPHICS_RE.findall(text)
+    return {
+        'words': words,
+        'paragraphs': len(PARAGRAPH_RE.findall(text)),
+        'display_math': len(DISPLAY_MATH_RE.findall(text)) + text.count('$$') // 2,
+        'figures': len(graphics),
+        'figure_height': round(sum(figure_height(options) for options in graphics), 3),
+        'lists': len(LIST_RE.findall(text)),
+        'items': len(ITEM_RE.findall(text)),
+        'tables': len(TABLE_RE.findall(text)),
+    }
+
+
+def chapter_features(directory: str) -> Dict[str, Dict[str, float]]:
+    """Section (file stem) -> features, for the forecast parts of a chapter on disk."""
+    features = {}
+    for path in sorted((ROOT / directory).glob('*.tex')):
+        if part_of(path.stem):
+            features[path.stem] = source_features(path.read_text(encoding='utf-8', errors='ignore'))
+    return features
+
+
+# --- history -----------------------------------------------------------------
+
+FEATURES_SCHEMA = """
+CREATE TABLE IF NOT EXISTS source_features (
+    build INTEGER NOT NULL REFERENCES builds (id) ON DELETE CASCADE,
+    directory TEXT NOT NULL,
+    section TEXT NOT NULL,
+    features TEXT NOT NULL,
+    PRIMARY KEY (build, directory, section)
+) WITHOUT ROWID;
+"""
+
+
+def record_features(build_id: str, db_file: Path = HISTORY_DB) -> int:
+    """Store the source features of every chapter with a recorded build; returns the rows written."""
+    rows = []
+    for chapter in load_book().chapter_dirs():
+        for section, features in chapter_features(chapter.directory).items():
+            rows.append((chapter.directory, section, json.dumps(features)))
+    with connect(db_file) as conn:
+        conn.executescript(FEATURES_SCHEMA)
+        build = conn.execute('SELECT id FROM builds WHERE build_id = ?', (build_id,)).fetchone()['id']
+        conn.execute('DELETE FROM source_features WHERE build = ?', (build,))
+        conn.executemany('INSERT INTO source_features (build, directory, section, features) VALUES (?, ?, ?, ?)',
+                         [(build, *row) for row in rows])
+    return len(rows)
+
+
+def git_features(specs: Sequence[str]) -> Dict[str, Optional[Dict[str, float]]]:
+    """'<commit>:<path>' -> features of that blob (None if missing), through one git cat-file --batch."""
+    if not specs:
+        return {}
+    proc = subprocess.run(['git', 'cat-file', '--batch'], cwd=ROOT, input='\n'.join(specs).encode() + b'\n',
+                          capture_output=True)
+    out, pos, result, by_blob = proc.stdout, 0, {}, {}
+    for spec in specs:
+        end = out.index(b'\n', pos)
+        header = out[pos:end].split()
+        pos = end + 1
+        if len(header) < 3 or header[1] != b'blob':
+            result[spec] = None
+            continue
+        size = int(header[2])
+        blob = header[0]
+        if blob not in by_blob:
+            by_blob[blob] = source_features(out[pos:pos + size].decode('utf-8', 'ignore'))
+        result[spec] = by_blob[blob]
+        pos += size + 1
+    return result
+
+
+def training_samples(db_file: Path = HISTORY_DB) -> List[Tuple[str, Dict[str, float], int]]:
+    """(part, features, pages) for every chapter part of every recorded build with known sources."""
+    with connect(db_file) as conn:
+        conn.executescript(FEATURES_SCHEMA)
+        pages = conn.execute(
+            'SELECT p.build, b.commit_sha, b.dirty, p.chapter_name, p.section, COUNT(*) AS pages '
+            'FROM pages p JOIN builds b ON b.id = p.build WHERE p.chapter > 0 '
+            'GROUP BY p.build, p.chapter, p.chapter_name, p.section').fetchall()
+        recorded = {(r['build'], r['directory'], r['section']): json.loads(r['features'])
+                    for r in conn.execute('SELECT * FROM source_features')}
+
+    directories = {}
+    for chapter in load_book().chapter_dirs():
+        directories[chapter.name] = directories[chapter.directory] = chapter.directory
+    rows, missing = [], []
+    for row in pages:
+        directory = directories.get(row['chapter_name'])
+        if directory is None or part_of(row['section']) is None:
+            continue
+        key = (row['build'], directory, row['section'])
+        rows.append((key, row))
+        if key not in recorded and row['commit_sha'] and not row['dirty']:
+            missing.append(f"{row['commit_sha']}:{directory}/{row['section']}.tex")
+    from_git = git_features(sorted(set(missing)))
+
+    samples, seen = [], set()
+    for key, row in rows:
+        features = recorded.get(key) or from_git.get(f"{row['commit_sha']}:{key[1]}/{key[2]}.tex")
+        if not features:
+            continue
+        sample = (part_of(row['section']), tuple(features.get(name, 0) for name in FEATURES), row['pages'])
+        if sample not in seen:  # An unchanged chapter contributes once, not once per build
+            seen.add(sample)
+            samples.append((sample[0], dict(zip(FEATURES, sample[1])), sample[2]))
+    return samples
+
+
+# --- model -------------------------------------------------------------------
+
+def solve(matrix: List[List[float]], vector: List[float]) -> List[float]:
+    """Gaussian elimination with partial pivoting."""
+    n = len(vector)
+    a = [row[:] + [vector[i]] for i, row in enumerate(matrix)]
+    for col in range(n):
+        pivot = max(range(col, n), key=lambda r: abs(a[r][col]))
+        a[col], a[pivot] = a[pivot], a[col]
+        if abs(a[col][col]) < 1e-12:
+            continue
+        for r in range(n):
+            if r != col and a[r][col]:
+                factor = a[r][col] / a[col][col]
+                a[r] = [x - factor * y for x, y in zip(a[r], a[col])]
+    return [a[i][n] / a[i][i] if abs(a[i][i]) >= 1e-12 else 0.0 for i in range(n)]
+
+
+def fit_part(samples: List[Tuple[Dict[str, float], int]]) -> dict:
+    """Least-squares pages ~ intercept + features (a small ridge keeps unused features at 0)."""
+    scale = [max(abs(f[name]) for f, _ in samples) or 1.0 for name in FEATURES]
+    xs = [[1.0] + [f[name] / s for name, s in zip(FEATURES, scale)] for f, _ in samples]
+    ys = [float(pages) for _, pages in samples]
+    k = len(FEATURES) + 1
+    xtx = [[sum(x[i] * x[j] for x in xs) + (RIDGE * len(xs) if i == j and i else 0.0) for j in range(k)]
+           for i in range(k)]
+    xty = [sum(x[i] * y for x, y in zip(xs, ys)) for i in range(k)]
+    beta = solve(xtx, xty)
+    residuals = [y - sum(b * v for b, v in zip(beta, x)) for x, y in zip(xs, ys)]
+    dof = max(1, len(ys) - k)
+    return {
+        'intercept': beta[0],
+        'coefficients': {name: b / s for name, b, s in zip(FEATURES, beta[1:], scale)},
+        'rmse': max(0.15, math.sqrt(sum(r * r for r in residuals) / dof)),
+        'samples': len(ys),
+    }
+
+
+def history_stamp(db_file: Path) -> Optional[int]:
+    return db_file.stat().st_mtime_ns if db_file.exists() else None
+
+
+def fit(db_file: Path = HISTORY_DB) -> dict:
+    """Fit one model per part on the history; parts with too few samples keep the defaults."""
+    by_part: Dict[str, List[Tuple[Dict[str, float], int]]] = {part: [] for part in PARTS}
+    if db_file.exists():
+        for part, features, pages in training_samples(db_file):
+            by_part[part].append((features, pages))
+    models = {}
+    for part in PARTS:
+        samples = by_part[part]
+        models[part] = fit_part(samples) if len(samples) >= len(FEATURES) + 3 else DEFAULT_MODELS[part]
+    model = {'version': MODEL_VERSION, 'history': history_stamp(db_file), 'fitted': time.time(), 'models': models}
+    MODEL_FILE.parent.mkdir(parents=True, exist_ok=True)
+    MODEL_FILE.write_text(json.dumps(model, indent=1), encoding='utf-8')
+    return model
+
+
+def load_model(db_file: Path = HISTORY_DB) -> dict:
+    """The fitted model, refitted first if the history changed since."""
+    try:
+        model = json.loads(MODEL_FILE.read_text(encoding='utf-8'))
+        if model.get('version') == MODEL_VERSION and model.get('history') == history_stamp(db_file):
+            return model
+    except (OSError, ValueError):
+        pass
+    return fit(db_file)
+
+
+def predict(model: dict, part: str, features: Dict[str, float]) -> float:
+    m = model['models'][part]
+    return max(0.0, m['intercept'] + sum(m['coefficients'][name] * features.get(name, 0) for name in FEATURES))
+
+
+def overflow_risk(predicted: float, limit: int, rmse: float) -> float:
+    """P(more than limit pages) for a forecast with normal error rmse."""
+    z = (limit + 0.5 - predicted) / rmse
+    return 0.5 * (1 - math.erf(z / math.sqrt(2)))
+
+
+def fitted(model: dict, parts: Sequence[str]) -> bool:
+    """Whether every one of the parts has a model fitted on page history (not the built-in defaults)."""
+    return all(model['models'][part]['samples'] > 0 for part in parts)
+
+
+def forecast(model: dict, directory: str) -> dict:
+    """Predicted pages per part, content block and technical page of one chapter, with overflow risks.
+
+    A risk is None when a part it depends on has no fitted model yet.
+    """
+    parts = {part: 0.0 for part in PARTS}
+    extras = 0  # Each optional extra is its own sample, as in training
+    for section, features in chapter_features(directory).items():
+        part = part_of(section)
+        parts[part] += predict(model, part, features)
+        extras += part == 'extras'
+    block = parts['historical'] + parts['main'] + parts['extras']
+    block_parts = ('historical', 'main') + (('extras',) if extras else ())
+    block_rmse = math.sqrt(sum(model['models'][p]['rmse'] ** 2 for p in ('historical', 'main'))
+                           + extras * model['models']['extras']['rmse'] ** 2)
+    return {
+        'directory': directory,
+        'parts': parts,
+        'block': block,
+        'block_risk': overflow_risk(block, CONTENT_PAGES, block_rmse) if fitted(model, block_parts) else None,
+        'technical_risk': (overflow_risk(parts['technical'], TECHNICAL_PAGES, model['models']['technical']['rmse'])
+                           if fitted(model, ('technical',)) else None),
+    }
+
+
+def max_risk(f: dict) -> Optional[float]:
+    risks = [r for r in (f['block_risk'], f['technical_risk']) if r is not None]
+    return max(risks) if risks else None
+
+
+def chapter_dirs(args: Sequence[str]) -> List[str]:
+    """Chapter directories named by directory, number, or a path inside the chapter; all chapters by default."""
+    model = load_book()
+    if not args:
+        return [e.directory for e in model.entries if e.inputstory_line and e.directory in model.chapters]
+    directories = []
+    for arg in args:
+        path = Path(arg).resolve()
+        parts = path.relative_to(ROOT).parts if path.is_relative_to(ROOT) else Path(arg).parts
+        directory = next((p for p in parts if p in model.chapters), None)
+        if directory is None and arg.isdigit():
+            entry = model.entry_by_number(int(arg))
+            directory = entry.directory if entry else None
+        if directory is None:
+            print(f"⚠️  No chapter matches '{arg}'")
+            continue
+        directories.append(directory)
+    return directories
+
+
+def print_forecasts(forecasts: List[dict], model: dict, risky_only: bool) -> None:
+    print(f"{'Chapter':<32} {'hist':>5} {'main':>5} {'extra':>5} {'block':>7} {'tech':>5}  risk")
+    for f in forecasts:
+        risk = max_risk(f)
+        if risky_only and (risk is None or risk < 0.2):
+            continue
+        p = f['parts']
+        if f['block_risk'] is None:
+            block = '   no history'
+        else:
+            mark = '⚠️ ' if risk >= 0.5 else ('🟡' if risk >= 0.2 else '✅')
+            block = f"{mark} {f['block_risk']:4.0%}"
+        technical = ''
+        if f['technical_risk'] is not None and f['technical_risk'] >= 0.2:
+            technical = f"  technical {f['technical_risk']:.0%}"
+        print(f"{f['directory'][:32]:<32} {p['historical']:5.1f} {p['main']:5.1f} {p['extras']:5.1f} "
+              f"{f['block']:4.1f}/{CONTENT_PAGES} {p['technical']:5.1f}  {block}{technical}")
+
+def describe_model(model: dict) -> str:
+    fitted = [f"{part} ({m['samples']})" for part, m in model['models'].items() if m['samples']]
+    if not fitted:
+        return "built-in coefficients (no page history to fit yet, so no overflow risk)"
+    return f"fitted on {', '.join(fitted)} samples"
+
+
+def watch(directories: List[str], interval: float) -> None:
+    """Forecast a chapter again whenever one of its .tex files is saved."""
+    def stamps(directory: str) -> Dict[str, int]:
+        return {p.name: p.stat().st_mtime_ns for p in (ROOT / directory).glob('*.tex')}
+
+    seen = {d: stamps(d) for d in directories}
+    print(f"👀 Watching {len(directories)} chapter(s); Ctrl-C to stop")
+    try:
+        while True:
+            time.sleep(interval)
+            for directory in directories:
+                current = stamps(directory)
+                if current != seen[directory]:
+                    seen[directory] = current
+                    start = time.perf_counter()
+                    model = load_model()
+                    result = forecast(model, directory)
+                    print(f"\n💾 {directory} ({(time.perf_counter() - start) * 1000:.0f} ms)")
+                    print_forecasts([result], model, risky_only=False)
+    except KeyboardInterrupt:
+        print("\n👋 Stopped")
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(
+        description='Forecast chapter page counts from source metrics and flag likely overflows',
+        formatter_class=argparse.RawDescriptionHelpFormatter,
+        epilog=f"""
+block = historical + main + extras against the {CONTENT_PAGES}-page content block;
+risk = probability of more than {CONTENT_PAGES} pages given the model's error; it is
+reported only once page history has been fitted ("no history" until then).
+
+Examples:
+  python3 utils/page_forecast.py 05_CircleWheel/main.tex
+  python3 utils/page_forecast.py --risky
+  python3 utils/page_forecast.py --fit
+        """
+    )
+    parser.add_argument('chapters', nargs='*', help='Chapter directories, numbers or files inside them (default: all)')
+    parser.add_argument('--risky', action='store_true', help='Only chapters with at least 20%% overflow risk')
+    parser.add_argument('--fit', action='store_true', help='Refit the model on the page history and print it')
+    parser.add_argument('--watch', action='store_true', help='Forecast chapters again whenever their files are saved')
+    parser.add_argument('--json', action='store_true', help='Print the forecasts as JSON')
+    args = parser.parse_args()
+
+    start = time.perf_counter()
+    if args.fit:
+        model = fit()
+        print(f"🧮 {describe_model(model)} ({(time.perf_counter() - start) * 1000:.0f} ms)")
+        for part, m in model['models'].items():
+            terms = ', '.join(f"{name} {value:+.4g}" for name, value in m['coefficients'].items() if value)
+            print(f"  {part:<10} {m['intercept']:+.3f}  {terms}  (rmse {m['rmse']:.2f}, {m['samples']} samples)")
+        return
+
+    directories = chapter_dirs(args.chapters)
+    if not directories:
+        sys.exit(1)
+    if args.watch:
+        watch(directories, 0.3)
+        return
+
+    model = load_model()
+    forecasts = [forecast(model, d) for d in directories]
+    elapsed = (time.perf_counter() - start) * 1000
+    if args.json:
+        print(json.dumps(forecasts, indent=2))
+        return
+    print_forecasts(forecasts, model, args.risky)
+    at_risk = sum(1 for f in forecasts if (max_risk(f) or 0.0) >= 0.5)
+    print(f"\n⏱️  {len(forecasts)} chapter(s) in {elapsed:.0f} ms; {describe_model(model)}"
+          + (f"; ⚠️  {at_risk} likely to overflow" if at_risk else ''))
+
+
+if __name__ == '__main__':
+    main()
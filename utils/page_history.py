@@ -0,0 +1,318 @@
+#!/usr/bin/env python3
+"""
+Page-structure history of the book's builds, in SQLite.
+
+generate_page_table.py appends every page (chapter, part, position) and
+analyze_chapter_pages.py every chapter length of a build to
+build/page_history.sqlite, keyed by a build ID and the git commit it was
+built from. A build ID is the target name and the time its PDF (else its
+.log) was written, so both tools file the results of one build together and
+running a tool twice on the same build replaces its rows.
+
+Chapters are compared by the number they are typeset with. When a build has
+no chapter rows (only its page table was recorded), its chapter lengths are
+counted from its pages.
+
+Usage:
+  python3 utils/page_history.py builds                  # recorded builds, newest first
+  python3 utils/page_history.py changed main@20261018_091500   # chapters whose page count changed since
+  python3 utils/page_history.py changed main@20261018_091500 --to main@20261018_121000
+  python3 utils/page_history.py drift 27                # page count of chapter 27 per build, and when it drifted
+"""
+
+import argparse
+import sqlite3
+import subprocess
+import sys
+import time
+from pathlib import Path
+from typing import List, Optional, Tuple
+
+from build_dirs import BUILD_ROOT, artifact_path
+
+ROOT = Path(__file__).resolve().parents[1]
+HISTORY_DB = BUILD_ROOT / 'page_history.sqlite'
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS builds (
+    id INTEGER PRIMARY KEY,
+    build_id TEXT NOT NULL UNIQUE,
+    target TEXT NOT NULL,
+    built REAL NOT NULL,
+    commit_sha TEXT,
+    dirty INTEGER NOT NULL DEFAULT 0,
+    pages INTEGER
+);
+CREATE INDEX IF NOT EXISTS builds_target_built ON builds (target, built);
+CREATE TABLE IF NOT EXISTS pages (
+    build INTEGER NOT NULL REFERENCES builds (id) ON DELETE CASCADE,
+    page INTEGER NOT NULL,
+    chapter INTEGER,
+    chapter_name TEXT,
+    section TEXT,
+    page_in_chapter INTEGER,
+    page_in_section INTEGER,
+    PRIMARY KEY (build, page)
+) WITHOUT ROWID;
+CREATE TABLE IF NOT EXISTS chapters (
+    build INTEGER NOT NULL REFERENCES builds (id) ON DELETE CASCADE,
+    chapter INTEGER NOT NULL,
+    title TEXT,
+    folder TEXT,
+    start_page INTEGER,
+    end_page INTEGER,
+    page_length INTEGER,
+    PRIMARY KEY (build, chapter)
+) WITHOUT ROWID;
+CREATE INDEX IF NOT EXISTS chapters_by_chapter ON chapters (chapter, build);
+CREATE INDEX IF NOT EXISTS pages_by_chapter ON pages (chapter, build);
+CREATE VIEW IF NOT EXISTS chapter_lengths AS
+    SELECT build, chapter, title, folder, start_page, end_page, page_length FROM chapters
+    UNION ALL
+    SELECT build, chapter, MIN(chapter_name), NULL, MIN(page), MAX(page), COUNT(*) FROM pages
+    WHERE chapter > 0 AND build NOT IN (SELECT DISTINCT build FROM chapters)
+    GROUP BY build, chapter;
+"""
+
+
+def connect(db_file: Path = HISTORY_DB) -> sqlite3.Connection:
+    db_file.parent.mkdir(parents=True, exist_ok=True)
+    conn = sqlite3.connect(str(db_file))
+    conn.row_factory = sqlite3.Row
+    conn.execute('PRAGMA foreign_keys = ON')
+    conn.executescript(SCHEMA)
+    return conn
+
+
+def git_commit() -> Tuple[Optional[str], bool]:
+    """(HEAD commit, whether tracked files differ from it), or (None, False) outside a git checkout."""
+    try:
+        sha = subprocess.run(['git', 'rev-parse', 'HEAD'], cwd=ROOT, capture_output=True,
+                             text=True, check=True).stdout.strip()
+        status = subprocess.run(['git', 'status', '--porcelain', '--untracked-files=no'], cwd=ROOT,
+                                capture_output=True, text=True, check=True).stdout
+    except (OSError, subprocess.CalledProcessError):
+        return None, False
+    return sha, bool(status.strip())
+
+
+def build_id_for(base_name: str, build_dir: Optional[Path] = None) -> Tuple[str, float]:
+    """(build ID, build time) of the build whose PDF/.log are at artifact_path(base_name, ...)."""
+    built = next((path.stat().st_mtime for path in (artifact_path(base_name, ext, build_dir) for ext in ('pdf', 'log'))
+                  if path.exists()), time.time())
+    return f"{Path(base_name).name}@{time.strftime('%Y%m%d_%H%M%S', time.localtime(built))}", built
+
+
+def record_build(conn: sqlite3.Connection, base_name: str, build_dir: Optional[Path] = None,
+                 pages: Optional[int] = None) -> Tuple[int, str]:
+    """Row id and build ID of a build, adding it on first sight."""
+    build_id, built = build_id_for(base_name, build_dir)
+    row = conn.execute('SELECT id FROM builds WHERE build_id = ?', (build_id,)).fetchone()
+    if row:
+        if pages:
+            conn.execute('UPDATE builds SET pages = ? WHERE id = ?', (pages, row['id']))
+        return row['id'], build_id
+    sha, dirty = git_commit()
+    cur = conn.execute('INSERT INTO builds (build_id, target, built, commit_sha, dirty, pages) VALUES (?, ?, ?, ?, ?, ?)',
+                       (build_id, Path(base_name).name, built, sha, int(dirty), pages))
+    return cur.lastrowid, build_id
+
+
+def record_page_table(base_name: str, build_dir: Optional[Path], page_table: List[dict],
+                      db_file: Path = HISTORY_DB) -> str:
+    """Store the rows of generate_page_table for a build; returns its build ID."""
+    with connect(db_file) as conn:
+        build, build_id = record_build(conn, base_name, build_dir, len(page_table))
+        conn.execute('DELETE FROM pages WHERE build = ?', (build,))
+        conn.executemany(
+            'INSERT INTO pages (build, page, chapter, chapter_name, section, page_in_chapter, page_in_section) '
+            'VALUES (?, ?, ?, ?, ?, ?, ?)',
+            [(build, r['page'], r['chapter'], r['chapter_name'], r['section'],
+              r['page_in_chapter'], r['page_in_section']) for r in page_table])
+    return build_id
+
+
+def record_chapter_lengths(base_name: str, build_dir: Optional[Path], results: List[dict],
+                           total_pages: Optional[int] = None, db_file: Path = HISTORY_DB) -> str:
+    """Store the results of analyze_chapter_pages for a build; returns its build ID."""
+    with connect(db_file) as conn:
+        build, build_id = record_build(conn, base_name, build_dir, total_pages)
+        conn.execute('DELETE FROM chapters WHERE build = ?', (build,))
+        conn.executemany(
+            'INSERT INTO chapters (build, chapter, title, folder, start_page, end_page, page_length) '
+            'VALUES (?, ?, ?, ?, ?, ?, ?)',
+            [(build, r['chapter_num'], r['chapter_title'], r.get('full_folder'), r['start_page'],
+              r['end_page'], r['page_length']) for r in results])
+    return build_id
+
+
+def find_build(conn: sqlite3.Connection, name: str, target: Optional[str] = None) -> Optional[sqlite3.Row]:
+    """A build by build ID, unique prefix of it, commit (prefix), or 'latest'."""
+    if name == 'latest':
+        sql, args = 'SELECT * FROM builds', []
+        if target:
+            sql, args = sql + ' WHERE target = ?', [target]
+        return conn.execute(sql + ' ORDER BY built DESC LIMIT 1', args).fetchone()
+    row = conn.execute('SELECT * FROM builds WHERE build_id = ?', (name,)).fetchone()
+    if row:
+        return row
+    # Newest build of a commit, or the only build with this prefix
+    rows = conn.execute("SELECT * FROM builds WHERE commit_sha LIKE ? || '%' OR build_id LIKE ? || '%' "
+                        'ORDER BY built DESC', (name, name)).fetchall()
+    by_commit = [r for r in rows if r['commit_sha'] and r['commit_sha'].startswith(name)]
+    if by_commit:
+        return by_commit[0]
+    return rows[0] if len(rows) == 1 else None
+
+
+def lengths(conn: sqlite3.Connection, build: int) -> dict:
+    return {row['chapter']: row for row in
+            conn.execute('SELECT * FROM chapter_lengths WHERE build = ?', (build,))}
+
+
+def changed_since(conn: sqlite3.Connection, since: sqlite3.Row, to: sqlite3.Row) -> List[dict]:
+    """Chapters whose page count differs between two builds (added or dropped chapters included)."""
+    before, after = lengths(conn, since['id']), lengths(conn, to['id'])
+    changes = []
+    for chapter in sorted(set(before) | set(after)):
+        old, new = before.get(chapter), after.get(chapter)
+        old_len = old['page_length'] if old else None
+        new_len = new['page_length'] if new else None
+        if old_len != new_len:
+            changes.append({
+                'chapter': chapter,
+                'title': (new or old)['title'] or '',
+                'before': old_len,
+                'after': new_len,
+                'start_before': old['start_page'] if old else None,
+                'start_after': new['start_page'] if new else None,
+            })
+    return changes
+
+
+def chapter_history(conn: sqlite3.Connection, chapter: int, target: Optional[str] = None) -> List[sqlite3.Row]:
+    """Page count of one chapter in every build that has it, oldest first (via chapters_by_chapter)."""
+    sql = ('SELECT b.build_id, b.commit_sha, b.dirty, b.built, l.page_length, l.start_page, l.title '
+           'FROM chapter_lengths l JOIN builds b ON b.id = l.build WHERE l.chapter = ?')
+    args: list = [chapter]
+    if target:
+        sql += ' AND b.target = ?'
+        args.append(target)
+    return conn.execute(sql + ' ORDER BY b.built', args).fetchall()
+
+
+def drift_start(history: List[sqlite3.Row]) -> Optional[int]:
+    """Index of the build from which the page count has differed from the first build's, up to the latest."""
+    if not history:
+        return None
+    baseline = history[0]['page_length']
+    start = None
+    for i, row in enumerate(history):
+        if row['page_length'] == baseline:
+            start = None
+        elif start is None:
+            start = i
+    return start
+
+
+def short_commit(row: sqlite3.Row) -> str:
+    if not row['commit_sha']:
+        return '-'
+    return row['commit_sha'][:9] + ('+' if row['dirty'] else '')
+
+
+def print_builds(conn: sqlite3.Connection, limit: int, target: Optional[str]) -> None:
+    sql = ('SELECT b.*, (SELECT COUNT(*) FROM pages p WHERE p.build = b.id) AS page_rows, '
+           '(SELECT COUNT(*) FROM chapters c WHERE c.build = b.id) AS chapter_rows FROM builds b')
+    args: list = []
+    if target:
+        sql += ' WHERE b.target = ?'
+        args.append(target)
+    rows = conn.execute(sql + ' ORDER BY b.built DESC LIMIT ?', args + [limit]).fetchall()
+    if not rows:
+        print(f"📭 No builds recorded in {HISTORY_DB.relative_to(ROOT)} yet")
+        return
+    print(f"{'Build':<26} {'Commit':<11} {'Pages':>5} {'Rows':>11}")
+    for row in rows:
+        recorded = f"{row['page_rows']}p/{row['chapter_rows']}ch"
+        print(f"{row['build_id']:<26} {short_commit(row):<11} {row['pages'] or '-':>5} {recorded:>11}")
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(
+        description='Query the page-structure history of recorded builds',
+        formatter_class=argparse.RawDescriptionHelpFormatter,
+        epilog="""
+Builds are named by build ID (main@20261018_091500), a unique prefix of it,
+a commit (prefix; its newest build) or 'latest'. A commit marked + was built
+with uncommitted changes.
+
+Examples:
+  python3 utils/page_history.py builds --limit 10
+  python3 utils/page_history.py changed 4f1c2a9
+  python3 utils/page_history.py drift 27 --target main
+        """
+    )
+    parser.add_argument('--db', default=str(HISTORY_DB), help=f'History database (default: {HISTORY_DB.relative_to(ROOT)})')
+    parser.add_argument('--target', help='Only builds of this target (e.g. main, main_subset)')
+    sub = parser.add_subparsers(dest='command', required=True)
+    builds = sub.add_parser('builds', help='List recorded builds, newest first')
+    builds.add_argument('--limit', type=int, default=20)
+    changed = sub.add_parser('changed', help='Chapters whose page count changed since a build')
+    changed.add_argument('since', help='Build to compare against')
+    changed.add_argument('--to', default='latest', help='Later build (default: latest)')
+    drift = sub.add_parser('drift', help='Page count of a chapter across builds, and the build it started drifting on')
+    drift.add_argument('chapter', type=int, help='Chapter number')
+    args = parser.parse_args()
+
+    db_file = Path(args.db)
+    if not db_file.exists():
+        print(f"❌ No history database at {db_file} - run generate_page_table.py or analyze_chapter_pages.py after a build")
+        sys.exit(1)
+    conn = connect(db_file)
+
+    if args.command == 'builds':
+        print_builds(conn, args.limit, args.target)
+        return
+
+    if args.command == 'changed':
+        since = find_build(conn, args.since, args.target)
+        to = find_build(conn, args.to, args.target)
+        for name, row in ((args.since, since), (args.to, to)):
+            if row is None:
+                print(f"❌ No (unique) build matches '{name}'")
+                sys.exit(1)
+        changes = changed_since(conn, since, to)
+        print(f"🔍 {since['build_id']} ({short_commit(since)}) -> {to['build_id']} ({short_commit(to)})")
+        if not changes:
+            print("✅ No chapter changed page count")
+            return
+        print(f"\n{'Ch':>3} {'Chapter':<40} {'Pages':>9} {'Start':>11}")
+        for c in changes:
+            pages = f"{c['before'] if c['before'] is not None else '-'}→{c['after'] if c['after'] is not None else '-'}"
+            start = f"{c['start_before'] or '-'}→{c['start_after'] or '-'}"
+            print(f"{c['chapter']:3d} {c['title'][:40]:<40} {pages:>9} {start:>11}")
+        print(f"\n📊 {len(changes)} chapter(s) changed page count")
+        return
+
+    history = chapter_history(conn, args.chapter, args.target)
+    if not history:
+        print(f"❌ Chapter {args.chapter} is not in any recorded build")
+        sys.exit(1)
+    start = drift_start(history)
+    print(f"📈 Chapter {args.chapter}: {history[-1]['title'] or ''}")
+    print(f"\n{'Build':<26} {'Commit':<11} {'Start':>5} {'Pages':>5}")
+    previous = None
+    for i, row in enumerate(history):
+        mark = '  ← drift starts' if i == start else ('  ← changed' if previous is not None and row['page_length'] != previous else '')
+        print(f"{row['build_id']:<26} {short_commit(row):<11} {row['start_page'] or '-':>5} {row['page_length']:>5}{mark}")
+        previous = row['page_length']
+    if start is None:
+        print(f"\n✅ Same page count as in {history[0]['build_id']} ({history[0]['page_length']} pages)")
+    else:
+        print(f"\n⚠️  {history[0]['page_length']} → {history[-1]['page_length']} pages since "
+              f"{history[start]['build_id']} ({short_commit(history[start])})")
+
+
+if __name__ == '__main__':
+    main()
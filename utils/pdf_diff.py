@@ -0,0 +1,308 @@
+#!/usr/bin/env python3
+"""
+Visual diff of two builds of the book, page by page.
+
+Every page of both PDFs is fingerprinted from what it draws: its content
+streams and, recursively, its resources (images, forms, fonts by name; font
+subsets are left out because one new glyph anywhere changes them on every
+page). The two page sequences are aligned on these fingerprints, so pages
+that only moved are matched too, and identical pages are skipped without
+rendering. Only the remaining candidates are rasterized with pdftoppm, in
+a process pool, and compared pixel by pixel; pages that render the same are
+dropped as well.
+
+Each changed page gets a diff image:
+  side     old and new next to each other, the changed region boxed in red
+  overlay  one image: removed ink in cyan, added ink in red, unchanged in black
+and index.html lists them with their chapter and part (see pdf_pagemap.py).
+Without Pillow, the rendered old/new pages are shown side by side instead.
+
+Usage:
+  python3 utils/pdf_diff.py old/main.pdf main.pdf
+  python3 utils/pdf_diff.py old.pdf new.pdf --dpi 150 --mode overlay --jobs 8
+  python3 utils/pdf_diff.py old.pdf new.pdf --out build/pdfdiff/review
+"""
+
+import argparse
+import difflib
+import hashlib
+import html
+import os
+import re
+import shutil
+import subprocess
+import sys
+import time
+from concurrent.futures import ProcessPoolExecutor
+from pathlib import Path
+from typing import Dict, List, Optional, Tuple
+
+from build_dirs import BUILD_ROOT
+from pdf_pagemap import load_page_map
+
+# Optional PDF analysis
+try:
+    import PyPDF2
+    from PyPDF2.generic import IndirectObject, StreamObject
+    HAS_PYPDF2 = True
+except ImportError:
+    HAS_PYPDF2 = False
+
+# Optional diff images
+try:
+    from PIL import Image, ImageChops, ImageDraw
+    HAS_PIL = True
+except ImportError:
+    HAS_PIL = False
+
+DIFF_ROOT = BUILD_ROOT / 'pdfdiff'
+DEFAULT_DPI = 100
+SUBSET_TAG_RE = re.compile(r'^/?[A-Z]{6}\+')
+# Keys that do not change what a page looks like (or only point back up the tree)
+SKIPPED_KEYS = {'/Parent', '/Annots', '/Length', '/StructParents', '/Thumb', '/B', '/ID', '/PieceInfo'}
+
+
+class Fingerprinter:
+    """Content digests of the pages of one PDF; shared resources are digested once."""
+
+    def __init__(self, pdf_file: Path) -> None:
+        self.reader = PyPDF2.PdfReader(str(pdf_file))
+        self._memo: Dict[int, bytes] = {}
+
+    def digest(self, obj) -> bytes:
+        if isinstance(obj, IndirectObject):
+            memo = self._memo.get(obj.idnum)
+            if memo is None:
+                self._memo[obj.idnum] = b'cycle'
+                memo = self._memo[obj.idnum] = self.digest(obj.get_object())
+            return memo
+        h = hashlib.sha1()
+        if isinstance(obj, dict):
+            if obj.get('/Type') == '/Font':
+                return self.font_digest(obj)
+            if isinstance(obj, StreamObject):
+                h.update(b'S')
+                h.update(getattr(obj, '_data', b'') or obj.get_data())
+            for key in sorted(obj):
+                if key not in SKIPPED_KEYS:
+                    h.update(str(key).encode())
+                    h.update(self.digest(obj.raw_get(key)))
+        elif isinstance(obj, list):
+            h.update(b'A')
+            for item in obj:
+                h.update(self.digest(item))
+        else:
+            h.update(repr(obj).encode('utf-8', 'replace'))
+        return h.digest()
+
+    def font_digest(self, font) -> bytes:
+        """A font by what it is, not by its (build-wide) subset."""
+        parts = [str(font.get('/Subtype')), SUBSET_TAG_RE.sub('', str(font.get('/BaseFont', '')))]
+        descendants = font.get('/DescendantFonts')
+        for descendant in descendants.get_object() if descendants is not None else []:
+            parts.append(SUBSET_TAG_RE.sub('', str(descendant.get_object().get('/BaseFont', ''))))
+        encoding = font.get('/Encoding')
+        if encoding is not None and not isinstance(encoding.get_object(), dict):
+            parts.append(str(encoding))
+        return hashlib.sha1('\0'.join(parts).encode()).digest()
+
+    def page(self, index: int) -> str:
+        """Fingerprint of one page (0-based)."""
+        page = self.reader.pages[index]
+        h = hashlib.sha1()
+        for key in ('/Contents', '/Resources', '/MediaBox', '/CropBox', '/Rotate', '/Group'):
+            if key in page:
+                h.update(key.encode())
+                h.update(self.digest(page.raw_get(key)))
+        return h.hexdigest()
+
+    def pages(self) -> List[str]:
+        return [self.page(i) for i in range(len(self.reader.pages))]
+
+
+def page_fingerprints(pdf_file: str) -> List[str]:
+    return Fingerprinter(Path(pdf_file)).pages()
+
+
+def align(old: List[str], new: List[str], everything: bool = False) -> Tuple[List[Tuple[Optional[int], Optional[int]]], int]:
+    """(old page, new page) pairs to render (1-based; None for an added or removed page), and the skipped count."""
+    if everything:
+        pairs = [(i + 1 if i < len(old) else None, i + 1 if i < len(new) else None)
+                 for i in range(max(len(old), len(new)))]
+        return pairs, 0
+    pairs, skipped = [], 0
+    for op, i1, i2, j1, j2 in difflib.SequenceMatcher(None, old, new, autojunk=False).get_opcodes():
+        if op == 'equal':
+            skipped += i2 - i1
+            continue
+        for k in range(max(i2 - i1, j2 - j1)):
+            pairs.append((i1 + k + 1 if i1 + k < i2 else None, j1 + k + 1 if j1 + k < j2 else None))
+    return pairs, skipped
+
+
+def render(pdf_file: str, page: int, dpi: int, prefix: Path) -> Path:
+    """Rasterize one page with pdftoppm and return the PNG."""
+    subprocess.run(['pdftoppm', '-r', str(dpi), '-f', str(page), '-l', str(page), '-png', '-singlefile',
+                    pdf_file, str(prefix)], check=True, capture_output=True)
+    return prefix.with_suffix('.png')
+
+
+def diff_images(old_png: Path, new_png: Path, mode: str, out: Path) -> Optional[Tuple[int, int, int, int]]:
+    """Bounding box of the changed pixels (None if the pages render the same), writing the diff image to out."""
+    old, new = Image.open(old_png).convert('RGB'), Image.open(new_png).convert('RGB')
+    size = (max(old.width, new.width), max(old.height, new.height))
+    if old.size != size or new.size != size:
+        padded = []
+        for image in (old, new):
+            canvas = Image.new('RGB', size, 'white')
+            canvas.paste(image, (0, 0))
+            padded.append(canvas)
+        old, new = padded
+    bbox = ImageChops.difference(old, new).getbbox()
+    if bbox is None:
+        return None
+
+    if mode == 'overlay':
+        old_gray, new_gray = old.convert('L'), new.convert('L')
+        Image.merge('RGB', (old_gray, new_gray, new_gray)).save(out)
+    else:
+        gap = max(8, size[0] // 40)
+        sheet = Image.new('RGB', (size[0] * 2 + gap, size[1]), (200, 200, 200))
+        sheet.paste(old, (0, 0))
+        sheet.paste(new, (size[0] + gap, 0))
+        draw = ImageDraw.Draw(sheet)
+        for dx in (0, size[0] + gap):
+            draw.rectangle((bbox[0] + dx - 2, bbox[1] - 2, bbox[2] + dx + 1, bbox[3] + 1), outline=(220, 0, 0), width=2)
+        sheet.save(out)
+    return bbox
+
+
+def diff_page(task: tuple) -> dict:
+    """Render one (old, new) page pair and compare it; runs in the process pool."""
+    old_pdf, old_page, new_pdf, new_page, dpi, mode, out_dir = task
+    out_dir = Path(out_dir)
+    name = f"p{new_page or 0:04d}-o{old_page or 0:04d}"
+    old_png = render(old_pdf, old_page, dpi, out_dir / f'{name}-old') if old_page else None
+    new_png = render(new_pdf, new_page, dpi, out_dir / f'{name}-new') if new_page else None
+    result = {'old': old_page, 'new': new_page, 'old_png': old_png and old_png.name,
+              'new_png': new_png and new_png.name, 'image': None, 'bbox': None}
+    if old_png is None or new_png is None:
+        result['status'] = 'added' if old_png is None else 'removed'
+        return result
+
+    if HAS_PIL:
+        image = out_dir / f'{name}-{mode}.png'
+        result['bbox'] = diff_images(old_png, new_png, mode, image)
+        changed = result['bbox'] is not None
+        result['image'] = image.name if changed else None
+    else:
+        changed = old_png.read_bytes() != new_png.read_bytes()
+    if not changed or result['image']:
+        # Only pages without a diff image keep their renderings for the index
+        old_png.unlink()
+        new_png.unlink()
+        result['old_png'] = result['new_png'] = None
+    result['status'] = 'changed' if changed else 'same'
+    return result
+
+
+def page_caption(page_map, page: Optional[int]) -> str:
+    entry = page_map.content.get(page) if page_map and page else None
+    if entry:
+        return f"ch. {entry['chapter']} {entry['chapter_name']} · {entry['section']} · p. {entry['label']}"
+    if page_map and page and page <= len(page_map.labels):
+        return f"p. {page_map.labels[page - 1]}"
+    return ''
+
+
+def write_index(out_dir: Path, old_pdf: str, new_pdf: str, results: List[dict], page_map, summary: str) -> Path:
+    rows = []
+    for r in results:
+        title = (f"new page {r['new']}" if r['new'] else f"removed page {r['old']}") + \
+                (f" (old page {r['old']})" if r['new'] and r['old'] and r['old'] != r['new'] else '')
+        caption = html.escape(page_caption(page_map, r['new']))
+        images = [r['image']] if r['image'] else [name for name in (r['old_png'], r['new_png']) if name]
+        imgs = ''.join(f'<a href="{html.escape(n)}"><img src="{html.escape(n)}" loading="lazy"></a>' for n in images)
+        rows.append(f'<section id="p{r["new"] or r["old"]}"><h2>{html.escape(title)} '
+                    f'<small>{r["status"]} {caption}</small></h2>{imgs}</section>')
+    toc = ' '.join(f'<a href="#p{r["new"] or r["old"]}">{r["new"] or "-" + str(r["old"])}</a>' for r in results)
+    index = out_dir / 'index.html'
+    index.write_text(
+        '<!doctype html>\n<meta charset="utf-8">\n<title>PDF diff</title>\n'
+        '<style>body{font-family:sans-serif;margin:1em}img{max-width:100%;border:1px solid #ccc;margin:2px}'
+        'small{color:#666;font-weight:normal}</style>\n'
+        f'<h1>{html.escape(Path(old_pdf).name)} → {html.escape(Path(new_pdf).name)}</h1>\n'
+        f'<p>{html.escape(summary)}</p>\n<p>{toc}</p>\n' + '\n'.join(rows) + '\n',
+        encoding='utf-8')
+    return index
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(
+        description='Visual page diff of two PDFs; identical pages are skipped without rendering',
+        formatter_class=argparse.RawDescriptionHelpFormatter,
+        epilog="""
+Examples:
+  python3 utils/pdf_diff.py build/old/main.pdf main.pdf
+  python3 utils/pdf_diff.py old.pdf new.pdf --mode overlay --dpi 150
+  python3 utils/pdf_diff.py old.pdf new.pdf --all          # render every page pair
+
+Requires PyPDF2 and pdftoppm (poppler); Pillow for the diff images.
+        """
+    )
+    parser.add_argument('old_pdf', help='Earlier build')
+    parser.add_argument('new_pdf', help='Later build')
+    parser.add_argument('--dpi', type=int, default=DEFAULT_DPI, help=f'Raster resolution (default: {DEFAULT_DPI})')
+    parser.add_argument('--mode', choices=['side', 'overlay'], default='side', help='Diff image layout (default: side)')
+    parser.add_argument('--jobs', type=int, default=os.cpu_count(), help='Pages rendered at the same time (default: CPU count)')
+    parser.add_argument('--out', help=f'Output directory (default: {DIFF_ROOT.relative_to(BUILD_ROOT.parent)}/<old>-vs-<new>)')
+    parser.add_argument('--all', action='store_true', help='Render every page pair instead of skipping identical pages')
+    args = parser.parse_args()
+
+    for pdf in (args.old_pdf, args.new_pdf):
+        if not Path(pdf).exists():
+            print(f"❌ PDF not found: {pdf}")
+            sys.exit(1)
+    if not HAS_PYPDF2:
+        print("❌ PyPDF2 is required: pip install PyPDF2")
+        sys.exit(1)
+    if not shutil.which('pdftoppm'):
+        print("❌ pdftoppm not found - install poppler (brew install poppler / apt install poppler-utils)")
+        sys.exit(1)
+    if not HAS_PIL:
+        print("⚠️  Pillow not available: changed pages are shown side by side without a diff image")
+
+    out_dir = Path(args.out) if args.out else DIFF_ROOT / f"{Path(args.old_pdf).stem}-vs-{Path(args.new_pdf).stem}"
+    if out_dir.exists():
+        for stale in out_dir.glob('p*.png'):
+            stale.unlink()
+    out_dir.mkdir(parents=True, exist_ok=True)
+
+    start = time.perf_counter()
+    with ProcessPoolExecutor(max_workers=2) as pool:
+        old_fp, new_fp = pool.map(page_fingerprints, [args.old_pdf, args.new_pdf])
+    pairs, skipped = align(old_fp, new_fp, args.all)
+    fingerprinted = time.perf_counter() - start
+    print(f"🔎 {len(old_fp)} → {len(new_fp)} pages: {skipped} identical, {len(pairs)} to render "
+          f"(fingerprints in {fingerprinted:.1f}s)")
+
+    tasks = [(args.old_pdf, o, args.new_pdf, n, args.dpi, args.mode, str(out_dir)) for o, n in pairs]
+    results = []
+    if tasks:
+        with ProcessPoolExecutor(max_workers=max(1, min(args.jobs or 1, len(tasks)))) as pool:
+            for result in pool.map(diff_page, tasks):
+                results.append(result)
+                if result['status'] != 'same':
+                    print(f"  📄 {result['status']:<8} new {result['new'] or '-':>4}  old {result['old'] or '-':>4}")
+    changed = [r for r in results if r['status'] != 'same']
+
+    elapsed = time.perf_counter() - start
+    summary = (f"{len(changed)} changed page(s); {skipped} skipped as identical, "
+               f"{len(results) - len(changed)} rendered the same; {elapsed:.1f}s at {args.dpi} dpi")
+    index = write_index(out_dir, args.old_pdf, args.new_pdf, changed, load_page_map(args.new_pdf), summary)
+    print(f"\n✅ {summary}")
+    print(f"🌐 {index}")
+
+
+if __name__ == '__main__':
+    main()
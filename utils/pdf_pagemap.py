@@ -0,0 +1,362 @@
+#!/usr/bin/env python3
+"""
+Exact page -> chapter/part map of a compiled book PDF.
+
+\\inputstory (preamble.tex) puts a named destination story:<directory>:<part>
+on the first line of every part of a chapter block (block, title, sidenote,
+summary, historical, main, the optional extras, technical). This module reads
+only the document catalog of the PDF: the page tree (for page object numbers),
+the named destinations, the outline and the page labels. No page content is
+parsed or rasterized, so a full build maps in a fraction of a second.
+
+Every physical page gets the chapter and part that is running at its end,
+the shape build_events.page_content() returns, plus the printed page label:
+
+  {'chapter': 5, 'chapter_name': 'CircleWheel', 'section': 'main', 'directory': '05_CircleWheel',
+   'file_path': '05_CircleWheel/main.tex', 'label': '47'}
+
+file_path is None for parts without a .tex file of that name in the chapter
+directory, such as the block anchor.
+
+The chapter number is the one typeset in the chapter's outline entry (so a
+reordered book is numbered as printed); the directory prefix is the fallback.
+
+Usage:
+  python3 utils/pdf_pagemap.py main.pdf                  # chapter page ranges
+  python3 utils/pdf_pagemap.py build/main/main.pdf --pages
+  python3 utils/pdf_pagemap.py main.pdf --json
+"""
+
+import argparse
+import json
+import re
+import sys
+import time
+from dataclasses import dataclass, field
+from pathlib import Path
+from typing import Dict, Iterator, List, Optional, Tuple, Union
+
+from build_events import CHAPTER_DIR_RE
+
+ROOT = Path(__file__).resolve().parents[1]
+
+# Optional PDF analysis
+try:
+    import PyPDF2
+    from PyPDF2.generic import IndirectObject
+    HAS_PYPDF2 = True
+except ImportError:
+    HAS_PYPDF2 = False
+
+STORY_PREFIX = 'story:'
+# Parts of a chapter block in the order \\inputstory anchors them
+STORY_PARTS = ('block', 'title', 'sidenote', 'summary', 'historical', 'main', 'phenomenon_extra',
+               'joke', 'exercises', 'cartoon', 'imagefigure', 'technical')
+OUTLINE_NUMBER_RE = re.compile(r'^\s*(\d+)\s+(.*)$', re.DOTALL)
+ROMAN = [(1000, 'm'), (900, 'cm'), (500, 'd'), (400, 'cd'), (100, 'c'), (90, 'xc'),
+         (50, 'l'), (40, 'xl'), (10, 'x'), (9, 'ix'), (5, 'v'), (4, 'iv'), (1, 'i')]
+
+
+@dataclass
+class PageMap:
+    """What the catalog of a PDF says about its pages (all page numbers physical, 1-based)."""
+    pages: int
+    labels: List[str] = field(default_factory=list)
+    anchors: List[Tuple[int, str, str]] = field(default_factory=list)  # (page, directory, part), in page order
+    outline: List[dict] = field(default_factory=list)  # {level, title, page}
+    content: Dict[int, dict] = field(default_factory=dict)
+
+    def chapter_ranges(self) -> Dict[int, dict]:
+        """Chapter number -> {name, first, last, pages}, like build_events.chapter_page_ranges()."""
+        ranges: Dict[int, dict] = {}
+        for page, entry in sorted(self.content.items()):
+            chapter = ranges.setdefault(entry['chapter'], {
+                'name': entry['chapter_name'], 'first': page, 'last': page, 'pages': 0})
+            chapter['last'] = page
+            chapter['pages'] += 1
+        return ranges
+
+
+def roman(number: int) -> str:
+    out = []
+    for value, digits in ROMAN:
+        count, number = divmod(number, value)
+        out.append(digits * count)
+    return ''.join(out)
+
+
+def letters(number: int) -> str:
+    """PDF letter numbering: a..z, then aa..zz, ..."""
+    return chr(ord('a') + (number - 1) % 26) * ((number - 1) // 26 + 1)
+
+
+def page_label(style: Optional[str], prefix: str, number: int) -> str:
+    if style == '/D':
+        return f'{prefix}{number}'
+    if style in ('/r', '/R'):
+        text = roman(number)
+        return prefix + (text.upper() if style == '/R' else text)
+    if style in ('/a', '/A'):
+        text = letters(number)
+        return prefix + (text.upper() if style == '/A' else text)
+    return prefix
+
+
+def resolve(node, key: str, default=None):
+    """node[key] with an indirect reference resolved (PyPDF2's dict .get() does not resolve)."""
+    value = node.get(key)
+    return value.get_object() if value is not None else default
+
+
+def page_numbers(catalog) -> Dict[int, int]:
+    """Object number of every page -> physical page, from the page tree alone."""
+    numbers: Dict[int, int] = {}
+    stack = [catalog.raw_get('/Pages')]
+    while stack:
+        ref = stack.pop()
+        node = ref.get_object()
+        if '/Kids' in node:
+            stack.extend(reversed(resolve(node, '/Kids')))
+        elif isinstance(ref, IndirectObject):
+            numbers[ref.idnum] = len(numbers) + 1
+    return numbers
+
+
+def name_tree(node) -> Iterator[Tuple[str, object]]:
+    """(name, unresolved value) pairs of a PDF name tree."""
+    stack = [node]
+    while stack:
+        node = stack.pop().get_object()
+        names = resolve(node, '/Names', [])
+        for i in range(0, len(names) - 1, 2):
+            yield pdf_string(names[i].get_object()), names[i + 1]
+        stack.extend(reversed(resolve(node, '/Kids', [])))
+
+
+def number_tree(node) -> Iterator[Tuple[int, object]]:
+    """(number, value) pairs of a PDF number tree, in order."""
+    stack = [node]
+    while stack:
+        node = stack.pop().get_object()
+        nums = resolve(node, '/Nums', [])
+        for i in range(0, len(nums) - 1, 2):
+            yield int(nums[i]), nums[i + 1].get_object()
+        stack.extend(reversed(resolve(node, '/Kids', [])))
+
+
+def pdf_string(value) -> str:
+    return value.decode('latin-1') if isinstance(value, bytes) else str(value)
+
+
+def dest_page(dest, numbers: Dict[int, int]) -> Optional[int]:
+    """Physical page of an explicit destination ([page /XYZ ...] or << /D [...] >>)."""
+    dest = dest.get_object()
+    if isinstance(dest, dict):
+        dest = resolve(dest, '/D')
+    if not dest:
+        return None
+    target = dest[0]
+    return numbers.get(target.idnum) if isinstance(target, IndirectObject) else None
+
+
+class CatalogReader:
+    """Lazy view of the catalog of one PDF: only what a page map needs is resolved."""
+
+    def __init__(self, pdf_file: Union[str, Path]) -> None:
+        self.reader = PyPDF2.PdfReader(str(pdf_file))
+        self.catalog = self.reader.trailer['/Root']
+        self.numbers = page_numbers(self.catalog)
+        self._dests: Optional[Dict[str, object]] = None
+
+    @property
+    def dests(self) -> Dict[str, object]:
+        """Name -> unresolved destination (the /Names /Dests tree, or the old /Dests dictionary)."""
+        if self._dests is None:
+            self._dests = {}
+            names = resolve(self.catalog, '/Names')
+            if names is not None and '/Dests' in names:
+                self._dests.update(name_tree(names.raw_get('/Dests')))
+            old = resolve(self.catalog, '/Dests')
+            if old is not None:
+                self._dests.update((str(key)[1:], old.raw_get(key)) for key in old)
+        return self._dests
+
+    def target_page(self, target) -> Optional[int]:
+        """Page of an outline target: a destination name (string or /Name) or an explicit destination."""
+        target = target.get_object()
+        if isinstance(target, (list, dict)):
+            return dest_page(target, self.numbers)
+        name = pdf_string(target)
+        dest = self.dests.get(name[1:] if name.startswith('/') else name)
+        return dest_page(dest, self.numbers) if dest is not None else None
+
+    def anchors(self) -> List[Tuple[int, str, str]]:
+        """(page, directory, part) of every story anchor, in reading order."""
+        anchors = []
+        for name, dest in self.dests.items():
+            if not name.startswith(STORY_PREFIX):
+                continue
+            directory, _, part = name[len(STORY_PREFIX):].rpartition(':')
+            page = dest_page(dest, self.numbers)
+            if directory and page is not None:
+                anchors.append((page, directory, part))
+        # The name tree is sorted by name: parts on the same page are ordered as \inputstory sets them
+        order = {part: i for i, part in enumerate(STORY_PARTS)}
+        return sorted(anchors, key=lambda a: (a[0], order.get(a[2], len(order))))
+
+    def outline(self) -> List[dict]:
+        """{level, title, page} of every outline entry, in document order."""
+        items = []
+        outlines = resolve(self.catalog, '/Outlines')
+        stack = [(outlines.get('/First'), 0)] if outlines is not None else []
+        while stack:
+            node, level = stack.pop()
+            if node is None:
+                continue
+            node = node.get_object()
+            target = node.get('/Dest')
+            action = resolve(node, '/A')
+            if target is None and action is not None and resolve(action, '/S') == '/GoTo':
+                target = action.get('/D')
+            items.append({'level': level, 'title': pdf_string(resolve(node, '/Title', '')),
+                          'page': self.target_page(target) if target is not None else None})
+            stack.append((node.get('/Next'), level))
+            stack.append((node.get('/First'), level + 1))
+        return items
+
+    def labels(self) -> List[str]:
+        """Printed label of every page (/PageLabels, or the physical page number without it)."""
+        count = len(self.numbers)
+        node = resolve(self.catalog, '/PageLabels')
+        if node is None:
+            return [str(page) for page in range(1, count + 1)]
+        labels: List[str] = [str(page) for page in range(1, count + 1)]
+        ranges = list(number_tree(node))
+        for i, (start, spec) in enumerate(ranges):
+            end = ranges[i + 1][0] if i + 1 < len(ranges) else count
+            first = int(resolve(spec, '/St', 1))
+            style, prefix = resolve(spec, '/S'), pdf_string(resolve(spec, '/P', ''))
+            labels[start:end] = [page_label(style, prefix, first + k) for k in range(end - start)]
+        return labels[:count]
+
+
+def page_content(anchors: List[Tuple[int, str, str]], outline: List[dict], pages: int) -> Dict[int, dict]:
+    """Physical page -> {chapter, chapter_name, section, directory, file_path} from the story anchors.
+
+    A page belongs to the part whose anchor is the last one on or before it.
+    The last chapter block ends before the first outline entry after its
+    last anchor (back matter), or at the end of the document.
+    """
+    if not anchors:
+        return {}
+    numbered = [(item['page'], OUTLINE_NUMBER_RE.match(item['title'])) for item in outline if item['page']]
+    blocks = [(page, directory) for page, directory, part in anchors if part == 'block']
+    chapters = {}
+    for i, (first, directory) in enumerate(blocks):
+        last = blocks[i + 1][0] - 1 if i + 1 < len(blocks) else pages
+        match = next((m for page, m in numbered if m and first <= page <= last), None)
+        prefix = CHAPTER_DIR_RE.match(directory)
+        if match:
+            chapters[directory] = int(match.group(1))
+        elif prefix:
+            chapters[directory] = int(prefix.group(1))
+
+    end = min([item['page'] - 1 for item in outline
+               if item['level'] == 0 and item['page'] and item['page'] > anchors[-1][0]] + [pages])
+    content = {}
+    for i, (first, directory, part) in enumerate(anchors):
+        # Empty when the next part starts further down the same page: that one runs at its end
+        last = anchors[i + 1][0] - 1 if i + 1 < len(anchors) else end
+        if directory not in chapters:
+            continue
+        prefix = CHAPTER_DIR_RE.match(directory)
+        file_path = f'{directory}/{part}.tex' if (ROOT / directory / f'{part}.tex').exists() else None
+        for page in range(first, last + 1):
+            content[page] = {
+                'chapter': chapters[directory],
+                'chapter_name': prefix.group(2) if prefix else directory,
+                'section': part,
+                'directory': directory,
+                'file_path': file_path,
+            }
+    return content
+
+
+def read_page_map(pdf_file: Union[str, Path]) -> PageMap:
+    catalog = CatalogReader(pdf_file)
+    page_map = PageMap(pages=len(catalog.numbers), labels=catalog.labels(),
+                       anchors=catalog.anchors(), outline=catalog.outline())
+    page_map.content = page_content(page_map.anchors, page_map.outline, page_map.pages)
+    for page, entry in page_map.content.items():
+        entry['label'] = page_map.labels[page - 1]
+    return page_map
+
+
+def load_page_map(pdf_file: Union[str, Path, None]) -> Optional[PageMap]:
+    """read_page_map() of a PDF, or None without the PDF or PyPDF2 (or for an unreadable PDF)."""
+    if not HAS_PYPDF2 or not pdf_file or not Path(pdf_file).exists():
+        return None
+    try:
+        return read_page_map(pdf_file)
+    except Exception as e:
+        print(f"⚠️  Could not read the page map of {pdf_file}: {e}")
+        return None
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(
+        description='Map every page of a compiled PDF to its chapter and part, from the story anchors',
+        formatter_class=argparse.RawDescriptionHelpFormatter,
+        epilog="""
+Examples:
+  python3 utils/pdf_pagemap.py main.pdf
+  python3 utils/pdf_pagemap.py build/main/main.pdf --pages
+  python3 utils/pdf_pagemap.py main.pdf --json > pages.json
+        """
+    )
+    parser.add_argument('pdf_file', help='Compiled PDF')
+    parser.add_argument('--pages', action='store_true', help='List every page instead of chapter ranges')
+    parser.add_argument('--json', action='store_true', help='Print the page map as JSON')
+    args = parser.parse_args()
+
+    if not HAS_PYPDF2:
+        print("❌ PyPDF2 is required: pip install PyPDF2")
+        sys.exit(1)
+    if not Path(args.pdf_file).exists():
+        print(f"❌ PDF not found: {args.pdf_file}")
+        sys.exit(1)
+
+    start = time.perf_counter()
+    page_map = read_page_map(args.pdf_file)
+    elapsed = (time.perf_counter() - start) * 1000
+
+    if args.json:
+        print(json.dumps({'pages': page_map.pages, 'labels': page_map.labels,
+                          'content': page_map.content}, indent=2))
+        return
+
+    print(f"📖 {args.pdf_file}: {page_map.pages} pages, {len(page_map.anchors)} story anchors, "
+          f"{len(page_map.outline)} outline entries ({elapsed:.0f} ms)")
+    if not page_map.anchors:
+        print("⚠️  No story anchors - the PDF was built before \\storyanchor was added to \\inputstory")
+        return
+
+    if args.pages:
+        print(f"\n{'Page':>5} {'Label':>6} {'Ch':>3} {'Chapter':<30} Part")
+        for page in range(1, page_map.pages + 1):
+            entry = page_map.content.get(page)
+            label = page_map.labels[page - 1]
+            if entry:
+                print(f"{page:5d} {label:>6} {entry['chapter']:3d} {entry['chapter_name'][:30]:<30} {entry['section']}")
+            else:
+                print(f"{page:5d} {label:>6}   -")
+        return
+
+    print(f"\n{'Ch':>3} {'Chapter':<35} {'Pages':>9} {'Printed':>11} {'Count':>5}")
+    for number, entry in sorted(page_map.chapter_ranges().items()):
+        printed = f"{page_map.labels[entry['first'] - 1]}-{page_map.labels[entry['last'] - 1]}"
+        print(f"{number:3d} {entry['name'][:35]:<35} {entry['first']:4d}-{entry['last']:<4d} {printed:>11} {entry['pages']:5d}")
+
+
+if __name__ == '__main__':
+    main()
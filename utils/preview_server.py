@@ -0,0 +1,285 @@
+#!/usr/bin/env python3
+"""
+On-demand chapter previews over localhost HTTP.
+
+GET /chapter/05_CircleWheel.pdf returns that chapter typeset as a subset of
+the book, with the chapter number, page numbers, recto/verso parity and
+cross-references of the last full build (see generate_chapter_subset.py).
+Builds go through the build server's queue (utils/build_server.py), so they
+run in their own build directories with a bounded number of workers.
+
+Finished PDFs are kept in a bounded LRU cache under build/preview/, keyed by
+the chapter's content hash: the SHA-1s of every .tex file the chapter reads
+(from the dependency index), the preamble, the images it includes, its line
+in main.tex and the full build it is seeded from. An unchanged chapter is
+served from the cache; a request for a chapter that is already building
+waits for that build instead of starting another one.
+
+Usage:
+  python3 utils/preview_server.py [--port 8766] [--workers 2] [--cache-size 16]
+  curl -o ch05.pdf http://127.0.0.1:8766/chapter/05_CircleWheel.pdf
+  curl http://127.0.0.1:8766/chapter/ch:goldrelativity.pdf -o gold.pdf   # by label or number too
+
+HTTP protocol:
+  GET /                    -> HTML list of chapters with preview links
+  GET /chapter/<ch>.pdf    -> application/pdf (ETag = content hash), or JSON error
+  GET /cache               -> JSON list of cached previews, most recently used last
+"""
+
+import argparse
+import hashlib
+import html
+import json
+import shutil
+import sys
+import threading
+import urllib.parse
+from collections import OrderedDict
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from pathlib import Path
+from typing import Dict, List, Optional, Tuple
+
+from build_dirs import BUILD_ROOT
+from build_server import DEFAULT_WORKERS, BuildJob, BuildQueue, BuildRequestError
+from dep_index import PREAMBLE_FILES, DepIndex, chapter_arg, load_index
+from latex_aux import find_aux, load_seeds
+
+ROOT = Path(__file__).resolve().parents[1]
+PREVIEW_DIR = BUILD_ROOT / 'preview'
+# The preview queue builds in build/preview/builds/<jobname>, not in the build daemon's build/server/
+PREVIEW_BUILD_ROOT = 'preview/builds'
+
+DEFAULT_PORT = 8766
+DEFAULT_CACHE_SIZE = 16
+
+
+class PreviewError(Exception):
+    def __init__(self, status: int, message: str, **details) -> None:
+        super().__init__(message)
+        self.status = status
+        self.details = details
+
+
+class PreviewCache:
+    """LRU of chapter PDFs on disk; evicted previews are deleted."""
+
+    def __init__(self, directory: Path, capacity: int) -> None:
+        self.directory = directory
+        self.capacity = capacity
+        self._lock = threading.Lock()
+        self._entries: 'OrderedDict[str, Path]' = OrderedDict()
+        directory.mkdir(parents=True, exist_ok=True)
+        # Previews of an earlier run, oldest first
+        for pdf in sorted(directory.glob('*.pdf'), key=lambda p: p.stat().st_mtime):
+            self._entries[pdf.stem] = pdf
+        self._evict()
+
+    def get(self, key: str) -> Optional[Path]:
+        with self._lock:
+            path = self._entries.get(key)
+            if path is None or not path.exists():
+                self._entries.pop(key, None)
+                return None
+            self._entries.move_to_end(key)
+            path.touch()
+            return path
+
+    def put(self, key: str, pdf: Path) -> Path:
+        with self._lock:
+            path = self.directory / f'{key}.pdf'
+            if key not in self._entries:
+                tmp = path.with_suffix('.tmp')
+                shutil.copy2(pdf, tmp)
+                tmp.replace(path)
+            self._entries[key] = path
+            self._entries.move_to_end(key)
+            self._evict()
+            return path
+
+    def _evict(self) -> None:
+        while len(self._entries) > self.capacity:
+            _, old = self._entries.popitem(last=False)
+            old.unlink(missing_ok=True)
+
+    def keys(self) -> List[str]:
+        with self._lock:
+            return list(self._entries)
+
+
+class PreviewServer:
+    """Maps chapter requests to cached PDFs or to (shared) subset builds."""
+
+    def __init__(self, build_queue: BuildQueue, cache: PreviewCache) -> None:
+        self.build_queue = build_queue
+        self.cache = cache
+        self._lock = threading.Lock()
+        self._in_flight: Dict[str, BuildJob] = {}
+
+    def index(self) -> DepIndex:
+        with self._lock:
+            # The index file is rewritten when sources changed; one updater at a time
+            return load_index(str(ROOT / 'main.tex'))
+
+    def chapter_key(self, index: DepIndex, directory: str) -> str:
+        """Cache key of a chapter: its directory and the hash of everything its preview is built from."""
+        h = hashlib.sha1()
+        files = index.chapter_files(directory)
+        for preamble in sorted(PREAMBLE_FILES):
+            files += [f for f in [preamble] + index.files.get(preamble, {}).get('inputs', []) if f in index.files]
+        graphics = set(index.chapter_sources().get(directory, [])) - set(index.files)
+        for path in files:
+            entry = index.files[path]
+            h.update(f"{path}\0{entry['sha1']}\n".encode())
+            graphics.update(entry['graphics'])
+        for path in sorted(graphics):
+            try:
+                st = (ROOT / path).stat()
+                h.update(f"{path}\0{st.st_mtime_ns}\0{st.st_size}\n".encode())
+            except OSError:
+                h.update(f"{path}\0missing\n".encode())
+
+        entry = next(e for e in index.model.entries if e.directory == directory)
+        h.update(entry.chapterwithsummary_line.encode())
+        aux_file = find_aux('main')
+        if aux_file:
+            # Seeds and the label snapshot come from the last full build
+            h.update(json.dumps(load_seeds(aux_file).get(directory)).encode())
+            h.update(str(aux_file.stat().st_mtime_ns).encode())
+        return f'{directory}-{h.hexdigest()[:16]}'
+
+    def chapter_pdf(self, name: str) -> Tuple[Path, str, bool]:
+        """(pdf, key, cached) for a chapter given by directory, number or label."""
+        index = self.index()
+        directory = chapter_arg(index, name)
+        if directory is None or directory not in index.chapters():
+            raise PreviewError(404, f"no chapter matches '{name}'")
+        key = self.chapter_key(index, directory)
+
+        cached = self.cache.get(key)
+        if cached:
+            return cached, key, True
+
+        while True:
+            with self._lock:
+                job = self._in_flight.get(key)
+                previous = next(((k, j) for k, j in self._in_flight.items()
+                                 if k.startswith(f'{directory}-')), None) if job is None else None
+                if job is None and previous is None:
+                    entry = next(e for e in index.model.entries if e.directory == directory)
+                    job, _ = self.build_queue.submit({'target': 'subset', 'chapters': str(entry.number)})
+                    self._in_flight[key] = job
+                    print(f"🔨 Building {directory} (job {job.id})")
+                    break
+            if job is not None:
+                print(f"⏳ {directory} is already building (job {job.id}), waiting for it")
+                break
+            # An older version of the chapter is building and the queue would merge this request into it
+            self._wait(*previous)
+        self._wait(key, job)
+
+        pdf = job.artifacts.get('pdf')
+        if job.state != 'ok' or not pdf:
+            raise PreviewError(500, f"build of {directory} failed", job=job.id, log=job.artifacts.get('log'))
+        if self.chapter_key(self.index(), directory) != key:
+            # Sources changed during the build: serve it, but do not cache it under the old hash
+            return Path(pdf), key, False
+        return self.cache.put(key, Path(pdf)), key, False
+
+    def _wait(self, key: str, job: BuildJob) -> None:
+        for _ in job.stream():
+            pass  # The events are for build_server clients
+        with self._lock:
+            if self._in_flight.get(key) is job:
+                del self._in_flight[key]
+
+    def chapter_list(self) -> List[dict]:
+        index = self.index()
+        cached = {key.rsplit('-', 1)[0] for key in self.cache.keys()}
+        return [{'position': e.position, 'directory': e.directory, 'label': e.label,
+                 'cached': e.directory in cached} for e in index.model.entries]
+
+
+def make_handler(server: PreviewServer):
+    class Handler(BaseHTTPRequestHandler):
+        def log_message(self, fmt, *args):
+            sys.stderr.write(f"🌐 {self.address_string()} {fmt % args}\n")
+
+        def _send(self, status: int, body: bytes, content_type: str, headers: Optional[dict] = None) -> None:
+            self.send_response(status)
+            self.send_header('Content-Type', content_type)
+            self.send_header('Content-Length', str(len(body)))
+            for name, value in (headers or {}).items():
+                self.send_header(name, value)
+            self.end_headers()
+            self.wfile.write(body)
+
+        def _send_json(self, status: int, payload) -> None:
+            self._send(status, json.dumps(payload).encode(), 'application/json')
+
+        def do_GET(self):
+            path = urllib.parse.unquote(urllib.parse.urlparse(self.path).path)
+            try:
+                if path == '/':
+                    self._send(200, index_page(server.chapter_list()).encode(), 'text/html; charset=utf-8')
+                elif path == '/cache':
+                    self._send_json(200, server.cache.keys())
+                elif path.startswith('/chapter/') and path.endswith('.pdf'):
+                    self._send_chapter(path[len('/chapter/'):-len('.pdf')])
+                else:
+                    self._send_json(404, {'error': 'not found'})
+            except PreviewError as e:
+                self._send_json(e.status, {'error': str(e), **e.details})
+            except BuildRequestError as e:
+                # The chapter exists in the index, so a rejected build request is the server's fault
+                self._send_json(500, {'error': f"preview build rejected: {e}"})
+            except (BrokenPipeError, ConnectionResetError):
+                pass  # Client went away; a build it started still fills the cache
+
+        def _send_chapter(self, name: str) -> None:
+            pdf, key, cached = server.chapter_pdf(name)
+            etag = f'"{key}"'
+            if self.headers.get('If-None-Match') == etag:
+                self._send(304, b'', 'application/pdf', {'ETag': etag})
+                return
+            self._send(200, pdf.read_bytes(), 'application/pdf', {
+                'ETag': etag,
+                'Cache-Control': 'no-cache',
+                'Content-Disposition': f'inline; filename="{key.rsplit("-", 1)[0]}.pdf"',
+                'X-Preview-Cache': 'hit' if cached else 'miss',
+            })
+
+    return Handler
+
+
+def index_page(chapters: List[dict]) -> str:
+    rows = '\n'.join(
+        f'<li><a href="/chapter/{urllib.parse.quote(c["directory"])}.pdf">{html.escape(c["directory"])}</a>'
+        f'{" (cached)" if c["cached"] else ""}</li>'
+        for c in chapters)
+    return f'<!doctype html>\n<title>Chapter previews</title>\n<h1>Chapter previews</h1>\n<ol>\n{rows}\n</ol>\n'
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description='Serve chapter previews built on demand, with an LRU PDF cache')
+    parser.add_argument('--port', type=int, default=DEFAULT_PORT, help=f'Localhost HTTP port (default: {DEFAULT_PORT})')
+    parser.add_argument('--workers', type=int, default=DEFAULT_WORKERS,
+                        help=f'Chapter builds run at the same time (default: {DEFAULT_WORKERS})')
+    parser.add_argument('--cache-size', type=int, default=DEFAULT_CACHE_SIZE,
+                        help=f'Chapter PDFs kept in {PREVIEW_DIR.relative_to(ROOT)} (default: {DEFAULT_CACHE_SIZE})')
+    parser.add_argument('--tmpfs', action='store_true', help='Keep build directories on /dev/shm')
+    args = parser.parse_args()
+
+    cache = PreviewCache(PREVIEW_DIR, args.cache_size)
+    server = PreviewServer(BuildQueue(args.workers, args.tmpfs, PREVIEW_BUILD_ROOT), cache)
+    http_server = ThreadingHTTPServer(('127.0.0.1', args.port), make_handler(server))
+    http_server.daemon_threads = True
+    print(f"🚀 Chapter previews on http://127.0.0.1:{args.port}/ "
+          f"({args.workers} worker(s), {len(cache.keys())}/{args.cache_size} cached)")
+    try:
+        http_server.serve_forever()
+    except KeyboardInterrupt:
+        print("\n👋 Shutting down")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,248 @@
+#!/usr/bin/env python3
+"""
+Macro- and environment-level hotspot profiler for chapter typesetting.
+
+Runs one instrumented LuaLaTeX pass in build/profile/<jobname>/. Generated
+hooks wrap the profiled environments (LaTeX env/<name>/before and after
+hooks) and heavy macros (redefined around a copy of the original) in
+push/pop calls to utils/lua/profile_macros.lua. That module times every
+frame with the CPU clock of the TeX process. Every \\inputstory{<dir>} call
+becomes a chapter frame, so the time is attributed per chapter.
+
+Outputs (in the build directory):
+  <jobname>.profile.json     per chapter and frame: calls, inclusive and self seconds
+  <jobname>.profile.folded   folded stacks for flamegraph.pl / speedscope
+  <jobname>_profile.csv      the ranked table
+
+Usage:
+  python3 utils/profile_macros.py                       # whole book
+  python3 utils/profile_macros.py --chapters 1-5,29
+  python3 utils/profile_macros.py --env align* --macro "chemfig:o m"
+  python3 utils/profile_macros.py --report build/profile/main/main.profile.json
+  flamegraph.pl build/profile/main/main.profile.folded > flame.svg
+"""
+
+import argparse
+import csv
+import json
+import os
+import subprocess
+import sys
+import time
+from pathlib import Path
+from typing import Dict, List, Tuple
+
+from build_dirs import build_dir_for
+from build_events import EVENTS_ENV, EVENTS_EXT, LUA_MODULE, lualatex_command
+from generate_chapter_subset import ChapterExtractor
+
+ROOT = Path(__file__).resolve().parents[1]
+PROFILE_LUA = ROOT / 'utils' / 'lua' / 'profile_macros.lua'
+PROFILE_ENV = 'BOOK_PROFILE_FILE'
+
+# The suspects: mdframed (TikZ frame method) behind historical/commentary, tcolorbox boxes,
+# TikZ and pgfplots pictures, plus the book's own environments around them
+ENVIRONMENTS = [
+    'historical', 'technical', 'commentary', 'humorbox', 'exercisebox', 'SideNotePage',
+    'mdframed', 'tcolorbox', 'shadedstory', 'tikzpicture', 'axis', 'figure', 'table',
+    'multicols', 'minipage', 'tabular', 'align*', 'equation',
+]
+
+# Macro name -> xparse argument signature (s, o and m only) used to re-pass the arguments
+MACROS = {
+    'inputstory': 'm',
+    'topicmap': 'm',
+    'chapterseparator': '',
+    'includegraphics': 's o o m',
+    'chemfig': 'o m',
+}
+
+# \inputstory{<dir>} frames are named after their chapter directory
+CHAPTER_MACRO = 'inputstory'
+
+
+def original_name(macro: str) -> str:
+    return 'profileorig' + ''.join(c for c in macro if c.isalpha())
+
+
+def call_original(macro: str, signature: List[str], index: int = 0, args: str = '') -> str:
+    """Code that calls the saved original with the arguments the wrapper received."""
+    if index == len(signature):
+        return f'\\{original_name(macro)}{args}'
+    param = f'#{index + 1}'
+    kind = signature[index]
+    if kind == 's':
+        return (f'\\IfBooleanTF{{{param}}}{{{call_original(macro, signature, index + 1, args + "*")}}}'
+                f'{{{call_original(macro, signature, index + 1, args)}}}')
+    if kind == 'o':
+        return (f'\\IfNoValueTF{{{param}}}{{{call_original(macro, signature, index + 1, args)}}}'
+                f'{{{call_original(macro, signature, index + 1, args + "[" + param + "]")}}}')
+    return call_original(macro, signature, index + 1, args + '{' + param + '}')
+
+
+def render_wrappers(macros: Dict[str, str]) -> str:
+    out = ["% Generated by utils/profile_macros.py - profiled macro wrappers, input at \\begin{document}\n"]
+    for macro, signature in macros.items():
+        kinds = signature.split()
+        frame = '#1' if macro == CHAPTER_MACRO else macro
+        out.append(f"\\ifdefined\\{macro}\n")
+        out.append(f"  \\NewCommandCopy{{\\{original_name(macro)}}}{{\\{macro}}}\n")
+        out.append(f"  \\RenewDocumentCommand{{\\{macro}}}{{{' '.join(kinds)}}}"
+                   f"{{\\profilepush{{{frame}}}{call_original(macro, kinds)}\\profilepop}}\n")
+        out.append("\\fi\n")
+    return "".join(out)
+
+
+def render_hooks(environments: List[str], wrappers_file: str) -> str:
+    out = ["% Generated by utils/profile_macros.py - profiling hooks, input before \\documentclass\n"]
+    out.append("\\newcommand{\\profilepush}[1]{\\directlua{book_profile.push(\"\\luaescapestring{#1}\")}}\n")
+    out.append("\\newcommand{\\profilepop}{\\directlua{book_profile.pop()}}\n")
+    for env in environments:
+        out.append(f"\\AddToHook{{env/{env}/before}}{{\\profilepush{{{env}}}}}\n")
+        out.append(f"\\AddToHook{{env/{env}/after}}{{\\profilepop}}\n")
+    out.append(f"\\AddToHook{{begindocument}}{{\\input{{{wrappers_file}}}\\profilepush{{document}}}}\n")
+    out.append("\\AddToHook{enddocument/afterlastpage}{\\profilepop}\n")
+    return "".join(out)
+
+
+def folded_path(profile_file: Path) -> Path:
+    return profile_file.with_suffix('.folded')
+
+
+def relative_to_root(path: Path) -> str:
+    try:
+        return path.relative_to(ROOT).as_posix()
+    except ValueError:
+        return path.as_posix()
+
+
+def run_profile(tex_file: str, build_dir: Path, environments: List[str], macros: Dict[str, str]) -> Path:
+    """One instrumented pass; returns the path of the profile JSON."""
+    jobname = Path(tex_file).stem
+    wrappers = build_dir / 'profile_wrappers.tex'
+    hooks = build_dir / 'profile_hooks.tex'
+    wrappers.write_text(render_wrappers(macros), encoding='utf-8')
+    hooks.write_text(render_hooks(environments, relative_to_root(wrappers)), encoding='utf-8')
+
+    profile_file = build_dir / f'{jobname}.profile.json'
+    for stale in (profile_file, folded_path(profile_file)):
+        stale.unlink(missing_ok=True)
+
+    cmd = lualatex_command(tex_file, ['-interaction=nonstopmode', f'-output-directory={build_dir}'],
+                           jobname=jobname, lua_modules=(LUA_MODULE, PROFILE_LUA),
+                           pre_inputs=[relative_to_root(hooks)])
+    env = {**os.environ,
+           EVENTS_ENV: str((build_dir / f'{jobname}.{EVENTS_EXT}').resolve()),
+           PROFILE_ENV: str(profile_file.resolve())}
+
+    print(f"🔬 Profiling {tex_file} ({len(environments)} environments, {len(macros)} macros)")
+    start = time.time()
+    with open(build_dir / 'profile_pass.log', 'w') as log:
+        subprocess.run(cmd, stdout=log, stderr=subprocess.STDOUT, cwd=ROOT, env=env)
+    print(f"⏱️  Pass finished in {time.time() - start:.1f}s")
+    return profile_file
+
+
+def ranked_rows(profile: dict) -> List[dict]:
+    rows = []
+    for chapter, names in profile['chapters'].items():
+        for name, entry in names.items():
+            rows.append({'chapter': chapter, 'frame': name, **entry})
+    return sorted(rows, key=lambda r: r['self'], reverse=True)
+
+
+def frame_totals(rows: List[dict]) -> List[Tuple[str, int, float]]:
+    """(frame, calls, self seconds) summed over chapters, excluding the chapter frames themselves."""
+    totals: Dict[str, List[float]] = {}
+    for row in rows:
+        if row['frame'] == row['chapter'] or row['frame'] == 'document':
+            continue
+        entry = totals.setdefault(row['frame'], [0, 0.0])
+        entry[0] += row['calls']
+        entry[1] += row['self']
+    return sorted(((name, int(c), s) for name, (c, s) in totals.items()), key=lambda t: t[2], reverse=True)
+
+
+def display_report(profile_file: Path, top: int) -> None:
+    profile = json.loads(profile_file.read_text(encoding='utf-8'))
+    rows = ranked_rows(profile)
+    cpu = profile.get('cpu', 0.0)
+
+    print(f"\n📊 PROFILE: {profile_file}  (CPU {cpu:.1f}s)")
+    print("=" * 78)
+
+    chapters = sorted(((r['chapter'], r['inclusive']) for r in rows if r['frame'] == r['chapter']),
+                      key=lambda t: t[1], reverse=True)
+    if chapters:
+        print(f"\n📚 Slowest chapters (inclusive CPU seconds):")
+        for chapter, seconds in chapters[:top]:
+            print(f"  {seconds:7.2f}s  {chapter}")
+
+    print(f"\n🔥 Frames by self time, all chapters:")
+    print(f"  {'Frame':<20} {'Calls':>7} {'Self s':>9} {'Share':>6}")
+    for name, calls, seconds in frame_totals(rows)[:top]:
+        share = seconds / cpu * 100 if cpu else 0.0
+        print(f"  {name:<20} {calls:7d} {seconds:9.2f} {share:5.1f}%")
+
+    print(f"\n🎯 Hotspots (chapter × frame, by self time):")
+    print(f"  {'Chapter':<32} {'Frame':<18} {'Calls':>6} {'Self s':>8} {'Incl s':>8}")
+    for row in rows[:top]:
+        print(f"  {row['chapter'][:32]:<32} {row['frame'][:18]:<18} {row['calls']:6d} "
+              f"{row['self']:8.2f} {row['inclusive']:8.2f}")
+
+    csv_file = profile_file.with_name(profile_file.name.replace('.profile.json', '_profile.csv'))
+    with open(csv_file, 'w', newline='', encoding='utf-8') as f:
+        writer = csv.DictWriter(f, fieldnames=['chapter', 'frame', 'calls', 'self', 'inclusive'])
+        writer.writeheader()
+        writer.writerows(rows)
+    print(f"\n💾 Ranked table: {csv_file}")
+    print(f"🔥 Folded stacks: {folded_path(profile_file)} (flamegraph.pl or speedscope)")
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(
+        description='Attribute typesetting CPU time to environments and macros, per chapter')
+    parser.add_argument('tex_file', nargs='?', default='main.tex', help='Book file (default: main.tex)')
+    parser.add_argument('--chapters', help='Profile a chapter subset (same syntax as generate_chapter_subset.py)')
+    parser.add_argument('--env', action='append', default=[], metavar='NAME',
+                        help='Also profile this environment (repeatable)')
+    parser.add_argument('--macro', action='append', default=[], metavar='NAME:SIGNATURE',
+                        help='Also profile this macro, e.g. "chemfig:o m" (repeatable)')
+    parser.add_argument('--top', type=int, default=25, help='Rows per table (default: 25)')
+    parser.add_argument('--report', metavar='PROFILE_JSON', help='Only print the report of an existing profile')
+    args = parser.parse_args()
+
+    if args.report:
+        display_report(Path(args.report), args.top)
+        return
+
+    macros = dict(MACROS)
+    for spec in args.macro:
+        name, _, signature = spec.partition(':')
+        macros[name.lstrip('\\')] = signature
+    environments = ENVIRONMENTS + [e for e in args.env if e not in ENVIRONMENTS]
+
+    tex_file = args.tex_file
+    jobname = Path(tex_file).stem
+    if args.chapters:
+        jobname = 'profile_subset'
+        extractor = ChapterExtractor(ROOT / tex_file)
+        extractor.parse_main_tex()
+        numbers = extractor.parse_chapter_spec(args.chapters)
+        build_dir = build_dir_for(f'profile/{jobname}')
+        subset = build_dir / f'{jobname}.tex'
+        if not numbers or not extractor.generate_subset_tex(numbers, str(subset)):
+            sys.exit(1)
+        tex_file = relative_to_root(subset)
+    else:
+        build_dir = build_dir_for(f'profile/{jobname}')
+
+    profile_file = run_profile(tex_file, build_dir, environments, macros)
+    if not profile_file.exists():
+        print(f"❌ No profile written - see {build_dir / 'profile_pass.log'}")
+        sys.exit(1)
+    display_report(profile_file, args.top)
+
+
+if __name__ == '__main__':
+    main()
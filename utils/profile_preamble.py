@@ -0,0 +1,352 @@
+#!/usr/bin/env python3
+"""
+Preamble package load-time profiler.
+
+Typesets an empty document with the book's real preamble (everything in the
+book file before \\begin{document}, including preamble.tex) in
+build/profile/preamble/, with the build event hooks from
+utils/lua/build_events.lua loaded. The open/close events of that run form a
+tree of every file read. Each package loaded from a .tex file is charged the
+time and the transitive files of its subtree, so the report shows:
+- load time per \\usepackage, in preamble order, with the cumulative total
+- the packages that dominate startup
+- redundant loads: duplicate \\usepackage lines, packages another package had
+  already loaded, and packages whose commands the sources never use
+- time to \\begin{document} (the fixed cost every pass and every subset pays)
+
+Font loading in \\setmainfont etc. does not go through the file callbacks; it
+shows up as the self time of the file that declares it.
+
+Usage:
+  python3 utils/profile_preamble.py
+  python3 utils/profile_preamble.py --runs 3 --top 10
+  python3 utils/profile_preamble.py --report build/profile/preamble/preamble_probe.events.ndjson
+"""
+
+import argparse
+import csv
+import re
+import subprocess
+import sys
+import time
+from dataclasses import dataclass, field
+from pathlib import Path
+from statistics import median
+from typing import Dict, List, Optional, Tuple
+
+from build_dirs import build_dir_for
+from build_events import EVENTS_EXT, events_env, lualatex_command, read_events
+
+ROOT = Path(__file__).resolve().parents[1]
+JOBNAME = 'preamble_probe'
+
+USEPACKAGE_RE = re.compile(r'\\(?:usepackage|RequirePackage)\s*(?:\[[^\]]*\])?\s*\{([^}]+)\}')
+INPUT_RE = re.compile(r'\\input\s*\{([^}]+)\}')
+BEGIN_DOCUMENT_RE = re.compile(r'\\begin\s*\{document\}')
+
+# Package -> pattern of the commands/environments it provides. A package whose
+# pattern matches nowhere in the sources is reported as possibly unused.
+# Only packages with a small, recognisable user interface are listed.
+USAGE = {
+    'chemfig': r'\\chemfig|\\schemestart',
+    'lipsum': r'\\lipsum',
+    'shadowtext': r'\\shadowtext',
+    'bbding': r'\\(?:Checkmark|XSolid|HandRight|Pencil|Envelope|Asterisk\w*|Star\w*)\b',
+    'pifont': r'\\ding\b|\\Pisymbol|dingautolist',
+    'tikzsymbols': r'\\(?:Smiley|Sadey|Winkey|Cooley|Coffeecup|Strichmaxerl|Changey)\b',
+    'pgfplots': r'\{axis\}|\\addplot|\\pgfplotsset',
+    'varwidth': r'\{varwidth\}',
+    'needspace': r'\\needspace',
+    'catchfile': r'\\CatchFile',
+    'xstring': r'\\(?:IfSubStr|IfStrEq|IfBeginWith|IfEndWith|StrLeft|StrRight|StrMid|StrSubstitute|StrLen|StrBefore|StrBehind|StrDel)\b',
+    'physics': r'\\(?:dv|pdv|abs|norm|ket|bra|braket|qty|order|grad|curl|vb|vu|eval|comm|mqty)\b',
+    'CJK': r'\{CJK\*?\}',
+    'multicol': r'\{multicols\*?\}',
+    'changepage': r'\{adjustwidth\*?\}|\\checkoddpage',
+    'ifoddpage': r'\\checkoddpage|\\ifoddpage',
+    'epstopdf': r'\.eps\b',
+    'pagecolor': r'\\(?:newpagecolor|restorepagecolor|pagecolor)\b',
+    'tabularx': r'\{tabularx\}',
+    'booktabs': r'\\(?:toprule|midrule|bottomrule|cmidrule)\b',
+    'verbatim': r'\{verbatim\*?\}|\\verbatiminput',
+    'comment': r'\{comment\}|\\(?:includecomment|excludecomment)',
+    'colortbl': r'\\(?:rowcolor|columncolor|cellcolor|arrayrulecolor)\b',
+    'caption': r'\\caption(?:setup|of)\b',
+}
+
+
+@dataclass
+class Declaration:
+    """One package named in a \\usepackage line."""
+    package: str
+    file: str
+    line: int
+
+
+@dataclass
+class FileNode:
+    file: str
+    opened: float
+    closed: Optional[float] = None
+    children: List['FileNode'] = field(default_factory=list)
+
+    @property
+    def seconds(self) -> float:
+        return (self.closed or self.opened) - self.opened
+
+    def count(self) -> int:
+        return 1 + sum(c.count() for c in self.children)
+
+    def walk(self):
+        yield self
+        for child in self.children:
+            yield from child.walk()
+
+
+@dataclass
+class PackageLoad:
+    declaration: Declaration
+    status: str                   # 'loaded', 'duplicate', 'preloaded', 'missing'
+    seconds: float = 0.0
+    files: int = 0
+    loaded_by: str = ''
+
+
+def strip_comment(line: str) -> str:
+    return re.sub(r'(?<!\\)%.*', '', line)
+
+
+def preamble_lines(tex_path: Path) -> List[Tuple[str, int, str]]:
+    """(file, line number, text) of the book file up to \\begin{document}, following \\input."""
+    lines: List[Tuple[str, int, str]] = []
+
+    def read(path: Path, stop_at_document: bool) -> bool:
+        for number, line in enumerate(path.read_text(encoding='utf-8', errors='ignore').splitlines(), 1):
+            text = strip_comment(line)
+            if stop_at_document and BEGIN_DOCUMENT_RE.search(text):
+                return True
+            lines.append((path.relative_to(ROOT).as_posix(), number, text))
+            for name in INPUT_RE.findall(text):
+                child = ROOT / (name if name.endswith('.tex') else f'{name}.tex')
+                if child.exists():
+                    read(child, False)
+        return False
+
+    read(tex_path, True)
+    return lines
+
+
+def declarations(lines: List[Tuple[str, int, str]]) -> List[Declaration]:
+    found = []
+    for file, number, text in lines:
+        for names in USEPACKAGE_RE.findall(text):
+            for name in names.split(','):
+                if name.strip():
+                    found.append(Declaration(name.strip(), file, number))
+    return found
+
+
+def probe_source(lines: List[Tuple[str, int, str]], book_file: str) -> str:
+    """The book's own preamble lines (not the \\input files) followed by an empty document."""
+    own = [text for file, _, text in lines if file == book_file]
+    return ('% Generated by utils/profile_preamble.py - empty document with the book preamble\n'
+            + '\n'.join(own) + '\n\\begin{document}\n\\end{document}\n')
+
+
+def file_tree(events: List[dict]) -> Tuple[FileNode, float]:
+    """Tree of input files from open/close events, and the end time of the run."""
+    root = FileNode('<run>', 0.0)
+    stack = [root]
+    end = 0.0
+    for event in events:
+        kind = event.get('event')
+        if kind == 'open':
+            node = FileNode(event['file'], event['t'])
+            del stack[max(1, event.get('depth', len(stack))):]
+            stack[-1].children.append(node)
+            stack.append(node)
+        elif kind == 'close':
+            for i in range(len(stack) - 1, 0, -1):
+                if stack[i].file == event['file'] and stack[i].closed is None:
+                    stack[i].closed = event['t']
+                    del stack[i:]
+                    break
+        elif kind == 'end':
+            end = event.get('seconds', event['t'])
+    root.closed = end
+    return root, end
+
+
+def package_of(file: str) -> str:
+    return Path(file).stem if file.endswith('.sty') else ''
+
+
+def package_loads(root: FileNode, decls: List[Declaration]) -> List[PackageLoad]:
+    """Match each declaration to the .sty subtree it loaded, or explain why it loaded nothing."""
+    top_level: Dict[str, List[FileNode]] = {}   # .sty opened directly from a .tex file
+    first_seen: Dict[str, str] = {}             # package -> top-level package that opened it first
+    for node in root.walk():
+        if not node.file.endswith('.tex'):
+            continue
+        for child in node.children:
+            name = package_of(child.file)
+            if not name:
+                continue
+            top_level.setdefault(name, []).append(child)
+            for inner in child.walk():
+                first_seen.setdefault(package_of(inner.file) or inner.file, name)
+
+    loads = []
+    declared: Dict[str, Declaration] = {}
+    for decl in decls:
+        earlier = declared.get(decl.package)
+        nodes = top_level.get(decl.package)
+        if earlier:
+            loads.append(PackageLoad(decl, 'duplicate', loaded_by=f'{earlier.file}:{earlier.line}'))
+        elif nodes:
+            node = nodes.pop(0)
+            loads.append(PackageLoad(decl, 'loaded', node.seconds, node.count()))
+        elif decl.package in first_seen:
+            loads.append(PackageLoad(decl, 'preloaded', loaded_by=first_seen[decl.package]))
+        else:
+            loads.append(PackageLoad(decl, 'missing'))
+        declared.setdefault(decl.package, decl)
+    return loads
+
+
+def unused_packages(decls: List[Declaration]) -> List[str]:
+    """Declared packages from USAGE whose commands appear in no source file."""
+    sources = [p for p in ROOT.rglob('*.tex') if 'build' not in p.relative_to(ROOT).parts]
+    text = '\n'.join(strip_comment(line) for p in sources
+                     for line in p.read_text(encoding='utf-8', errors='ignore').splitlines()
+                     if not USEPACKAGE_RE.search(line))
+    unused = []
+    for decl in decls:
+        pattern = USAGE.get(decl.package)
+        if pattern and decl.package not in unused and not re.search(pattern, text):
+            unused.append(decl.package)
+    return unused
+
+
+def run_probe(build_dir: Path, probe: Path) -> Path:
+    events_file = build_dir / f'{JOBNAME}.{EVENTS_EXT}'
+    cmd = lualatex_command(probe.relative_to(ROOT).as_posix(),
+                           ['-interaction=nonstopmode', f'-output-directory={build_dir}'], jobname=JOBNAME)
+    with open(build_dir / 'probe_pass.log', 'w') as log:
+        subprocess.run(cmd, stdout=log, stderr=subprocess.STDOUT, cwd=ROOT,
+                       env=events_env(events_file.resolve()))
+    return events_file
+
+
+def merge_runs(runs: List[List[PackageLoad]]) -> List[PackageLoad]:
+    """Median seconds over runs; the structure comes from the first run."""
+    merged = runs[0]
+    for i, load in enumerate(merged):
+        load.seconds = median(run[i].seconds for run in runs)
+    return merged
+
+
+def display_report(loads: List[PackageLoad], ends: List[float], root: FileNode,
+                   unused: List[str], top: int, csv_file: Path) -> None:
+    total = median(ends) if ends else 0.0
+    print(f"\n📊 PREAMBLE PROFILE ({len(ends)} run{'s' if len(ends) != 1 else ''}, median)")
+    print("=" * 78)
+    print(f"  {'Line':<18} {'Package':<16} {'Seconds':>8} {'Files':>6} {'Cumul.':>8}  Note")
+    cumulative = 0.0
+    for load in loads:
+        cumulative += load.seconds
+        where = f"{load.declaration.file}:{load.declaration.line}"
+        note = {
+            'loaded': '',
+            'duplicate': f'duplicate of {load.loaded_by}',
+            'preloaded': f'already loaded by {load.loaded_by}',
+            'missing': 'not opened (failed or not a .sty)',
+        }[load.status]
+        files = str(load.files) if load.status == 'loaded' else '-'
+        print(f"  {where:<18} {load.declaration.package[:16]:<16} {load.seconds:8.3f} {files:>6} "
+              f"{cumulative:8.2f}  {note}")
+
+    print(f"\n🔥 Packages dominating startup:")
+    ranked = sorted((l for l in loads if l.status == 'loaded'), key=lambda l: l.seconds, reverse=True)
+    for load in ranked[:top]:
+        share = load.seconds / total * 100 if total else 0.0
+        print(f"  {load.seconds:7.3f}s {share:5.1f}%  {load.declaration.package} ({load.files} files)")
+
+    redundant = [l for l in loads if l.status in ('duplicate', 'preloaded')]
+    if redundant or unused:
+        print(f"\n♻️  Redundant:")
+        for load in redundant:
+            reason = 'duplicate' if load.status == 'duplicate' else 'already loaded'
+            print(f"  {load.declaration.file}:{load.declaration.line:<5} {load.declaration.package:<16} "
+                  f"{reason} ({load.loaded_by})")
+        for package in unused:
+            print(f"  {'':<18} {package:<16} possibly unused - none of its commands appear in the sources")
+
+    packages = sum(l.seconds for l in loads)
+    print(f"\n⏱️  Time to \\begin{{document}}: {total:.2f}s over {root.count() - 1} files "
+          f"(packages {packages:.2f}s, other preamble code and \\begin{{document}} hooks {total - packages:.2f}s)")
+
+    with open(csv_file, 'w', newline='', encoding='utf-8') as f:
+        writer = csv.writer(f)
+        writer.writerow(['file', 'line', 'package', 'status', 'seconds', 'files', 'loaded_by'])
+        for load in loads:
+            writer.writerow([load.declaration.file, load.declaration.line, load.declaration.package,
+                             load.status, f'{load.seconds:.4f}', load.files, load.loaded_by])
+    print(f"💾 Table: {csv_file}")
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(
+        description='Time every \\usepackage of the book preamble and find redundant ones')
+    parser.add_argument('tex_file', nargs='?', default='main.tex', help='Book file (default: main.tex)')
+    parser.add_argument('--runs', type=int, default=1, help='Probe runs; times are medians (default: 1)')
+    parser.add_argument('--top', type=int, default=15, help='Packages in the ranking (default: 15)')
+    parser.add_argument('--report', metavar='EVENTS_FILE', help='Only analyze an existing probe events file')
+    args = parser.parse_args()
+
+    tex_path = ROOT / args.tex_file
+    if not tex_path.exists():
+        print(f"❌ File not found: {args.tex_file}")
+        sys.exit(1)
+    lines = preamble_lines(tex_path)
+    decls = declarations(lines)
+    build_dir = build_dir_for('profile/preamble')
+
+    if args.report:
+        event_files = [Path(args.report)]
+    else:
+        probe = build_dir / f'{JOBNAME}.tex'
+        probe.write_text(probe_source(lines, tex_path.relative_to(ROOT).as_posix()), encoding='utf-8')
+        print(f"🔬 Probing the preamble of {args.tex_file} ({len(decls)} package declarations, {args.runs} run(s))")
+        event_files = []
+        for run in range(1, args.runs + 1):
+            start = time.time()
+            events_file = run_probe(build_dir, probe)
+            saved = events_file.with_name(f'{JOBNAME}.run{run}.{EVENTS_EXT}')
+            if events_file.exists():
+                events_file.replace(saved)
+                event_files.append(saved)
+            print(f"  Run {run}: {time.time() - start:.1f}s")
+
+    runs, ends, root = [], [], None
+    for events_file in event_files:
+        if not events_file.exists():
+            continue
+        events = list(read_events(events_file))
+        tree, end = file_tree(events)
+        if not any(e.get('event') == 'end' for e in events):
+            print(f"⚠️  {events_file.name}: the probe did not finish - see {build_dir / 'probe_pass.log'}")
+            continue
+        root = root or tree
+        runs.append(package_loads(tree, decls))
+        ends.append(end)
+    if not runs:
+        print(f"❌ No complete probe run - see {build_dir / 'probe_pass.log'}")
+        sys.exit(1)
+
+    display_report(merge_runs(runs), ends, root, unused_packages(decls), args.top,
+                   build_dir / 'preamble_profile.csv')
+
+
+if __name__ == '__main__':
+    main()
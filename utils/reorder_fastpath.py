@@ -0,0 +1,450 @@
+#!/usr/bin/env python3
+"""
+Reorder-only fast path: reassemble the book after a chapter reorder without retypesetting.
+
+Every chapter block (verso separator, title page, sidenote, intro page,
+content, technical page) is self-contained, so when the only change to
+main.tex is the order of its \\chapterwithsummaryfromfile/\\inputstory pairs
+the chapter pages of the last full build can be reused as they are:
+
+  1. after each full build the PDF and the page bookkeeping that preamble.tex
+     writes to the .aux (\\storypage, \\storystyle, \\storytree) are saved as the
+     reorder base in <build-dir>/reorder/
+  2. on a --fast-reorder build the driver compares main.tex with the base snapshot;
+     if only the chapter order changed (and no other source did) it writes
+     <jobname>_reorder.tex, which typesets the front matter and TOC afresh and
+     includes the old chapter pages with pdfpages in the new order
+  3. each included page gets its running head/foot and fruit tree replaced,
+     so chapter numbers, page numbers and headers match the new order
+  4. the plan knows where every chapter now starts, so the TOC and chapter
+     labels of the new order are computed from the base's .toc and .aux and
+     embedded as a cross-reference snapshot, as for subset builds (see
+     generate_chapter_subset.snapshot_macros); the first pass is then final,
+     which single_pass_ok() confirms, and further passes run only if not
+
+Chapter blocks with an odd page count would move between recto and verso;
+then the fast path declines. The reassembly is lossy: pdfpages does not carry
+over the link annotations, named destinations or outline entries of the
+included chapter pages. It is therefore opt-in (compile_realtime.py
+--fast-reorder), and its PDF stays in the reorder directory
+(<build-dir>/reorder/<jobname>.pdf) instead of replacing the job's PDF, so a
+release PDF always comes from a full build.
+
+Usage:
+  python3 utils/reorder_fastpath.py main.tex --build-dir build/main          # reassemble if possible
+  python3 utils/reorder_fastpath.py main.tex --build-dir build/main --check  # only report
+"""
+
+import argparse
+import json
+import re
+import shutil
+import subprocess
+import sys
+import time
+from pathlib import Path
+from typing import Callable, Dict, List, Optional, Tuple
+
+from build_dirs import BUILD_ROOT, resolve_build_dir
+from editions import MAX_PASSES, aux_state, sources_fingerprint
+from generate_chapter_subset import ChapterExtractor, snapshot_macros
+from latex_aux import (CONTENTSLINE_RE, NUMBERLINE_RE, brace_groups, newlabels, parse_layout, single_pass_ok,
+                       toc_line)
+
+ROOT = Path(__file__).resolve().parents[1]
+
+BASE_DIR_NAME = 'reorder'
+BASE_PDF = 'base.pdf'
+BASE_SOURCE = 'source.tex'
+BASE_STATE = 'base.json'
+
+PAGES_RE = re.compile(r'Output written on .*?\((\d+) pages?')
+
+# Macros of the reassembly document (see the module docstring)
+REORDER_MACROS = r"""\usepackage{pdfpages}
+\makeatletter
+% Height of the band above the text block (running head) and below it (running foot)
+\newcommand{\reorder@headband}{\dimexpr1in+\voffset+\topmargin+\headheight+\headsep\relax}
+\newcommand{\reorder@footband}{\dimexpr\paperheight-\reorder@headband-\textheight\relax}
+% Hide the running head/foot of the included page; the new one is typeset on top
+\newcommand{\reorderhead}{%
+  \AddToShipoutPictureBG*{\AtPageUpperLeft{\raisebox{-\reorder@headband}{\color{white}\rule{\paperwidth}{\reorder@headband}}}}%
+  \thispagestyle{fancy}}
+\newcommand{\reorderfoot}{%
+  \AddToShipoutPictureBG*{\AtPageLowerLeft{\color{white}\rule{\paperwidth}{\reorder@footband}}}%
+  \thispagestyle{plain}}
+% Replace the fruit tree of old chapter #1 (lower left corner at #3,#4 sp) with the one of chapter #2
+\newcommand{\reordertree}[4]{%
+  \AddToShipoutPictureBG*{\AtPageLowerLeft{%
+    \sbox0{\includegraphics[height=3.5cm]{fractal_trees/with_fruits/#1.png}}%
+    \sbox2{\includegraphics[height=3.5cm]{fractal_trees/with_fruits/#2.png}}%
+    \kern#3sp\raisebox{#4sp}{\color{white}\rule{\wd0}{\ht0}}%
+    \kern-\dimexpr(\wd0+\wd2)/2\relax\raisebox{#4sp}{\usebox2}}}}
+% Chapter labels get an empty name, so their .aux value is known in advance (see reorder_snapshot)
+\newcommand{\reordernoname}{\let\@currentlabelname\@empty}
+% \chapterwithsummaryfromfile without its vertical space: the included pages bring their own breaks
+\newcommand{\reorderchapter}[2][]{%
+  \refstepcounter{chapter}%
+  \reordernoname
+  \IfFileExists{#2/title.tex}{\readfirstline{\chaptertitle}{#2/title.tex}}{\def\chaptertitle{Missing Title}}%
+  \IfFileExists{#2/summary.tex}{\readfirstline{\chaptersummary}{#2/summary.tex}}{\def\chaptersummary{No summary available.}}%
+  \gdef\storedchaptertitle{\chaptertitle}%
+  \gdef\storedchaptersummary{\chaptersummary}%
+  \ifx\\#1\\\else\label{#1}\fi}
+% The TOC entry \inputstory adds on the chapter's intro page, anchored by the new chapter number
+\newcommand{\reordertocentry}{%
+  \def\@currentHref{reorder.\thechapter}%
+  \Hy@raisedlink{\hyper@anchorstart{\@currentHref}\hyper@anchorend}%
+  \addcontentsline{toc}{chapter}{%
+    \protect\numberline{\thechapter}\storedchaptertitle\\
+    {\normalfont\small\textit{\textcolor{summarycolor}{\storedchaptersummary}}}}}
+\makeatother
+"""
+
+
+def base_dir_for(jobname: str, build_dir: Optional[Path] = None) -> Path:
+    """Directory holding the reorder base of a job (inside its build directory if it has one)."""
+    return (Path(build_dir) if build_dir else BUILD_ROOT / jobname) / BASE_DIR_NAME
+
+
+def pages_from_log(log_file: Path) -> Optional[int]:
+    if not log_file.exists():
+        return None
+    matches = PAGES_RE.findall(log_file.read_text(encoding='utf-8', errors='ignore'))
+    return int(matches[-1]) if matches else None
+
+
+def chapter_entries(tex_path: Path) -> Tuple[Optional[List[str]], List[dict]]:
+    """Split a book file into its skeleton (every non-chapter line) and its chapter entries in order.
+
+    The skeleton is None when something other than comments sits between the
+    chapter entries, since such content would move with a reorder.
+    """
+    extractor = ChapterExtractor(tex_path)
+    extractor.parse_main_tex()
+    lines = tex_path.read_text(encoding='utf-8').splitlines()
+
+    entry_lines = set()
+    entries = []
+    for ch in sorted(extractor.chapters, key=lambda c: c['line_index']):
+        index = ch['line_index']
+        entry_lines.add(index)
+        story = ''
+        if ch['inputstory_line']:
+            entry_lines.add(index + 1)
+            story = ch['inputstory_line'].strip()
+        entries.append({
+            'directory': ch['directory'],
+            'label': ch['label'],
+            'chapter_line': ch['chapterwithsummary_line'].strip(),
+            'key': (ch['chapterwithsummary_line'].strip(), story),
+        })
+
+    skeleton = []
+    first = min(entry_lines) if entry_lines else len(lines)
+    last = max(entry_lines) if entry_lines else len(lines)
+    for i, line in enumerate(lines):
+        if i in entry_lines or not line.strip():
+            continue
+        if first < i < last and not line.strip().startswith('%'):
+            return None, entries
+        skeleton.append(line.rstrip())
+    return skeleton, entries
+
+
+def save_base(tex_file: str, artifact: Callable[[str], str], base_dir: Path) -> bool:
+    """Keep the PDF and page layout of a finished full build as the base for later reorders."""
+    aux_file, pdf_file = Path(artifact('aux')), Path(artifact('pdf'))
+    if not aux_file.exists() or not pdf_file.exists():
+        return False
+    layout = parse_layout(aux_file.read_text(encoding='utf-8', errors='ignore'))
+    pages = pages_from_log(Path(artifact('log')))
+    if not layout['blocks'] or not pages:
+        return False
+
+    aux_text = aux_file.read_text(encoding='utf-8', errors='ignore')
+    toc_file = Path(artifact('toc'))
+    toc_text = toc_file.read_text(encoding='utf-8', errors='ignore') if toc_file.exists() else ''
+    chapter_labels = {e['label'] for e in chapter_entries(Path(tex_file))[1] if e['label']}
+
+    base_dir.mkdir(parents=True, exist_ok=True)
+    shutil.copy2(pdf_file, base_dir / BASE_PDF)
+    shutil.copy2(tex_file, base_dir / BASE_SOURCE)
+    state = {'fingerprint': sources_fingerprint([]), 'pages': pages, **layout,
+             'toc_lines': base_toc(aux_text, toc_text),
+             'labels': {name: value for name, value in newlabels(aux_text).items() if name in chapter_labels}}
+    (base_dir / BASE_STATE).write_text(json.dumps(state, indent=1), encoding='utf-8')
+    return True
+
+
+def plan_reorder(tex_file: str, base_dir: Path) -> Tuple[Optional[List[dict]], str]:
+    """Work out where every old chapter page goes, or say why the fast path does not apply."""
+    state_file = base_dir / BASE_STATE
+    if not state_file.exists() or not (base_dir / BASE_PDF).exists():
+        return None, 'no reorder base yet (needs one full build)'
+    base = json.loads(state_file.read_text(encoding='utf-8'))
+
+    if base['fingerprint'] != sources_fingerprint([]):
+        return None, 'sources other than the chapter list changed since the last full build'
+
+    old_skeleton, old_entries = chapter_entries(base_dir / BASE_SOURCE)
+    new_skeleton, new_entries = chapter_entries(Path(tex_file))
+    if new_skeleton is None:
+        return None, 'content between chapter entries'
+    if new_skeleton != old_skeleton:
+        return None, f'{tex_file} changed beyond the chapter order'
+    if sorted(e['key'] for e in new_entries) != sorted(e['key'] for e in old_entries):
+        return None, 'the set of chapters changed'
+    if [e['key'] for e in new_entries] == [e['key'] for e in old_entries]:
+        return None, 'chapter order unchanged'
+
+    blocks = base['blocks']
+    if any(e['directory'] not in blocks for e in new_entries):
+        return None, 'page layout of the last full build is incomplete'
+
+    # Old block of a chapter: from its first page up to the next block (the last one runs to the end)
+    starts = sorted(blocks.values())
+    old_numbers = {e['directory']: n for n, e in enumerate(old_entries, 1)}
+    front_pages = starts[0] - 1
+
+    plan = []
+    cursor = front_pages
+    for number, entry in enumerate(new_entries, 1):
+        first = blocks[entry['directory']]
+        following = [s for s in starts if s > first]
+        last = following[0] - 1 if following else base['pages']
+        new_first = cursor + 1
+        if (new_first - first) % 2:
+            return None, f"{entry['directory']} would move from {'recto' if first % 2 else 'verso'} to the other side"
+
+        toc_page = base['toc'].get(entry['directory'])
+        marked = False
+        pages = []
+        for page in range(first, last + 1):
+            commands = []
+            style = base['styles'].get(str(page))
+            if style == 'head':
+                commands.append(r'\reorderhead')
+                if not marked:
+                    commands.append(r'\chaptermark{\storedchaptertitle}')
+                    marked = True
+            elif style == 'foot':
+                commands.append(r'\reorderfoot')
+            else:
+                commands.append(r'\thispagestyle{empty}')
+            if page == toc_page:
+                commands.append(r'\reordertocentry')
+            tree = base['trees'].get(str(page))
+            if tree and tree[0] != number:
+                commands.append(f'\\reordertree{{{tree[0]}}}{{{number}}}{{{tree[1]}}}{{{tree[2]}}}')
+            pages.append((page, ''.join(commands)))
+
+        plan.append({
+            'number': number,
+            'old_number': old_numbers[entry['directory']],
+            'directory': entry['directory'],
+            'label': entry['label'],
+            'chapter_line': entry['chapter_line'],
+            'shift': new_first - first,  # Physical and printed pages move alike within the main matter
+            'pages': pages,
+        })
+        cursor += len(pages)
+
+    if cursor != base['pages']:
+        return None, 'page count does not add up'
+    return plan, f'{sum(c["number"] != c["old_number"] for c in plan)} chapters moved'
+
+
+def base_toc(aux_text: str, toc_text: str) -> Optional[dict]:
+    """The .toc lines of a full build that a reassembly writes again: {front: [...], chapters: {directory: line}}.
+
+    Numbered chapter entries are matched to the \\storypage toc marks in
+    order. Entries below a chapter come from inside its included pages and are
+    not written again, so they are left out. None if the .toc does not match
+    the marks.
+    """
+    marks = list(parse_layout(aux_text)['toc'])
+    front, chapters = [], {}
+    for raw in toc_text.splitlines():
+        match = CONTENTSLINE_RE.match(raw.strip())
+        if not match:
+            continue
+        number = NUMBERLINE_RE.search(raw) if match.group(1) == 'chapter' else None
+        if number and number.group(1).isdigit():
+            if len(chapters) >= len(marks):
+                return None
+            chapters[marks[len(chapters)]] = toc_line(raw)
+        elif not chapters:
+            front.append(toc_line(raw))
+    return {'front': front, 'chapters': chapters} if marks and len(chapters) == len(marks) else None
+
+
+def moved_toc_line(line: str, number: int, shift: int) -> Optional[str]:
+    """A chapter's .toc line with its new number and page and the \\reordertocentry anchor."""
+    match = CONTENTSLINE_RE.match(line)
+    groups, _ = brace_groups(line, match.end(), 3) if match else ([], 0)
+    numberline = NUMBERLINE_RE.search(groups[0]) if groups else None
+    if len(groups) < 2 or not numberline or not groups[1].strip().isdigit():
+        return None
+    text = f"{groups[0][:numberline.start(1)]}{number}{groups[0][numberline.end(1):]}"
+    return f"\\contentsline {{chapter}}{{{text}}}{{{int(groups[1]) + shift}}}{{reorder.{number}}}"
+
+
+def moved_label(value: str, number: int, shift: int) -> Optional[str]:
+    """A chapter label's \\newlabel value as \\reorderchapter writes it: new number and page, no name."""
+    fields, _ = brace_groups(value, 0, 5)
+    if len(fields) < 2 or not fields[1].strip().isdigit():
+        return None
+    moved = [str(number), str(int(fields[1]) + shift)]
+    if len(fields) >= 4:  # hyperref: {number}{page}{name}{anchor}{extra}
+        moved += ['', f'chapter.{number}', fields[4] if len(fields) > 4 else '']
+    return ''.join(f'{{{field}}}' for field in moved)
+
+
+def reorder_snapshot(base: dict, plan: List[dict], source: str) -> Optional[dict]:
+    """Cross-reference snapshot of the reassembly: the TOC and chapter labels of the new order.
+
+    None for a base saved without its .toc; the reassembly then settles over
+    several passes as before.
+    """
+    toc = base.get('toc_lines')
+    if not toc:
+        return None
+    lines = list(toc['front'])
+    labels = {}
+    for chapter in plan:
+        line = toc['chapters'].get(chapter['directory'])
+        moved = moved_toc_line(line, chapter['number'], chapter['shift']) if line else None
+        if moved is None:
+            return None
+        lines.append(moved)
+        value = base.get('labels', {}).get(chapter['label'] or '')
+        label = moved_label(value, chapter['number'], chapter['shift']) if value else None
+        if label:
+            labels[chapter['label']] = label
+    return {'source': source, 'labels': labels, 'toc': lines, 'stale': []}
+
+
+def render_reorder_tex(tex_file: str, plan: List[dict], base_pdf: str, snapshot: Optional[dict] = None) -> str:
+    """Reassembly document: the book's own preamble and front matter, then the old chapter pages."""
+    extractor = ChapterExtractor(tex_file)
+    extractor.parse_main_tex()
+
+    out: List[str] = []
+    out.append(f"% Generated by utils/reorder_fastpath.py from {tex_file} - chapters reassembled from the last full build\n")
+    for line in extractor.preamble:
+        if line.strip().startswith('\\begin{document}'):
+            out.append(REORDER_MACROS)
+            if snapshot:
+                out.extend(snapshot_macros(snapshot))
+        out.append(line)
+
+    for i, chapter in enumerate(plan):
+        out.append(f"\n% Chapter {chapter['number']} (was {chapter['old_number']})\n")
+        if i == 0:
+            # The first entry keeps its own page break after \mainmatter, as in the full build
+            out.append("\\makeatletter\\reordernoname\\makeatother\n")
+            out.append(chapter['chapter_line'] + "\n")
+        else:
+            out.append(f"\\reorderchapter[{chapter['label']}]{{{chapter['directory']}}}\n")
+        out.append("\\clearpage\n")
+        for page, commands in chapter['pages']:
+            out.append(f"\\includepdf[pages={page},pagecommand={{{commands}}}]{{{base_pdf}}}\n")
+
+    out.extend(extractor.postamble)
+    return "".join(out)
+
+
+def run_reorder_build(reorder_tex: Path, base_dir: Path, jobname: str) -> Tuple[bool, int]:
+    """Compile the reassembly document; (success, passes).
+
+    With a matching snapshot the first pass is final (single_pass_ok);
+    otherwise it reruns while its aux/toc still change.
+    """
+    # The aux/toc of an earlier reassembly would override the snapshot of this one
+    for ext in ('aux', 'toc'):
+        (base_dir / f'{jobname}.{ext}').unlink(missing_ok=True)
+    passes = 0
+    success = False
+    while passes < MAX_PASSES:
+        before = aux_state(base_dir, jobname)
+        passes += 1
+        cmd = ['lualatex', '-interaction=nonstopmode', f'-output-directory={base_dir}',
+               f'-jobname={jobname}', str(reorder_tex)]
+        with open(base_dir / f'compile_pass{passes}.log', 'w') as log:
+            result = subprocess.run(cmd, stdout=log, stderr=subprocess.STDOUT, cwd=ROOT)
+        success = result.returncode == 0 or (base_dir / f'{jobname}.pdf').exists()
+        if not success or aux_state(base_dir, jobname) == before:
+            break
+        if passes == 1 and single_pass_ok(reorder_tex, base_dir / f'{jobname}.toc', base_dir / f'{jobname}.log'):
+            break
+    return success, passes
+
+
+def relative_to_root(path: Path) -> str:
+    try:
+        return path.resolve().relative_to(ROOT).as_posix()
+    except ValueError:
+        return path.resolve().as_posix()
+
+
+def reorder_fastpath(tex_file: str, base_dir: Path, check: bool = False) -> bool:
+    """Try the fast path; True when <base_dir>/<jobname>.pdf now reflects the new order.
+
+    The job's own PDF, aux and toc are left alone: the reassembled PDF lacks the
+    chapter pages' links and outline and must not stand in for a full build.
+    """
+    plan, reason = plan_reorder(tex_file, base_dir)
+    if plan is None:
+        print(f"⏭️  Reorder fast path not used: {reason}")
+        return False
+    print(f"⚡ Reorder-only change detected: {reason}")
+    if check:
+        for chapter in plan:
+            if chapter['number'] != chapter['old_number']:
+                print(f"   {chapter['old_number']:2d} → {chapter['number']:2d}  {chapter['directory']}")
+        return True
+
+    start = time.time()
+    jobname = Path(tex_file).stem
+    base = json.loads((base_dir / BASE_STATE).read_text(encoding='utf-8'))
+    snapshot = reorder_snapshot(base, plan, relative_to_root(base_dir / BASE_STATE))
+    if snapshot is None:
+        print("⚠️  No TOC snapshot for this reorder base; the reassembly needs more than one pass")
+    reorder_tex = base_dir / f'{jobname}_reorder.tex'
+    reorder_tex.write_text(render_reorder_tex(tex_file, plan, relative_to_root(base_dir / BASE_PDF), snapshot),
+                           encoding='utf-8')
+
+    success, passes = run_reorder_build(reorder_tex, base_dir, jobname)
+    if not success:
+        print(f"❌ Reassembly failed - see {base_dir}/compile_pass*.log")
+        return False
+    pages = pages_from_log(base_dir / f'{jobname}.log')
+    if pages != base['pages']:
+        print(f"❌ Reassembled PDF has {pages} pages, expected {base['pages']}")
+        return False
+
+    print(f"✅ Reassembled {pages} pages in {time.time() - start:.1f}s "
+          f"({passes} pass{'es' if passes > 1 else ''}): {base_dir / f'{jobname}.pdf'}")
+    print("⚠️  Links, named destinations and outline entries inside the chapter pages were dropped; "
+          "build without --fast-reorder for main.pdf and releases")
+    return True
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(
+        description='Reassemble the book from the last full build after a reorder-only change')
+    parser.add_argument('tex_file', nargs='?', default='main.tex', help='Book file (default: main.tex)')
+    parser.add_argument('--build-dir', help='Build directory of the last full build (default: build/<jobname>)')
+    parser.add_argument('--check', action='store_true', help='Only report whether the fast path applies')
+    args = parser.parse_args()
+
+    build_dir = resolve_build_dir(args.build_dir)
+    base_dir = base_dir_for(Path(args.tex_file).stem, build_dir)
+
+    ok = reorder_fastpath(args.tex_file, base_dir, check=args.check)
+    sys.exit(0 if ok else 1)
+
+
+if __name__ == '__main__':
+    main()
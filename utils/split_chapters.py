@@ -0,0 +1,193 @@
+#!/usr/bin/env python3
+"""
+Split a compiled book into one PDF per chapter, without recompiling.
+
+The page ranges come from the story anchors of the PDF itself (see
+pdf_pagemap.py). Each range is copied with its named destinations, the
+internal links whose targets fall inside it (links to other chapters are
+dropped, web links kept), the outline entries that point into it, and page
+labels that continue the book's numbering. Chapters are written in parallel,
+each worker reading the book once.
+
+Chapter PDFs are written to build/chapters/ (or --out) as "<directory>.pdf",
+e.g. 05_CircleWheel.pdf, with the title from title.tex in their metadata.
+Nothing is written into the chapter directories: their "<NN>_ <title>.pdf"
+files are the sidenote artworks that sidenote.tex includes, not extracts.
+
+Usage:
+  python3 utils/split_chapters.py                     # all chapters of main.pdf
+  python3 utils/split_chapters.py build/main/main.pdf 5 27
+  python3 utils/split_chapters.py --out /tmp/chapters --jobs 4
+  python3 utils/split_chapters.py --dry-run           # only show ranges and file names
+"""
+
+import argparse
+import os
+import re
+import sys
+import time
+from concurrent.futures import ProcessPoolExecutor
+from pathlib import Path
+from typing import Dict, List, Optional, Sequence
+
+from book_model import load_book
+from build_dirs import BUILD_ROOT
+from pdf_pagemap import load_page_map
+
+# Optional PDF analysis
+try:
+    import PyPDF2
+    from PyPDF2.generic import ArrayObject, DictionaryObject, NameObject, NumberObject
+    HAS_PYPDF2 = True
+except ImportError:
+    HAS_PYPDF2 = False
+
+ROOT = Path(__file__).resolve().parents[1]
+CHAPTERS_DIR = BUILD_ROOT / 'chapters'
+LATEX_RE = re.compile(r'\\(?:[A-Za-z]+\*?|.)|[{}~]')
+
+
+def plain_title(title: str) -> str:
+    """A title.tex title as plain text."""
+    text = title.replace('\\&', '&').replace('---', '—').replace('--', '–')
+    return ' '.join(LATEX_RE.sub('', text).split())
+
+
+def chapter_ranges(page_map) -> Dict[str, dict]:
+    """Chapter directory -> {number, first, last} (physical, 1-based) from a page map."""
+    ranges: Dict[str, dict] = {}
+    for page, entry in sorted(page_map.content.items()):
+        directory = entry['directory']
+        chapter = ranges.setdefault(directory, {'number': entry['chapter'], 'first': page, 'last': page})
+        chapter['last'] = page
+    return ranges
+
+
+def first_label(page_map, first: int, last: int) -> Optional[int]:
+    """Arabic number of the first page when the range is numbered consecutively, else None."""
+    labels = page_map.labels[first - 1:last]
+    if labels and all(label.isdigit() for label in labels):
+        start = int(labels[0])
+        if all(int(label) == start + i for i, label in enumerate(labels)):
+            return start
+    return None
+
+
+def write_chapters(tasks: List[dict]) -> List[dict]:
+    """Worker: write the chapter PDFs of `tasks`, all cut from the same book."""
+    reader = PyPDF2.PdfReader(tasks[0]['pdf'])
+    results = []
+    for task in tasks:
+        start = time.perf_counter()
+        writer = PyPDF2.PdfWriter()
+        # Copies the pages with the named destinations, links and outline entries that point into them
+        writer.append(reader, pages=(task['first'] - 1, task['last']))
+        if task['label'] is not None:
+            writer._root_object[NameObject('/PageLabels')] = DictionaryObject({
+                NameObject('/Nums'): ArrayObject([NumberObject(0), DictionaryObject({
+                    NameObject('/S'): NameObject('/D'), NameObject('/St'): NumberObject(task['label'])})])})
+        writer.add_metadata({'/Title': task['title'], '/Producer': 'utils/split_chapters.py'})
+        writer.page_mode = '/UseOutlines'
+        out = Path(task['out'])
+        out.parent.mkdir(parents=True, exist_ok=True)
+        tmp = out.with_name(out.name + '.tmp')
+        with open(tmp, 'wb') as f:
+            writer.write(f)
+        os.replace(tmp, out)
+        results.append({'directory': task['directory'], 'out': str(out), 'pages': task['last'] - task['first'] + 1,
+                        'size': out.stat().st_size, 'seconds': time.perf_counter() - start})
+    return results
+
+
+def select(ranges: Dict[str, dict], args: Sequence[str]) -> List[str]:
+    """Chapter directories by directory name or number, in book order; all by default."""
+    if not args:
+        return sorted(ranges, key=lambda d: ranges[d]['first'])
+    selected = []
+    for arg in args:
+        arg = arg.rstrip('/')
+        found = [d for d in ranges if d == arg or (arg.isdigit() and ranges[d]['number'] == int(arg))]
+        if not found:
+            print(f"⚠️  No chapter '{arg}' in the PDF")
+        selected.extend(d for d in found if d not in selected)
+    return selected
+
+
+def shown(path: Path) -> str:
+    return str(path.relative_to(ROOT)) if path.is_relative_to(ROOT) else str(path)
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(
+        description='Split the compiled book into per-chapter PDFs using its page map',
+        formatter_class=argparse.RawDescriptionHelpFormatter,
+        epilog="""
+Examples:
+  python3 utils/split_chapters.py
+  python3 utils/split_chapters.py main.pdf 1 5 27
+  python3 utils/split_chapters.py build/main/main.pdf --out /tmp/chapters
+        """
+    )
+    parser.add_argument('pdf_file', nargs='?', default='main.pdf', help='Compiled book (default: main.pdf)')
+    parser.add_argument('chapters', nargs='*', help='Chapter directories or numbers (default: all)')
+    parser.add_argument('--out', default=str(CHAPTERS_DIR),
+                        help=f'Output directory (default: {CHAPTERS_DIR.relative_to(ROOT)})')
+    parser.add_argument('--jobs', type=int, default=os.cpu_count(), help='Parallel writers (default: CPU count)')
+    parser.add_argument('--dry-run', action='store_true', help='Show the page ranges and file names only')
+    args = parser.parse_args()
+
+    if not HAS_PYPDF2:
+        print("❌ PyPDF2 is required: pip install PyPDF2")
+        sys.exit(1)
+    if not Path(args.pdf_file).exists():
+        print(f"❌ PDF not found: {args.pdf_file}")
+        sys.exit(1)
+
+    start = time.perf_counter()
+    page_map = load_page_map(args.pdf_file)
+    if not page_map or not page_map.content:
+        print(f"❌ {args.pdf_file} has no story anchors to split it by (build it with the current preamble.tex)")
+        sys.exit(1)
+    ranges = chapter_ranges(page_map)
+    directories = select(ranges, args.chapters)
+    if not directories:
+        sys.exit(1)
+
+    model = load_book()
+    tasks = []
+    for directory in directories:
+        r = ranges[directory]
+        chapter = model.chapters.get(directory)
+        title = chapter.title if chapter and chapter.title else directory
+        out = Path(args.out) / f'{directory}.pdf'
+        tasks.append({'pdf': str(Path(args.pdf_file).resolve()), 'directory': directory, 'first': r['first'],
+                      'last': r['last'], 'title': plain_title(title), 'out': str(out),
+                      'label': first_label(page_map, r['first'], r['last'])})
+
+    if args.dry_run:
+        for task in tasks:
+            print(f"  {task['directory']:<32} pages {task['first']:>4}-{task['last']:<4} → {shown(Path(task['out']))}")
+        return
+
+    jobs = max(1, min(args.jobs or 1, len(tasks)))
+    chunks = [tasks[i::jobs] for i in range(jobs)]
+    results = []
+    if jobs == 1:
+        results = write_chapters(tasks)
+    else:
+        with ProcessPoolExecutor(max_workers=jobs) as pool:
+            for chunk_results in pool.map(write_chapters, chunks):
+                results.extend(chunk_results)
+    results.sort(key=lambda r: ranges[r['directory']]['first'])
+
+    for r in results:
+        out = Path(r['out'])
+        print(f"  📄 {shown(out):<60} {r['pages']:3d} pages  {r['size'] / 1024:7.0f} KB")
+
+    elapsed = time.perf_counter() - start
+    total = sum(r['size'] for r in results)
+    print(f"\n✅ {len(results)} chapter PDF(s), {total / 1024 / 1024:.1f} MB in {elapsed:.1f}s ({jobs} writer(s))")
+
+
+if __name__ == '__main__':
+    main()